@@ -91,6 +91,19 @@ def getLogDestDir():
     return os.path.join(EL._exceptionDestDir, EL._exceptionLogFileName)
 
 
+def getOriginalStdOut():
+    """
+    Return stdout as it was before startLogger() replaced it (e.g. for
+    writing machine-readable output in batch mode).
+    """
+    global EL
+
+    if EL is None:
+        return sys.stdout
+
+    return EL._previousStdOut
+
+
 
 def startLogger(versionstring):
     global EL
@@ -1,4 +1,8 @@
+import multiprocessing
+
 import WikidPadStarter
 
 if __name__ == "__main__":
+    # Needed for parse worker processes in frozen (py2exe) version
+    multiprocessing.freeze_support()
     WikidPadStarter.main()
@@ -229,6 +229,20 @@ exception = None
 
 
 def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == "--batch":
+        # Headless batch mode, creates no wx.App and no GUI.
+        # Not run on import of this module because the background jobs
+        # would block on the import lock while batch mode waits for them
+        from pwiki import BatchMode
+
+        try:
+            sys.exit(BatchMode.main(sys.argv[2:]))
+        except SystemExit:
+            raise
+        except:
+            traceback.print_exc()
+            sys.exit(1)
+
     try:
         app = App(0)
         app.MainLoop()
@@ -0,0 +1,215 @@
+"""
+Benchmark of the memory used by the AST of a large page (WikiPyparsing
+syntax nodes).
+
+The page is built by concatenating all pages of the WikidPadHelp wiki
+a number of times. It is parsed with the WikidPad default parser, then the
+bytes of all nodes, of their instance dictionaries and of their child lists
+are summed with sys.getsizeof(). The growth of the resident set size
+by parsing is reported where /proc is available.
+
+To compare with the layout before the nodes had slots for all common fields
+(every NonTerminalNode carried an instance dictionary with
+"_calcedStrLength" and an unused "strLength" slot), a copy of the AST is
+built with node classes of that old layout and measured the same way.
+
+Usage (from the WikidPad directory):
+    python benchmarks/benchmarkAstMemory.py [-m <multiplier>]
+
+e.g. "-m 3"
+"""
+
+import sys, os, os.path, glob, getopt, time
+
+_BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_BASEDIR, "extensions"))
+sys.path.insert(0, os.path.join(_BASEDIR, "lib"))
+sys.path.insert(0, _BASEDIR)
+
+import __builtin__
+if not hasattr(__builtin__, "_"):
+    __builtin__._ = lambda s: s
+if not hasattr(__builtin__, "N_"):
+    __builtin__.N_ = lambda s: s
+
+from pwiki.ParseUtilities import WikiPageFormatDetails
+from pwiki.Utilities import DUMBTHREADSTOP
+from pwiki.WikiPyparsing import NonTerminalNode
+from wikidPadParser import WikidPadParser
+
+
+
+class BenchmarkWikiDocument(object):
+    """
+    The little the parser needs from a wiki document
+    """
+    def getCcWordBlacklist(self):
+        return ()
+
+    def getNccWordBlacklist(self):
+        return ()
+
+
+
+class OldSyntaxNode(object):
+    __slots__ = ("pos", "strLength", "name", "__dict__", "__weakref__")
+
+
+class OldNonTerminalNode(OldSyntaxNode):
+    __slots__ = ("sub",)
+
+
+class OldTerminalNode(OldSyntaxNode):
+    __slots__ = ("text",)
+
+
+
+def getNodeDict(node):
+    """
+    Return instance dictionary of node or None if it has none
+    """
+    nodeDict = node.__dict__
+    if not nodeDict:
+        # Accessing __dict__ created it, release it again
+        del node.__dict__
+        return None
+
+    return nodeDict
+
+
+def iterNodes(ast):
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, (NonTerminalNode, OldNonTerminalNode)):
+            stack.extend(node.sub)
+
+
+def buildOldAst(node):
+    """
+    Return copy of node and its children with the old node layout
+    """
+    if isinstance(node, NonTerminalNode):
+        ret = OldNonTerminalNode()
+        ret.sub = [buildOldAst(n) for n in node.sub]
+        # Was set in the instance dictionary by the old constructor
+        ret._calcedStrLength = node.strLength
+    else:
+        ret = OldTerminalNode()
+        ret.text = node.text
+        ret.strLength = node.strLength
+
+    ret.pos = node.pos
+    ret.name = node.name
+
+    extraAttrs = getNodeDict(node)
+    if extraAttrs:
+        ret.__dict__.update(extraAttrs)
+
+    return ret
+
+
+def measure(ast):
+    """
+    Return tuple (node count, count of nodes with dictionary, node bytes,
+    dictionary bytes, child list bytes)
+    """
+    nodeCount = 0
+    dictCount = 0
+    nodeBytes = 0
+    dictBytes = 0
+    listBytes = 0
+
+    for node in iterNodes(ast):
+        nodeCount += 1
+        nodeBytes += sys.getsizeof(node)
+
+        nodeDict = getNodeDict(node)
+        if nodeDict is not None:
+            dictCount += 1
+            dictBytes += sys.getsizeof(nodeDict)
+
+        if isinstance(node, (NonTerminalNode, OldNonTerminalNode)):
+            listBytes += sys.getsizeof(node.sub)
+
+    return (nodeCount, dictCount, nodeBytes, dictBytes, listBytes)
+
+
+def getRss():
+    """
+    Return resident set size in bytes or None if unknown
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def loadHelpText():
+    """
+    Return the content of all pages of the help wiki as one unistring
+    """
+    pattern = os.path.join(_BASEDIR, "WikidPadHelp", "data", "*.wiki")
+    parts = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            parts.append(f.read().decode("utf-8", "replace").replace(
+                    u"\r\n", u"\n"))
+
+    return u"\n".join(parts)
+
+
+def printMeasurement(title, values):
+    nodeCount, dictCount, nodeBytes, dictBytes, listBytes = values
+    total = nodeBytes + dictBytes + listBytes
+    print "%-12s %8i %11i %10.2f MB %10.2f MB %10.2f MB %10.2f MB %6.0f B" % \
+            (title, nodeCount, dictCount, nodeBytes / 1048576.0,
+            dictBytes / 1048576.0, listBytes / 1048576.0, total / 1048576.0,
+            float(total) / nodeCount)
+
+
+def main(args):
+    multiplier = 3
+
+    opts, rest = getopt.getopt(args, "m:")
+    for opt, value in opts:
+        if opt == "-m":
+            multiplier = int(value)
+
+    text = u"\n".join([loadHelpText()] * multiplier)
+    formatDetails = WikiPageFormatDetails(
+            wikiDocument=BenchmarkWikiDocument(),
+            wikiLanguageDetails=WikidPadParser.WikiLanguageDetails(None, None))
+
+    rssBefore = getRss()
+    start = time.time()
+    ast = WikidPadParser.THE_PARSER.parse(WikidPadParser.WIKI_LANGUAGE_NAME,
+            text, formatDetails, DUMBTHREADSTOP)
+    parseTime = time.time() - start
+    rssAfter = getRss()
+
+    print "Page of %i chars parsed in %.2f s" % (len(text), parseTime)
+    if rssBefore is not None:
+        print "RSS growth after parsing: %.2f MB" % \
+                ((rssAfter - rssBefore) / 1048576.0)
+
+    print
+    print "%-12s %8s %11s %13s %13s %13s %13s %8s" % ("layout", "nodes",
+            "with dict", "node bytes", "dict bytes", "list bytes", "total",
+            "per node")
+
+    oldValues = measure(buildOldAst(ast))
+    currentValues = measure(ast)
+    # Child lists are the same in both layouts but the copied lists aren't
+    # over-allocated as the lists built while parsing
+    oldValues = oldValues[:4] + currentValues[4:]
+
+    printMeasurement("old", oldValues)
+    printMeasurement("current", currentValues)
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,147 @@
+"""
+Benchmark of the diff engines for version packets (StringOps.DIFF_ENGINES).
+
+Page histories are built from the pages of the WikidPadHelp wiki: the pages
+are concatenated up to the wanted page size, then a number of edits with a
+few random line insertions and deletions each is applied. For each version
+step a packet is built with getBinCompactForDiff() by every engine and the
+mean time and packet size are reported. Every packet is checked by
+applying it with applyBinCompact().
+
+Usage (from the WikidPad directory):
+    python benchmarks/benchmarkDiffEngines.py [-s <sizes in KB>] [-e <edits>]
+            [-d <max. size in KB for difflib>] [-r <random seed>]
+
+e.g. "-s 20,100,300,800 -e 10 -d 300"
+"""
+
+import sys, os, os.path, glob, getopt, random, time
+
+_BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_BASEDIR, "lib"))
+sys.path.insert(0, _BASEDIR)
+
+import __builtin__
+if not hasattr(__builtin__, "_"):
+    __builtin__._ = lambda s: s
+
+from pwiki.StringOps import DIFF_ENGINES, getBinCompactForDiff, \
+        applyBinCompact
+
+
+
+def loadHelpText():
+    """
+    Return the content of all pages of the help wiki as one bytestring
+    """
+    pattern = os.path.join(_BASEDIR, "WikidPadHelp", "data", "*.wiki")
+    parts = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            parts.append(f.read().replace("\r\n", "\n"))
+
+    return "\n".join(parts)
+
+
+def buildPage(helpText, size):
+    """
+    Return a page of (about) size bytes cut at a line end
+    """
+    text = helpText * (size // len(helpText) + 1)
+    end = text.rfind("\n", 0, size)
+    return text[:end + 1]
+
+
+def editPage(rnd, text, helpLines):
+    """
+    Return text with 1 to 5 random line insertions and deletions
+    """
+    lines = text.split("\n")
+    for i in xrange(rnd.randint(1, 5)):
+        pos = rnd.randrange(len(lines))
+        if rnd.random() < 0.5 and len(lines) > 1:
+            del lines[pos]
+        else:
+            lines.insert(pos, rnd.choice(helpLines))
+
+    return "\n".join(lines)
+
+
+def buildHistory(rnd, page, helpLines, editCount):
+    """
+    Return list of versions of page, starting with page itself
+    """
+    history = [page]
+    for i in xrange(editCount):
+        history.append(editPage(rnd, history[-1], helpLines))
+
+    return history
+
+
+def measure(history, engine):
+    """
+    Build packets for all version steps of history (newer to older version,
+    as the versioning stores them). Return tuple (mean time in seconds,
+    mean packet size in bytes).
+    """
+    totalTime = 0.0
+    totalSize = 0
+    for older, newer in zip(history, history[1:]):
+        start = time.time()
+        packet = getBinCompactForDiff(newer, older, engine)
+        totalTime += time.time() - start
+
+        if applyBinCompact(newer, packet) != older:
+            raise AssertionError("Engine %s built a wrong packet" % engine)
+
+        totalSize += len(packet)
+
+    steps = len(history) - 1
+    return (totalTime / steps, float(totalSize) / steps)
+
+
+def main(args):
+    sizes = [20, 100, 300, 800]
+    editCount = 10
+    difflibLimit = 300
+    seed = 1
+
+    opts, rest = getopt.getopt(args, "s:e:d:r:")
+    for opt, value in opts:
+        if opt == "-s":
+            sizes = [int(s) for s in value.split(",")]
+        elif opt == "-e":
+            editCount = int(value)
+        elif opt == "-d":
+            difflibLimit = int(value)
+        elif opt == "-r":
+            seed = int(value)
+
+    helpText = loadHelpText()
+    helpLines = [l for l in helpText.split("\n") if l.strip()]
+    engines = sorted(DIFF_ENGINES)
+
+    print "%i edits per history, mean time and packet size per version step" % \
+            editCount
+    print "%8s" % "size" + "".join(["  %22s" % e for e in engines])
+
+    for size in sizes:
+        rnd = random.Random(seed)
+        history = buildHistory(rnd, buildPage(helpText, size * 1024),
+                helpLines, editCount)
+
+        row = "%5i KB" % size
+        for engine in engines:
+            if engine == "difflib" and size > difflibLimit:
+                row += "  %22s" % "(not run)"
+                continue
+
+            t, s = measure(history, engine)
+            row += "  %22s" % ("%.4f s, %6.0f B" % (t, s))
+
+        print row
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,265 @@
+"""
+Benchmark of the relation graph of the compact_sqlite backend
+(getAllSubWords() and findBestPathFromWordToWord()).
+
+Two synthetic hierarchies are written to an in-memory database:
+a deep one (a chain of pages, each page linking to the next one) and a
+wide one (a tree where each page links to <breadth> children). For each
+hierarchy both functions are timed with the old query path (child relations
+queried per visited page, breadth-first search through a temporary table)
+and with the in-memory WikiRelationGraph. The results of both paths are
+compared.
+
+The path is searched from the last page (leaf) up to the root page, the
+sub-words are collected from the root page.
+
+Usage (from the WikidPad directory):
+    python benchmarks/benchmarkRelationGraph.py [-c <chain length>]
+            [-b <breadth>] [-d <depth>] [-n <repetitions>]
+
+e.g. "-c 3000 -b 10 -d 4 -n 5"
+"""
+
+import sys, os, os.path, getopt, time
+
+_BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_BASEDIR, "lib"))
+sys.path.insert(0, _BASEDIR)
+
+import __builtin__
+if not hasattr(__builtin__, "_"):
+    __builtin__._ = lambda s: s
+
+import pwiki.sqlite3api as sqlite
+from pwiki.wikidata.compact_sqlite import DbStructure
+from pwiki.wikidata.compact_sqlite.WikiData import WikiData
+
+
+
+class BenchmarkWikiData(WikiData):
+    """
+    WikiData on an in-memory database without wiki document and application
+    """
+    def __init__(self, relations):
+        """
+        relations -- list of tuples (word, relation), every word and relation
+            becomes a page
+        """
+        self.wikiDocument = None
+        self.dataDir = None
+        self.linkTermIndex = None
+        self.relationGraph = None
+
+        self.connWrap = DbStructure.ConnectWrapSyncCommit(
+                sqlite.connect(":memory:"))
+
+        for tn in DbStructure.MAIN_TABLES:
+            DbStructure.changeTableSchema(self.connWrap, tn,
+                    DbStructure.TABLE_DEFINITIONS[tn])
+        DbStructure.rebuildIndices(self.connWrap)
+
+        words = set()
+        for word, relation in relations:
+            words.add(word)
+            words.add(relation)
+
+        self.connWrap.execSqlMany("insert into wikiwordcontent(word) "
+                "values (?)", [(w,) for w in words])
+        self.connWrap.execSqlMany("insert into wikirelations(word, relation) "
+                "values (?, ?)", relations)
+        self.connWrap.syncCommit()
+
+        # Temporary table of the old findBestPathFromWordToWord()
+        self.connWrap.execSql("create temp table temppathfindparents "
+                "(word text primary key, child text, steps integer)")
+        self.connWrap.execSql("create index temppathfindparents_steps "
+                "on temppathfindparents(steps)")
+
+
+    def oldGetAllSubWords(self, words, level=-1):
+        """
+        getAllSubWords() as before the relation graph
+        """
+        checkList = [(w, 0)
+                for w in (self.getWikiPageNameForLinkTerm(w) for w in words)
+                if w is not None]
+        checkList.reverse()
+
+        resultSet = {}
+        result = []
+
+        while len(checkList) > 0:
+            toCheck, chLevel = checkList.pop()
+            if resultSet.has_key(toCheck):
+                continue
+
+            result.append(toCheck)
+            resultSet[toCheck] = None
+
+            if level > -1 and chLevel >= level:
+                continue  # Don't go deeper
+
+            children = self.getChildRelationships(toCheck, existingonly=True,
+                    selfreference=False)
+
+            children = [(self.getWikiPageNameForLinkTerm(c), chLevel + 1)
+                    for c in children]
+            children.reverse()
+            checkList += children
+
+        return result
+
+
+    def oldFindBestPathFromWordToWord(self, word, toWord):
+        """
+        findBestPathFromWordToWord() as before the relation graph
+        """
+        if word == toWord:
+            return [word]
+
+        self.connWrap.execSql("delete from temppathfindparents")
+
+        self.connWrap.execSql("insert into temppathfindparents "+
+                "(word, child, steps) select word, relation, 1 from wikirelations "+
+                "where relation = ?", (word,))
+
+        step = 1
+        while True:
+            changes = self.connWrap.rowcount
+
+            if changes == 0:
+                # No more (grand-)parents
+                return []
+
+            if self.connWrap.execSqlQuerySingleItem("select word from "+
+                    "temppathfindparents where word=?", (toWord,)) is not None:
+                # Path found
+                result = [toWord]
+                crumb = toWord
+
+                while crumb != word:
+                    crumb = self.connWrap.execSqlQuerySingleItem(
+                            "select child from temppathfindparents where "+
+                            "word=?", (crumb,))
+                    result.append(crumb)
+
+                self.connWrap.execSql("delete from temppathfindparents")
+
+                return result
+
+            self.connWrap.execSql("""
+                insert or ignore into temppathfindparents (word, child, steps)
+                select wikirelations.word, temppathfindparents.word, ? from
+                    temppathfindparents inner join wikirelations on
+                    temppathfindparents.word == wikirelations.relation where
+                    temppathfindparents.steps == ?
+                """, (step+1, step))
+
+            step += 1
+
+
+
+def buildChain(length):
+    """
+    Return tuple (relations, root, leaf) for a chain of length pages
+    """
+    relations = [(u"ChainPage%i" % i, u"ChainPage%i" % (i + 1))
+            for i in xrange(length - 1)]
+
+    return relations, u"ChainPage0", u"ChainPage%i" % (length - 1)
+
+
+def buildTree(breadth, depth):
+    """
+    Return tuple (relations, root, leaf) for a tree where each page above
+    depth has breadth children
+    """
+    relations = []
+    level = [u"TreePage"]
+    for d in xrange(depth):
+        nextLevel = []
+        for word in level:
+            for i in xrange(breadth):
+                child = u"%s_%i" % (word, i)
+                relations.append((word, child))
+                nextLevel.append(child)
+        level = nextLevel
+
+    return relations, u"TreePage", level[-1]
+
+
+def timeCall(repetitions, fct, *args):
+    """
+    Return tuple (mean time in seconds, result of last call)
+    """
+    start = time.time()
+    for i in xrange(repetitions):
+        result = fct(*args)
+
+    return ((time.time() - start) / repetitions, result)
+
+
+def measure(name, relations, root, leaf, repetitions):
+    wikiData = BenchmarkWikiData(relations)
+    # Needed by both paths, not part of the measurement
+    wikiData._getLinkTermIndex()
+
+    start = time.time()
+    wikiData._getRelationGraph()
+    buildTime = time.time() - start
+
+    oldSubTime, oldSubWords = timeCall(repetitions,
+            wikiData.oldGetAllSubWords, [root])
+    newSubTime, newSubWords = timeCall(repetitions,
+            wikiData.getAllSubWords, [root])
+    if oldSubWords != newSubWords:
+        raise AssertionError("Sub-words differ for %s" % name)
+
+    oldPathTime, oldPath = timeCall(repetitions,
+            wikiData.oldFindBestPathFromWordToWord, leaf, root)
+    newPathTime, newPath = timeCall(repetitions,
+            wikiData.findBestPathFromWordToWord, leaf, root)
+    if len(oldPath) != len(newPath) or len(newPath) == 0:
+        raise AssertionError("Paths differ for %s" % name)
+
+    print "%-26s %7i  %9.5f s  %9.5f s / %9.5f s  %9.5f s / %9.5f s" % \
+            (name, len(newSubWords), buildTime, oldSubTime, newSubTime,
+            oldPathTime, newPathTime)
+
+    wikiData.connWrap.close()
+
+
+def main(args):
+    chainLength = 3000
+    breadth = 10
+    depth = 4
+    repetitions = 5
+
+    opts, rest = getopt.getopt(args, "c:b:d:n:")
+    for opt, value in opts:
+        if opt == "-c":
+            chainLength = int(value)
+        elif opt == "-b":
+            breadth = int(value)
+        elif opt == "-d":
+            depth = int(value)
+        elif opt == "-n":
+            repetitions = int(value)
+
+    print "Mean time of %i calls, old query path / relation graph" % \
+            repetitions
+    print "%-26s %7s  %11s  %25s  %25s" % ("hierarchy", "pages",
+            "graph build", "sub-words", "path")
+
+    relations, root, leaf = buildChain(chainLength)
+    measure("chain of %i pages" % chainLength, relations, root, leaf,
+            repetitions)
+
+    relations, root, leaf = buildTree(breadth, depth)
+    measure("%i-ary tree of depth %i" % (breadth, depth), relations, root,
+            leaf, repetitions)
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
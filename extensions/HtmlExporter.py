@@ -3,7 +3,8 @@ from __future__ import with_statement
 ## profile = profilehooks.profile(filename="profile.prf", immediate=False)
 
 # from Enum import Enumeration
-import sys, os, os.path, string, re, traceback, locale, time, urllib
+import sys, os, os.path, string, re, traceback, locale, time, urllib, \
+        collections
 from os.path import join, exists
 from cStringIO import StringIO
 import shutil
@@ -28,7 +29,8 @@ from pwiki.TempFileSet import TempFileSet
 from pwiki.SearchAndReplace import SearchReplaceOperation, ListWikiPagesOperation, \
         ListItemWithSubtreeWikiPagesNode
 
-from pwiki import SystemInfo, PluginManager, OsAbstract, DocPages
+from pwiki import SystemInfo, PluginManager, OsAbstract, DocPages, \
+        ParseWorkerPool, ImageDimensions
 
 
 from pwiki.Exporters import AbstractExporter
@@ -38,6 +40,11 @@ from pwiki.Exporters import AbstractExporter
 WIKIDPAD_PLUGIN = (("Exporters", 1),)
 
 
+# Milliseconds to collect page changes before continuous export updates
+# the exported files
+CONTINUOUS_EXPORT_DELAY = 2000
+
+
 def describeExportersV01(mainControl):
     """
     Return sequence of exporter classes.
@@ -416,6 +423,106 @@ class TableCell(object):
 
 
 
+class ContinuousExportDependencies(object):
+    """
+    Records on which wiki pages the exported fragment of each page
+    depends, so continuous export only has to re-render the fragments
+    affected by a change.
+    """
+    def __init__(self):
+        # Reverse maps {word or link term: set of fragment words}
+        self.contentDependents = {}   # Fragments inserting content of word
+        self.linkDependents = {}   # Fragments linking to word or link term
+        self.parentDependents = {}   # Fragments listing word as parent
+        # Fragments of pages having link term as name or alias, a page
+        # linking the term is one of their parents
+        self.parentTermDependents = {}
+
+        # {fragment word: (contentDeps, linkDeps, parents, parentTerms)}
+        self.fragmentDeps = {}
+        # Fragments with insertions depending on the whole wiki
+        self.volatile = set()
+
+
+    def setDeps(self, word, recorder, parentTerms):
+        """
+        Set dependencies of fragment word as recorded by DependencyRecorder
+        recorder.
+        parentTerms -- Sequence of link terms (name and aliases) of the page
+        """
+        self.removeDeps(word)
+
+        deps = (frozenset(recorder.contentDeps), frozenset(recorder.linkDeps),
+                frozenset(recorder.parents), frozenset(parentTerms))
+        self.fragmentDeps[word] = deps
+
+        for depDict, keys in zip((self.contentDependents, self.linkDependents,
+                self.parentDependents, self.parentTermDependents), deps):
+            for key in keys:
+                depDict.setdefault(key, set()).add(word)
+
+        if recorder.volatile:
+            self.volatile.add(word)
+
+
+    def removeDeps(self, word):
+        self.volatile.discard(word)
+
+        deps = self.fragmentDeps.pop(word, None)
+        if deps is None:
+            return
+
+        for depDict, keys in zip((self.contentDependents, self.linkDependents,
+                self.parentDependents, self.parentTermDependents), deps):
+            for key in keys:
+                dependents = depDict.get(key)
+                if dependents is None:
+                    continue
+                dependents.discard(word)
+                if not dependents:
+                    del depDict[key]
+
+
+    def getRenderedParents(self, word):
+        """
+        Return frozenset of parents listed in fragment word when it was
+        rendered or None if unknown.
+        """
+        deps = self.fragmentDeps.get(word)
+        if deps is None:
+            return None
+
+        return deps[2]
+
+
+    def getContentDependents(self, word):
+        return self.contentDependents.get(word, frozenset())
+
+    def getLinkDependents(self, term):
+        return self.linkDependents.get(term, frozenset())
+
+    def getParentDependents(self, word):
+        return self.parentDependents.get(word, frozenset())
+
+    def getParentTermDependents(self, term):
+        return self.parentTermDependents.get(term, frozenset())
+
+
+
+class DependencyRecorder(object):
+    """
+    Collects dependencies while a fragment is rendered.
+    """
+    __slots__ = ("contentDeps", "linkDeps", "parents", "volatile")
+
+    def __init__(self):
+        self.contentDeps = set()
+        self.linkDeps = set()
+        self.parents = ()
+        self.volatile = False
+
+
+
 # TODO UTF-8 support for HTML? Other encodings?
 
 class HtmlExporter(AbstractExporter):
@@ -440,6 +547,23 @@ class HtmlExporter(AbstractExporter):
         self.avoidDeadWikiLinks = True  # avoid links to not exported wikiwords
         self.listPagesOperation = None
 
+        # Dependency tracking for continuous export, see
+        # startContinuousExport()
+        self.continuousDeps = None
+        self.continuousFragments = None
+        self.continuousToc = None
+        self.continuousLinkStates = None
+        self.continuousChildren = None
+        self.continuousPending = None
+        self.continuousMembershipChanged = False
+        self.continuousFlushTimer = None
+        self.depRecorder = None   # DependencyRecorder of fragment in work
+
+        # Number of worker processes parsing pages during export, None
+        # means to use the pool of the wiki (see option "parseWorkers_count")
+        self.parseWorkerCount = None
+        self.parseWorkerPool = None   # Pool used by running export
+
         self.wordAnchor = None  # For multiple wiki pages in one HTML page, this contains the anchor
                 # of the current word.
         self.tempFileSet = None
@@ -632,6 +756,62 @@ class HtmlExporter(AbstractExporter):
         return True
 
 
+    def setParseWorkerCount(self, count):
+        """
+        Set number of worker processes parsing pages during export.
+        None uses the parse worker pool of the wiki, 0 parses pages in
+        the main process.
+        """
+        self.parseWorkerCount = count
+
+
+    def _iterExportWords(self, words, needsPage=None):
+        """
+        Yield the words of sequence words in order. While export is running,
+        pages are parsed by the parse worker pool ahead of their turn so
+        formatContent() finds the page AST ready and only has to render it.
+        needsPage -- if not None, function taking a word and returning
+            False if the page won't be rendered and needn't be parsed
+        """
+        if self.parseWorkerPool is None:
+            for word in words:
+                yield word
+            return
+
+        queue = collections.deque()   # (word, <page parsed?>)
+
+        def iterPages():
+            for word in words:
+                if needsPage is not None and not needsPage(word):
+                    queue.append((word, False))
+                    continue
+                try:
+                    wikiPage = self.wikiDocument.getWikiPage(word)
+                except WikiWordNotFoundException:
+                    queue.append((word, False))
+                    continue
+
+                if not self.shouldExport(word, wikiPage):
+                    queue.append((word, False))
+                    continue
+
+                queue.append((word, True))
+                yield wikiPage.getNonAliasPage()
+
+        # The page objects are held by the pool iterator until rendered,
+        # so getWikiPage() returns them again with AST set
+        for item in ParseWorkerPool.iterPageAsts(iterPages(),
+                pool=self.parseWorkerPool):
+            while True:
+                word, parsed = queue.popleft()
+                yield word
+                if parsed:
+                    break
+
+        while queue:
+            yield queue.popleft()[0]
+
+
     def export(self, wikiDocument, wordList, exportType, exportDest,
             compatFilenames, addOpt, progressHandler, tempFileSetReset=True):
         """
@@ -670,16 +850,33 @@ class HtmlExporter(AbstractExporter):
             self.referencedStorageFiles = set()
 
 
-        if exportType == u"html_multi":
-            browserFile = self.exportHtmlMultiFile()
-        elif exportType == u"html_single":
-            browserFile = self._exportHtmlSingleFiles(self.wordList)
+        ownPool = None
+        if self.parseWorkerCount is None:
+            self.parseWorkerPool = self.wikiDocument.getParseWorkerPool()
+        elif self.parseWorkerCount > 0:
+            try:
+                ownPool = ParseWorkerPool.ParseWorkerPool(
+                        self.parseWorkerCount)
+                self.parseWorkerPool = ownPool
+            except (OSError, ImportError):
+                traceback.print_exc()
+
+        try:
+            if exportType == u"html_multi":
+                browserFile = self.exportHtmlMultiFile()
+            elif exportType == u"html_single":
+                browserFile = self._exportHtmlSingleFiles(self.wordList)
+        finally:
+            self.parseWorkerPool = None
+            if ownPool is not None:
+                ownPool.close()
 
         # Other supported types: html_previewWX, html_previewIE, html_previewMOZ,
         #   html_previewWK
         # are not handled in this function
 
         wx.GetApp().getInsertionPluginManager().taskEnd()
+        self._getImageDimsCache().save()
 
         if self.referencedStorageFiles is not None:
             # Some files must be available
@@ -713,6 +910,16 @@ class HtmlExporter(AbstractExporter):
         # for continuous export we want to have dead links to simplify updates
         self.avoidDeadWikiLinks = False
 
+        # State to re-render only the affected parts on changes
+        self.continuousDeps = ContinuousExportDependencies()
+        self.continuousFragments = {}   # {word: HTML fragment} for html_multi
+        self.continuousToc = None   # Table of contents for html_multi
+        self.continuousLinkStates = {}   # {word: see _getContinuousLinkState()}
+        self.continuousChildren = {}   # {word: see _getContinuousChildren()}
+        self.continuousPending = {}   # {word: False iff page was removed}
+        self.continuousMembershipChanged = False
+        self.continuousFlushTimer = None
+
         wordList = wikiDocument.searchWiki(self.listPagesOperation)
         
         self.listPagesOperation.beginWikiSearch(wikiDocument)
@@ -732,10 +939,28 @@ class HtmlExporter(AbstractExporter):
 
 
     def stopContinuousExport(self):
+        self.__sinkWikiDocument.disconnect()
+
+        if self.continuousFlushTimer is not None:
+            self.continuousFlushTimer.Stop()
+            self.continuousFlushTimer = None
+
+        # Export changes still waiting
+        try:
+            self._flushContinuousExport()
+        except Exception:
+            traceback.print_exc()
+
         self.listPagesOperation.endWikiSearch()
         self.listPagesOperation = None
         self.avoidDeadWikiLinks = True
-        self.__sinkWikiDocument.disconnect()
+
+        self.continuousDeps = None
+        self.continuousFragments = None
+        self.continuousToc = None
+        self.continuousLinkStates = None
+        self.continuousChildren = None
+        self.continuousPending = None
 
         self.tempFileSet.reset()
         self.tempFileSet = None
@@ -745,16 +970,11 @@ class HtmlExporter(AbstractExporter):
     def onDeletedWikiPage(self, miscEvt):
         wikiWord = miscEvt.get("wikiPage").getWikiWord()
 
-        if wikiWord not in self.wordList:
-            return
-            
-        self.wordList.remove(wikiWord)
-        
-        if self.exportType == u"html_multi":
-            self.exportHtmlMultiFile()
+        if wikiWord in self.wordList:
+            self.wordList.remove(wikiWord)
+            self.continuousMembershipChanged = True
 
-        elif self.exportType == u"html_single":
-            self._exportHtmlSingleFiles([])
+        self._queueContinuousUpdate(wikiWord, False)
 
 
     def onRenamedWikiPage(self, miscEvt):
@@ -762,29 +982,17 @@ class HtmlExporter(AbstractExporter):
         newWord = miscEvt.get("newWord")
         newPage = self.wikiDocument.getWikiPage(newWord)
         
-        oldInList = oldWord in self.wordList
-        newInList = self.listPagesOperation.testWikiPageByDocPage(newPage)
-
-        if not oldInList and not newInList:
-            return
-
-        if oldInList:
+        if oldWord in self.wordList:
             self.wordList.remove(oldWord)
+            self.continuousMembershipChanged = True
         
-        if newInList:
+        if self.listPagesOperation.testWikiPageByDocPage(newPage) and \
+                newWord not in self.wordList:
             self.wordList.append(newWord)
+            self.continuousMembershipChanged = True
 
-
-        if self.exportType == u"html_multi":
-            self.exportHtmlMultiFile()
-
-        elif self.exportType == u"html_single":
-            if newInList:
-                updList = [newWord]
-            else:
-                updList = []
-
-            self._exportHtmlSingleFiles(updList)
+        self._queueContinuousUpdate(oldWord, False)
+        self._queueContinuousUpdate(newWord, True)
 
 
     def onUpdatedWikiPage(self, miscEvt):
@@ -794,32 +1002,199 @@ class HtmlExporter(AbstractExporter):
         oldInList = wikiWord in self.wordList
         newInList = self.listPagesOperation.testWikiPageByDocPage(wikiPage)
 
-        if not oldInList:
-            if not newInList:
-                # Current set not affected
-                return
-            else:
+        if oldInList != newInList:
+            if newInList:
                 self.wordList.append(wikiWord)
-                updList = [wikiWord]
-        else:
-            if not newInList:
-                self.wordList.remove(wikiWord)
-                updList = []
             else:
-                updList = [wikiWord]
-        
-        if not wikiWord in self.wordList:
+                self.wordList.remove(wikiWord)
+
+            self.continuousMembershipChanged = True
+
+        # Even if page isn't exported, exported pages may link to or
+        # insert it
+        self._queueContinuousUpdate(wikiWord, True)
+
+
+    def _queueContinuousUpdate(self, wikiWord, exists):
+        """
+        Remember change of page wikiWord for continuous export. Changes
+        are collected for CONTINUOUS_EXPORT_DELAY milliseconds to handle
+        a burst of saves at once.
+        exists -- False iff page was deleted or renamed
+        """
+        self.continuousPending[wikiWord] = exists
+
+        if self.continuousFlushTimer is None:
+            self.continuousFlushTimer = wx.CallLater(CONTINUOUS_EXPORT_DELAY,
+                    self._flushContinuousExport)
+
+
+    def _getContinuousLinkState(self, wikiWord):
+        """
+        Return tuple of everything influencing how links to wikiWord
+        are exported or None if page doesn't exist.
+        """
+        try:
+            wikiPage = self.wikiDocument.getWikiPage(wikiWord)
+        except WikiWordNotFoundException:
+            return None
+
+        attrs = wikiPage.getAttributes()
+
+        return (wikiWord in self.wordList,
+                self.shouldExport(wikiWord, wikiPage),
+                tuple(attrs.get(u"alias", ())),
+                tuple(attrs.get(u"short_hint", ())))
+
+
+    def _getContinuousChildren(self, wikiWord):
+        """
+        Return frozenset of link terms (existing or not) on page wikiWord
+        or None if page doesn't exist.
+        """
+        try:
+            wikiPage = self.wikiDocument.getWikiPage(wikiWord)
+        except WikiWordNotFoundException:
+            return None
+
+        return frozenset(wikiPage.getChildRelationships(existingonly=False,
+                selfreference=False))
+
+
+    def _flushContinuousExport(self):
+        """
+        Re-render the fragments (pages, table of contents) affected by
+        the changes queued since last call and update the exported files.
+        """
+        self.continuousFlushTimer = None
+
+        pending = self.continuousPending
+        if not pending and not self.continuousMembershipChanged:
             return
 
+        self.continuousPending = {}
+
+        deps = self.continuousDeps
+        wordSet = set(self.wordList)
+        toRender = set()
+        parentCandidates = set()
+
+        tocChanged = self.continuousMembershipChanged
+        self.continuousMembershipChanged = False
+
+        for word, pageExists in pending.iteritems():
+            # Fragments inserting the content of word
+            toRender |= deps.getContentDependents(word)
+
+            if pageExists:
+                toRender.add(word)
+            else:
+                self.continuousFragments.pop(word, None)
+                deps.removeDeps(word)
+
+            # Fragments linking to word. A False state means unknown
+            oldState = self.continuousLinkStates.pop(word, False)
+            if pageExists:
+                newState = self._getContinuousLinkState(word)
+            else:
+                newState = None
+
+            if newState is not None:
+                self.continuousLinkStates[word] = newState
+
+            if newState != oldState:
+                tocChanged = True
+                terms = set((word,))
+                for state in (oldState, newState):
+                    if state:
+                        terms.update(state[2])
+
+                for term in terms:
+                    toRender |= deps.getContentDependents(term)
+                    toRender |= deps.getLinkDependents(term)
+
+            # Fragments with changed parents
+            oldChildren = self.continuousChildren.pop(word, None)
+            if pageExists:
+                newChildren = self._getContinuousChildren(word)
+            else:
+                newChildren = None
+
+            if newChildren is not None:
+                self.continuousChildren[word] = newChildren
+
+            # Fragments listing word as parent are re-checked always, the
+            # page may also have been created or deleted
+            parentCandidates |= deps.getParentDependents(word)
+            if oldChildren != newChildren:
+                for children in (oldChildren, newChildren):
+                    if children is None:
+                        continue
+                    for term in children:
+                        parentCandidates |= deps.getParentTermDependents(term)
+
+        if pending and self.addOpt[1] == 1:
+            # Order of the content tree may depend on modification dates
+            # of children, so it is always rebuilt
+            tocChanged = True
+
+        for word in (parentCandidates & wordSet) - toRender:
+            try:
+                parents = frozenset(self.wikiDocument.getWikiPage(word)
+                        .getParentRelationships())
+            except WikiWordNotFoundException:
+                continue
+
+            if parents != deps.getRenderedParents(word):
+                toRender.add(word)
+
+        toRender |= deps.volatile
+        toRender &= wordSet
+
+        for word in toRender:
+            self.continuousFragments.pop(word, None)
+
+        if tocChanged:
+            self.continuousToc = None
+
         try:
             if self.exportType == u"html_multi":
                 self.exportHtmlMultiFile()
     
             elif self.exportType == u"html_single":
-                self._exportHtmlSingleFiles(updList)
+                self._exportHtmlSingleFiles([w for w in self.wordList
+                        if w in toRender], updateIndex=tocChanged)
         except WikiWordNotFoundException:
             pass
 
+        self._getImageDimsCache().save()
+
+
+    def _beginDependencyRecording(self):
+        if self.continuousDeps is not None:
+            self.depRecorder = DependencyRecorder()
+
+
+    def _endDependencyRecording(self, word):
+        if self.depRecorder is None:
+            return
+
+        # Current state is what the other fragments were rendered with
+        state = self._getContinuousLinkState(word)
+        if state is not None:
+            self.continuousLinkStates[word] = state
+            parentTerms = (word,) + state[2]
+        else:
+            parentTerms = (word,)
+
+        self.continuousDeps.setDeps(word, self.depRecorder, parentTerms)
+        self.depRecorder = None
+
+        if word not in self.continuousChildren:
+            children = self._getContinuousChildren(word)
+            if children is not None:
+                self.continuousChildren[word] = children
+
 
 
     def getTempFileSet(self):
@@ -848,6 +1223,8 @@ class HtmlExporter(AbstractExporter):
     def exportHtmlMultiFile(self, realfp=None, tocMode=None):
         """
         Multiple wiki pages in one file.
+        During continuous export, fragments still valid are taken from
+        self.continuousFragments.
         """
         config = self.mainControl.getConfig()
         sepLineCount = config.getint("main",
@@ -880,70 +1257,47 @@ class HtmlExporter(AbstractExporter):
 
         filePointer.write(self.getFileHeaderMultiPage(self.mainControl.wikiName))
 
-        tocTitle = self.addOpt[2]
-        
         if tocMode is None:
             tocMode = self.addOpt[1]
 
-        if tocMode == 1:
-            # Write a content tree at beginning
-            rootPage = self.mainControl.getWikiDocument().getWikiPage(
-                        self.mainControl.getWikiDocument().getWikiName())
-            flatTree = rootPage.getFlatTree()
-
-            filePointer.write((u'<h2 class="wikidpad">%s</h2>\n'
-                    '%s%s<hr class="wikidpad" />') %
-                    (tocTitle, # = "Table of Contents"
-                    self.getContentTreeBody(flatTree, linkAsFragments=True),
-                    u'<br class="wikidpad" />\n' * sepLineCount))
-
-        elif tocMode == 2:
-            # Write a content list at beginning
-            filePointer.write((u'<h2 class="wikidpad">%s</h2>\n'
-                    '%s%s<hr class="wikidpad" />') %
-                    (tocTitle, # = "Table of Contents"
-                    self.getContentListBody(linkAsFragments=True),
-                    u'<br class="wikidpad" />\n' * sepLineCount))
-
+        if self.continuousFragments is not None and tocMode == self.addOpt[1]:
+            if self.continuousToc is None:
+                self.continuousToc = self._getHtmlMultiFileToc(tocMode,
+                        sepLineCount)
+            filePointer.write(self.continuousToc)
+        else:
+            filePointer.write(self._getHtmlMultiFileToc(tocMode, sepLineCount))
 
         if self.progressHandler is not None:
             self.progressHandler.open(len(self.wordList))
             step = 0
 
+        if self.continuousFragments is not None:
+            needsPage = lambda word: word not in self.continuousFragments
+        else:
+            needsPage = None
+
         # Then create the big page word by word
-        for word in self.wordList:
+        for word in self._iterExportWords(self.wordList, needsPage):
             if self.progressHandler is not None:
                 step += 1
                 self.progressHandler.update(step, _(u"Exporting %s") % word)
 
-            wikiPage = self.wikiDocument.getWikiPage(word)
-            if not self.shouldExport(word, wikiPage):
-                continue
-                
-            try:
-                content = wikiPage.getLiveText()
-#                 formatDetails = wikiPage.getFormatDetails()
-                    
-                self.wordAnchor = _escapeAnchor(word)
-                formattedContent = self.formatContent(wikiPage)
-                
-                if self.avoidDeadWikiLinks:
-                    parentLinks = self.getParentLinks(wikiPage, False,
-                            self.wordList)
-                else:
-                    parentLinks = self.getParentLinks(wikiPage, False)
-
-                filePointer.write((u'<span class="wikidpad wiki-name-ref">'
-                        u'[<a name="%s" class="wikidpad">%s</a>]<br class="wikidpad" />'
-                        u'<br class="wikidpad" /></span>'
-                        u'<span class="wikidpad parent-nodes">parent nodes: %s'
-                        u'<br class="wikidpad" /></span>%s%s<hr class="wikidpad" />') %
-                        (self.wordAnchor, word,
-                        parentLinks,
-                        formattedContent,
-                        u'<br class="wikidpad" />\n' * sepLineCount))
-            except Exception, e:
-                traceback.print_exc()
+            if self.continuousFragments is not None:
+                fragment = self.continuousFragments.get(word)
+                if fragment is None:
+                    self._beginDependencyRecording()
+                    try:
+                        fragment = self._getHtmlMultiFileFragment(word,
+                                sepLineCount)
+                    finally:
+                        self._endDependencyRecording(word)
+
+                    self.continuousFragments[word] = fragment
+            else:
+                fragment = self._getHtmlMultiFileFragment(word, sepLineCount)
+
+            filePointer.write(fragment)
 
         self.wordAnchor = None
 
@@ -958,13 +1312,82 @@ class HtmlExporter(AbstractExporter):
         return outputFile
 
 
-    def _exportHtmlSingleFiles(self, wordListToUpdate):
+    def _getHtmlMultiFileToc(self, tocMode, sepLineCount):
+        """
+        Return table of contents for exportHtmlMultiFile().
+        """
+        tocTitle = self.addOpt[2]
+
+        if tocMode == 1:
+            # Write a content tree at beginning
+            rootPage = self.mainControl.getWikiDocument().getWikiPage(
+                        self.mainControl.getWikiDocument().getWikiName())
+            flatTree = rootPage.getFlatTree()
+
+            return (u'<h2 class="wikidpad">%s</h2>\n'
+                    '%s%s<hr class="wikidpad" />') % \
+                    (tocTitle, # = "Table of Contents"
+                    self.getContentTreeBody(flatTree, linkAsFragments=True),
+                    u'<br class="wikidpad" />\n' * sepLineCount)
+
+        elif tocMode == 2:
+            # Write a content list at beginning
+            return (u'<h2 class="wikidpad">%s</h2>\n'
+                    '%s%s<hr class="wikidpad" />') % \
+                    (tocTitle, # = "Table of Contents"
+                    self.getContentListBody(linkAsFragments=True),
+                    u'<br class="wikidpad" />\n' * sepLineCount)
+
+        return u""
+
+
+    def _getHtmlMultiFileFragment(self, word, sepLineCount):
+        """
+        Return the part of exportHtmlMultiFile() output for a single word.
+        """
+        wikiPage = self.wikiDocument.getWikiPage(word)
+        if not self.shouldExport(word, wikiPage):
+            return u""
+            
+        try:
+            content = wikiPage.getLiveText()
+#             formatDetails = wikiPage.getFormatDetails()
+                
+            self.wordAnchor = _escapeAnchor(word)
+            formattedContent = self.formatContent(wikiPage)
+            
+            if self.avoidDeadWikiLinks:
+                parentLinks = self.getParentLinks(wikiPage, False,
+                        self.wordList)
+            else:
+                parentLinks = self.getParentLinks(wikiPage, False)
+
+            return (u'<span class="wikidpad wiki-name-ref">'
+                    u'[<a name="%s" class="wikidpad">%s</a>]<br class="wikidpad" />'
+                    u'<br class="wikidpad" /></span>'
+                    u'<span class="wikidpad parent-nodes">parent nodes: %s'
+                    u'<br class="wikidpad" /></span>%s%s<hr class="wikidpad" />') % \
+                    (self.wordAnchor, word,
+                    parentLinks,
+                    formattedContent,
+                    u'<br class="wikidpad" />\n' * sepLineCount)
+        except Exception, e:
+            traceback.print_exc()
+            return u""
+
+
+    def _exportHtmlSingleFiles(self, wordListToUpdate, updateIndex=True):
+        """
+        Export pages of wordListToUpdate into one file each.
+        updateIndex -- Write table of contents (if configured) to
+            "index.html"
+        """
         self.setLinkConverter(LinkConverterForHtmlSingleFilesExport(
                 self.wikiDocument, self))
         self.buildStyleSheetList()
 
 
-        if self.addOpt[1] in (1, 2):
+        if updateIndex and self.addOpt[1] in (1, 2):
             # TODO Configurable name
             outputFile = join(self.exportDest, pathEnc(u"index.html"))
             try:
@@ -1008,7 +1431,7 @@ class HtmlExporter(AbstractExporter):
             self.progressHandler.open(len(self.wordList))
             step = 0
 
-        for word in wordListToUpdate:
+        for word in self._iterExportWords(wordListToUpdate):
             if self.progressHandler is not None:
                 step += 1
                 self.progressHandler.update(step, _(u"Exporting %s") % word)
@@ -1017,9 +1440,19 @@ class HtmlExporter(AbstractExporter):
             if not self.shouldExport(word, wikiPage):
                 continue
 
-            self.exportWordToHtmlPage(self.exportDest, word, False)
+            self._beginDependencyRecording()
+            try:
+                self.exportWordToHtmlPage(self.exportDest, word, False)
+            finally:
+                self._endDependencyRecording(word)
 
         self.copyCssFiles(self.exportDest)
+
+        if not self.wordList:
+            # E.g. last page of continuous export was deleted, only the
+            # index was rewritten
+            return None
+
         rootFile = join(self.exportDest,
                 self.filenameConverter.getFilenameForWikiWord(self.wordList[0]) +
                 ".html")
@@ -1192,6 +1625,10 @@ class HtmlExporter(AbstractExporter):
         parents = u""
         parentRelations = wikiPage.getParentRelationships()[:]
         self.mainControl.getCollator().sort(parentRelations)
+
+        if self.depRecorder is not None:
+            self.depRecorder.parents = parentRelations
+            self.depRecorder.linkDeps.update(parentRelations)
         
         for relation in parentRelations:
             if wordsToInclude and relation not in wordsToInclude:
@@ -1468,12 +1905,25 @@ class HtmlExporter(AbstractExporter):
             self.optsStack["innermostDocPage"] = wikiPage
             self.processAst(content, self.basePageAst)
 
-        if self.asHtmlPreview and facename:
-            self.outAppend('</font>')
+        if self.asHtmlPreview:
+            if facename:
+                self.outAppend('</font>')
+
+            # There is no end of a preview "export"
+            self._getImageDimsCache().save()
 
         return self.getOutput()
 
 
+    def _getImageDimsCache(self):
+        """
+        Return ImageDimensions.ImageDimsCache for the local images of
+        the wiki.
+        """
+        return ImageDimensions.getImageDimsCache(join(
+                self.wikiDocument.getDataDir(), u"imagedims.cache"))
+
+
     def _getImageDims(self, absUrl):
         """
         Return tuple (width, height) of image absUrl or (None, None) if it
@@ -1482,21 +1932,13 @@ class HtmlExporter(AbstractExporter):
         try:
             if absUrl.startswith(u"file:"):
                 absLink = pathnameFromUrl(absUrl)
-                imgFile = file(absLink, "rb")
-            else:
-                imgFile = urllib.urlopen(absUrl)
-                imgData = imgFile.read()
-                imgFile.close()
-                imgFile = StringIO(imgData)
+                return self._getImageDimsCache().getImageDims(absLink)
 
-            img = wx.EmptyImage(0, 0)
-            img.LoadStream(imgFile)
+            imgFile = urllib.urlopen(absUrl)
+            imgData = imgFile.read()
             imgFile.close()
-            
-            if img.Ok():
-                return img.GetWidth(), img.GetHeight()
 
-            return None, None
+            return ImageDimensions.getImageDims(StringIO(imgData))
 
         except IOError:
             return None, None
@@ -1876,6 +2318,11 @@ class HtmlExporter(AbstractExporter):
 
             value = langHelper.resolveWikiWordLink(value, containingPage)
 
+            if self.depRecorder is not None:
+                self.depRecorder.contentDeps.add(value)
+                self.depRecorder.contentDeps.add(
+                        self.wikiDocument.getWikiPageNameForLinkTermOrAsIs(value))
+
             docpage = self.wikiDocument.getWikiPageNoError(value)
             pageAst = docpage.getLivePageAst()
             
@@ -1932,8 +2379,14 @@ class HtmlExporter(AbstractExporter):
                 del self.insertionVisitStack[-1]
 
             return
-            
-        elif key == u"rel":
+
+        if self.depRecorder is not None and not (key in (u"self", u"toc",
+                u"iconimage") or (key == u"rel" and
+                value in (u"parents", u"children", u"top", u"back"))):
+            # Result may depend on any page
+            self.depRecorder.volatile = True
+
+        if key == u"rel":
             # List relatives (children, parents)
             if value == u"parents":
                 wordList = self.wikiDocument.getWikiData().getParentRelationships(
@@ -2213,6 +2666,11 @@ class HtmlExporter(AbstractExporter):
             wikiWord = astNodeOrWord
             anchorLink = None
             titleNode = None
+
+        if self.depRecorder is not None:
+            self.depRecorder.linkDeps.add(wikiWord)
+            self.depRecorder.linkDeps.add(
+                    self.wikiDocument.getWikiPageNameForLinkTermOrAsIs(wikiWord))
             
         if self.avoidDeadWikiLinks and not self.shouldExport(
                 self.wikiDocument.getWikiPageNameForLinkTerm(wikiWord)):
@@ -139,6 +139,23 @@ def createCheckNotIn(tokNames):
     return checkNoContain
 
 
+def preActCountMarkupStart(s, l, st, pe):
+    """
+    Count start of markup which may search arbitrarily far for its end.
+    Together with actionCountMarkupEnd() this finds the unclosed markup
+    needed by _TheParser.parseIncremental().
+    """
+    counts = st.dictStack.get("unclosedMarkupCounts")
+    if counts is not None:
+        counts[l] = counts.get(l, 0) + 1
+
+
+def actionCountMarkupEnd(s, l, st, t):
+    counts = st.dictStack.get("unclosedMarkupCounts")
+    if counts is not None:
+        counts[l] -= 1
+
+
 def pseudoActionFindMarkup(s, l, st, t):
     if t.strLength == 0:
         return []
@@ -202,7 +219,9 @@ italicsStart = italicsStart.setParseStartAction(createCheckNotIn(("italics",)))
 italicsEnd = buildRegex(ur"_\b")
 
 italics = italicsStart + characterAttributionContent + italicsEnd
-italics = italics.setResultsNameNoCopy("italics").setName("italics")
+italics = italics.setResultsNameNoCopy("italics").setName("italics")\
+        .setParseStartAction(preActCountMarkupStart)\
+        .setParseAction(actionCountMarkupEnd)
 
 boldStart = buildRegex(ur"\*(?=\S)")
 boldStart = boldStart.setParseStartAction(createCheckNotIn(("bold",)))
@@ -210,7 +229,9 @@ boldStart = boldStart.setParseStartAction(createCheckNotIn(("bold",)))
 boldEnd = buildRegex(ur"\*")
 
 bold = boldStart + characterAttributionContent + boldEnd
-bold = bold.setResultsNameNoCopy("bold").setName("bold")
+bold = bold.setResultsNameNoCopy("bold").setName("bold")\
+        .setParseStartAction(preActCountMarkupStart)\
+        .setParseAction(actionCountMarkupEnd)
 
 
 script = buildRegex(ur"<%") + buildRegex(ur".*?(?=%>)", "code") + \
@@ -619,7 +640,9 @@ table = buildRegex(ur"<<\|").setParseStartAction(preActCheckNothingLeft) + \
         Optional(tableModeAppendix) + buildRegex(ur"[ \t]*\n") + \
         tableRow + newRow + ZeroOrMore(NotAny(tableEnd) + tableRow + newRow) + \
         tableEnd
-table = table.setResultsNameNoCopy("table")
+table = table.setResultsNameNoCopy("table")\
+        .setParseStartAction(preActCountMarkupStart)\
+        .setParseAction(actionCountMarkupEnd)
 
 
 
@@ -655,7 +678,8 @@ noExportMultipleLines = buildRegex(ur"<<hide[ \t]*\n")\
         createCheckNotIn(("noExportMl", "noExportSl"))) + \
         content + noExportMultipleLinesEnd
 noExportMultipleLines = noExportMultipleLines.setResultsNameNoCopy("noExportMl")\
-        .setParseAction(actionNoExport)
+        .setParseStartAction(preActCountMarkupStart)\
+        .setParseAction(actionNoExport, actionCountMarkupEnd)
 
 noExportSingleLine = buildRegex(ur"<<hide[ \t]") + oneLineContent + \
         noExportSingleLineEnd
@@ -725,7 +749,8 @@ preHtmlEnd = buildRegex(ur"</pre(?: [^\n>]*)?>", "htmlTag")
 
 preHtmlTag = preHtmlStart + content + preHtmlEnd
 preHtmlTag = preHtmlTag.setResultsNameNoCopy("preHtmlTag")\
-        .setParseAction(actionPreHtmlTag)
+        .setParseStartAction(preActCountMarkupStart)\
+        .setParseAction(actionPreHtmlTag, actionCountMarkupEnd)
 
 
 
@@ -1123,13 +1148,17 @@ attrInsKey = buildRegex(ur"[\w\-\_\.]+", "key")
 attribute = bracketStart + whitespace + attrInsKey + \
         buildRegex(ur"[ \t]*[=:]") + attrInsValue + \
         ZeroOrMore(buildRegex(ur";") + attrInsValue) + whitespace + bracketEnd
-attribute = attribute.setResultsNameNoCopy("attribute").setParseAction(actionAttribute)
+attribute = attribute.setResultsNameNoCopy("attribute")\
+        .setParseStartAction(preActCountMarkupStart)\
+        .setParseAction(actionAttribute, actionCountMarkupEnd)
 
 
 insertion = bracketStart + buildRegex(ur":") + whitespace + attrInsKey + \
         buildRegex(ur"[ \t]*[=:]") + attrInsValue + \
         ZeroOrMore(buildRegex(ur";") + attrInsValue) + whitespace + bracketEnd
-insertion = insertion.setResultsNameNoCopy("insertion").setParseAction(actionInsertion)
+insertion = insertion.setResultsNameNoCopy("insertion")\
+        .setParseStartAction(preActCountMarkupStart)\
+        .setParseAction(actionInsertion, actionCountMarkupEnd)
 
 
 
@@ -1365,6 +1394,12 @@ text = text.optimize(("regexcombine",)).parseWithTabs()
 # text.setDebugRecurs(True)
 
 
+# Element for one iteration of the loop over the top level content and
+# the final string end, both needed by _TheParser.parseIncremental()
+topLevelContentItem = text.exprs[0].expr.expr
+topLevelEnd = text.exprs[1]
+
+
 
 def _buildBaseDict(wikiDocument=None, formatDetails=None):
     if formatDetails is None:
@@ -1380,6 +1415,65 @@ def _buildBaseDict(wikiDocument=None, formatDetails=None):
 
 
 
+# -------------------- Incremental parsing --------------------
+
+# Names of top level nodes consisting of newline(s). Incremental parsing
+# only restarts or resynchronizes behind such a node.
+_INCREMENTAL_SYNC_NODE_NAMES = frozenset(("newParagraph", "lineBreak",
+        "whitespace"))
+
+# Block markup matched by a single regular expression which searches
+# arbitrarily far for the end of the block. Tuples (markup start, end regex)
+_INCREMENTAL_BLOCK_MARKUP = (
+        (u"<%", re.compile(ur"%>", RE_FLAGS)),
+        (u"<<", re.compile(ur"^[ \t]*>>[ \t]*(?:\n|$)", RE_FLAGS)),
+        (u"<body", re.compile(ur"</body>", RE_FLAGS))
+    )
+
+
+def _findUnclosedBlockMarkup(text, end):
+    """
+    Return position of the first block markup start (from
+    _INCREMENTAL_BLOCK_MARKUP) in text before  end  which has no block end
+    before  end , return  end  if there is no such markup.
+    """
+    result = end
+    for startStr, endRE in _INCREMENTAL_BLOCK_MARKUP:
+        if text.find(startStr, 0, end) == -1:
+            continue
+
+        # Any start before the last block end is closed
+        searchPos = 0
+        for match in endRE.finditer(text, 0, end):
+            if match.end() < end:
+                searchPos = max(0, match.start() - len(startStr) + 1)
+
+        pos = text.find(startStr, searchPos, end)
+        if pos != -1:
+            result = min(result, pos)
+
+    return result
+
+
+def _findTopLevelNodeIndex(nodes, pos):
+    """
+    Return number of nodes in list  nodes  (sorted by position) which start
+    at or before  pos .
+    """
+    # Algorithm taken from standard lib bisect module
+    lo = 0
+    hi = len(nodes)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if pos < nodes[mid].pos:
+            hi = mid
+        else:
+            lo = mid + 1
+
+    return lo
+
+
+
 # -------------------- API for plugin WikiParser --------------------
 # During beta state of the WikidPad version, this API isn't stable yet, 
 # so changes may occur!
@@ -1504,12 +1598,16 @@ class _TheParser(object):
                     0, "text")
 
         baseDict = _buildBaseDict(formatDetails=formatDetails)
+        markupCounts = {}
+        baseDict["unclosedMarkupCounts"] = markupCounts
 
 ##         _prof.start()
         try:
             t = text.parseString(content, parseAll=True, baseDict=baseDict,
                     threadstop=threadstop)
             t = buildSyntaxNode(t, 0, "text")
+            t.unclosedMarkupPositions = sorted(pos for pos, count in
+                    markupCounts.iteritems() if count > 0)
 
             t = _TheParser._postProcessing(intLanguageName, content, formatDetails,
                     t, threadstop)
@@ -1520,6 +1618,135 @@ class _TheParser(object):
 
         return t
 
+
+    @staticmethod
+    def parseIncremental(intLanguageName, oldContent, oldPageAst, content,
+            formatDetails, threadstop):
+        """
+        Same as parse() but  oldPageAst  is the AST built by parse() or
+        parseIncremental() for the previous page text  oldContent  with
+        equivalent  formatDetails . Top level nodes before and after the
+        changed part of the text are taken from  oldPageAst  so only the
+        changed blocks must be parsed again.
+        """
+        oldMarkupPositions = getattr(oldPageAst, "unclosedMarkupPositions",
+                None)
+
+        if len(content) == 0 or formatDetails.noFormat or \
+                formatDetails.autoLinkMode == u"relax" or \
+                oldMarkupPositions is None:
+            # Auto-links in "relax" mode depend on the whole wiki, not only
+            # on the page text
+            return _TheParser.parse(intLanguageName, content, formatDetails,
+                    threadstop)
+
+        if content == oldContent:
+            return oldPageAst
+
+        oldNodes = oldPageAst.getChildren()
+
+        prefixLen = StringOps.getCommonPrefixLength(oldContent, content)
+        suffixLen = StringOps.getCommonSuffixLength(oldContent, content,
+                min(len(oldContent), len(content)) - prefixLen)
+        delta = len(content) - len(oldContent)
+        changeEnd = len(content) - suffixLen
+
+        # Markup matched before the restart position may have looked ahead
+        # up to the end of the next line or, if it is unclosed, up to the
+        # end of text. So restart at least two lines before the change and
+        # before any unclosed markup.
+        limit = oldContent.rfind(u"\n", 0, prefixLen)
+        if limit > 0:
+            limit = oldContent.rfind(u"\n", 0, limit)
+
+        if len(oldMarkupPositions) > 0:
+            limit = min(limit, oldMarkupPositions[0])
+
+        limit = min(limit, _findUnclosedBlockMarkup(oldContent, prefixLen))
+
+        startIdx = max(0, _findTopLevelNodeIndex(oldNodes, limit) - 1)
+        while startIdx > 0 and oldNodes[startIdx - 1].name not in \
+                _INCREMENTAL_SYNC_NODE_NAMES:
+            startIdx -= 1
+
+        if startIdx == 0:
+            loc = 0
+        else:
+            loc = oldNodes[startIdx].pos
+
+        baseDict = _buildBaseDict(formatDetails=formatDetails)
+        markupCounts = {}
+        baseDict["unclosedMarkupCounts"] = markupCounts
+
+        ParserElement.resetCache()
+        state = text.buildStartState(content, baseDict, threadstop)
+
+        # Same dictionary stack as for the top level content during a
+        # full parse
+        for i in range(3):
+            state.dictStack.push()
+
+        newNodes = oldNodes[:startIdx]
+        reuseIdx = -1
+
+        # Parse top level nodes until behind the changed part the end of
+        # a newline node is found which is also the end of a newline node
+        # in the old AST. From there on the old nodes are valid (moved by
+        # delta).
+        while True:
+            try:
+                newLoc, tokens = topLevelContentItem._parse(content, loc, state)
+            except (ParseException, IndexError):
+                break
+
+            if newLoc == -1:
+                break
+
+            loc = newLoc
+            newNodes += tokens
+
+            if loc <= changeEnd or len(tokens) == 0:
+                continue
+
+            lastNode = tokens[-1]
+            if lastNode.name not in _INCREMENTAL_SYNC_NODE_NAMES or \
+                    lastNode.pos < changeEnd:
+                continue
+
+            idx = _findTopLevelNodeIndex(oldNodes, loc - delta)
+            if idx > 1 and oldNodes[idx - 1].pos == loc - delta and \
+                    oldNodes[idx - 2].name in _INCREMENTAL_SYNC_NODE_NAMES:
+                reuseIdx = idx - 1
+                break
+
+        newMarkupPositions = set(pos for pos, count in
+                markupCounts.iteritems() if count > 0)
+
+        if reuseIdx == -1:
+            loc, tokens = topLevelEnd._parse(content, loc, state)
+            if loc == -1:
+                raise tokens
+
+            newNodes += tokens
+        else:
+            reuseStart = oldNodes[reuseIdx].pos
+            if delta == 0:
+                newNodes += oldNodes[reuseIdx:]
+            else:
+                newNodes += [node.cloneDeep(delta)
+                        for node in oldNodes[reuseIdx:]]
+
+            # Unclosed markup found inside of the newly parsed part may
+            # already be contained here
+            newMarkupPositions.update(pos + delta for pos in
+                    oldMarkupPositions if pos >= reuseStart)
+
+        t = buildSyntaxNode(newNodes, 0, "text")
+        t.unclosedMarkupPositions = sorted(newMarkupPositions)
+
+        return _TheParser._postProcessing(intLanguageName, content,
+                formatDetails, t, threadstop)
+
 THE_PARSER = _TheParser()
 
 
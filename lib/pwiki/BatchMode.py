@@ -0,0 +1,448 @@
+"""
+Headless batch mode. Opens a wiki without creating the wx GUI (so no
+display is needed), performs rebuild, export, search and integrity check
+and reports progress as one JSON object per line on stdout.
+
+Started by "WikidPad.py --batch <options>", intended for cron jobs and
+benchmarks.
+"""
+
+import os, os.path, time, traceback, json
+
+import wx
+
+import ExceptionLogger
+import Consts
+from WikiExceptions import *
+
+from .MiscEvent import MiscEventSourceMixin
+from .MainApp import AppBase
+from .CmdLineAction import CmdLineAction
+from .StringOps import mbcsDec
+
+
+
+def emitEvent(event, **props):
+    """
+    Write one JSON line describing an event to stdout.
+    """
+    props["event"] = event
+    out = ExceptionLogger.getOriginalStdOut()
+    out.write(json.dumps(props, sort_keys=True) + "\n")
+    out.flush()
+
+
+
+class _HeadlessIconCache(object):
+    """
+    Replacement for wxHelper.IconCache which only knows the paths of the
+    icons but creates no bitmaps.
+    """
+    def __init__(self, iconDir):
+        self.iconDir = iconDir
+        self.iconPathDict = {}
+        try:
+            for fn in os.listdir(iconDir):
+                if fn.endswith(".gif"):
+                    self.iconPathDict[fn[:-4]] = os.path.join(iconDir, fn)
+        except OSError:
+            traceback.print_exc()
+
+    def lookupIconPath(self, iconname):
+        return self.iconPathDict.get(iconname)
+
+    def lookupIcon(self, iconname):
+        return None
+
+    def lookupIconIndex(self, iconname):
+        return -1
+
+
+
+class HeadlessApp(AppBase):
+    """
+    Application object for batch mode. It provides what the non-GUI code
+    expects from wx.GetApp() without creating a wx.App.
+
+    wx.GetApp is redirected to this object, therefore it must be created
+    before modules are imported which bind GetApp at import time
+    ("from wx import GetApp"), e.g. WikiDataManager and the database
+    backends.
+    """
+    def __init__(self):
+        from . import MainApp
+
+        MainApp.app = self
+        wx.GetApp = lambda: self
+
+        MiscEventSourceMixin.__init__(self)
+
+        self.sqliteInitFlag = False   # Read and modified only by WikiData classes
+        self.removeAppLockOnExit = False
+        self.mainFrameSet = set()
+
+        self._initDirsAndGlobalConfig()
+        self._initOptionsAndLocalization()
+
+        self.iconCache = _HeadlessIconCache(os.path.join(self.wikiAppDir,
+                "icons"))
+
+        self.reloadPlugins()
+
+        self.collator = None
+        self._rereadGlobalConfig()
+
+
+    def IsMainLoopRunning(self):
+        return False
+
+    def GetAppName(self):
+        return "WikidPad"
+
+    def GetTopWindow(self):
+        return None
+
+    def close(self):
+        self.getInsertionPluginManager().taskEnd()
+
+
+
+class BatchProgressHandler(object):
+    """
+    Progress handler (same interface as wxHelper.ProgressHandler) writing
+    "progress" events for  action  to stdout. To keep the output small
+    an event is written at most every  interval  seconds and for the
+    last step.
+    """
+    def __init__(self, action, interval=0.5):
+        self.action = action
+        self.interval = interval
+        self.msg = u""
+        self.sum = 0
+        self.lastEmit = 0
+
+    def setTitle(self, title):
+        pass
+
+    def setMessage(self, msg):
+        self.msg = msg
+
+    def open(self, sum):
+        self.sum = sum
+        self.lastEmit = 0
+
+    def update(self, step, msg):
+        self.msg = msg
+        now = time.time()
+        if step >= self.sum or now - self.lastEmit >= self.interval:
+            self.lastEmit = now
+            emitEvent("progress", action=self.action, step=step,
+                    total=self.sum, message=msg)
+
+        return True
+
+    def close(self):
+        pass
+
+
+
+class BatchMainControl(object):
+    """
+    Minimal replacement of PersonalWikiFrame as "mainControl" for
+    CmdLineAction, exporters and other plugins in batch mode.
+    """
+    def __init__(self, app, wikiDocument):
+        self.wikiAppDir = app.getWikiAppDir()
+        self.wikiDocument = wikiDocument
+        self.wikiName = wikiDocument.getWikiName()
+        self.evalLib = None
+
+        self.configuration = app.createCombinedConfiguration()
+        self.configuration.setGlobalConfig(app.getGlobalConfig())
+        self.configuration.setWikiConfig(wikiDocument.getWikiConfig())
+
+    def getWikiDocument(self):
+        return self.wikiDocument
+
+    def getWikiData(self):
+        return self.wikiDocument.getWikiData()
+
+    def getWikiConfigPath(self):
+        return self.wikiDocument.getWikiConfigPath()
+
+    def getWikiDefaultWikiLanguage(self):
+        return self.wikiDocument.getWikiDefaultWikiLanguage()
+
+    def getConfig(self):
+        return self.configuration
+
+    def getCollator(self):
+        return wx.GetApp().getCollator()
+
+    def isReadOnlyWiki(self):
+        return self.wikiDocument.isReadOnlyEffect()
+
+    def saveAllDocPages(self):
+        pass
+
+    def displayErrorMessage(self, errorStr, e=u""):
+        emitEvent("error", message=u"%s %s" % (errorStr, e))
+
+
+    def rebuildWiki(self, skipConfirm=True, onlyDirty=False):
+        if self.isReadOnlyWiki():
+            return
+
+        self.wikiDocument.rebuildWiki(BatchProgressHandler(u"rebuild"),
+                onlyDirty=onlyDirty)
+
+
+    def updateExternallyModFiles(self):
+        if self.isReadOnlyWiki():
+            return
+
+        self.wikiDocument.initiateExtWikiFileUpdate()
+
+
+    def waitForUpdateJobs(self):
+        """
+        Wait until the background jobs (e.g. updates of pages
+        after --update-ext or --rebuild) are done and end the executor.
+        Must be called before the wiki document is released which would
+        abort queued jobs.
+        """
+        executor = self.wikiDocument.getUpdateExecutor()
+        progress = BatchProgressHandler(u"update", interval=2.0)
+        jobCount = executor.getJobCount()
+        progress.open(jobCount)
+
+        while jobCount > 0:
+            progress.update(progress.sum - jobCount,
+                    _(u"Performing background jobs..."))
+            time.sleep(0.2)
+            jobCount = executor.getJobCount()
+
+        # The last job may still run, jobs of a large wiki can take longer
+        # than the usual time limit
+        executor.end(hardEnd=False, timeout=None)
+        progress.close()
+
+
+
+class BatchCmdLineAction(CmdLineAction):
+    """
+    Command line of batch mode. Understands the options of the normal
+    command line which make sense without GUI and additionally
+    --search  and  --check .
+    """
+    LONG_OPTIONS = CmdLineAction.LONG_OPTIONS + ("search=", "search-type=",
+            "check")
+
+    SEARCH_TYPES = {
+            u"regex": Consts.SEARCHTYPE_REGEX,
+            u"boolean": Consts.SEARCHTYPE_BOOLEANREGEX,
+            u"asis": Consts.SEARCHTYPE_ASIS,
+            u"index": Consts.SEARCHTYPE_INDEX
+        }
+
+    def __init__(self, sargs):
+        self.searchQueries = []
+        self.searchType = None   # None: Use option "search_wiki_searchType"
+        self.checkIntegrity = False
+        self.actionFailed = False   # Set if an action reported an error
+
+        CmdLineAction.__init__(self, sargs)
+
+
+    def _handleOption(self, o, a):
+        if o == "--search":
+            self.searchQueries.append(mbcsDec(a, "replace")[0])
+        elif o == "--search-type":
+            self.searchType = self.SEARCH_TYPES.get(mbcsDec(a, "replace")[0])
+            if self.searchType is None:
+                self.cmdLineError = True
+        elif o == "--check":
+            self.checkIntegrity = True
+
+
+    def searchAction(self, pWiki):
+        from .SearchAndReplace import SearchReplaceOperation, stripSearchString
+
+        searchType = self.searchType
+        if searchType is None:
+            searchType = pWiki.getConfig().getint("main",
+                    "search_wiki_searchType", 0)
+
+        for query in self.searchQueries:
+            sarOp = SearchReplaceOperation()
+            sarOp.searchStr = stripSearchString(query)
+            sarOp.booleanOp = searchType == Consts.SEARCHTYPE_BOOLEANREGEX
+            sarOp.indexSearch = 'no' if searchType != Consts.SEARCHTYPE_INDEX \
+                    else 'default'
+            sarOp.wildCard = 'regex' if searchType != Consts.SEARCHTYPE_ASIS \
+                    else 'no'
+            sarOp.wikiWide = True
+
+            startTime = time.time()
+            wordList = pWiki.getWikiDocument().searchWiki(sarOp, True)
+            for word in wordList:
+                emitEvent("hit", action=u"search", query=query, word=word)
+
+            emitEvent("end", action=u"search", query=query,
+                    count=len(wordList), seconds=time.time() - startTime)
+
+
+    def checkAction(self, pWiki):
+        wikiData = pWiki.getWikiData()
+        if wikiData.checkCapability("integrity check") is None:
+            self.showCmdLineUsage(pWiki,
+                    _(u"Database backend doesn't support integrity check"))
+            return
+
+        problems = wikiData.checkIntegrity()
+        for problem in problems:
+            emitEvent("problem", action=u"check", message=problem)
+
+        if problems:
+            self.actionFailed = True
+
+
+    def showCmdLineUsage(self, pWiki, addRemark=u""):
+        """
+        Report an error as JSON line instead of showing the usage dialog.
+        """
+        self.actionFailed = True
+        emitEvent("error", message=addRemark.strip())
+
+
+
+USAGE = \
+u"""Usage: WikidPad --batch -w <wiki path> <options>
+
+    -w, --wiki  <wiki path>: the wiki to process
+    -p, --page  <page name>: page for "--export-what page" or "subtree"
+    --rebuild: rebuild the wiki database
+    --update-ext: update externally modified wiki files
+    --export-what <what>: choose if you want to export page, subtree or wiki
+    --export-type <type>: tag of the export type
+    --export-dest <destination path>: path of destination directory for export
+    --export-saved <name of saved export>: alternatively name of saved export to run
+    --export-compfn: use compatible filenames on export
+    --export-workers <count>: number of processes parsing pages for HTML
+               export, 0 parses in main process only
+    --search <query>: search the wiki, can be given multiple times
+    --search-type <type>: regex, boolean, asis or index; default is the
+               type set for wiki-wide search in the options
+    --check: check the database for corruption
+
+Actions run in the above order. Progress, results and errors are written
+to stdout as one JSON object per line. The exit code is 0 on success,
+1 if an action failed and 2 on a command line error.
+"""
+
+
+def _runAction(clAction, action, fct, pWiki):
+    emitEvent("begin", action=action)
+    startTime = time.time()
+    try:
+        fct(pWiki)
+    except Exception, e:
+        traceback.print_exc()
+        clAction.actionFailed = True
+        emitEvent("error", action=action, message=unicode(e))
+        return
+
+    emitEvent("end", action=action, seconds=time.time() - startTime)
+
+
+def _releaseWiki(clAction, pWiki, wikiDoc):
+    """
+    Wait for the background jobs queued by opening the wiki or by the
+    actions (release() would abort them), then release wikiDoc.
+    Errors are reported as event.
+    """
+    try:
+        try:
+            if pWiki is not None:
+                pWiki.waitForUpdateJobs()
+        finally:
+            wikiDoc.release()
+    except Exception, e:
+        traceback.print_exc()
+        clAction.actionFailed = True
+        emitEvent("error", action=u"close", message=unicode(e))
+
+
+def main(sargs):
+    """
+    Run batch mode for command line arguments  sargs  (without the
+    leading "--batch"). Returns exit code.
+    """
+    app = HeadlessApp()
+    try:
+        clAction = BatchCmdLineAction(sargs)
+        if clAction.showHelp:
+            ExceptionLogger.getOriginalStdOut().write(USAGE)
+            return 0
+
+        if clAction.cmdLineError or not clAction.wikiToOpen:
+            emitEvent("error", message=u"Invalid command line, "
+                    u"see --batch --help")
+            return 2
+
+        # Import only now, after wx.GetApp was redirected
+        from .wikidata import WikiDataManager
+
+        cfgPath, wikiWord = WikiDataManager.splitConfigPathAndWord(
+                clAction.wikiToOpen)
+        if cfgPath is None:
+            emitEvent("error", message=_(u"Inaccessible or missing file: %s")
+                    % clAction.wikiToOpen)
+            return 1
+
+        globalConfig = app.getGlobalConfig()
+        startTime = time.time()
+        try:
+            wikiDoc = WikiDataManager.openWikiDocument(cfgPath,
+                    ignoreLock=globalConfig.getboolean("main",
+                        "wikiLockFile_ignore", False),
+                    createLock=globalConfig.getboolean("main",
+                        "wikiLockFile_create", True))
+            frmcode, frmtext = wikiDoc.checkDatabaseFormat()
+            if frmcode == 2:
+                wikiDoc.release()
+                emitEvent("error", message=frmtext)
+                return 1
+
+            wikiDoc.connect()
+        except (AppBaseException, IOError, OSError), e:
+            traceback.print_exc()
+            emitEvent("error", message=unicode(e))
+            return 1
+
+        pWiki = None
+        try:
+            emitEvent("open", wiki=cfgPath, seconds=time.time() - startTime)
+
+            pWiki = BatchMainControl(app, wikiDoc)
+
+            if clAction.rebuild != CmdLineAction.NOT_SET:
+                _runAction(clAction, u"rebuild", clAction.rebuildAction, pWiki)
+                pWiki.waitForUpdateJobs()
+
+            if clAction.exportWhat or clAction.exportSaved:
+                _runAction(clAction, u"export", clAction.exportAction, pWiki)
+
+            if clAction.searchQueries:
+                _runAction(clAction, u"search", clAction.searchAction, pWiki)
+
+            if clAction.checkIntegrity:
+                _runAction(clAction, u"check", clAction.checkAction, pWiki)
+        finally:
+            _releaseWiki(clAction, pWiki, wikiDoc)
+
+        emitEvent("close", failed=clAction.actionFailed)
+
+        return 1 if clAction.actionFailed else 0
+    finally:
+        app.close()
@@ -20,6 +20,16 @@ class CmdLineAction:
     REBUILD_EXT = 1 # Update externally modified files
     REBUILD_FULL = 2 # Full rebuild
 
+    # Options for getopt, derived classes may add further ones and process
+    # them in _handleOption()
+    SHORT_OPTIONS = "hw:p:x"
+    LONG_OPTIONS = ("help", "wiki=", "page=", "exit", "export-what=",
+            "export-type=", "export-dest=", "export-compfn",
+            "export-saved=", "export-workers=",
+            "continuous-export-saved=",
+            "anchor",
+            "rebuild", "update-ext", "no-recent", "preview", "editor")
+
     def __init__(self, sargs):
         """
         sargs -- stripped args (normally sys.args[1:])
@@ -38,6 +48,8 @@ class CmdLineAction:
         self.exportDest = None   # Destination path to dir/file
         self.exportCompFn = False   # Export with compatible filenames?
         self.exportSaved = None  # Name of saved export instead
+        self.exportWorkers = None   # Number of processes parsing pages
+                # for export or None to use option "parseWorkers_count"
         self.continuousExportSaved = None  # Name of saved export to run as continuous export
         self.rebuild = self.NOT_SET  # Rebuild the wiki
         self.frameToOpen = 1  # Open wiki in new frame? (yet unrecognized) 
@@ -65,12 +77,8 @@ class CmdLineAction:
 
         # New style
         try:
-            opts, rargs = getopt.getopt(sargs, "hw:p:x",
-                    ["help", "wiki=", "page=", "exit", "export-what=",
-                    "export-type=", "export-dest=", "export-compfn",
-                    "export-saved=", "continuous-export-saved=",
-                    "anchor",
-                    "rebuild", "update-ext", "no-recent", "preview", "editor"])
+            opts, rargs = getopt.getopt(sargs, self.SHORT_OPTIONS,
+                    list(self.LONG_OPTIONS))
         except getopt.GetoptError:
             self.cmdLineError = True
             return
@@ -98,6 +106,12 @@ class CmdLineAction:
                 self.exportCompFn = True
             elif o == "--export-saved":
                 self.exportSaved = mbcsDec(a, "replace")[0]
+            elif o == "--export-workers":
+                try:
+                    self.exportWorkers = max(0, int(a))
+                except ValueError:
+                    self.cmdLineError = True
+                    return
             elif o == "--continuous-export-saved":
                 self.continuousExportSaved = mbcsDec(a, "replace")[0]
             elif o == "--rebuild":
@@ -110,6 +124,8 @@ class CmdLineAction:
                 self._fillLastTabsSubCtrls(len(wikiWordsToOpen), "preview")
             elif o == "--editor":
                 self._fillLastTabsSubCtrls(len(wikiWordsToOpen), "textedit")
+            else:
+                self._handleOption(o, a)
 
 
         if len(wikiWordsToOpen) > 0:
@@ -119,6 +135,14 @@ class CmdLineAction:
 #         self._fillLastTabsSubCtrls(len(wikiWordsToOpen))
 
 
+    def _handleOption(self, o, a):
+        """
+        Called for options which are not processed by this class itself.
+        Derived classes with additional options overwrite this.
+        """
+        pass
+
+
     def _fillLastTabsSubCtrls(self, wwoLen, newItem=None):
         """
         If self.lastTabsSubCtrls contains at least one item, fill it up
@@ -268,6 +292,7 @@ class CmdLineAction:
         if not continuousExport:
             wordList = pWiki.getWikiDocument().searchWiki(sarOp,
                     True)
+            self._setExportWorkers(exporter)
             try:
                 exporter.export(pWiki.getWikiDocument(), wordList,
                         etype, exportDest, self.exportCompFn, addOpt, None)
@@ -284,6 +309,16 @@ class CmdLineAction:
 
 
 
+    def _setExportWorkers(self, exporter):
+        """
+        Pass number of parse worker processes to exporter if given and
+        supported by exporter.
+        """
+        if self.exportWorkers is not None and \
+                hasattr(exporter, "setParseWorkerCount"):
+            exporter.setParseWorkerCount(self.exportWorkers)
+
+
     def exportAction(self, pWiki):
         if not (self.exportWhat or self.exportType or self.exportDest or
                 self.exportSaved):
@@ -348,6 +383,7 @@ class CmdLineAction:
                     _(u"Value for --export-type can be one of:\n%s") % exList) + u"\n\n"
             return
 
+        self._setExportWorkers(exporter)
         try:
             exporter.export(pWiki.getWikiDocument(), wordList,
                     self.exportType, self.exportDest, 
@@ -385,6 +421,8 @@ N_(u"""Options:
     --export-dest <destination path>: path of destination directory for export
     --export-saved <name of saved export>: alternatively name of saved export to run
     --export-compfn: Use compatible filenames on export
+    --export-workers <count>: number of processes parsing pages for HTML
+               export, 0 parses in main process only
     --continuous-export-saved <name of saved export>: continuous export to start with
     --rebuild: rebuild the Wiki database
     --update-ext: update externally modified wiki files
@@ -854,6 +854,11 @@ GLOBALDEFAULTS = {
             # than base and shift level
     ("main", "zombieCheck"): "True", # Check for already running processes? Only active if "single_process" is True
     ("main", "cpu_affinity"): "-1", # Assign process to a single CPU? -1: Use CPU affinity on startup; greater numbers denote a particular CPU
+    ("main", "parseWorkers_count"): "0", # Number of worker processes to parse pages during rebuild, background
+            # update and HTML export. 0: Parse inside main process only; -1: One process per CPU
+    ("main", "wikiPageCache_budgetMB"): "32", # Memory budget in MB for recently used wiki pages (with text
+            # and parsed AST) kept in memory per opened wiki. 0: Keep pages only as long as they are used.
+            # Changes take effect when the wiki is opened again
 
     ("main", "tempHandling_preferMemory"): "False", # Prefer to store temporary data in memory where this is possible?
     ("main", "tempHandling_tempMode"): u"system", # Mode for storing of temporary data.
@@ -890,6 +895,8 @@ WIKIDEFAULTS = {
     ("main", "indexSearch_enabled"): u"False", # should the index search be enabled?
     ("main", "indexSearch_formatNo"): u"1", # internal: Number of format of search index (only valid if index enabled)
             # if it doesn't match format number of this WikidPad version, index rebuild is needed
+    ("main", "search_contentIndex_enabled"): u"False", # Keep a trigram index of page content to speed up
+            # searches without index search (Compact Sqlite only, needs sqlite 3.34 or later)
     ("main", "tabs_maxCharacters"): u"0", # Maximum number of characters to show on a tab (0: inifinite)
     ("main", "template_pageNamesRE"): u"^template/",  # Regular expression pattern for pages which should be seen as templates
             # Especially they will be listed in text editor context menu on new pages
@@ -947,6 +954,9 @@ WIKIDEFAULTS = {
     ("main", "wikiPageFiles_writeFileMode"): u"0", # How wiki page files are modified on saving?
             # 0: Safe: create temp file, delete target file, rename temp to target
             # 1: Just overwrite in place (useful if files are hardlinked).
+    ("main", "wikiPageFiles_watchExternalChanges"): u"False", # Watch data directory (Linux only) and update pages
+            # as soon as their files are changed by other programs instead of waiting for
+            # "Update ext. modif. wiki files".
 
     ("main", "headingsAsAliases_depth"): "0",  # Maximum heading depth for which aliases should be generated for
             # each heading up to and including this depth.
@@ -3,7 +3,7 @@ from __future__ import with_statement
 ## profile = profilehooks.profile(filename="profile.prf", immediate=False)
 
 
-import os.path, re, struct, time, traceback, collections
+import sys, os.path, re, struct, time, traceback, collections
 
 from .rtlibRepl import minidom
 
@@ -32,6 +32,37 @@ import Serialization
 UNDEFINED = object()
 
 
+# Rough numbers to estimate the memory used by a cached page
+# (see AbstractWikiPage.getCacheCost())
+_UNICHAR_SIZE = 4 if sys.maxunicode > 0xffff else 2
+_PAGE_BASE_CACHE_COST = 2000   # Page object itself, locks, attributes
+_AST_CACHE_COST_PER_CHAR = 44   # Measured for parsed pages of WikidPadHelp
+_UNKNOWN_WORD_CACHE_COST = 300  # Node of a word unknown to spell checker
+
+
+class MainDbCacheData(object):
+    """
+    Compact form of the data a page AST contributes to the database cache
+    (attributes, todos, child relations, headings). Unlike the AST itself it
+    is small enough to be held for all pages of a wiki during rebuild and
+    can be transferred from a parse worker process.
+    """
+    __slots__ = ("liveTextPlaceHold", "formatDetails", "attrs", "todos",
+            "childRelations", "headings")
+
+    def __init__(self, liveTextPlaceHold, formatDetails, attrs, todos,
+            childRelations, headings):
+        # liveTextPlaceHold object of the page when the AST was valid
+        self.liveTextPlaceHold = liveTextPlaceHold
+        # Format details the AST was built with (without basePage to not
+        # keep the page and its AST alive) or None if unknown
+        self.formatDetails = formatDetails
+        self.attrs = attrs   # Dictionary {attrKey: [attrValue, ...]} or None
+        self.todos = todos   # List of (todoKey, todoValue) tuples
+        self.childRelations = childRelations   # List of (toWord, pos) tuples
+        self.headings = headings   # List of (level, title, endPos) tuples
+
+
 class DocPage(object, MiscEventSourceMixin):
     """
     Abstract common base class for WikiPage and FunctionalPage
@@ -182,7 +213,10 @@ class DocPage(object, MiscEventSourceMixin):
             self.writeToDatabase(text, fireEvent=fireEvent)
 
 
-    def replaceLiveText(self, text, fireEvent=True):
+    def replaceLiveText(self, text, fireEvent=True, deferUpdate=False):
+        """
+        deferUpdate -- see writeToDatabase(), ignored if page is in an editor
+        """
         with self.textOperationLock:
             if self.isReadOnlyEffect():
                 return
@@ -196,7 +230,8 @@ class DocPage(object, MiscEventSourceMixin):
                 txtEditor.replaceText(text)
                 return
 
-            self.writeToDatabase(text, fireEvent=fireEvent)
+            self.writeToDatabase(text, fireEvent=fireEvent,
+                    deferUpdate=deferUpdate)
 
 
     def informEditorTextChanged(self, changer):
@@ -269,9 +304,14 @@ class DocPage(object, MiscEventSourceMixin):
         return (self.wikiDocument is None) or self.wikiDocument.isReadOnlyEffect()
 
 
-    def writeToDatabase(self, text=None, fireEvent=True):
+    def writeToDatabase(self, text=None, fireEvent=True, deferUpdate=False):
         """
         Write current text to database and initiate update of meta-data.
+
+        deferUpdate -- if True and text must be saved, meta-data is only
+            marked dirty (wiki pages only). The caller must call
+            WikiDataManager.pushDirtyMetaDataUpdate() afterwards. Used to
+            update many pages at once.
         """
         with self.textOperationLock:
             if self.isReadOnlyEffect():
@@ -282,7 +322,10 @@ class DocPage(object, MiscEventSourceMixin):
                 if text is None:
                     text = self.getLiveText()
                 self._save(text, fireEvent=fireEvent)
-                self.initiateUpdate(fireEvent=fireEvent)
+                if deferUpdate:
+                    self.markMetaDataDirty()
+                else:
+                    self.initiateUpdate(fireEvent=fireEvent)
             elif u:
                 self.initiateUpdate(fireEvent=fireEvent)
             else:
@@ -343,6 +386,10 @@ class AliasWikiPage(DocPage):
         """
         return u"wikipage/" + self.aliasWikiWord
 
+    def getCacheCost(self):
+        # Cached data is held and counted by the real page
+        return 0
+
     def getNonAliasPage(self):
         """
         If this page belongs to an alias of a wiki word, return a page for
@@ -499,12 +546,27 @@ class AbstractWikiPage(DataCarryingPage):
         self.livePageBaseFormatDetails = None   # Cached format details on which the
                 # page-ast bases
 
+        # Text and AST of the last parsing. In contrast to livePageAst these
+        # are kept when text changes so the parser can reuse the unchanged
+        # parts of the AST.
+        self.livePageReuseText = None
+        self.livePageReuseAst = None
+
         # List of words unknown to spellchecker
         self.liveSpellCheckerUnknownWords = None
 
         # liveTextPlaceHold object on which the liveSpellCheckerUnknownWords is based.
         self.liveSpellCheckerUnknownWordsBasePlaceHold = None
 
+        # Text, unknown words and dictionary language of the last spell check.
+        # They are kept when text changes so only the changed lines must
+        # be checked again.
+        self.liveSpellCheckerReuseText = None
+        self.liveSpellCheckerReuseUnknownWords = None
+        self.liveSpellCheckerReuseLanguage = None
+        # Incremented each time the spell checker session was modified
+        self.liveSpellCheckerSessionChanges = 0
+
         self.__sinkWikiDocumentSpellSession = KeyFunctionSinkAR((
                 ("modified spell checker session", self.onModifiedSpellCheckerSession),
         ))
@@ -525,6 +587,33 @@ class AbstractWikiPage(DataCarryingPage):
         super(AbstractWikiPage, self).invalidate()
         self.__sinkWikiDocumentSpellSession.setEventSource(None)
 
+
+    def getCacheCost(self):
+        """
+        Return approximate number of bytes held by the cached data of this
+        page (live text, AST, words unknown to spell checker). Used by the
+        page cache of the WikiDataManager to keep its memory budget.
+        """
+        cost = _PAGE_BASE_CACHE_COST
+
+        editorText = self.editorText
+        if editorText is not None:
+            cost += len(editorText) * _UNICHAR_SIZE
+
+        reuseText = self.livePageReuseText
+        if reuseText is not None:
+            if reuseText is not editorText:
+                cost += len(reuseText) * _UNICHAR_SIZE
+            if self.livePageReuseAst is not None:
+                cost += len(reuseText) * _AST_CACHE_COST_PER_CHAR
+
+        unknownWords = self.liveSpellCheckerUnknownWords
+        if unknownWords is not None:
+            cost += len(unknownWords) * _UNKNOWN_WORD_CACHE_COST
+
+        return cost
+
+
     # TODO: Replace getWikiWord by getWikiPageName where appropriate
     def getWikiWord(self):
         """
@@ -853,6 +942,84 @@ class AbstractWikiPage(DataCarryingPage):
         return pageAst.iterDeepByName("todoEntry")
 
 
+    @staticmethod
+    def extractAttributesFromPageAst(pageAst, threadstop=DUMBTHREADSTOP):
+        """
+        Return dictionary {attrKey: [attrValue, ...]} of the attributes
+        in pageAst. Needs neither wiki document nor GUI, so it can also run
+        in a parse worker process.
+        """
+        attrs = {}
+
+        def addAttribute(key, value):
+            threadstop.testValidThread()
+            values = attrs.get(key)
+            if not values:
+                values = []
+                attrs[key] = values
+            values.append(value)
+
+
+        attrNodes = AbstractWikiPage.extractAttributeNodesFromPageAst(pageAst)
+        for node in attrNodes:
+            for attrKey, attrValue in \
+                    (getattr(node, "attrs", []) + getattr(node, "props", [])):  # TODO remove "property"-compatibility
+                addAttribute(attrKey, attrValue)
+
+        return attrs
+
+
+    @staticmethod
+    def extractMainDbCacheEntriesFromPageAst(pageAst,
+            threadstop=DUMBTHREADSTOP):
+        """
+        Return tuple (todos, childRelations, headings) with lists as
+        described in MainDbCacheData. Like extractAttributesFromPageAst()
+        this can run in a parse worker process.
+        """
+        todos = []
+        childRelations = []
+        childRelationSet = set()
+
+        def addTodo(todoKey, todoValue):
+            threadstop.testValidThread()
+            todo = (todoKey, todoValue)
+            if todo not in todos:
+                todos.append(todo)
+
+        def addChildRelationship(toWord, pos):
+            threadstop.testValidThread()
+            if toWord not in childRelationSet:
+                childRelations.append((toWord, pos))
+                childRelationSet.add(toWord)
+
+        # Add todo entries
+        todoNodes = pageAst.iterDeepByName("todoEntry")
+        for node in todoNodes:
+            for todoKey, todoValueNode in node.todos:
+                addTodo(todoKey, todoValueNode.getString())
+
+        threadstop.testValidThread()
+
+        # Add child relations
+        wwTokens = pageAst.iterDeepByName("wikiWord")
+        for t in wwTokens:
+            addChildRelationship(t.wikiWord, t.pos)
+
+        threadstop.testValidThread()
+
+        headings = []
+        for node in pageAst.iterFlatByName("heading"):
+            threadstop.testValidThread()
+            title = node.getString()
+            if title.endswith(u"\n"):
+                title = title[:-1]
+
+            headings.append((node.level, title, node.pos + node.strLength))
+
+        return todos, childRelations, headings
+
+
     def _save(self, text, fireEvent=True):
         """
         Saves the content of current doc page.
@@ -909,6 +1076,18 @@ class AbstractWikiPage(DataCarryingPage):
         Return PageAst of live text. In rare cases the live text may have
         changed while method is running and the result is inaccurate.
         """
+        return self.getLivePageAstAndText(fireEvent=fireEvent,
+                dieOnChange=dieOnChange, threadstop=threadstop,
+                allowMetaDataUpdate=allowMetaDataUpdate)[0]
+
+
+    def getLivePageAstAndText(self, fireEvent=True, dieOnChange=False,
+            threadstop=DUMBTHREADSTOP, allowMetaDataUpdate=False):
+        """
+        Same as getLivePageAst() but returns tuple (pageAst, text) where
+        text is the live text the AST is based on. Callers needing both
+        (e.g. rebuild) don't have to retrieve the text a second time.
+        """
 #         if self.livePageAstBuildLock.acquire(False):
 #             self.livePageAstBuildLock.release()
 #         else:
@@ -924,8 +1103,15 @@ class AbstractWikiPage(DataCarryingPage):
 
                 pageAst = self.getLivePageAstIfAvailable()
 
+                reuseText = self.livePageReuseText
+                reuseAst = self.livePageReuseAst
+                if self.livePageBaseFormatDetails is None or \
+                        not formatDetails.isEquivTo(
+                        self.livePageBaseFormatDetails):
+                    reuseAst = None
+
             if pageAst is not None:
-                return pageAst
+                return pageAst, text
 
             if dieOnChange:
                 if threadstop is DUMBTHREADSTOP:
@@ -941,7 +1127,8 @@ class AbstractWikiPage(DataCarryingPage):
                 pageAst = buildSyntaxNode([], 0)
             else:
                 pageAst = self.parseTextInContext(text, formatDetails=formatDetails,
-                        threadstop=threadstop)
+                        threadstop=threadstop, reuseText=reuseText,
+                        reusePageAst=reuseAst)
 
             with self.textOperationLock:
                 threadstop.testValidThread()
@@ -949,11 +1136,13 @@ class AbstractWikiPage(DataCarryingPage):
                 self.livePageAst = pageAst
                 self.livePageBasePlaceHold = liveTextPlaceHold
                 self.livePageBaseFormatDetails = formatDetails
+                self.livePageReuseText = text
+                self.livePageReuseAst = pageAst
 
 
         if self.isReadOnlyEffect():
             threadstop.testValidThread()
-            return pageAst
+            return pageAst, text
 
 #         if False and allowMetaDataUpdate:   # TODO: Option
 #             self._refreshMetaData(pageAst, formatDetails, fireEvent=fireEvent,
@@ -961,7 +1150,29 @@ class AbstractWikiPage(DataCarryingPage):
 
         with self.textOperationLock:
             threadstop.testValidThread()
-            return pageAst
+            return pageAst, text
+
+
+    def setLivePageAstIfCurrent(self, pageAst, text, liveTextPlaceHold,
+            formatDetails):
+        """
+        Set pageAst (e.g. parsed by a ParseWorkerPool) as AST of live text
+        if live text and format details are still the ones the AST was
+        parsed from. Returns True iff AST was set.
+        """
+        with self.livePageAstBuildLock:
+            with self.textOperationLock:
+                if self.liveTextPlaceHold is not liveTextPlaceHold or \
+                        not self.getFormatDetails().isEquivTo(formatDetails):
+                    return False
+
+                self.livePageAst = pageAst
+                self.livePageBasePlaceHold = liveTextPlaceHold
+                self.livePageBaseFormatDetails = formatDetails
+                self.livePageReuseText = text
+                self.livePageReuseAst = pageAst
+
+                return True
 
 
     def onModifiedSpellCheckerSession(self, miscevt):
@@ -974,6 +1185,10 @@ class AbstractWikiPage(DataCarryingPage):
 
             self.liveSpellCheckerUnknownWords = None
             self.liveSpellCheckerUnknownWordsBasePlaceHold = None
+            self.liveSpellCheckerReuseText = None
+            self.liveSpellCheckerReuseUnknownWords = None
+            self.liveSpellCheckerReuseLanguage = None
+            self.liveSpellCheckerSessionChanges += 1
 
         self.fireMiscEventKeys(("modified spell checker session",))
 
@@ -1011,6 +1226,11 @@ class AbstractWikiPage(DataCarryingPage):
 
             unknownWords = self.getSpellCheckerUnknownWordsIfAvailable()
 
+            reuseText = self.liveSpellCheckerReuseText
+            reuseUnknownWords = self.liveSpellCheckerReuseUnknownWords
+            reuseLanguage = self.liveSpellCheckerReuseLanguage
+            sessionChanges = self.liveSpellCheckerSessionChanges
+
         if unknownWords is not None:
             return unknownWords
 
@@ -1029,20 +1249,34 @@ class AbstractWikiPage(DataCarryingPage):
             return
             
         spellSession.setCurrentDocPage(self)
+        language = spellSession.dictLanguage
+
+        if language != reuseLanguage:
+            # Unknown words were checked with another dictionary
+            reuseText = None
+            reuseUnknownWords = None
 
         if len(text) == 0:
-            unknownWords = []
+            unknownWords = buildSyntaxNode([], -1, "unknownSpellList")
         else:
             unknownWords = spellSession.buildUnknownWordList(text,
-                    threadstop=threadstop)
+                    threadstop=threadstop, reuseText=reuseText,
+                    reuseUnknownWords=reuseUnknownWords)
 
         spellSession.close()
 
         with self.textOperationLock:
             threadstop.testValidThread()
 
+            if sessionChanges != self.liveSpellCheckerSessionChanges:
+                # Session was modified meanwhile, result may be outdated
+                return unknownWords
+
             self.liveSpellCheckerUnknownWords = unknownWords
             self.liveSpellCheckerUnknownWordsBasePlaceHold = liveTextPlaceHold
+            self.liveSpellCheckerReuseText = text
+            self.liveSpellCheckerReuseUnknownWords = unknownWords
+            self.liveSpellCheckerReuseLanguage = language
             
             self.__sinkWikiDocumentSpellSession.setEventSource(
                     self.getWikiDocument().getOnlineSpellCheckerSession())
@@ -1063,12 +1297,16 @@ class AbstractWikiPage(DataCarryingPage):
 
 ##     @profile
     def parseTextInContext(self, text, formatDetails=None,
-            threadstop=DUMBTHREADSTOP):
+            threadstop=DUMBTHREADSTOP, reuseText=None, reusePageAst=None):
         """
         Return PageAst of text in the context of this page (wiki language and
         format details).
 
         text: unistring with text
+        reuseText, reusePageAst: Previous text and its AST built with
+            equivalent format details. If the parser supports it
+            (has method "parseIncremental"), only the changed part of
+            text is parsed again.
         """
         parser = wx.GetApp().createWikiParser(self.getWikiLanguageName()) # TODO debug mode  , True
 
@@ -1076,8 +1314,14 @@ class AbstractWikiPage(DataCarryingPage):
             formatDetails = self.getFormatDetails()
 
         try:
-            pageAst = parser.parse(self.getWikiLanguageName(), text,
-                    formatDetails, threadstop=threadstop)
+            if reusePageAst is not None and reuseText is not None and \
+                    hasattr(parser, "parseIncremental"):
+                pageAst = parser.parseIncremental(self.getWikiLanguageName(),
+                        reuseText, reusePageAst, text, formatDetails,
+                        threadstop=threadstop)
+            else:
+                pageAst = parser.parse(self.getWikiLanguageName(), text,
+                        formatDetails, threadstop=threadstop)
         finally:
             wx.GetApp().freeWikiParser(parser)
 
@@ -1441,7 +1685,7 @@ class WikiPage(AbstractWikiPage):
         Delete a page which doesn't really exist.
         Just sends an appropriate event.
         """
-        wx.CallAfter(self.fireMiscEventKeys,
+        Utilities.callAfter(self.fireMiscEventKeys,
                 ("pseudo-deleted page", "pseudo-deleted wiki page"))
 
 
@@ -1464,7 +1708,7 @@ class WikiPage(AbstractWikiPage):
             self.queueRemoveFromSearchIndex()   # TODO: Check for (dead-)locks
 
             if fireEvent:
-                wx.CallAfter(self.fireMiscEventKeys,
+                Utilities.callAfter(self.fireMiscEventKeys,
                         ("deleted page", "deleted wiki page"))
 
 
@@ -1569,7 +1813,7 @@ class WikiPage(AbstractWikiPage):
             callInMainThread(editor.handleInvalidFileSignature, self)
 
         if fireEvent:
-            wx.CallAfter(self.fireMiscEventKeys,
+            Utilities.callAfter(self.fireMiscEventKeys,
                     ("checked file signature invalid",))
 
         return False
@@ -1621,34 +1865,11 @@ class WikiPage(AbstractWikiPage):
                 syncUpdate=True)
 
 
-    def refreshAttributesFromPageAst(self, pageAst, threadstop=DUMBTHREADSTOP):
+    def _writeAttributes(self, attrs, threadstop=DUMBTHREADSTOP):
         """
-        Update properties (aka attributes) only.
-        This is step one in update/rebuild process.
+        Write attributes dictionary attrs to database. Returns False if page
+        doesn't exist anymore.
         """
-        if self.wikiDocument.isReadOnlyEffect():
-            return True  # TODO Error?
-
-        langHelper = wx.GetApp().createWikiLanguageHelper(
-                self.getWikiLanguageName())
-
-        attrs = {}
-
-        def addAttribute(key, value):
-            threadstop.testValidThread()
-            values = attrs.get(key)
-            if not values:
-                values = []
-                attrs[key] = values
-            values.append(value)
-
-
-        attrNodes = self.extractAttributeNodesFromPageAst(pageAst)
-        for node in attrNodes:
-            for attrKey, attrValue in \
-                    (getattr(node, "attrs", []) + getattr(node, "props", [])):  # TODO remove "property"-compatibility
-                addAttribute(attrKey, attrValue)
-
         with self.textOperationLock:
             threadstop.testValidThread()
 
@@ -1659,6 +1880,22 @@ class WikiPage(AbstractWikiPage):
         except WikiWordNotFoundException:
             return False
 
+        return True
+
+
+    def refreshAttributesFromPageAst(self, pageAst, threadstop=DUMBTHREADSTOP):
+        """
+        Update properties (aka attributes) only.
+        This is step one in update/rebuild process.
+        """
+        if self.wikiDocument.isReadOnlyEffect():
+            return True  # TODO Error?
+
+        attrs = self.extractAttributesFromPageAst(pageAst, threadstop=threadstop)
+
+        if not self._writeAttributes(attrs, threadstop=threadstop):
+            return False
+
         valid = False
 
         with self.textOperationLock:
@@ -1679,47 +1916,109 @@ class WikiPage(AbstractWikiPage):
         return valid
 
 
-
-    def refreshMainDbCacheFromPageAst(self, pageAst, fireEvent=True,
-            threadstop=DUMBTHREADSTOP):
+    def refreshAttributesFromData(self, data, threadstop=DUMBTHREADSTOP):
         """
-        Update everything else (todos, relations).
-        This is step two in update/rebuild process.
+        Same as refreshAttributesFromPageAst() but takes a MainDbCacheData
+        object (with attrs set) as built by extractMainDbCacheDataFromPageAst()
+        or by a ParseWorkerPool.
         """
         if self.wikiDocument.isReadOnlyEffect():
-            return True   # return True or False?
-
-        todos = []
-        childRelations = []
-        childRelationSet = set()
+            return True
 
-        def addTodo(todoKey, todoValue):
-            threadstop.testValidThread()
-            todo = (todoKey, todoValue)
-            if todo not in todos:
-                todos.append(todo)
+        if not self._writeAttributes(data.attrs, threadstop=threadstop):
+            return False
 
-        def addChildRelationship(toWord, pos):
-            threadstop.testValidThread()
-            if toWord not in childRelationSet:
-                childRelations.append((toWord, pos))
-                childRelationSet.add(toWord)
+        return self.finishAttributesBatchEntry(data, threadstop=threadstop)
 
-        # Add todo entries
-        todoNodes = pageAst.iterDeepByName("todoEntry")
-        for node in todoNodes:
-            for todoKey, todoValueNode in node.todos:
-                addTodo(todoKey, todoValueNode.getString())
 
+    def getAttributesBatchEntry(self, data, threadstop=DUMBTHREADSTOP):
+        """
+        Return entry for WikiData.updateMetaDataBatch() to write the
+        attributes of MainDbCacheData object data. After the batch was
+        written, finishAttributesBatchEntry() must be called.
+        """
         threadstop.testValidThread()
 
-        # Add child relations
-        wwTokens = pageAst.iterDeepByName("wikiWord")
-        for t in wwTokens:
-            addChildRelationship(t.wikiWord, t.pos)
+        return (self.wikiPageName, data.attrs, None, None, None)
 
-        threadstop.testValidThread()
-        
+
+    def finishAttributesBatchEntry(self, data, threadstop=DUMBTHREADSTOP,
+            fromRebuild=False):
+        """
+        Called after attributes of data were written to database.
+        Sets meta-data state if data is still current and returns True then.
+
+        fromRebuild -- see _isMainDbCacheDataCurrent()
+        """
+        valid = False
+
+        with self.textOperationLock:
+            self.attrs = None
+
+            if self._isMainDbCacheDataCurrent(data, fromRebuild=fromRebuild):
+                threadstop.testValidThread()
+                # clear the dirty flag
+
+                self.getWikiData().setMetaDataState(self.wikiPageName,
+                        Consts.WIKIWORDMETADATA_STATE_ATTRSPROCESSED)
+
+                valid = True
+
+        return valid
+
+
+    def _isMainDbCacheDataCurrent(self, data, fromRebuild=False):
+        """
+        Check if MainDbCacheData data is based on the current live text and
+        format details. Must be called inside self.textOperationLock.
+
+        fromRebuild -- If True, data may also be built for another WikiPage
+            object of the same word as long as this page isn't open in an
+            editor. Only the rebuild may use it: It creates fresh page
+            objects and nothing else writes pages meanwhile, so the database
+            content can't have changed since data was built (it isn't
+            possible to check this here).
+        """
+        if self.saveDirtySince is not None or data.formatDetails is None:
+            return False
+
+        if data.liveTextPlaceHold is not self.liveTextPlaceHold and \
+                not (fromRebuild and self.getEditorText() is None):
+            return False
+
+        return self.getFormatDetails().isEquivTo(data.formatDetails)
+
+
+    def extractMainDbCacheDataFromPageAst(self, pageAst,
+            threadstop=DUMBTHREADSTOP):
+        """
+        Collect attributes, todos, child relations and headings from pageAst
+        into a MainDbCacheData object for refreshAttributesFromData() and
+        refreshMainDbCacheFromData().
+        """
+        attrs = self.extractAttributesFromPageAst(pageAst, threadstop=threadstop)
+        todos, childRelations, headings = \
+                self.extractMainDbCacheEntriesFromPageAst(pageAst,
+                threadstop=threadstop)
+
+        with self.textOperationLock:
+            if pageAst is self.livePageAst and \
+                    self.livePageBaseFormatDetails is not None:
+                formatDetails = \
+                        self.livePageBaseFormatDetails.copyWithoutBasePage()
+                liveTextPlaceHold = self.livePageBasePlaceHold
+            else:
+                formatDetails = None
+                liveTextPlaceHold = None
+
+        return MainDbCacheData(liveTextPlaceHold, formatDetails, attrs, todos,
+                childRelations, headings)
+
+
+    def _buildMainDbCacheMatchTerms(self, headings, threadstop=DUMBTHREADSTOP):
+        """
+        Return list of match terms built from aliases and headings.
+        """
         # Add aliases to match terms
         matchTerms = []
 
@@ -1745,17 +2044,23 @@ class WikiPage(AbstractWikiPage):
 
         if depth > 0:
             HEADALIAS_TYPE = Consts.WIKIWORDMATCHTERMS_TYPE_FROM_CONTENT
-            for node in pageAst.iterFlatByName("heading"):
-                threadstop.testValidThread()
-                if node.level > depth:
+            for level, title, endPos in headings:
+                if level > depth:
                     continue
 
-                title = node.getString()
-                if title.endswith(u"\n"):
-                    title = title[:-1]
-                
                 matchTerms.append((title, HEADALIAS_TYPE, self.wikiPageName,
-                        node.pos + node.strLength, 0))
+                        endPos, 0))
+
+        return matchTerms
+
+
+    def _writeMainDbCacheData(self, data, threadstop=DUMBTHREADSTOP):
+        """
+        Write todos, relations and match terms from MainDbCacheData object
+        data to database. Returns False if page doesn't exist anymore.
+        """
+        matchTerms = self._buildMainDbCacheMatchTerms(data.headings,
+                threadstop=threadstop)
 
         with self.textOperationLock:
             threadstop.testValidThread()
@@ -1764,16 +2069,34 @@ class WikiPage(AbstractWikiPage):
             self.childRelations = None
             self.childRelationSet = set()
         try:
-            self.getWikiData().updateTodos(self.wikiPageName, todos)
+            self.getWikiData().updateTodos(self.wikiPageName, data.todos)
             threadstop.testValidThread()
             self.getWikiData().updateChildRelations(self.wikiPageName,
-                    childRelations)
+                    data.childRelations)
             threadstop.testValidThread()
             self.getWikiData().updateWikiWordMatchTerms(self.wikiPageName,
                     matchTerms)
             threadstop.testValidThread()
         except WikiWordNotFoundException:
             return False
+
+        return True
+
+
+    def refreshMainDbCacheFromPageAst(self, pageAst, fireEvent=True,
+            threadstop=DUMBTHREADSTOP):
+        """
+        Update everything else (todos, relations).
+        This is step two in update/rebuild process.
+        """
+        if self.wikiDocument.isReadOnlyEffect():
+            return True   # return True or False?
+
+        data = self.extractMainDbCacheDataFromPageAst(pageAst,
+                threadstop=threadstop)
+
+        if not self._writeMainDbCacheData(data, threadstop=threadstop):
+            return False
 #             self.modified = None   # ?
 #             self.created = None
 
@@ -1812,46 +2135,101 @@ class WikiPage(AbstractWikiPage):
         return valid
 
 
-    def putIntoSearchIndex(self, threadstop=DUMBTHREADSTOP):
+    def refreshMainDbCacheFromData(self, data, fireEvent=True,
+            threadstop=DUMBTHREADSTOP):
+        """
+        Same as refreshMainDbCacheFromPageAst() but takes a MainDbCacheData
+        object previously built by extractMainDbCacheDataFromPageAst(),
+        for this WikiPage object
+        (see _isMainDbCacheDataCurrent() for the validity check).
+        """
+        if self.wikiDocument.isReadOnlyEffect():
+            return True
+
+        if not self._writeMainDbCacheData(data, threadstop=threadstop):
+            return False
+
+        return self.finishMainDbCacheBatchEntry(data, fireEvent=fireEvent,
+                threadstop=threadstop)
+
+
+    def getMainDbCacheBatchEntry(self, data, threadstop=DUMBTHREADSTOP):
+        """
+        Return entry for WikiData.updateMetaDataBatch() to write todos,
+        relations and match terms of MainDbCacheData object data. After the
+        batch was written, finishMainDbCacheBatchEntry() must be called.
+        """
+        matchTerms = self._buildMainDbCacheMatchTerms(data.headings,
+                threadstop=threadstop)
+
+        threadstop.testValidThread()
+
+        return (self.wikiPageName, None, data.todos, data.childRelations,
+                matchTerms)
+
+
+    def finishMainDbCacheBatchEntry(self, data, fireEvent=True,
+            threadstop=DUMBTHREADSTOP, fromRebuild=False):
         """
-        Add or update the index for the given docPage
+        Called after todos, relations and match terms of data were written
+        to database. Sets meta-data state if data is still current and
+        returns True then.
+
+        fromRebuild -- see _isMainDbCacheDataCurrent()
         """
+        valid = False
         with self.textOperationLock:
-            threadstop.testValidThread()
+            self.todos = None
+            self.childRelations = None
+            self.childRelationSet = set()
 
-            if not self.getWikiDocument().isSearchIndexEnabled():
-                return True  # Or false?
-            
-            liveTextPlaceHold = self.liveTextPlaceHold
-            content = self.getLiveText()
+            if self._isMainDbCacheDataCurrent(data, fromRebuild=fromRebuild):
 
-        writer = None
-        try:
-            searchIdx = self.getWikiDocument().getSearchIndex()
-            writer = searchIdx.writer(timeout=Consts.DEADBLOCKTIMEOUT)
+                threadstop.testValidThread()
+                # clear the dirty flag
+                self.updateDirtySince = None
+
+                self.getWikiData().setMetaDataState(self.wikiPageName,
+                        Consts.WIKIWORDMETADATA_STATE_SYNTAXPROCESSED)
+                valid = True
+
+        if fireEvent:
+            callInMainThreadAsync(self.fireMiscEventKeys,
+                    ("updated wiki page", "updated page"))
 
-            unifName = self.getUnifiedPageName()
+        return valid
 
-            writer.delete_by_term("unifName", unifName)
-            
-            writer.add_document(unifName=unifName,
-                    modTimestamp=self.getTimestamps()[0],
-                    content=content)
-        except:
-            if writer is not None:
-                writer.cancel()
-            raise
 
-        # Check within lock if data is current yet
+    def putIntoSearchIndex(self, threadstop=DUMBTHREADSTOP, content=None,
+            liveTextPlaceHold=None, markIndexed=True):
+        """
+        Add or update the index for the given docPage. The update is
+        written together with other pending ones by
+        WikiDataManager.flushSearchIndexUpdates().
+        Returns False if content isn't current anymore.
+
+        content -- Text to index. If None, the live text is retrieved.
+            Otherwise liveTextPlaceHold must be the placeholder object
+            belonging to content.
+        markIndexed -- Set meta-data state to "indexed" when written.
+            Rebuild uses False here because the index is written before
+            the syntax is processed.
+        """
         with self.textOperationLock:
-            if not liveTextPlaceHold is self.liveTextPlaceHold:
-                writer.cancel()
+            threadstop.testValidThread()
+
+            if not self.getWikiDocument().isSearchIndexEnabled():
+                return True  # Or false?
+            
+            if content is None:
+                liveTextPlaceHold = self.liveTextPlaceHold
+                content = self.getLiveText()
+            elif not liveTextPlaceHold is self.liveTextPlaceHold:
                 return False
-            else:
-                writer.commit()
-                self.getWikiData().setMetaDataState(self.wikiPageName,
-                        Consts.WIKIWORDMETADATA_STATE_INDEXED)
-                return True
+
+        self.getWikiDocument().queueSearchIndexUpdate(self, content,
+                liveTextPlaceHold, markIndexed=markIndexed)
+        return True
 
     def removeFromSearchIndex(self):
         """
@@ -1861,19 +2239,8 @@ class WikiPage(AbstractWikiPage):
         if not self.getWikiDocument().isSearchIndexEnabled() or self.isInvalid():
             return
 
-        unifName = self.getUnifiedPageName()
-        
-        writer = None
-        try:
-            searchIdx = self.getWikiDocument().getSearchIndex()
-            writer = searchIdx.writer(timeout=Consts.DEADBLOCKTIMEOUT)
-            writer.delete_by_term("unifName", unifName)
-        except:
-            if writer is not None:
-                writer.cancel()
-            raise
-
-        writer.commit()
+        self.getWikiDocument().queueSearchIndexRemoval(
+                self.getUnifiedPageName())
 
 
     def queueRemoveFromSearchIndex(self):
@@ -2115,9 +2482,9 @@ class WikiPage(AbstractWikiPage):
         other = []
 
         # Put relations into their appropriate arrays
+        relationAttrs = wikiDocument.getAttributesForWords(relations)
         for relation in relations:
-            relationPage = wikiDocument.getWikiPageNoError(relation)
-            attrs = relationPage.getAttributes()
+            attrs = relationAttrs[relation]
             try:
                 if (attrs.has_key(u'tree_position')):
                     positioned.append((int(attrs[u'tree_position'][-1]) - 1, relation))
@@ -4,10 +4,18 @@ from __future__ import with_statement
 ## profile = profilehooks.profile(filename="profile.prf", immediate=False)
 
 # from Enum import Enumeration
-import sys, os, string, re, traceback, locale, time, urllib
+import sys, os, string, re, traceback, locale, time, urllib, gzip
 from os.path import join, exists, splitext, abspath
 from cStringIO import StringIO
 import shutil
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 ## from xml.sax.saxutils import escape
 
 from . import urllib_red as urllib
@@ -460,6 +468,63 @@ class _SeparatorWatchUtf8Writer(utf8Writer):
 
 
 
+class _SeparatorUtf8Writer(utf8Writer):
+    """
+    Writes separators between entries without checking the content.
+    Used when the separator was chosen by a pre-pass with
+    _SeparatorScanWriter.
+    """
+    def __init__(self, stream, separator, errors="strict"):
+        utf8Writer.__init__(self, stream, errors)
+        self.separator = separator
+        self.firstSeparatorCallDone = False
+
+    def checkAndClearBuffer(self):
+        pass
+
+    def writeSeparator(self):
+        if self.firstSeparatorCallDone:
+            utf8Writer.write(self, u"\n%s\n" % self.separator)
+        else:
+            self.firstSeparatorCallDone = True
+
+
+class _SeparatorScanWriter(object):
+    """
+    Stand-in for the export file during the pre-pass of an export. Nothing
+    is written, only lines looking like a separator are collected for one
+    entry at a time.
+    """
+    _SEPARATOR_LIKE_RE = re.compile(ur"^-----.{25}-----$",
+            re.MULTILINE | re.UNICODE)
+
+    def __init__(self):
+        self.buffer = []
+        self.separatorLikeLines = set()
+
+    def write(self, object):
+        self.buffer.append(object)
+
+    def writelines(self, list):
+        self.buffer += list
+
+    def checkAndClearBuffer(self):
+        if len(self.buffer) > 0:
+            self.separatorLikeLines.update(self._SEPARATOR_LIKE_RE.findall(
+                    u"".join(self.buffer)))
+            self.buffer = []
+
+    def writeSeparator(self):
+        self.checkAndClearBuffer()
+
+    def flush(self):
+        self.checkAndClearBuffer()
+
+    def getSeparatorLikeLines(self):
+        return self.separatorLikeLines
+
+
+
 class MultiPageTextWikiPageWriter(object):
     """
     Exports in multipage text format
@@ -494,16 +559,15 @@ class MultiPageTextWikiPageWriter(object):
             self.exportFile.write(content)
 
 
-    def exportWikiWord(self, word):
-        page = self.wikiDocument.getWikiPage(word)
-
+    def _writeWikiPageEntry(self, word, content, timeStamps):
+        """
+        timeStamps -- tuple (modDate, creaDate, visitDate)
+        """
         self.exportFile.writeSeparator()
         if self.formatVer == 0:
             self.exportFile.write(u"%s\n" % word)
         else:
             self.exportFile.write(u"wikipage/%s\n" % word)
-            # modDate, creaDate, visitDate
-            timeStamps = page.getTimestamps()[:3]
 
             # Do not use StringOps.strftimeUB here as its output
             # relates to local time, but we need UTC here.
@@ -513,21 +577,108 @@ class MultiPageTextWikiPageWriter(object):
 
             self.exportFile.write(u"%s  %s  %s\n" % tuple(timeStrings))
 
-        self.exportFile.write(page.getLiveText())
+        self.exportFile.write(content)
+
+
+    def _writeVersionData(self, page):
+        verOvw = page.getExistingVersionOverview()
+        if verOvw is not None and not verOvw.isNotInDatabase():
+            unifName = verOvw.getUnifiedName()
+
+            self.exportFile.writeSeparator()
+            self._writeHintedDatablock(unifName, False)
+
+            for unifName in verOvw.getDependentDataBlocks(
+                    omitSelf=True):
+                self.exportFile.writeSeparator()
+                self._writeHintedDatablock(unifName, True)
+
+
+    def exportWikiWord(self, word):
+        page = self.wikiDocument.getWikiPage(word)
+
+        # modDate, creaDate, visitDate
+        self._writeWikiPageEntry(word, page.getLiveText(),
+                page.getTimestamps()[:3])
 
         # Write version data for this word
         if self.writeVersionData:
-            verOvw = page.getExistingVersionOverview()
-            if verOvw is not None and not verOvw.isNotInDatabase():
-                unifName = verOvw.getUnifiedName()
+            self._writeVersionData(page)
 
-                self.exportFile.writeSeparator()
-                self._writeHintedDatablock(unifName, False)
 
-                for unifName in verOvw.getDependentDataBlocks(
-                        omitSelf=True):
-                    self.exportFile.writeSeparator()
-                    self._writeHintedDatablock(unifName, True)
+    def exportWikiWords(self, words, batchSize=100):
+        """
+        Export all pages in sequence words. Content and timestamps are read
+        from the database in batches of batchSize pages instead of creating
+        a page object for each word. Pages which are loaded and have unsaved
+        text in an editor are exported with this text.
+
+        Pages are exported in the order of words. Only if words contains
+        all pages of the wiki and the database supports it, the whole wiki
+        is read page by page in name order which is then also the export
+        order.
+        """
+        wikiData = self.wikiDocument.getWikiData()
+
+        if wikiData.checkCapability("content paging") is not None and \
+                set(words).issuperset(wikiData.getAllDefinedWikiPageNames()):
+            remaining = set(words)
+            lastWord = None
+
+            while True:
+                batch = wikiData.getWikiPageContentsAfter(lastWord, batchSize)
+                if len(batch) == 0:
+                    break
+
+                for entry in batch:
+                    if entry[1] is not None:
+                        remaining.discard(entry[0])
+                        self._exportWikiPageContentEntry(*entry)
+
+                lastWord = batch[-1][0]
+
+            # Words which weren't found in the database (e.g. page file
+            # missing) are exported the usual way to get the same error
+            # handling
+            for word in words:
+                if word in remaining:
+                    remaining.discard(word)
+                    self.exportWikiWord(word)
+                    self.exportFile.checkAndClearBuffer()
+
+            return
+
+        for i in xrange(0, len(words), batchSize):
+            chunk = words[i:i + batchSize]
+            entries = dict((entry[0], entry) for entry in
+                    wikiData.getWikiPageContentsForWords(chunk))
+
+            for word in chunk:
+                entry = entries.pop(word, None)
+                if entry is None or entry[1] is None:
+                    # Not found (or exported already), use usual way to
+                    # get the same error handling
+                    self.exportWikiWord(word)
+                    self.exportFile.checkAndClearBuffer()
+                else:
+                    self._exportWikiPageContentEntry(*entry)
+
+
+    def _exportWikiPageContentEntry(self, word, content, modified, created,
+            visited):
+        """
+        Export a page with content and timestamps as read from the database
+        """
+        page = self.wikiDocument.getWikiPageIfLoaded(word)
+        if page is not None and page.getEditorText() is not None:
+            content = page.getLiveText()
+
+        self._writeWikiPageEntry(word, content, (modified, created, visited))
+
+        if self.writeVersionData:
+            self._writeVersionData(self.wikiDocument.getWikiPage(word))
+
+        self.exportFile.checkAndClearBuffer()
 
 
 def getSingleWikiWordPacket(wikiDocument, word, writeVersionData=True,
@@ -623,8 +774,15 @@ class MultiPageTextExporter(AbstractExporter):
         If an export type goes to a directory, None is returned
         """
         if exportType == u"multipage_text":
-            return ((_(u"Multipage files (*.mpt)"), "*.mpt"),
-                    (_(u"Text file (*.txt)"), "*.txt")) 
+            result = [(_(u"Multipage files (*.mpt)"), "*.mpt"),
+                    (_(u"Text file (*.txt)"), "*.txt"),
+                    (_(u"Gzip compressed multipage files (*.mpt.gz)"),
+                    "*.mpt.gz")]
+            if lzma is not None:
+                result.append((_(u"Xz compressed multipage files (*.mpt.xz)"),
+                        "*.mpt.xz"))
+
+            return tuple(result)
 
         return None
 
@@ -658,6 +816,7 @@ class MultiPageTextExporter(AbstractExporter):
             fileVersion = 1
             writeWikiFuncPages = 1
             writeSavedSearches = 1            
+            writeVersionData = 1
         else:
             ctrls = addoptpanel.ctrls
             fileVersion = ctrls.chFileVersion.GetSelection()
@@ -737,6 +896,105 @@ class MultiPageTextExporter(AbstractExporter):
 #             self.firstSeparatorCallDone = True
 
 
+    def _openRawExportFile(self):
+        """
+        Open the destination file. It is compressed if the name ends
+        with ".gz" or ".xz".
+        """
+        ext = splitext(self.exportDest)[1].lower()
+        if ext == u".gz":
+            return gzip.open(pathEnc(self.exportDest), "wb", 6)
+        elif ext == u".xz":
+            if lzma is None:
+                raise ExportException(
+                        _(u"Python module lzma needed for xz compression"))
+            return lzma.LZMAFile(pathEnc(self.exportDest), "wb")
+        else:
+            return open(pathEnc(self.exportDest), "w")
+
+
+    def _runExportPasses(self, writeEntries):
+        """
+        Call writeEntries() first in a pre-pass which collects lines looking
+        like a separator to choose a separator not contained in the data.
+        Then open the destination and call writeEntries() again to write
+        the data. This way each entry must be hold in memory only while
+        it is written.
+        """
+        self.exportFile = _SeparatorScanWriter()
+        writeEntries()
+        self.exportFile.flush()
+        separatorLikeLines = self.exportFile.getSeparatorLikeLines()
+        self.exportFile = None
+
+        for tryNumber in range(35):
+            self.separator = u"-----%s-----" % createRandomString(25)
+            if self.separator not in separatorLikeLines:
+                break
+        else:
+            raise ExportException(_(u"No usable separator found"))
+
+        self.rawExportFile = self._openRawExportFile()
+
+        # Only UTF-8 mode currently
+        self.rawExportFile.write(BOM_UTF8)
+        self.exportFile = _SeparatorUtf8Writer(self.rawExportFile,
+                self.separator, "replace")
+
+        # Identifier line with file format
+        self.exportFile.write(u"Multipage text format %i\n" %
+                self.formatVer)
+        # Separator line
+        self.exportFile.write(u"Separator: %s\n" % self.separator)
+
+        writeEntries()
+
+
+    def _writeEntries(self):
+        self.wikiPageWriter = MultiPageTextWikiPageWriter(
+                self.wikiDocument, self.exportFile,
+                self.writeVersionData, self.formatVer)
+
+        # Write wiki-bound functional pages
+        if self.writeWikiFuncPages:
+            # Only wiki related functional pages
+            wikiFuncTags = [ft for ft in DocPages.getFuncTags()
+                    if ft.startswith("wiki/")]
+            
+            for ft in wikiFuncTags:
+                self.exportFile.writeSeparator()
+                self.exportFile.write(u"funcpage/%s\n" % ft)
+                page = self.wikiDocument.getFuncPage(ft)
+                self.exportFile.write(page.getLiveText())
+
+
+        # Write saved searches
+        if self.writeSavedSearches:
+            # Wiki-wide searches
+            wikiData = self.wikiDocument.getWikiData()
+            unifNames = wikiData.getDataBlockUnifNamesStartingWith(
+                    u"savedsearch/")
+
+            for un in unifNames:
+                self.exportFile.writeSeparator()
+                self.exportFile.write(un + u"\n")
+                datablock = wikiData.retrieveDataBlock(un)
+
+                self.exportFile.write(base64BlockEncode(datablock))
+            
+            # Page searches
+            unifNames = wikiData.getDataBlockUnifNamesStartingWith(
+                    u"savedpagesearch/")
+
+            for un in unifNames:
+                self.exportFile.writeSeparator()
+                self._writeHintedDatablock(un, False)
+
+        # Write actual wiki words
+        self.wikiPageWriter.exportWikiWords(self.wordList)
+        self.exportFile.checkAndClearBuffer()
+
+
     def export(self, wikiDocument, wordList, exportType, exportDest,
             compatFilenames, addOpt, progressHandler):
         """
@@ -764,87 +1022,17 @@ class MultiPageTextExporter(AbstractExporter):
         self.writeVersionData = addOpt[3] and (self.formatVer > 0)
 
         try:
-            for tryNumber in range(35):
-                self.separator = u"-----%s-----" % createRandomString(25)
-                try:
-                    self.rawExportFile = open(pathEnc(self.exportDest), "w")
-
-                    # Only UTF-8 mode currently
-                    self.rawExportFile.write(BOM_UTF8)
-                    self.exportFile = _SeparatorWatchUtf8Writer(
-                            self.rawExportFile, self.separator, "replace")
-
-                    self.wikiPageWriter = MultiPageTextWikiPageWriter(
-                            self.wikiDocument, self.exportFile,
-                            self.writeVersionData, self.formatVer)
-
-                    # Identifier line with file format
-                    self.exportFile.write(u"Multipage text format %i\n" %
-                            self.formatVer)
-                    # Separator line
-                    self.exportFile.write(u"Separator: %s\n" % self.separator)
-    
-    
-                    # Write wiki-bound functional pages
-                    if self.writeWikiFuncPages:
-                        # Only wiki related functional pages
-                        wikiFuncTags = [ft for ft in DocPages.getFuncTags()
-                                if ft.startswith("wiki/")]
-                        
-                        for ft in wikiFuncTags:
-                            self.exportFile.writeSeparator()
-                            self.exportFile.write(u"funcpage/%s\n" % ft)
-                            page = self.wikiDocument.getFuncPage(ft)
-                            self.exportFile.write(page.getLiveText())
-    
-    
-                    # Write saved searches
-                    if self.writeSavedSearches:
-                        # Wiki-wide searches
-                        wikiData = self.wikiDocument.getWikiData()
-                        unifNames = wikiData.getDataBlockUnifNamesStartingWith(
-                                u"savedsearch/")
-    
-                        for un in unifNames:
-                            self.exportFile.writeSeparator()
-                            self.exportFile.write(un + u"\n")
-                            datablock = wikiData.retrieveDataBlock(un)
-    
-                            self.exportFile.write(base64BlockEncode(datablock))
-                        
-                        # Page searches
-                        unifNames = wikiData.getDataBlockUnifNamesStartingWith(
-                                u"savedpagesearch/")
-    
-                        for un in unifNames:
-                            self.exportFile.writeSeparator()
-                            self._writeHintedDatablock(un, False)
-
-                    locale.setlocale(locale.LC_ALL, '')
-                    
-                    wx.Locale(wx.LANGUAGE_DEFAULT)
-    
-                    # Write actual wiki words
-                    for word in self.wordList:
-                        self.wikiPageWriter.exportWikiWord(word)
-                        self.exportFile.checkAndClearBuffer()
-                    break
-
-                except _SeparatorFoundException:
-                    if self.exportFile is not None:
-                        self.exportFile.flush()
-                        self.exportFile = None
-        
-                    if self.rawExportFile is not None:
-                        self.rawExportFile.close()
-                        self.rawExportFile = None
+            try:
+                locale.setlocale(locale.LC_ALL, '')
+                
+                wx.Locale(wx.LANGUAGE_DEFAULT)
 
-                    continue
-                except Exception, e:
-                    traceback.print_exc()
-                    raise ExportException(unicode(e))
-            else:
-                raise ExportException(_(u"No usable separator found"))
+                self._runExportPasses(self._writeEntries)
+            except ExportException:
+                raise
+            except Exception, e:
+                traceback.print_exc()
+                raise ExportException(unicode(e))
         finally:
             if self.exportFile is not None:
                 self.exportFile.flush()
@@ -1046,6 +1234,12 @@ class MultiPageTextExporter(AbstractExporter):
             traceback.print_exc()
 
 
+    def _recoveryWriteEntries(self):
+        self._recoveryExportDatablocks()
+        self._recoveryExportWikiWords()
+        self.exportFile.checkAndClearBuffer()
+
+
     def recoveryExport(self, wikiDocument, exportDest, progressHandler):
         """
         Export in recovery mode
@@ -1062,41 +1256,7 @@ class MultiPageTextExporter(AbstractExporter):
         self.formatVer = 1
         
         try:
-            for tryNumber in range(35):
-                self.separator = u"-----%s-----" % createRandomString(25)
-                try:
-                    self.rawExportFile = open(pathEnc(self.exportDest), "w")
-
-                    # Only UTF-8 mode currently
-                    self.rawExportFile.write(BOM_UTF8)
-                    self.exportFile = _SeparatorWatchUtf8Writer(
-                            self.rawExportFile, self.separator, "replace")
-
-#                     self.wikiPageWriter = MultiPageTextWikiPageWriter(
-#                             self.wikiDocument, self.exportFile,
-#                             self.writeVersionData, self.formatVer)
-
-                    # Identifier line with file format
-                    self.exportFile.write(u"Multipage text format %i\n" %
-                            self.formatVer)
-                    # Separator line
-                    self.exportFile.write(u"Separator: %s\n" % self.separator)
-
-                    self._recoveryExportDatablocks()
-                    self._recoveryExportWikiWords()
-                    
-                    break
-                except _SeparatorFoundException:
-                    if self.exportFile is not None:
-                        self.exportFile.flush()
-                        self.exportFile = None
-        
-                    if self.rawExportFile is not None:
-                        self.rawExportFile.close()
-                        self.rawExportFile = None
-
-            else:
-                raise ExportException(_(u"No usable separator found"))
+            self._runExportPasses(self._recoveryWriteEntries)
         finally:
             if self.exportFile is not None:
                 self.exportFile.flush()
@@ -108,6 +108,11 @@ class InfoDatabase:
                         (self.fileStorDir, self.normFileStorDir))
         procCounter = 1
 
+        # Files directly inside the storage are known by the storage index
+        # already so they don't have to be tested one by one
+        storFileNames = self.wikiDocument.getFileStorage().getIndex()\
+                .getFileNames()
+
         # Using a stack instead of recursion to avoid hitting rec. limit
         dirStack = [(self.fileStorDir, self.tempDb.lastrowid, u"", 0)]
 
@@ -121,7 +126,8 @@ class InfoDatabase:
                 fpi = os.path.join(procDir, fn)
                 relFpi = os.path.join(relPath, fn)
 
-                if os.path.isfile(StringOps.longPathEnc(fpi)):
+                if (procDir == self.fileStorDir and fn in storFileNames) or \
+                        os.path.isfile(StringOps.longPathEnc(fpi)):
                     self.tempDb.execSql("insert into fStorItems(procCounter, "
                             "fullpath, normpath, relpath, type, containerId, "
                             "deepness) values(?, ?, ?, ?, 0, ?, ?)",
@@ -0,0 +1,285 @@
+"""
+Retrieve width and height of images by reading only the headers of the
+common formats (PNG, JPEG, GIF, BMP, WebP) instead of decoding the whole
+image. Results for local files are cached (see ImageDimsCache).
+"""
+
+from __future__ import with_statement
+
+import os, os.path, struct, threading
+
+import wx
+
+from .StringOps import pathEnc
+
+
+
+_JPEG_SOF_MARKERS = frozenset(range(0xc0, 0xd0)) - \
+        frozenset((0xc4, 0xc8, 0xcc))   # DHT, JPG, DAC aren't SOF
+
+_JPEG_STANDALONE_MARKERS = frozenset(range(0xd0, 0xd8)) | \
+        frozenset((0x01, 0xd8))
+
+
+def _getJpegDims(stream):
+    """
+    Scan JPEG markers (stream is positioned after SOI) until a start of
+    frame marker is found. Returns (width, height) or None.
+    """
+    while True:
+        byte = stream.read(1)
+        if byte != "\xff":
+            return None
+
+        # Markers may be preceded by any number of fill bytes
+        while byte == "\xff":
+            byte = stream.read(1)
+
+        if byte == "":
+            return None
+
+        marker = ord(byte)
+        if marker in _JPEG_STANDALONE_MARKERS:
+            continue
+
+        if marker in (0xd9, 0xda):
+            # End of image or start of scan but no frame header yet
+            return None
+
+        data = stream.read(2)
+        if len(data) < 2:
+            return None
+
+        length = struct.unpack(">H", data)[0]
+        if length < 2:
+            return None
+
+        if marker in _JPEG_SOF_MARKERS:
+            data = stream.read(5)
+            if len(data) < 5:
+                return None
+
+            height, width = struct.unpack(">HH", data[1:5])
+            if height == 0:
+                # Height defined later by DNL marker
+                return None
+
+            return width, height
+
+        stream.seek(length - 2, 1)
+
+
+def getImageDimsFromHeader(stream):
+    """
+    Return tuple (width, height) of the image in seekable stream positioned
+    at the start of the image or None if format isn't supported or header
+    is invalid. Only the header is read, the image isn't decoded.
+    """
+    head = stream.read(30)
+
+    if head.startswith("\x89PNG\r\n\x1a\n"):
+        if len(head) < 24 or head[12:16] != "IHDR":
+            return None
+        return struct.unpack(">II", head[16:24])
+
+    if head[:6] in ("GIF87a", "GIF89a"):
+        if len(head) < 10:
+            return None
+        return struct.unpack("<HH", head[6:10])
+
+    if head.startswith("\xff\xd8"):
+        stream.seek(-len(head) + 2, 1)
+        return _getJpegDims(stream)
+
+    if head.startswith("BM"):
+        if len(head) < 26:
+            return None
+        headerSize = struct.unpack("<I", head[14:18])[0]
+        if headerSize == 12:
+            # OS/2 BITMAPCOREHEADER
+            return struct.unpack("<HH", head[18:22])
+
+        width, height = struct.unpack("<ii", head[18:26])
+        # Negative height means top-down bitmap
+        return abs(width), abs(height)
+
+    if head.startswith("RIFF") and head[8:12] == "WEBP" and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == "VP8 ":
+            if head[23:26] != "\x9d\x01\x2a":
+                return None
+            width, height = struct.unpack("<HH", head[26:30])
+            return width & 0x3fff, height & 0x3fff
+
+        if chunk == "VP8L":
+            if head[20] != "\x2f":
+                return None
+            bits = struct.unpack("<I", head[21:25])[0]
+            return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+
+        if chunk == "VP8X":
+            width = struct.unpack("<I", head[24:27] + "\x00")[0] + 1
+            height = struct.unpack("<I", head[27:30] + "\x00")[0] + 1
+            return width, height
+
+    return None
+
+
+def getImageDims(stream):
+    """
+    Return tuple (width, height) of the image in seekable stream or
+    (None, None) if it couldn't be determined. If the header can't be
+    interpreted, the image is decoded completely.
+    """
+    try:
+        dims = getImageDimsFromHeader(stream)
+    except (IOError, struct.error):
+        dims = None
+
+    if dims is not None:
+        return dims
+
+    # Unsupported format (or broken header), let wx decide
+    stream.seek(0)
+    img = wx.EmptyImage(0, 0)
+    img.LoadStream(stream)
+
+    if img.Ok():
+        return img.GetWidth(), img.GetHeight()
+
+    return None, None
+
+
+
+class ImageDimsCache(object):
+    """
+    Caches dimensions of local image files by path, modification time and
+    size. The cache is stored in a file so it survives between exports and
+    program runs.
+    """
+    # Increase if file format changes
+    FORMAT_VERSION = "1"
+
+    def __init__(self, cachePath):
+        """
+        cachePath -- Path of the file to store the cache in or None to
+            keep it in memory only
+        """
+        self.cachePath = cachePath
+        self.lock = threading.RLock()
+        self.entries = None   # {path: (mtime, size, width, height)}
+        self.modified = False
+
+
+    def _load(self):
+        self.entries = {}
+
+        if self.cachePath is None:
+            return
+
+        try:
+            with open(pathEnc(self.cachePath), "rb") as f:
+                lines = f.read().decode("utf-8").split(u"\n")
+        except (IOError, OSError, UnicodeError):
+            return
+
+        if not lines or lines[0] != self.FORMAT_VERSION:
+            return
+
+        for line in lines[1:]:
+            parts = line.split(u"\t", 4)
+            if len(parts) < 5:
+                continue
+
+            try:
+                mtime, size, width, height = float(parts[0]), int(parts[1]), \
+                        int(parts[2]), int(parts[3])
+            except ValueError:
+                continue
+
+            if width < 0:
+                # Dimensions couldn't be determined
+                width = height = None
+
+            self.entries[parts[4]] = (mtime, size, width, height)
+
+
+    def save(self):
+        """
+        Write cache to file if it was modified.
+        """
+        with self.lock:
+            if not self.modified or self.cachePath is None:
+                return
+
+            lines = [self.FORMAT_VERSION]
+            for path, (mtime, size, width, height) in \
+                    self.entries.iteritems():
+                if u"\n" in path:
+                    continue
+                if width is None:
+                    width = height = -1
+
+                lines.append(u"%r\t%i\t%i\t%i\t%s" % (mtime, size, width,
+                        height, path))
+
+            try:
+                with open(pathEnc(self.cachePath), "wb") as f:
+                    f.write(u"\n".join(lines).encode("utf-8"))
+            except (IOError, OSError):
+                # E.g. read-only wiki, cache just isn't persisted
+                pass
+
+            self.modified = False
+
+
+    def getImageDims(self, path):
+        """
+        Return tuple (width, height) of image file path or (None, None) if
+        it couldn't be determined. Raises IOError if file can't be read.
+        """
+        try:
+            st = os.stat(pathEnc(path))
+        except OSError, e:
+            with self.lock:
+                if self.entries is not None and \
+                        self.entries.pop(path, None) is not None:
+                    self.modified = True
+            raise IOError(str(e))
+
+        with self.lock:
+            if self.entries is None:
+                self._load()
+
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == st.st_mtime and \
+                    entry[1] == st.st_size:
+                return entry[2], entry[3]
+
+        with open(pathEnc(path), "rb") as imgFile:
+            width, height = getImageDims(imgFile)
+
+        with self.lock:
+            self.entries[path] = (st.st_mtime, st.st_size, width, height)
+            self.modified = True
+
+        return width, height
+
+
+
+_dimsCaches = {}   # {cachePath: ImageDimsCache}
+_dimsCachesLock = threading.Lock()
+
+
+def getImageDimsCache(cachePath):
+    """
+    Return the ImageDimsCache stored in file cachePath. All callers asking
+    for the same path get the same object.
+    """
+    with _dimsCachesLock:
+        cache = _dimsCaches.get(cachePath)
+        if cache is None:
+            cache = ImageDimsCache(cachePath)
+            _dimsCaches[cachePath] = cache
+
+        return cache
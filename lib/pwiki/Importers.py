@@ -1,11 +1,19 @@
 # from Enum import Enumeration
-import sys, os, string, re, traceback, time, sqlite3
+import sys, os, string, re, traceback, time, sqlite3, gzip
 from codecs import BOM_UTF8
 from os.path import join, exists, splitext
 from calendar import timegm
 from cStringIO import StringIO
 import urllib_red as urllib
 
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
 import wx, wx.xrc
 
 from .wxHelper import XrcControls
@@ -26,7 +34,186 @@ from .timeView import Versioning
 
 
 
+class MptReader(object):
+    """
+    Reads a multipage text file from a binary file object in large chunks.
+    Lines and entry contents are only decoded when they are returned.
+    Line ends are converted to "\\n". Positions returned by tell() can be
+    passed to seek() to go back to the beginning of an entry.
+    """
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, rawFile, decode):
+        """
+        rawFile -- file object opened in binary mode
+        decode -- decoder function as returned by codecs.getdecoder()
+        """
+        self.rawFile = rawFile
+        self.decode = decode
+        self.separator = None
+
+        self.buf = ""
+        self.bufPos = 0   # Position of next unread byte in buf
+        self.bufOffset = rawFile.tell()   # File position of buf[0]
+        self.eof = False
+
+
+    def setSeparator(self, separator):
+        """
+        separator -- bytestring of the separator line without line end
+        """
+        self.separator = separator
+
+
+    def tell(self):
+        return self.bufOffset + self.bufPos
+
+
+    def seek(self, pos):
+        if self.bufOffset <= pos <= self.bufOffset + len(self.buf):
+            self.bufPos = pos - self.bufOffset
+            return
+
+        self.rawFile.seek(pos)
+        self.buf = ""
+        self.bufPos = 0
+        self.bufOffset = pos
+        self.eof = False
+
+
+    def _fill(self):
+        """
+        Drop already read part of buffer and append next chunk of file.
+        Indices into the buffer must be corrected by the caller relative
+        to self.bufPos. Returns False at end of file.
+        """
+        if self.eof:
+            return False
+
+        data = self.rawFile.read(self.CHUNK_SIZE)
+        if not data:
+            self.eof = True
+            return False
+
+        self.bufOffset += self.bufPos
+        self.buf = self.buf[self.bufPos:] + data
+        self.bufPos = 0
+
+        return True
+
+
+    def readLineRaw(self):
+        """
+        Read next line as bytestring including line end or empty string
+        at end of file.
+        """
+        while True:
+            end = self.buf.find("\n", self.bufPos)
+            if end != -1:
+                line = self.buf[self.bufPos:end + 1]
+                self.bufPos = end + 1
+                return line
+
+            if not self._fill():
+                line = self.buf[self.bufPos:]
+                self.bufPos = len(self.buf)
+                return line
+
+
+    def readLine(self):
+        """
+        Read next line as unistring including line end or empty string
+        at end of file.
+        """
+        line = self.readLineRaw()
+        if line.endswith("\r\n"):
+            line = line[:-2] + "\n"
+
+        return self.decode(line, "replace")[0]
+
+
+    def _findEntryEnd(self):
+        """
+        Find the separator line after the current position. Returns tuple
+        (contentEnd, nextPos) of buffer indices where contentEnd is the
+        start of the separator line and nextPos the start of the line
+        following it. If no separator follows, both are the end of file.
+        """
+        separator = self.separator
+        searchFrom = self.bufPos
+
+        while True:
+            pos = self.buf.find(separator, searchFrom)
+
+            if pos == -1:
+                if self.eof:
+                    return len(self.buf), len(self.buf)
+
+                # Need more data, continue search where the start of a
+                # separator may have been cut off
+                rel = max(searchFrom,
+                        len(self.buf) - len(separator) + 1) - self.bufPos
+                self._fill()
+                searchFrom = self.bufPos + rel
+                continue
+
+            if len(self.buf) < pos + len(separator) + 2 and not self.eof:
+                # Need more data to check the line end after separator
+                rel = pos - self.bufPos
+                self._fill()
+                searchFrom = self.bufPos + rel
+                continue
+
+            searchFrom = pos + 1
+
+            if pos != self.bufPos and self.buf[pos - 1] != "\n":
+                # Not at start of line
+                continue
+
+            lineEnd = pos + len(separator)
+            if self.buf.startswith("\n", lineEnd):
+                return pos, lineEnd + 1
+            elif self.buf.startswith("\r\n", lineEnd):
+                return pos, lineEnd + 2
+
+
+    def readContent(self):
+        """
+        Read content of entry up to the separator line or end of file
+        and return it as unistring. The newline before the separator
+        is not part of the content.
+        """
+        contentEnd, nextPos = self._findEntryEnd()
+        content = self.buf[self.bufPos:contentEnd]
+
+        if contentEnd != nextPos and content:
+            # Iff last line of mpt page is empty, the original
+            # page ended with a newline, so remove last newline
+            if content.endswith("\r\n"):
+                content = content[:-2]
+            else:
+                content = content[:-1]
+
+        self.bufPos = nextPos
+
+        if "\r" in content:
+            content = content.replace("\r\n", "\n").replace("\r", "\n")
+
+        return self.decode(content, "replace")[0]
+
+
+    def skipContent(self):
+        """
+        Skip content of entry up to the separator line or end of file.
+        """
+        self.bufPos = self._findEntryEnd()[1]
+
+
+
 class MultiPageTextImporter:
+    # Commit imported data after so many entries
+    COMMIT_BATCH_SIZE = 500
+
     def __init__(self, mainControl):
         """
         mainControl -- Currently PersonalWikiFrame object
@@ -72,8 +259,15 @@ class MultiPageTextImporter:
         If an export type goes to a directory, None is returned
         """
         if importType == u"multipage_text":
-            return ((_(u"Multipage files (*.mpt)"), "*.mpt"),
-                    (_(u"Text file (*.txt)"), "*.txt")) 
+            result = [(_(u"Multipage files (*.mpt)"), "*.mpt"),
+                    (_(u"Text file (*.txt)"), "*.txt"),
+                    (_(u"Gzip compressed multipage files (*.mpt.gz)"),
+                    "*.mpt.gz")]
+            if lzma is not None:
+                result.append((_(u"Xz compressed multipage files (*.mpt.xz)"),
+                        "*.mpt.xz"))
+
+            return tuple(result)
 
         return None
 
@@ -109,48 +303,76 @@ class MultiPageTextImporter:
 
     def _collectContent(self):
         """
-        Collect lines from current position of importFile up to separator
-        or file end collect all lines and return them as list of lines.
+        Collect content from current position of importFile up to separator
+        or file end and return it as unistring.
         """
-        content = []                    
-        while True:
-            # Read lines of wikiword
-            line = self.importFile.readline()
-            if line == u"":
-                # The last page in mpt file without separator
-                # ends as the real wiki page
-#                 content = u"".join(content)
-                break
-            
-            if line == self.separator:
-                if len(content) > 0:
-                    # Iff last line of mpt page is empty, the original
-                    # page ended with a newline, so remove last
-                    # character (=newline)
-
-                    content[-1] = content[-1][:-1]
-#                     content = u"".join(content)
-                break
-
-            content.append(line)
-            
-        return u"".join(content)
+        return self.importFile.readContent()
 
 
     def _skipContent(self):
         """
         Skip content until reaching next separator or end of file
         """
-        while True:
-            # Read lines of wikiword
-            line = self.importFile.readline()
-            if line == u"":
-                # The last page in mpt file without separator
-                # ends as the real wiki page
-                break
-            
-            if line == self.separator:
-                break
+        self.importFile.skipContent()
+
+
+    def _entryImported(self):
+        """
+        Called after each imported entry, commits the imported data in
+        batches.
+        """
+        self.entriesSinceCommit += 1
+        if self.entriesSinceCommit >= self.COMMIT_BATCH_SIZE:
+            self.wikiDocument.getWikiData().commit()
+            self.entriesSinceCommit = 0
+
+
+    def _finishImport(self):
+        """
+        Commit remaining data and start the meta-data update of all
+        imported pages.
+        """
+        self.wikiDocument.getWikiData().commit()
+        self.entriesSinceCommit = 0
+        self.wikiDocument.pushDirtyMetaDataUpdate()
+
+
+    @staticmethod
+    def _openImportFile(path):
+        """
+        Open import file for binary reading. Files compressed with gzip
+        or xz are decompressed transparently.
+        """
+        f = open(path, "rb")
+        try:
+            magic = f.read(6)
+        finally:
+            f.close()
+
+        if magic.startswith("\x1f\x8b"):
+            return gzip.open(path, "rb")
+        elif magic == "\xfd7zXZ\x00":
+            if lzma is None:
+                raise ImportException(
+                        _(u"Python module lzma needed to read xz compressed file"))
+            return lzma.LZMAFile(path, "rb")
+        else:
+            return open(path, "rb")
+
+
+    def _convertOldMacLineEnds(self):
+        """
+        The importer only splits lines at "\\n". If the file has old Mac
+        line ends ("\\r" only) it is converted in memory.
+        """
+        pos = self.rawImportFile.tell()
+        head = self.rawImportFile.read(65536)
+        self.rawImportFile.seek(pos)
+
+        if "\r" in head and "\n" not in head:
+            data = self.rawImportFile.read().replace("\r", "\n")
+            self.rawImportFile.close()
+            self.rawImportFile = StringIO(data)
 
 
 
@@ -173,12 +395,13 @@ class MultiPageTextImporter:
             self.rawImportFile = StringIO(importData)
         else:
             try:
-                self.rawImportFile = open(pathEnc(importSrc), "rU")
+                self.rawImportFile = self._openImportFile(pathEnc(importSrc))
             except IOError:
                 raise ImportException(_(u"Opening import file failed"))
             
         self.wikiDocument = wikiDocument
         self.tempDb = None
+        self.entriesSinceCommit = 0
         
         showImportTableAlways = addOpt[0]
 #         wikiData = self.wikiDocument.getWikiData()
@@ -193,16 +416,17 @@ class MultiPageTextImporter:
                 bom = self.rawImportFile.read(len(BOM_UTF8))
                 if bom != BOM_UTF8:
                     self.rawImportFile.seek(0)
-                    decodingReader = mbcsReader
                     decode = mbcsDec
                 else:
-                    decodingReader = utf8Reader
                     decode = utf8Dec
 
-                line = decode(self.rawImportFile.readline())[0]
+                self._convertOldMacLineEnds()
+                self.importFile = MptReader(self.rawImportFile, decode)
+
+                line = self.importFile.readLine()
                 if line.startswith(u"#!"):
                     # Skip initial line with #! to allow execution as shell script
-                    line = decode(self.rawImportFile.readline())[0]
+                    line = self.importFile.readLine()
 
                 if not line.startswith(u"Multipage text format "):
                     raise ImportException(
@@ -218,15 +442,14 @@ class MultiPageTextImporter:
                             self.formatVer)
 
                 # Next is the separator line
-                line = decode(self.rawImportFile.readline())[0]
+                rawLine = self.importFile.readLineRaw()
+                line = decode(rawLine, "replace")[0]
                 if not line.startswith(u"Separator: "):
                     raise ImportException(
                             _(u"Bad file format, header not detected"))
 
                 self.separator = line[11:]
-                
-                startPos = self.rawImportFile.tell()
-                self.importFile = decodingReader(self.rawImportFile, "replace")
+                self.importFile.setSeparator(rawLine[11:].rstrip("\r\n"))
 
                 if self.formatVer == 0:
                     self._doImportVer0()
@@ -270,6 +493,13 @@ class MultiPageTextImporter:
                                 ");"
                                 )
 
+                        # Position of each entry in import file for pass 2
+                        self.tempDb.execSql("create table entrypos("
+                                "filePos integer primary key not null, "
+                                "unifName text not null default ''"
+                                ");"
+                                )
+
 
                         # Collect some initial information into the temporary database
                         self._doImportVer1Pass1()
@@ -291,10 +521,7 @@ class MultiPageTextImporter:
                         self._propagateRenames()
                         # TODO: Remove version data without ver. overview or main data
 
-                        # Back to start of import file and import according to settings 
-                        # in temp db
-                        self.rawImportFile.seek(startPos)
-                        self.importFile = decodingReader(self.rawImportFile, "replace")
+                        # Import according to settings in temp db
                         self._doImportVer1Pass2()
                         
                         return True
@@ -470,28 +697,33 @@ class MultiPageTextImporter:
         langHelper = wx.GetApp().createWikiLanguageHelper(
                 self.wikiDocument.getWikiDefaultWikiLanguage())
 
-        while True:
-            # Read next wikiword
-            line = self.importFile.readline()
-            if line == u"":
-                break
-
-            wikiWord = line[:-1]
-            errMsg = langHelper.checkForInvalidWikiWord(wikiWord,
-                    self.wikiDocument)
-            if errMsg:
-                raise ImportException(_(u"Bad wiki word: %s, %s") %
-                        (wikiWord, errMsg))
-
-            content = self._collectContent()
-            page = self.wikiDocument.getWikiPageNoError(wikiWord)
-
-            page.replaceLiveText(content)
+        try:
+            while True:
+                # Read next wikiword
+                line = self.importFile.readLine()
+                if line == u"":
+                    break
+
+                wikiWord = line[:-1]
+                errMsg = langHelper.checkForInvalidWikiWord(wikiWord,
+                        self.wikiDocument)
+                if errMsg:
+                    raise ImportException(_(u"Bad wiki word: %s, %s") %
+                            (wikiWord, errMsg))
+
+                content = self._collectContent()
+                page = self.wikiDocument.getWikiPageNoError(wikiWord)
+
+                page.replaceLiveText(content, deferUpdate=True)
+                self._entryImported()
+        finally:
+            self._finishImport()
 
 
     def _doImportVer1Pass1(self):
         while True:
-            tag = self.importFile.readline()
+            filePos = self.importFile.tell()
+            tag = self.importFile.readLine()
             if tag == u"":
                 # End of file
                 break
@@ -515,6 +747,8 @@ class MultiPageTextImporter:
 
             self.tempDb.execSql("insert or replace into entries(unifName, seen) "
                     "values (?, 1)", (tag,))
+            self.tempDb.execSql("insert into entrypos(filePos, unifName) "
+                    "values (?, ?)", (filePos, tag))
 
 
     def _readHintedDatablockVer1(self):
@@ -530,7 +764,7 @@ class MultiPageTextImporter:
         If (None, None) is returned, the remaining content of the entry
         was skipped already by the function.
         """
-        hintLine = self.importFile.readline()[:-1]
+        hintLine = self.importFile.readLine()[:-1]
         hintStrings = hintLine.split(u"  ")
         
         resultHintStrings = []
@@ -563,7 +797,6 @@ class MultiPageTextImporter:
                 content = base64BlockDecode(content)
             except TypeError:
                 # base64 decoding failed
-                self._skipContent()
                 return None, None
         
         return (resultHintStrings, content)
@@ -655,44 +888,39 @@ class MultiPageTextImporter:
                 versionOverview.delete()
 
 
-        while True:
-            tag = self.importFile.readline()
-            if tag == u"":
-                # End of file
-                break
-            tag = tag[:-1]  # Remove line end
-            
-            try:
-                dontImport, renameImportTo = \
-                        self.tempDb.execSqlQuery(
-                        "select dontImport, renameImportTo from "
-                        "entries where unifName = ?", (tag,))[0]
-            except IndexError:
-                # Maybe dangerous
-                traceback.print_exc()
-                self._skipContent()
-                continue
-
-            if dontImport:
-                self._skipContent()
-                continue
-            
-            if renameImportTo == u"":
-                renameImportTo = tag
+        # Go directly to the entries to import using the positions found
+        # in pass 1
+        try:
+            for filePos, tag, renameImportTo in self.tempDb.execSqlQuery(
+                    """
+                    select entrypos.filePos, entrypos.unifName,
+                    entries.renameImportTo from entrypos inner join entries
+                    on entrypos.unifName = entries.unifName
+                    where not entries.dontImport order by entrypos.filePos
+                    """):
+                self.importFile.seek(filePos)
+                self.importFile.readLine()   # Tag line
+
+                if renameImportTo == u"":
+                    renameImportTo = tag
+
+                if tag.startswith(u"wikipage/"):
+                    self._importItemWikiPageVer1Pass2(renameImportTo[9:])
+                elif tag.startswith(u"funcpage/"):
+                    self._importItemFuncPageVer1Pass2(tag[9:])
+                elif tag.startswith(u"savedsearch/"):
+                    self._importB64DatablockVer1Pass2(renameImportTo)
+                elif tag.startswith(u"savedpagesearch/"):
+                    self._importHintedDatablockVer1Pass2(renameImportTo)
+                elif tag.startswith(u"versioning/"):
+                    self._importHintedDatablockVer1Pass2(renameImportTo)
+                else:
+                    # Unknown tag
+                    continue
 
-            if tag.startswith(u"wikipage/"):
-                self._importItemWikiPageVer1Pass2(renameImportTo[9:])
-            elif tag.startswith(u"funcpage/"):
-                self._importItemFuncPageVer1Pass2(tag[9:])
-            elif tag.startswith(u"savedsearch/"):
-                self._importB64DatablockVer1Pass2(renameImportTo)
-            elif tag.startswith(u"savedpagesearch/"):
-                self._importHintedDatablockVer1Pass2(renameImportTo)
-            elif tag.startswith(u"versioning/"):
-                self._importHintedDatablockVer1Pass2(renameImportTo)
-            else:
-                # Unknown tag -> Ignore until separator
-                self._skipContent()
+                self._entryImported()
+        finally:
+            self._finishImport()
 
         
         for wikiWord in self.tempDb.execSqlQuerySingleColumn(
@@ -718,7 +946,7 @@ class MultiPageTextImporter:
 
 
     def _importItemWikiPageVer1Pass2(self, wikiWord):
-        timeStampLine = self.importFile.readline()[:-1]
+        timeStampLine = self.importFile.readLine()[:-1]
         timeStrings = timeStampLine.split(u"  ")
         if len(timeStrings) < 3:
             traceback.print_exc()
@@ -747,7 +975,7 @@ class MultiPageTextImporter:
         page = self.wikiDocument.getWikiPageNoError(wikiWord)
 
         # TODO How to handle versions here?
-        page.replaceLiveText(content)
+        page.replaceLiveText(content, deferUpdate=True)
         if page.getTxtEditor() is not None:
             page.writeToDatabase()
 
@@ -3,7 +3,7 @@ This is a Linux specific file for handling some operations not provided
 by the OS-independent wxPython library.
 """
 
-import ctypes, os, traceback, multiprocessing
+import sys, ctypes, os, traceback, multiprocessing, struct, select, threading, time
 from ctypes import c_int, c_uint, c_long, c_ulong, c_ushort, c_char, c_char_p, \
         c_wchar_p, c_byte, byref, create_string_buffer, create_unicode_buffer, \
         c_void_p, string_at, sizeof, Structure   # , WindowsError
@@ -29,6 +29,20 @@ except:
     sched_getaffinity = None
 
 
+# See http://man7.org/linux/man-pages/man7/inotify.7.html
+try:
+    inotify_init1 = libc.inotify_init1
+    inotify_add_watch = libc.inotify_add_watch
+    inotify_add_watch.argtypes = [c_int, c_char_p, c_uint]
+except:
+    import ExceptionLogger
+    ExceptionLogger.logOptionalComponentException(
+            "Link to inotify_init1() in LinuxHacks.py")
+
+    inotify_init1 = None
+    inotify_add_watch = None
+
+
 # int sched_setaffinity(pid_t pid, size_t cpusetsize,
 #                       cpu_set_t *mask);
 
@@ -147,3 +161,179 @@ def getCpuCount():
         return 0
 
 
+
+# Constants from "sys/inotify.h"
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_ONLYDIR = 0x1000000
+IN_CLOEXEC = 0o2000000
+
+_INOTIFY_EVENT = struct.Struct("iIII")   # wd, mask, cookie, len
+
+
+class DirectoryWatcher(object):
+    """
+    Watches a directory (not its subdirectories) with inotify and reports
+    changed files to a callback function, called from the watcher thread
+    as callback(changedNames, presenceChangedNames).
+    changedNames is a set of names of files created, modified, moved or
+    deleted, presenceChangedNames the subset of files which were created
+    or deleted (finally, so saving by deleting and renaming a temporary
+    file counts only as modification). If events were lost, both are None.
+
+    Changes are collected until no further change happened for  delay
+    seconds so that a burst of changes is reported at once.
+    """
+    _WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+            IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | \
+            IN_MOVE_SELF | IN_ONLYDIR
+
+    def __init__(self, path, callback, delay=0.5):
+        self.path = path
+        self.callback = callback
+        self.delay = delay
+        self.encPath = None
+        self.fd = -1
+        self.stopPipe = None
+        self.thread = None
+
+
+    @staticmethod
+    def isSupported():
+        return inotify_init1 is not None
+
+
+    def start(self):
+        """
+        Start watching. Returns False if watching isn't possible.
+        """
+        if not self.isSupported() or self.thread is not None:
+            return False
+
+        fd = inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            return False
+
+        encPath = self.path
+        if isinstance(encPath, unicode):
+            encPath = encPath.encode(sys.getfilesystemencoding() or "utf-8")
+
+        if inotify_add_watch(fd, encPath, self._WATCH_MASK) < 0:
+            os.close(fd)
+            return False
+
+        self.encPath = encPath
+        self.fd = fd
+        self.stopPipe = os.pipe()
+        self.thread = threading.Thread(target=self._run,
+                name="DirectoryWatcher")
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+        return True
+
+
+    def stop(self):
+        """
+        Stop watching and wait for the watcher thread to end. Must not be
+        called from inside the callback.
+        """
+        if self.thread is None:
+            return
+
+        os.write(self.stopPipe[1], "x")
+        self.thread.join()
+        self.thread = None
+
+        os.close(self.fd)
+        os.close(self.stopPipe[0])
+        os.close(self.stopPipe[1])
+        self.fd = -1
+        self.stopPipe = None
+
+
+    def _readEvents(self, wasPresent):
+        """
+        Read available events and store for each newly seen file name if
+        the file existed before the first event in dictionary wasPresent.
+        Returns False if events were lost.
+        """
+        data = os.read(self.fd, 65536)
+        pos = 0
+        while pos + _INOTIFY_EVENT.size <= len(data):
+            wd, mask, cookie, nameLen = _INOTIFY_EVENT.unpack_from(data, pos)
+            pos += _INOTIFY_EVENT.size
+            name = data[pos:pos + nameLen].rstrip("\0")
+            pos += nameLen
+
+            if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF):
+                return False
+
+            if not name or name in wasPresent:
+                continue
+
+            wasPresent[name] = not (mask & (IN_CREATE | IN_MOVED_TO))
+
+        return True
+
+
+    def _run(self):
+        stopFd = self.stopPipe[0]
+        wasPresent = {}   # {encoded file name: existed before first event}
+        lost = False
+        deadline = None
+
+        while True:
+            if deadline is None:
+                timeout = None
+            else:
+                timeout = max(0, deadline - time.time())
+
+            try:
+                readable = select.select([self.fd, stopFd], [], [], timeout)[0]
+            except select.error:
+                continue
+
+            if stopFd in readable:
+                return
+
+            if self.fd in readable:
+                if not self._readEvents(wasPresent):
+                    lost = True
+                deadline = time.time() + self.delay
+                continue
+
+            # Timeout, no further changes for some time
+            deadline = None
+            try:
+                if lost:
+                    self.callback(None, None)
+                else:
+                    self._reportChanges(wasPresent)
+            except:
+                traceback.print_exc()
+
+            wasPresent = {}
+            lost = False
+
+
+    def _reportChanges(self, wasPresent):
+        enc = sys.getfilesystemencoding() or "utf-8"
+        changed = set()
+        presenceChanged = set()
+
+        for name, present in wasPresent.iteritems():
+            uniName = name.decode(enc, "replace")
+            changed.add(uniName)
+            if present != os.path.exists(os.path.join(self.encPath, name)):
+                presenceChanged.add(uniName)
+
+        self.callback(changed, presenceChanged)
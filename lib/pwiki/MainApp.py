@@ -97,40 +97,17 @@ def findDirs():
 _defRedirect = (wx.Platform == '__WXMSW__' or wx.Platform == '__WXMAC__')
 
 
-class App(wx.App, MiscEventSourceMixin): 
-    def __init__(self, *args, **kwargs):
-        global app
-        app = self
-        
-        # Hack for Windows to allow installation in non-ascii path
-        sys.prefix = mbcsDec(sys.prefix)[0]
-
-        MiscEventSourceMixin.__init__(self)
-
-        wx.App.__init__(self, *args, **kwargs)
-        self.SetAppName("WikidPad")
-        # Do not initialize member variables here!
-
-
-    def OnInit(self):
-        ## _prof.start()
-#         global PREVIEW_CSS
-
-        self.SetAppName("WikidPad")
-
-#         self._CallAfterId = wx.NewEventType()
-#         self.Connect(-1, -1, self._CallAfterId,
-#                     lambda event: event.callable(*event.args, **event.kw) )
-# 
-        self.sqliteInitFlag = False   # Read and modified only by WikiData classes
-        
-        WindowLayout.initiateAfterWxApp()
-        self.removeAppLockOnExit = False
-        wx.EVT_END_SESSION(self, self.OnEndSession)
-        appdir = os.path.dirname(os.path.abspath(sys.argv[0]))
-        
-        self.mainFrameSet = set()
-
+class AppBase(MiscEventSourceMixin):
+    """
+    Application-wide functionality which doesn't need the wx GUI. Shared
+    by the GUI application (App) and the headless batch mode
+    (BatchMode.HeadlessApp).
+    """
+    def _initDirsAndGlobalConfig(self):
+        """
+        Locate application and global config directories and load (or create)
+        the global configuration. Needs no GUI.
+        """
         wikiAppDir, globalConfigDir = findDirs()
 
         if not globalConfigDir or not os.path.exists(globalConfigDir):
@@ -198,31 +175,8 @@ class App(wx.App, MiscEventSourceMixin):
             else:
                 self.createDefaultGlobalConfig(defaultGlobalConfigLoc)
 
-        splash = None
-        
-        cmdLine = CmdLineAction(sys.argv[1:])
-        if not cmdLine.exitFinally and self.globalConfig.getboolean("main",
-                "startup_splashScreen_show", True):
-            bitmap = wx.Bitmap(os.path.join(appdir, "icons/pwiki.ico"))
-            if bitmap:
-                splash = wx.SplashScreen(bitmap,
-                      wx.SPLASH_CENTRE_ON_SCREEN|wx.SPLASH_TIMEOUT, 15000, None,
-                      style=wx.BORDER_NONE|wx.FRAME_NO_TASKBAR)
-                wx.Yield()
-
-        try:
-            return self.initStep2(cmdLine)
-        finally:
-            if splash:
-                splash.Destroy()
-
 
-    def initStep2(self, cmdLine):
-        # Block of modules to import while splash screen is shown
-        from wxHelper import IconCache
-        from Serialization import SerializeStream
-        import OsAbstract
-        import Ipc
+    def _initOptionsAndLocalization(self):
         import OptionsDialog, Localization
 
         self.optionsDlgPanelList = list(
@@ -237,172 +191,6 @@ class App(wx.App, MiscEventSourceMixin):
         Localization.loadI18nDict(self.wikiAppDir, self.globalConfig.get(
                 "main", "gui_language", u""))
 
-        if self.globalConfig.getboolean("main", "single_process"):
-            # Single process mode means to create a server, detect an already
-            # running server and, if there, just send the commandline to
-            # the running server and quit then.            
-
-            # We create a "password" so that no other user can send commands to this
-            # WikidPad instance.
-            appCookie = createRandomString(30).encode("ascii")
-            
-            try:
-                port = Ipc.createCommandServer(appCookie)
-    
-                # True if this is the single existing instance which should write
-                # a new "AppLock.lock" file which either didn't exist or was invalid
-    
-                singleInstance = True
-    
-                # TODO maybe more secure method to ensure atomic exist. check and
-                #   writing of file
-                if os.path.exists(pathEnc(os.path.join(
-                        self.globalConfigSubDir, "AppLock.lock"))):
-                    singleInstance = False
-                    # There seems to be(!) another instance already
-                    # TODO Try to send commandline
-                    appLockContent = loadEntireFile(os.path.join(
-                            self.globalConfigSubDir, "AppLock.lock"))
-    #                 f = open(), "r")
-    #                 f.read()
-    #                 f.close()
-                    
-                    lines = appLockContent.split("\n")
-                    if len(lines) != 3:
-                        sys.stderr.write(_(u"Invalid AppLock.lock file.\n"
-                                u"Ensure that WikidPad is not running,\n"
-                                u"then delete file \"%s\" if present yet.\n") %
-                                    (os.path.join(self.globalConfigSubDir,
-                                    "AppLock.lock")))
-                        return True # TODO Error handling!!!
-    
-                    appCookie = lines[0]
-                    remotePort = int(lines[1])
-    
-                    if port != remotePort:
-                        # Everything ok so far
-                        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        sock.settimeout(10.0)
-                        try:
-                            try:
-                                sock.connect(("127.0.0.1", remotePort))
-                                greet = self._readSocketLine(sock)
-                                if greet == "WikidPad_command_server 1.0":
-                                    sock.send("cmdline\n" + appCookie + "\n")
-                                    
-                                    ack = self._readSocketLine(sock)
-                                    if ack[0] == "+":
-                                        # app cookie ok
-                                        sst = SerializeStream(stringBuf="", readMode=False)
-                                        sst.serArrString(sys.argv[1:])
-                                        sock.send(sst.getBytes())
-                                    
-                                        return True
-        
-                                # Reaching this point means something went wrong
-                                singleInstance = True  # TODO More fine grained reaction
-                            except socket.timeout, e:
-                                singleInstance = True
-                            except socket.error, e:
-                                if (e.args[0] == 10061 or e.args[0] == 111):
-                                    # Connection refused (port not bound to a server)
-                                    singleInstance = True
-                                else:
-                                    raise
-                        finally:
-                            sock.close()
-        
-                    else:
-                        # Sure indicator that AppLock file is invalid if newly
-                        # created server opened a port which is claimed to be used
-                        # already by previously started instance.
-                        singleInstance = True
-    
-                if not singleInstance:
-                    return False
-    
-                if self.globalConfig.getboolean("main", "zombieCheck", True):
-                    otherProcIds = OsAbstract.checkForOtherInstances()
-                    if len(otherProcIds) > 0:
-                        procIdString = u", ".join([unicode(procId)
-                                for procId in otherProcIds])
-                        answer = wx.MessageBox(
-                                _(u"Other WikidPad process(es) seem(s) to run already\n"
-                                "Process identifier(s): %s\nContinue?") % procIdString,
-                                _(u"Continue?"),
-                                wx.YES_NO | wx.YES_DEFAULT | wx.ICON_QUESTION, None)
-    
-                        if answer != wx.YES:
-                            return False
-
-                if port != -1:
-                    # Server is connected, start it
-                    Ipc.startCommandServer()
-        
-                    appLockContent = appCookie + "\n" + str(port) + "\n"
-                    appLockPath = os.path.join(self.globalConfigSubDir,
-                            "AppLock.lock")
-    
-                    writeEntireFile(appLockPath, appLockContent)
-    
-                    self.removeAppLockOnExit = True
-    
-                    Ipc.getCommandServer().setAppLockInfo(appLockPath, appLockContent)
-                else:
-                    answer = wx.MessageBox(
-                            _(u"WikidPad couldn't detect if other processes are "
-                            "already running.\nContinue anyway?"),
-                            _(u"Continue?"),
-                            wx.YES_NO | wx.YES_DEFAULT | wx.ICON_QUESTION, None)
-
-                    if answer != wx.YES:
-                        return False
-                    
-            except socket.error, e:
-                answer = wx.MessageBox(
-                        _(u"WikidPad couldn't detect if other processes are "
-                        "already running.\nSocket error: %s\nContinue anyway?") %
-                        unicode(e), _(u"Continue?"),
-                        wx.YES_NO | wx.YES_DEFAULT | wx.ICON_QUESTION, None)
-
-                if answer != wx.YES:
-                    return False
-
-
-        # Build icon cache
-        iconDir = os.path.join(self.wikiAppDir, "icons")
-        self.iconCache = IconCache(iconDir)
-
-        # Create plugin manager for application-wide plugins
-#         dirs = ( os.path.join(self.globalConfigSubDir, u'user_extensions'),
-#                 os.path.join(self.wikiAppDir, u'user_extensions'),
-#                 os.path.join(self.wikiAppDir, u'extensions') )
-
-        self.reloadPlugins()
-
-        self.collator = None
-
-        # Further configuration settings
-        self._rereadGlobalConfig()
-
-        rd = Localization.getI18nXrcData(self.wikiAppDir,
-                self.globalConfigSubDir, "WikidPad")
-        ## _prof.stop()
-
-        res = wx.xrc.XmlResource.Get()
-        res.SetFlags(0)
-        res.LoadFromString(rd)
-        
-#         rd = loadEntireFile(r"C:\Daten\Projekte\Wikidpad\Current\wizards.xrc", True)
-#         res.LoadFromString(rd)
-
-        self.standardIcon = wx.Icon(os.path.join(self.wikiAppDir, 'icons',
-                    'pwiki.ico'), wx.BITMAP_TYPE_ICO)
-
-        self.startPersonalWikiFrame(cmdLine)
-
-        return True
-
 
     def reloadPlugins(self):
         """
@@ -482,20 +270,6 @@ class App(wx.App, MiscEventSourceMixin):
                 menuItemProviderApi.provideMenuItemV01, 0)
 
 
-
-    def _readSocketLine(self, sock):
-        result = []
-        read = 0
-        while read < 300:
-            c = sock.recv(1)
-            if c == "\n" or c == "":
-                return "".join(result)
-            result.append(c)
-            read += 1
-            
-        return ""
-
-
     def getWikiLanguageDescription(self, intLanguageName):
         """
         Returns the parser description tuple as provided by a WikiParser plugin
@@ -503,6 +277,7 @@ class App(wx.App, MiscEventSourceMixin):
         """
         return self.wikiLanguageDescDict.get(intLanguageName)
 
+
     def listWikiLanguageDescriptions(self):
         """
         Return list of internal names of all available wiki languages
@@ -518,6 +293,7 @@ class App(wx.App, MiscEventSourceMixin):
     def getModifyMenuDispatcher(self):
         return self.modifyMenuDispatcher
 
+
     def getProvideMenuItemDispatcher(self):
         return self.provideMenuItemDispatcher
 
@@ -532,12 +308,15 @@ class App(wx.App, MiscEventSourceMixin):
         # Call parser factory function
         return desc[2](intLanguageName, debugMode)
 
+
     def freeWikiParser(self, parser):
         """
         Must be thread-safe, must accept None as parser!
         """
         pass
         
+
+
     def getUserDefaultWikiLanguage(self):
         """
         Returns the internal name of the default wiki language of the user.
@@ -546,7 +325,6 @@ class App(wx.App, MiscEventSourceMixin):
         return "wikidpad_default_2_0"
 
 
-
     def createWikiLanguageHelper(self, intLanguageName, debugMode=False):
         """
         Must be thread-safe
@@ -557,6 +335,7 @@ class App(wx.App, MiscEventSourceMixin):
         # Call language helper factory function
         return desc[4](intLanguageName, debugMode)
 
+
     def freeWikiLanguageHelper(self, helper):
         """
         Must be thread-safe, must accept None as helper!
@@ -564,51 +343,21 @@ class App(wx.App, MiscEventSourceMixin):
         pass
         
         
-    def FilterEvent(self, evt):
-        if isinstance(evt, wx.MouseEvent) and \
-                wx.wxEVT_MOUSEWHEEL == evt.GetEventType():
-                    
-            oldObj = evt.GetEventObject()
 
-            scPos = evt.GetEventObject().ClientToScreen(evt.GetPositionTuple())
-            wnd = wx.FindWindowAtPoint(scPos)
-            if wnd is not None and wnd is not oldObj:
-#                 newPos = wnd.ScreenToClient(scPos)
-                evt.m_x, evt.m_y = 0, 0 # newPos
-                evt.SetEventObject(wnd)
-                
-                scrollUnits = (evt.GetWheelRotation() // evt.GetWheelDelta()) * evt.GetLinesPerAction()
-                
-                if isinstance(wnd, wx.ScrolledWindow):
-                    x, y = wnd.GetViewStart()
-                    wnd.Scroll(x, y - scrollUnits)
-#                 elif isinstance(wnd, wx.ListCtrl):
-#                     print "--FilterEvent31", repr(wnd.HasScrollbar(wx.VERTICAL))
-                    
-#                 elif wnd.HasScrollbar(wx.VERTICAL):
-# #                     print "--FilterEvent31"
-#                     y = wnd.GetScrollPos(wx.VERTICAL)
-#                     wnd.SetScrollPos(wx.VERTICAL, y - scrollUnits)
-                else:
-#                     print "--FilterEvent45", repr(((evt.GetEventObject()), scrollUnits, wnd.HasScrollbar(wx.VERTICAL)))                    
-                    wnd.ProcessEvent(evt)
-
-                return 1
-                
-        result = wx.App.FilterEvent(self, evt)
-        return result
-        
 
     def pauseBackgroundThreads(self):
         self.fireMiscEventKeys(("pause background threads",))
 
+
     def resumeBackgroundThreads(self):
         self.fireMiscEventKeys(("resume background threads",))
 
+
     def onChangedGlobalConfiguration(self, miscevt):
         self._rereadGlobalConfig()
         
 
+
     def _rereadGlobalConfig(self):
         """
         Realize settings from global config which are changeable during session
@@ -652,71 +401,10 @@ class App(wx.App, MiscEventSourceMixin):
                 OsAbstract.setCpuAffinity((aff,))
 
 
-
-    def OnEndSession(self, evt):
-        # Loop over copy of set as original set is modified during loop
-        for wikiFrame in frozenset(self.mainFrameSet):
-            wikiFrame.exitWiki()
-
-
-    def OnExit(self):
-        import Ipc
-
-        self.getInsertionPluginManager().taskEnd()
-
-        if self.removeAppLockOnExit:
-            try:
-                os.remove(os.path.join(self.globalConfigSubDir, "AppLock.lock"))
-            except:  # OSError, ex:
-                traceback.print_exc()
-                # TODO Error message!
-
-        try:
-            Ipc.stopCommandServer()
-        except:
-            traceback.print_exc()
-
-        if ExceptionLogger._exceptionOccurred and hasattr(sys, 'frozen'):
-            wx.MessageBox(_(u"An error occurred during this session\nSee file %s") %
-                    os.path.join(ExceptionLogger.getLogDestDir()),
-                    "Error", style = wx.OK)
-
-
     def getMainFrameSet(self):
         return self.mainFrameSet
 
-    def startPersonalWikiFrame(self, clAction):
-        from PersonalWikiFrame import PersonalWikiFrame
-
-        wikiFrame = PersonalWikiFrame(None, -1, "WikidPad", self.wikiAppDir,
-                self.globalConfigDir, self.globalConfigSubDir, clAction)
-
-        self.fireMiscEventProps({"adding wiki frame": True,
-                "wiki frame": wikiFrame})
-        self.SetTopWindow(wikiFrame)
-        self.mainFrameSet.add(wikiFrame)
-        self.fireMiscEventProps({"added wiki frame": True,
-                "wiki frame": wikiFrame})
-
-        ## _prof.stop()
 
-        # set the icon of the app
-        try:
-            wikiFrame.SetIcon(self.standardIcon)
-        except:
-            pass
-        
-        return wikiFrame
-
-
-    def unregisterMainFrame(self, wikiFrame):
-        self.fireMiscEventProps({"removing wiki frame": True,
-                "wiki frame": wikiFrame})
-        self.mainFrameSet.discard(wikiFrame)
-        self.fireMiscEventProps({"removed wiki frame": True,
-                "wiki frame": wikiFrame})
-
-    
     def findFrameByWikiConfigPath(self, wikiConfigPath):
         """
         Find and return a PersonalWikiFrame which currently displays the wiki
@@ -740,6 +428,7 @@ class App(wx.App, MiscEventSourceMixin):
         return reduce(lambda a, b: a+list(b),
                 self.describeExportersApi.describeExporters(mainControl), [])
 
+
     def describePrints(self, mainControl):
         return reduce(lambda a, b: a+list(b),
                 self.describePrintsApi.describePrintsV01(mainControl), [])
@@ -761,33 +450,46 @@ class App(wx.App, MiscEventSourceMixin):
     def getGlobalConfigSubDir(self):
         return self.globalConfigSubDir
 
+
     def getGlobalConfigDir(self):
         return self.globalConfigDir
 
+
     def getGlobalConfig(self):
         return self.globalConfig
         
+
+
     def getWikiAppDir(self):
         return self.wikiAppDir
     
+
+
     def isInPortableMode(self):
         return self.globalConfigDir == self.wikiAppDir
 
+
     def getIconCache(self):
         """
         Return the icon cache object
         """
         return self.iconCache
 
+
     def getCollator(self):
         return self.collator
 
+
     def getInsertionPluginManager(self):
         return self.insertionPluginManager
         
+
+
     def getPageSearchHistory(self):
         return self.pageSearchHistory
         
+
+
     def setPageSearchHistory(self, hist):
         self.pageSearchHistory = hist
 
@@ -795,21 +497,26 @@ class App(wx.App, MiscEventSourceMixin):
     def getWikiSearchHistory(self):
         return self.wikiSearchHistory
 
+
     def setWikiSearchHistory(self, hist):
         self.wikiSearchHistory = hist
 
+
     def createGlobalConfiguration(self):
         return Configuration.SingleConfiguration(
                 self.getDefaultGlobalConfigDict())
 
+
     def createWikiConfiguration(self):
         return Configuration.SingleConfiguration(
                 self.getDefaultWikiConfigDict(), self.wikiConfigFallthroughDict)
 
+
     def createCombinedConfiguration(self):
         return Configuration.CombinedConfiguration(
                 self.createGlobalConfiguration(), self.createWikiConfiguration())
 
+
     def getDefaultGlobalConfigDict(self):
         """
         Returns the dictionary of the global configuration defaults.
@@ -819,6 +526,7 @@ class App(wx.App, MiscEventSourceMixin):
         """
         return self.defaultGlobalConfigDict
 
+
     def getDefaultWikiConfigDict(self):
         """
         Returns the dictionary of the wiki configuration defaults.
@@ -828,6 +536,7 @@ class App(wx.App, MiscEventSourceMixin):
         """
         return self.defaultWikiConfigDict
 
+
     def getWikiConfigFallthroughDict(self):
         """
         Returns the dictionary of the wiki fallthrough settings.
@@ -847,9 +556,11 @@ class App(wx.App, MiscEventSourceMixin):
         return self.wikiConfigFallthroughDict
         
 
+
     def getOptionsDlgPanelList(self):        
         return self.optionsDlgPanelList
 
+
     def addGlobalPluginOptionsDlgPanel(self, factory, title):
         """
         Add option page to global plugin options 
@@ -942,3 +653,348 @@ class App(wx.App, MiscEventSourceMixin):
             insPos += 1
 
         pl.insert(insPos, (factory, 4 * u" " + title))
+
+
+
+class App(wx.App, AppBase): 
+    def __init__(self, *args, **kwargs):
+        global app
+        app = self
+        
+        # Hack for Windows to allow installation in non-ascii path
+        sys.prefix = mbcsDec(sys.prefix)[0]
+
+        MiscEventSourceMixin.__init__(self)
+
+        wx.App.__init__(self, *args, **kwargs)
+        self.SetAppName("WikidPad")
+        # Do not initialize member variables here!
+
+
+    def OnInit(self):
+        ## _prof.start()
+#         global PREVIEW_CSS
+
+        self.SetAppName("WikidPad")
+
+#         self._CallAfterId = wx.NewEventType()
+#         self.Connect(-1, -1, self._CallAfterId,
+#                     lambda event: event.callable(*event.args, **event.kw) )
+# 
+        self.sqliteInitFlag = False   # Read and modified only by WikiData classes
+        
+        WindowLayout.initiateAfterWxApp()
+        self.removeAppLockOnExit = False
+        wx.EVT_END_SESSION(self, self.OnEndSession)
+        appdir = os.path.dirname(os.path.abspath(sys.argv[0]))
+        
+        self.mainFrameSet = set()
+
+        self._initDirsAndGlobalConfig()
+
+        splash = None
+        
+        cmdLine = CmdLineAction(sys.argv[1:])
+        if not cmdLine.exitFinally and self.globalConfig.getboolean("main",
+                "startup_splashScreen_show", True):
+            bitmap = wx.Bitmap(os.path.join(appdir, "icons/pwiki.ico"))
+            if bitmap:
+                splash = wx.SplashScreen(bitmap,
+                      wx.SPLASH_CENTRE_ON_SCREEN|wx.SPLASH_TIMEOUT, 15000, None,
+                      style=wx.BORDER_NONE|wx.FRAME_NO_TASKBAR)
+                wx.Yield()
+
+        try:
+            return self.initStep2(cmdLine)
+        finally:
+            if splash:
+                splash.Destroy()
+
+
+    def initStep2(self, cmdLine):
+        # Block of modules to import while splash screen is shown
+        from wxHelper import IconCache
+        from Serialization import SerializeStream
+        import OsAbstract
+        import Ipc
+        import Localization
+
+        self._initOptionsAndLocalization()
+
+        if self.globalConfig.getboolean("main", "single_process"):
+            # Single process mode means to create a server, detect an already
+            # running server and, if there, just send the commandline to
+            # the running server and quit then.            
+
+            # We create a "password" so that no other user can send commands to this
+            # WikidPad instance.
+            appCookie = createRandomString(30).encode("ascii")
+            
+            try:
+                port = Ipc.createCommandServer(appCookie)
+    
+                # True if this is the single existing instance which should write
+                # a new "AppLock.lock" file which either didn't exist or was invalid
+    
+                singleInstance = True
+    
+                # TODO maybe more secure method to ensure atomic exist. check and
+                #   writing of file
+                if os.path.exists(pathEnc(os.path.join(
+                        self.globalConfigSubDir, "AppLock.lock"))):
+                    singleInstance = False
+                    # There seems to be(!) another instance already
+                    # TODO Try to send commandline
+                    appLockContent = loadEntireFile(os.path.join(
+                            self.globalConfigSubDir, "AppLock.lock"))
+    #                 f = open(), "r")
+    #                 f.read()
+    #                 f.close()
+                    
+                    lines = appLockContent.split("\n")
+                    if len(lines) != 3:
+                        sys.stderr.write(_(u"Invalid AppLock.lock file.\n"
+                                u"Ensure that WikidPad is not running,\n"
+                                u"then delete file \"%s\" if present yet.\n") %
+                                    (os.path.join(self.globalConfigSubDir,
+                                    "AppLock.lock")))
+                        return True # TODO Error handling!!!
+    
+                    appCookie = lines[0]
+                    remotePort = int(lines[1])
+    
+                    if port != remotePort:
+                        # Everything ok so far
+                        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                        sock.settimeout(10.0)
+                        try:
+                            try:
+                                sock.connect(("127.0.0.1", remotePort))
+                                greet = self._readSocketLine(sock)
+                                if greet == "WikidPad_command_server 1.0":
+                                    sock.send("cmdline\n" + appCookie + "\n")
+                                    
+                                    ack = self._readSocketLine(sock)
+                                    if ack[0] == "+":
+                                        # app cookie ok
+                                        sst = SerializeStream(stringBuf="", readMode=False)
+                                        sst.serArrString(sys.argv[1:])
+                                        sock.send(sst.getBytes())
+                                    
+                                        return True
+        
+                                # Reaching this point means something went wrong
+                                singleInstance = True  # TODO More fine grained reaction
+                            except socket.timeout, e:
+                                singleInstance = True
+                            except socket.error, e:
+                                if (e.args[0] == 10061 or e.args[0] == 111):
+                                    # Connection refused (port not bound to a server)
+                                    singleInstance = True
+                                else:
+                                    raise
+                        finally:
+                            sock.close()
+        
+                    else:
+                        # Sure indicator that AppLock file is invalid if newly
+                        # created server opened a port which is claimed to be used
+                        # already by previously started instance.
+                        singleInstance = True
+    
+                if not singleInstance:
+                    return False
+    
+                if self.globalConfig.getboolean("main", "zombieCheck", True):
+                    otherProcIds = OsAbstract.checkForOtherInstances()
+                    if len(otherProcIds) > 0:
+                        procIdString = u", ".join([unicode(procId)
+                                for procId in otherProcIds])
+                        answer = wx.MessageBox(
+                                _(u"Other WikidPad process(es) seem(s) to run already\n"
+                                "Process identifier(s): %s\nContinue?") % procIdString,
+                                _(u"Continue?"),
+                                wx.YES_NO | wx.YES_DEFAULT | wx.ICON_QUESTION, None)
+    
+                        if answer != wx.YES:
+                            return False
+
+                if port != -1:
+                    # Server is connected, start it
+                    Ipc.startCommandServer()
+        
+                    appLockContent = appCookie + "\n" + str(port) + "\n"
+                    appLockPath = os.path.join(self.globalConfigSubDir,
+                            "AppLock.lock")
+    
+                    writeEntireFile(appLockPath, appLockContent)
+    
+                    self.removeAppLockOnExit = True
+    
+                    Ipc.getCommandServer().setAppLockInfo(appLockPath, appLockContent)
+                else:
+                    answer = wx.MessageBox(
+                            _(u"WikidPad couldn't detect if other processes are "
+                            "already running.\nContinue anyway?"),
+                            _(u"Continue?"),
+                            wx.YES_NO | wx.YES_DEFAULT | wx.ICON_QUESTION, None)
+
+                    if answer != wx.YES:
+                        return False
+                    
+            except socket.error, e:
+                answer = wx.MessageBox(
+                        _(u"WikidPad couldn't detect if other processes are "
+                        "already running.\nSocket error: %s\nContinue anyway?") %
+                        unicode(e), _(u"Continue?"),
+                        wx.YES_NO | wx.YES_DEFAULT | wx.ICON_QUESTION, None)
+
+                if answer != wx.YES:
+                    return False
+
+
+        # Build icon cache
+        iconDir = os.path.join(self.wikiAppDir, "icons")
+        self.iconCache = IconCache(iconDir)
+
+        # Create plugin manager for application-wide plugins
+#         dirs = ( os.path.join(self.globalConfigSubDir, u'user_extensions'),
+#                 os.path.join(self.wikiAppDir, u'user_extensions'),
+#                 os.path.join(self.wikiAppDir, u'extensions') )
+
+        self.reloadPlugins()
+
+        self.collator = None
+
+        # Further configuration settings
+        self._rereadGlobalConfig()
+
+        rd = Localization.getI18nXrcData(self.wikiAppDir,
+                self.globalConfigSubDir, "WikidPad")
+        ## _prof.stop()
+
+        res = wx.xrc.XmlResource.Get()
+        res.SetFlags(0)
+        res.LoadFromString(rd)
+        
+#         rd = loadEntireFile(r"C:\Daten\Projekte\Wikidpad\Current\wizards.xrc", True)
+#         res.LoadFromString(rd)
+
+        self.standardIcon = wx.Icon(os.path.join(self.wikiAppDir, 'icons',
+                    'pwiki.ico'), wx.BITMAP_TYPE_ICO)
+
+        self.startPersonalWikiFrame(cmdLine)
+
+        return True
+
+
+    def _readSocketLine(self, sock):
+        result = []
+        read = 0
+        while read < 300:
+            c = sock.recv(1)
+            if c == "\n" or c == "":
+                return "".join(result)
+            result.append(c)
+            read += 1
+            
+        return ""
+
+
+    def FilterEvent(self, evt):
+        if isinstance(evt, wx.MouseEvent) and \
+                wx.wxEVT_MOUSEWHEEL == evt.GetEventType():
+                    
+            oldObj = evt.GetEventObject()
+
+            scPos = evt.GetEventObject().ClientToScreen(evt.GetPositionTuple())
+            wnd = wx.FindWindowAtPoint(scPos)
+            if wnd is not None and wnd is not oldObj:
+#                 newPos = wnd.ScreenToClient(scPos)
+                evt.m_x, evt.m_y = 0, 0 # newPos
+                evt.SetEventObject(wnd)
+                
+                scrollUnits = (evt.GetWheelRotation() // evt.GetWheelDelta()) * evt.GetLinesPerAction()
+                
+                if isinstance(wnd, wx.ScrolledWindow):
+                    x, y = wnd.GetViewStart()
+                    wnd.Scroll(x, y - scrollUnits)
+#                 elif isinstance(wnd, wx.ListCtrl):
+#                     print "--FilterEvent31", repr(wnd.HasScrollbar(wx.VERTICAL))
+                    
+#                 elif wnd.HasScrollbar(wx.VERTICAL):
+# #                     print "--FilterEvent31"
+#                     y = wnd.GetScrollPos(wx.VERTICAL)
+#                     wnd.SetScrollPos(wx.VERTICAL, y - scrollUnits)
+                else:
+#                     print "--FilterEvent45", repr(((evt.GetEventObject()), scrollUnits, wnd.HasScrollbar(wx.VERTICAL)))                    
+                    wnd.ProcessEvent(evt)
+
+                return 1
+                
+        result = wx.App.FilterEvent(self, evt)
+        return result
+        
+
+
+    def OnEndSession(self, evt):
+        # Loop over copy of set as original set is modified during loop
+        for wikiFrame in frozenset(self.mainFrameSet):
+            wikiFrame.exitWiki()
+
+
+    def OnExit(self):
+        import Ipc
+
+        self.getInsertionPluginManager().taskEnd()
+
+        if self.removeAppLockOnExit:
+            try:
+                os.remove(os.path.join(self.globalConfigSubDir, "AppLock.lock"))
+            except:  # OSError, ex:
+                traceback.print_exc()
+                # TODO Error message!
+
+        try:
+            Ipc.stopCommandServer()
+        except:
+            traceback.print_exc()
+
+        if ExceptionLogger._exceptionOccurred and hasattr(sys, 'frozen'):
+            wx.MessageBox(_(u"An error occurred during this session\nSee file %s") %
+                    os.path.join(ExceptionLogger.getLogDestDir()),
+                    "Error", style = wx.OK)
+
+
+    def startPersonalWikiFrame(self, clAction):
+        from PersonalWikiFrame import PersonalWikiFrame
+
+        wikiFrame = PersonalWikiFrame(None, -1, "WikidPad", self.wikiAppDir,
+                self.globalConfigDir, self.globalConfigSubDir, clAction)
+
+        self.fireMiscEventProps({"adding wiki frame": True,
+                "wiki frame": wikiFrame})
+        self.SetTopWindow(wikiFrame)
+        self.mainFrameSet.add(wikiFrame)
+        self.fireMiscEventProps({"added wiki frame": True,
+                "wiki frame": wikiFrame})
+
+        ## _prof.stop()
+
+        # set the icon of the app
+        try:
+            wikiFrame.SetIcon(self.standardIcon)
+        except:
+            pass
+        
+        return wikiFrame
+
+
+    def unregisterMainFrame(self, wikiFrame):
+        self.fireMiscEventProps({"removing wiki frame": True,
+                "wiki frame": wikiFrame})
+        self.mainFrameSet.discard(wikiFrame)
+        self.fireMiscEventProps({"removed wiki frame": True,
+                "wiki frame": wikiFrame})
+
+    
@@ -205,6 +205,21 @@ else:
             return GtkHacks.ClipboardCatchFakeIceptor(callingWindow)
 
 
+# Define createDirectoryWatcher  (may return None)
+
+if LinuxHacks and LinuxHacks.DirectoryWatcher.isSupported():
+    def createDirectoryWatcher(path, callback, delay=0.5):
+        """
+        Return a watcher object with methods start() and stop() which
+        calls callback(changedNames, presenceChangedNames) from another thread
+        if files in directory path change (see LinuxHacks.DirectoryWatcher).
+        """
+        return LinuxHacks.DirectoryWatcher(path, callback, delay)
+else:
+    def createDirectoryWatcher(path, callback, delay=0.5):
+        return None
+
+
 if WindowsHacks:
     translateAcceleratorByKbLayout = WindowsHacks.translateAcceleratorByKbLayout
 else:
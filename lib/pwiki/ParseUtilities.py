@@ -53,6 +53,16 @@ class WikiPageFormatDetails(object):
         # TODO Allow only if currently dummy language is set?
         self.wikiLanguageDetails = wikiLanguageDetails
 
+    def copyWithoutBasePage(self):
+        """
+        Return a copy with basePage set to None. This allows to keep the
+        details for a later isEquivTo() check without keeping the page alive.
+        """
+        return WikiPageFormatDetails(withCamelCase=self.withCamelCase,
+                wikiDocument=self.wikiDocument, autoLinkMode=self.autoLinkMode,
+                noFormat=self.noFormat, paragraphMode=self.paragraphMode,
+                wikiLanguageDetails=self.wikiLanguageDetails)
+
     def isEquivTo(self, details):
         """
         Compares with other details object if both are "equivalent"
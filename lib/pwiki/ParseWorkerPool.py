@@ -0,0 +1,438 @@
+"""
+Parsing of wiki pages in worker processes.
+
+Parsing is done in pure Python and is CPU-bound, so it can only use one
+core inside the main process. A ParseWorkerPool sends page text and the
+relevant format details to worker processes which return the data
+derived from the page AST (as DocPages.MainDbCacheData) so that only the
+database writes remain in the main process. For export the workers return
+the page AST itself which is then only rendered in the main process.
+
+Pages which can't be handled by a worker (e.g. auto-links in "relax" mode
+need the whole list of wiki words, or a parser plugin which can't be
+loaded in a worker) are silently parsed in the main process instead.
+"""
+
+import sys, imp, copy, itertools, traceback, cPickle, multiprocessing
+
+import wx
+
+from .WikiExceptions import NotCurrentThreadException
+from .Utilities import DUMBTHREADSTOP
+from . import ParseUtilities
+from .DocPages import AbstractWikiPage, MainDbCacheData
+
+
+
+class _WorkerWikiDocument(object):
+    """
+    Stand-in for WikiDocument inside a worker process. Provides only the
+    few methods a parser calls during parsing.
+    """
+    def __init__(self, ccWordBlacklist, nccWordBlacklist):
+        self.ccWordBlacklist = ccWordBlacklist
+        self.nccWordBlacklist = nccWordBlacklist
+
+    def getCcWordBlacklist(self):
+        return self.ccWordBlacklist
+
+    def getNccWordBlacklist(self):
+        return self.nccWordBlacklist
+
+
+class _WorkerWikiPage(object):
+    """
+    Stand-in for the base page of the format details inside a worker process,
+    needed to resolve relative links.
+    """
+    def __init__(self, wikiDocument, wikiPageName):
+        self.wikiDocument = wikiDocument
+        self.wikiPageName = wikiPageName
+
+    def getWikiDocument(self):
+        return self.wikiDocument
+
+    def getWikiWord(self):
+        return self.wikiPageName
+
+    getWikiPageName = getWikiWord
+
+
+
+# Only used inside of worker processes
+_workerParserModuleInfos = None   # {intLanguageName: (moduleName,
+        # moduleFile, factoryName)}
+_workerParsers = {}   # {intLanguageName: parser object}
+
+
+def _initWorker(parserModuleInfos):
+    global _workerParserModuleInfos
+
+    _workerParserModuleInfos = parserModuleInfos
+
+    import __builtin__
+    if not hasattr(__builtin__, "_"):
+        # Process was spawned, localization isn't needed here
+        __builtin__._ = lambda s: s
+
+    # Main process may be bound to a single CPU (option "cpu_affinity")
+    # and a forked worker inherits that
+    try:
+        from . import OsAbstract
+
+        cpuCount = OsAbstract.getCpuCount()
+        if cpuCount > 1:
+            OsAbstract.setCpuAffinity(range(cpuCount))
+    except:
+        traceback.print_exc()
+
+
+def _getWorkerParser(intLanguageName):
+    parser = _workerParsers.get(intLanguageName)
+    if parser is not None:
+        return parser
+
+    moduleName, moduleFile, factoryName = \
+            _workerParserModuleInfos[intLanguageName]
+
+    module = sys.modules.get(moduleName)
+    if module is None:
+        # Worker wasn't forked from main process -> load plugin module
+        loadName = "_parseWorker_" + moduleName.replace(".", "_")
+        if moduleFile.endswith((".pyc", ".pyo")):
+            module = imp.load_compiled(loadName, moduleFile)
+        else:
+            module = imp.load_source(loadName, moduleFile)
+
+    parser = getattr(module, factoryName)(intLanguageName, False)
+    _workerParsers[intLanguageName] = parser
+
+    return parser
+
+
+def _parseTask(pickledTask):
+    """
+    Runs in worker process. Parse page described by pickledTask and
+    return page AST.
+    """
+    wikiPageName, intLanguageName, text, formatSettings, \
+            wikiLanguageDetails, ccWordBlacklist, nccWordBlacklist = \
+            cPickle.loads(pickledTask)
+
+    wikiDocument = _WorkerWikiDocument(ccWordBlacklist, nccWordBlacklist)
+
+    if hasattr(wikiLanguageDetails, "wikiDocument"):
+        wikiLanguageDetails.wikiDocument = wikiDocument
+
+    withCamelCase, autoLinkMode, noFormat, paragraphMode = formatSettings
+
+    formatDetails = ParseUtilities.WikiPageFormatDetails(
+            withCamelCase=withCamelCase, wikiDocument=wikiDocument,
+            basePage=_WorkerWikiPage(wikiDocument, wikiPageName),
+            autoLinkMode=autoLinkMode, noFormat=noFormat,
+            paragraphMode=paragraphMode,
+            wikiLanguageDetails=wikiLanguageDetails)
+
+    parser = _getWorkerParser(intLanguageName)
+    return parser.parse(intLanguageName, text, formatDetails, DUMBTHREADSTOP)
+
+
+def _parseInWorker(pickledTask):
+    """
+    Runs in worker process. Returns tuple (attrs, todos, childRelations,
+    headings) as needed for MainDbCacheData or None on error.
+    """
+    try:
+        pageAst = _parseTask(pickledTask)
+
+        attrs = AbstractWikiPage.extractAttributesFromPageAst(pageAst)
+        todos, childRelations, headings = \
+                AbstractWikiPage.extractMainDbCacheEntriesFromPageAst(pageAst)
+
+        return (attrs, todos, childRelations, headings)
+    except:
+        traceback.print_exc()
+        return None
+
+
+def _parseAstInWorker(pickledTask):
+    """
+    Runs in worker process. Returns the page AST itself (pickled back to
+    the main process) or None on error.
+    """
+    try:
+        return _parseTask(pickledTask)
+    except:
+        traceback.print_exc()
+        return None
+
+
+
+def getConfiguredWorkerCount():
+    """
+    Return number of parse worker processes according to global option
+    "parseWorkers_count", 0 means parsing inside the main process only.
+    """
+    count = wx.GetApp().getGlobalConfig().getint("main", "parseWorkers_count",
+            0)
+    if count < 0:
+        try:
+            count = multiprocessing.cpu_count()
+        except NotImplementedError:
+            count = 0
+
+    return count
+
+
+
+class ParseWorkerPool(object):
+    """
+    Pool of worker processes parsing wiki pages. The iterators of different
+    threads can use the same pool, but close() must only be called if no
+    iterator is active anymore.
+    """
+    def __init__(self, workerCount):
+        self.workerCount = workerCount
+        self.batchSize = workerCount * 8
+
+        self.parserModuleInfos = self._buildParserModuleInfos()
+        self.pool = multiprocessing.Pool(workerCount, _initWorker,
+                (self.parserModuleInfos,))
+
+
+    @staticmethod
+    def _buildParserModuleInfos():
+        """
+        Find out how workers can load the parser plugins.
+        """
+        result = {}
+        for desc in wx.GetApp().listWikiLanguageDescriptions():
+            factory = desc[2]
+            module = sys.modules.get(factory.__module__)
+            moduleFile = getattr(module, "__file__", None)
+            if moduleFile is None:
+                continue
+
+            result[desc[0]] = (factory.__module__, moduleFile,
+                    factory.__name__)
+
+        return result
+
+
+    def getWorkerCount(self):
+        return self.workerCount
+
+
+    def close(self):
+        """
+        Terminate worker processes. Don't use the pool afterwards.
+        """
+        if self.pool is None:
+            return
+
+        self.pool.terminate()
+        self.pool.join()
+        self.pool = None
+
+
+    def _buildPickledTask(self, wikiPage, text, formatDetails):
+        """
+        Return pickled task for _parseInWorker() or None if page must
+        be parsed in main process.
+        """
+        intLanguageName = wikiPage.getWikiLanguageName()
+
+        if formatDetails.autoLinkMode == u"relax" or \
+                intLanguageName not in self.parserModuleInfos:
+            return None
+
+        wikiDocument = wikiPage.getWikiDocument()
+
+        try:
+            wikiLanguageDetails = copy.copy(formatDetails.wikiLanguageDetails)
+            if hasattr(wikiLanguageDetails, "wikiDocument"):
+                wikiLanguageDetails.wikiDocument = None
+
+            return cPickle.dumps((wikiPage.getWikiWord(), intLanguageName, text,
+                    (formatDetails.withCamelCase, formatDetails.autoLinkMode,
+                    formatDetails.noFormat, formatDetails.paragraphMode),
+                    wikiLanguageDetails, wikiDocument.getCcWordBlacklist(),
+                    wikiDocument.getNccWordBlacklist()),
+                    cPickle.HIGHEST_PROTOCOL)
+        except (cPickle.PicklingError, TypeError, AttributeError):
+            # Language details can't be transferred
+            return None
+
+
+    def _submit(self, wikiPage, workerFunc):
+        """
+        Retrieve text and format details of wikiPage and send it to
+        workerFunc in a worker. Returns tuple (wikiPage, text,
+        liveTextPlaceHold, formatDetails, asyncResult) where asyncResult is
+        None if page must be parsed locally.
+        """
+        with wikiPage.getTextOperationLock():
+            text = wikiPage.getLiveText()
+            liveTextPlaceHold = wikiPage.liveTextPlaceHold
+            formatDetails = wikiPage.getFormatDetails()
+
+        pickledTask = self._buildPickledTask(wikiPage, text, formatDetails)
+        if pickledTask is None:
+            asyncResult = None
+        else:
+            asyncResult = self.pool.apply_async(workerFunc, (pickledTask,))
+
+        return (wikiPage, text, liveTextPlaceHold,
+                formatDetails.copyWithoutBasePage(), asyncResult)
+
+
+    def _submitBatch(self, wikiPages, workerFunc):
+        result = []
+        for wikiPage in wikiPages:
+            try:
+                result.append(self._submit(wikiPage, workerFunc))
+            except NotCurrentThreadException:
+                raise
+            except:
+                traceback.print_exc()
+                result.append((wikiPage, None, None, None, None))
+
+        return result
+
+
+    def _iterResults(self, wikiPages, workerFunc, threadstop):
+        """
+        Send pages of iterable wikiPages to workerFunc and yield for each
+        a tuple (wikiPage, text, liveTextPlaceHold, formatDetails, result)
+        in the same order. text is None if retrieving failed, result is None
+        if the page must be parsed locally.
+        While results of one batch of pages are consumed, the next batch is
+        already parsed by the workers.
+        """
+        wikiPages = iter(wikiPages)
+        pending = None
+
+        while True:
+            threadstop.testValidThread()
+
+            submitted = self._submitBatch(itertools.islice(wikiPages,
+                    self.batchSize), workerFunc)
+
+            if pending is not None:
+                for wikiPage, text, liveTextPlaceHold, formatDetails, \
+                        asyncResult in pending:
+                    threadstop.testValidThread()
+
+                    result = None
+                    if text is not None and asyncResult is not None:
+                        result = asyncResult.get()
+
+                    yield (wikiPage, text, liveTextPlaceHold, formatDetails,
+                            result)
+
+            if len(submitted) == 0:
+                return
+
+            pending = submitted
+
+
+    def iterPageData(self, wikiPages, threadstop=DUMBTHREADSTOP):
+        """
+        Parse pages of iterable wikiPages and yield for each a tuple
+        (wikiPage, text, mainDbCacheData) in the same order. text and
+        mainDbCacheData are None if retrieving or parsing failed.
+        """
+        for wikiPage, text, liveTextPlaceHold, formatDetails, entries in \
+                self._iterResults(wikiPages, _parseInWorker, threadstop):
+            if text is None:
+                # Retrieving failed
+                yield wikiPage, None, None
+                continue
+
+            if entries is not None:
+                attrs, todos, childRelations, headings = entries
+                yield wikiPage, text, MainDbCacheData(liveTextPlaceHold,
+                        formatDetails, attrs, todos, childRelations, headings)
+                continue
+
+            # Parse in main process
+            for item in iterPageData((wikiPage,), threadstop=threadstop):
+                yield item
+
+
+    def iterPageAsts(self, wikiPages, threadstop=DUMBTHREADSTOP):
+        """
+        Parse pages of iterable wikiPages and yield for each a tuple
+        (wikiPage, text, pageAst) in the same order. text and pageAst are
+        None if retrieving or parsing failed. The AST becomes the live page
+        AST of wikiPage if the page wasn't modified meanwhile.
+        """
+        for wikiPage, text, liveTextPlaceHold, formatDetails, pageAst in \
+                self._iterResults(wikiPages, _parseAstInWorker, threadstop):
+            if text is None:
+                # Retrieving failed
+                yield wikiPage, None, None
+                continue
+
+            if pageAst is not None:
+                wikiPage.setLivePageAstIfCurrent(pageAst, text,
+                        liveTextPlaceHold, formatDetails)
+                yield wikiPage, text, pageAst
+                continue
+
+            # Parse in main process
+            for item in iterPageAsts((wikiPage,), threadstop=threadstop):
+                yield item
+
+
+
+def iterPageData(wikiPages, pool=None, threadstop=DUMBTHREADSTOP):
+    """
+    Parse pages of iterable wikiPages using ParseWorkerPool pool or
+    in the main process if pool is None. Yields tuples
+    (wikiPage, text, mainDbCacheData) as described in
+    ParseWorkerPool.iterPageData().
+    """
+    if pool is not None:
+        for item in pool.iterPageData(wikiPages, threadstop=threadstop):
+            yield item
+        return
+
+    for wikiPage in wikiPages:
+        try:
+            pageAst, text = wikiPage.getLivePageAstAndText(threadstop=threadstop)
+            data = wikiPage.extractMainDbCacheDataFromPageAst(pageAst,
+                    threadstop=threadstop)
+        except NotCurrentThreadException:
+            raise
+        except:
+            traceback.print_exc()
+            yield wikiPage, None, None
+            continue
+
+        yield wikiPage, text, data
+
+
+
+def iterPageAsts(wikiPages, pool=None, threadstop=DUMBTHREADSTOP):
+    """
+    Parse pages of iterable wikiPages using ParseWorkerPool pool or
+    in the main process if pool is None. Yields tuples
+    (wikiPage, text, pageAst) as described in ParseWorkerPool.iterPageAsts().
+    """
+    if pool is not None:
+        for item in pool.iterPageAsts(wikiPages, threadstop=threadstop):
+            yield item
+        return
+
+    for wikiPage in wikiPages:
+        try:
+            pageAst, text = wikiPage.getLivePageAstAndText(threadstop=threadstop)
+        except NotCurrentThreadException:
+            raise
+        except:
+            traceback.print_exc()
+            yield wikiPage, None, None
+            continue
+
+        yield wikiPage, text, pageAst
@@ -1,9 +1,11 @@
-import re, traceback
+import re, sre_parse, sre_constants, traceback
 
 import wx
 
 from WikiExceptions import *
 
+from Utilities import DUMBTHREADSTOP
+
 from Serialization import SerializeStream, findXmlElementFlat, \
         iterXmlElementFlat, serToXmlUnicode, serFromXmlUnicode, \
         serToXmlBoolean, serFromXmlBoolean, serToXmlInt, serFromXmlInt
@@ -60,6 +62,20 @@ class AbstractSearchNode:
         Should return True in case of doubt.
         """
         return True
+
+    def getContentPrefilter(self):
+        """
+        Returns a condition the text of a page must fulfill if testWikiPage()
+        returns True for it or None if there is no such condition. A WikiData
+        implementation with a full text index can use it to find candidate
+        pages before testWikiPage() is called for them.
+
+        A condition is one of the tuples:
+            ("str", <unistring>, <case sensitive>) -- text contains string
+            ("and", <condition>, <condition>)
+            ("or", <condition>, <condition>)
+        """
+        return None
         
 
 #     def testText(self, text):
@@ -167,6 +183,7 @@ class NotSearchNode(AbstractSearchNode):
         return self.sub.isTextNeededForTest()
 
     # orderNatural() from the subnode is not delegated
+    # getContentPrefilter() of the subnode can't be used either
 
     def serializeBin(self, stream):  # TODO !!!
         """
@@ -511,6 +528,68 @@ def _serNodeFromXml(xmlNode, sarOp):
     return obj
 
 
+def _combineContentPrefilters(op, left, right):
+    """
+    Combine two conditions as returned by
+    AbstractSearchNode.getContentPrefilter() by  op  which is either "and"
+    or "or".
+    """
+    if op == "and":
+        if left is None:
+            return right
+        if right is None:
+            return left
+    elif left is None or right is None:
+        return None
+
+    return (op, left, right)
+
+
+def _getSreContentPrefilter(items, caseSensitive):
+    """
+    Returns condition as for AbstractSearchNode.getContentPrefilter()
+    for the literal strings each match of a regex must contain.
+
+    items -- sequence of (opcode, argument) tuples as created by sre_parse
+    """
+    result = None
+    run = []
+
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            run.append(unichr(av))
+            continue
+        elif op == sre_constants.AT:
+            # Zero-width, literals before and after are still adjacent
+            continue
+
+        if len(run) > 0:
+            result = _combineContentPrefilters("and", result,
+                    ("str", u"".join(run), caseSensitive))
+            run = []
+
+        if op == sre_constants.SUBPATTERN:
+            sub = _getSreContentPrefilter(av[-1], caseSensitive)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and \
+                av[0] > 0:
+            sub = _getSreContentPrefilter(av[2], caseSensitive)
+        elif op == sre_constants.BRANCH:
+            sub = reduce(lambda left, right: _combineContentPrefilters("or",
+                    left, right), [_getSreContentPrefilter(branch,
+                    caseSensitive) for branch in av[1]])
+        else:
+            # Character sets, lookarounds, group references ...
+            sub = None
+
+        result = _combineContentPrefilters("and", result, sub)
+
+    if len(run) > 0:
+        result = _combineContentPrefilters("and", result,
+                ("str", u"".join(run), caseSensitive))
+
+    return result
+
+
 
 # -------------------- Text search criteria --------------------
 
@@ -767,6 +846,11 @@ class AndSearchNode(AbstractAndOrSearchNode):
             
         return Unknown
 
+    def getContentPrefilter(self):
+        return _combineContentPrefilters("and",
+                self.left.getContentPrefilter(),
+                self.right.getContentPrefilter())
+
 
 class OrSearchNode(AbstractAndOrSearchNode):
     """
@@ -790,6 +874,11 @@ class OrSearchNode(AbstractAndOrSearchNode):
 
         return Unknown
 
+    def getContentPrefilter(self):
+        return _combineContentPrefilters("or",
+                self.left.getContentPrefilter(),
+                self.right.getContentPrefilter())
+
 
 
 class RegexTextNode(AbstractContentSearchNode):
@@ -825,6 +914,16 @@ class RegexTextNode(AbstractContentSearchNode):
     def testWikiPage(self, word, text):
         return bool(self.rePattern.search(text))
 
+    def getContentPrefilter(self):
+        try:
+            parsed = sre_parse.parse(self.rePattern.pattern,
+                    self.rePattern.flags)
+        except (sre_constants.error, TypeError, ValueError):
+            return None
+
+        caseSensitive = not (parsed.pattern.flags & re.IGNORECASE)
+        return _getSreContentPrefilter(parsed, caseSensitive)
+
 #     def testText(self, text):
 #         return bool(self.rePattern.search(text))
 
@@ -878,6 +977,9 @@ class SimpleStrNode(AbstractContentSearchNode):
     def testWikiPage(self, word, text):
         return text.find(self.subStr) != -1
 
+    def getContentPrefilter(self):
+        return ("str", self.subStr, True)
+
 
 #     def testText(self, text):
 #         return text.find(self.subStr) != -1
@@ -1338,6 +1440,16 @@ class ListWikiPagesOperation:
 
         return self.searchOpTree.isTextNeededForTest()
 
+    def getContentPrefilter(self):
+        """
+        Returns condition the text of a page fulfills if testWikiPage()
+        returns True for it, see AbstractSearchNode.getContentPrefilter().
+        """
+        if self.searchOpTree is None:
+            return None
+
+        return self.searchOpTree.getContentPrefilter()
+
 
     def testWikiPageByDocPage(self, docPage):
         return self.testWikiPage(docPage.getWikiWord(), docPage.getLiveText())
@@ -1762,6 +1874,35 @@ class SearchReplaceOperation:
             yield found
 
 
+    def searchAllDocPageAndText(self, docPage, text, maxCount=-1):
+        """
+        Find the consecutive occurrences from the beginning of text in one go
+        and return list of tuples with at least two elements
+        <first char>, <after last char>. The list is empty if the search
+        has no particular text position or nothing was found. It ends before
+        an empty match following the first occurrence.
+
+        maxCount -- if >= 0, stop after maxCount + 1 occurrences, so the
+                caller can see that there are more than maxCount ones
+        """
+        if not self.hasParticularTextPosition():
+            return []
+
+        found = self.searchOpTree.searchDocPageAndText(docPage, text, 0, False)
+        if found[0] is None:
+            return []
+
+        result = [found]
+        while len(result) != maxCount + 1:
+            found = self.searchOpTree.searchDocPageAndText(docPage, text,
+                    found[1], False)
+            if found[0] is None or found[0] == found[1]:
+                break
+            result.append(found)
+
+        return result
+
+
     def searchText(self, text, searchCharStartPos=0):
         """
         Applies the search operation on text and returns a
@@ -1872,6 +2013,115 @@ class SearchReplaceOperation:
         return self.searchOpTree.replace(text, foundData, self.replaceStr)
 
 
+    def replaceAllInText(self, docPage, text):
+        """
+        Replace all occurrences in text of docPage and return tuple
+        (new text, number of replacements). The new text is built in one
+        pass, occurrences are searched in the original text (as re.sub() does)
+        and replacing stops after an empty match.
+        It must be called after beginWikiSearch() and before corresponding
+        endWikiSearch() call.
+        """
+        if not self.replaceOp or not self.hasParticularTextPosition():
+            return (text, 0)
+
+        searchOpTree = self.searchOpTree
+        pieces = []
+        pos = 0
+
+        while True:
+            found = searchOpTree.searchDocPageAndText(docPage, text, pos, False)
+            start, end = found[:2]
+            if start is None:
+                break
+
+            pieces.append(text[pos:start])
+            pieces.append(searchOpTree.replace(text, found, self.replaceStr))
+            pos = end
+            if start == end:
+                # Otherwise replacing would go infinitely
+                break
+
+        if len(pieces) == 0:
+            return (text, 0)
+
+        replaceCount = len(pieces) // 2
+        pieces.append(text[pos:])
+
+        return (u"".join(pieces), replaceCount)
+
+
+    def replaceAllInWiki(self, wikiDocument, words, dryRun=False,
+            replacements=None, threadstop=DUMBTHREADSTOP):
+        """
+        Replace all occurrences in the pages of words. Read-only pages
+        are skipped.
+        All pages are searched before the first one is modified. The modified
+        pages are written and committed together, their meta-data (and search
+        index) is updated afterwards by one bulk update.
+
+        Returns tuple (number of replacements, replacements) where
+        replacements is a list of tuples (wikiPage, text, new text, count)
+        for the pages to modify.
+
+        dryRun -- if True, only count, nothing is modified
+        replacements -- replacements returned by a previous dry run.
+            The pages aren't searched again (words is ignored), only those
+            whose text was changed since the dry run.
+        """
+        self.beginWikiSearch(wikiDocument)
+        try:
+            if replacements is None:
+                replacements = []
+                for word in words:
+                    threadstop.testValidThread()
+                    wikiPage = wikiDocument.getWikiPageNoError(word)
+                    if wikiPage.isReadOnlyEffect():
+                        continue
+
+                    self._appendPageReplacement(replacements, wikiPage)
+            else:
+                previous = replacements
+                replacements = []
+                for entry in previous:
+                    threadstop.testValidThread()
+                    wikiPage, text = entry[:2]
+                    if wikiPage.getLiveTextNoTemplate() == text:
+                        replacements.append(entry)
+                    else:
+                        self._appendPageReplacement(replacements, wikiPage)
+        finally:
+            self.endWikiSearch()
+
+        replaceCount = sum(entry[3] for entry in replacements)
+
+        threadstop.testValidThread()
+        if dryRun or len(replacements) == 0:
+            return (replaceCount, replacements)
+
+        for wikiPage, text, newText, count in replacements:
+            wikiPage.replaceLiveText(newText, deferUpdate=True)
+
+        wikiDocument.getWikiData().commit()
+        wikiDocument.pushDirtyMetaDataUpdate()
+
+        return (replaceCount, replacements)
+
+
+    def _appendPageReplacement(self, replacements, wikiPage):
+        """
+        Append entry for wikiPage to list replacements (see
+        replaceAllInWiki()) if its text contains occurrences.
+        """
+        text = wikiPage.getLiveTextNoTemplate()
+        if text is None:
+            return
+
+        newText, count = self.replaceAllInText(wikiPage, text)
+        if count > 0:
+            replacements.append((wikiPage, text, newText, count))
+
+
     def beginWikiSearch(self, wikiDocument, commonCache=None):
         """
         Called by WikiDocument(=WikiDataManager) to begin a wiki-wide search
@@ -1935,6 +2185,17 @@ class SearchReplaceOperation:
                 self.searchOpTree.isTextNeededForTest()
 
 
+    def getContentPrefilter(self):
+        """
+        Returns condition the text of a page fulfills if testWikiPage()
+        returns True for it, see AbstractSearchNode.getContentPrefilter().
+        """
+        if self.searchOpTree is None:
+            self.rebuildSearchOpTree()
+
+        return self.searchOpTree.getContentPrefilter()
+
+
     def testWikiPageByDocPage(self, docPage):
         return self.testWikiPage(docPage.getWikiWord(), docPage.getLiveText())
 
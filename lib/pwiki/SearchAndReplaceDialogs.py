@@ -158,6 +158,9 @@ class SearchResultListBox(wx.HtmlListBox, MiscEventSourceMixin):
 
     def OnGetItem(self, i):
         if self.isShowingSearching:
+            if i < len(self.foundinfo):
+                # Hit already streamed in by searchAndShowFound()
+                return self.foundinfo[i].getHtml()
             return u"<b>" + _(u"Searching... (click into field to abort)") + u"</b>"
         elif self.GetCount() == 0:
             return u"<b>" + _(u"Not found") + u"</b>"
@@ -172,6 +175,8 @@ class SearchResultListBox(wx.HtmlListBox, MiscEventSourceMixin):
         Shows a "Searching..." as visual feedback while search runs
         """
         self.isShowingSearching = True
+        self.found = []
+        self.foundinfo = []
         self.SetItemCount(1)
         self.Refresh()
         self.Update()
@@ -196,6 +201,136 @@ class SearchResultListBox(wx.HtmlListBox, MiscEventSourceMixin):
             self.Refresh()
 
 
+    def _getFoundInfoSettings(self):
+        """
+        Return tuple (before, after, countOccurrences, maxCountOccurrences)
+        with the settings for the presentation of found pages.
+        """
+        config = self.pWiki.getConfig()
+        return (config.getint("main", "search_wiki_context_before"),
+                config.getint("main", "search_wiki_context_after"),
+                config.getboolean("main", "search_wiki_count_occurrences"),
+                config.getint("main", "search_wiki_max_count_occurrences", 100))
+
+
+    def _buildFoundInfo(self, sarOp, word, text, spans, settings):
+        """
+        Create the _SearchResultItemInfo for a found page of a non-index
+        search.
+        text -- Text of the page, may be None if no context is shown
+        spans -- list of occurrences as returned by
+                sarOp.searchAllDocPageAndText()
+        settings -- tuple returned by _getFoundInfoSettings()
+        """
+        before, after, countOccurrences, maxCountOccurrences = settings
+        context = before + after
+
+        if not sarOp.hasParticularTextPosition():
+            # No specific position to show as context, so show beginning of page
+            # Also, no occurrence counting possible
+            spans = []
+        elif context == 0 and not countOccurrences:
+            # No context, no occurrence counting
+            return _SearchResultItemInfo(word)
+
+        if len(spans) == 0:
+            # This can happen e.g. for boolean searches like
+            # 'foo or not bar' on a page which has neither 'foo'
+            # nor 'bar'.
+            if context == 0:
+                return _SearchResultItemInfo(word)
+
+            return _SearchResultItemInfo(word).buildOccurrence(text, before,
+                    after, (-1, -1), -1, 100)
+
+        info = _SearchResultItemInfo(word, occPos=spans[0],
+                maxOccCount=maxCountOccurrences)
+
+        if countOccurrences:
+            if len(spans) > maxCountOccurrences:
+                info.occCount = -2
+            else:
+                info.occCount = len(spans)
+
+        return info.buildOccurrence(text, before, after, spans[0], 1,
+                maxCountOccurrences)
+
+
+    def searchAndShowFound(self, sarOp, wikiDocument, applyOrdering=True,
+            threadstop=DUMBTHREADSTOP):
+        """
+        Runs the non-index search operation sarOp and shows the found pages
+        while the search is running. Each page is read and searched only once
+        to get its positions, occurrence count and context.
+        Returns list of found wiki words, ordered by the ordering of sarOp
+        if applyOrdering is True, alphabetically otherwise.
+        """
+        try:
+            # Store and prepare clone of search operation
+            self.searchOp = sarOp.clone()
+            self.searchOp.replaceOp = False
+            self.searchOp.cycleToStart = True
+
+            self.found = []
+            self.foundinfo = []
+
+            settings = self._getFoundInfoSettings()
+            before, after, countOccurrences, maxCountOccurrences = settings
+            if countOccurrences:
+                maxCount = maxCountOccurrences
+            else:
+                maxCount = 0   # Only first position needed
+
+            for hits in wikiDocument.iterSearchWikiHits(sarOp,
+                    withText=(before + after > 0 or countOccurrences),
+                    maxCount=maxCount, threadstop=threadstop):
+                if len(hits) == 0:
+                    continue
+
+                for word, text, spans in hits:
+                    self.found.append(word)
+                    self.foundinfo.append(self._buildFoundInfo(sarOp, word,
+                            text, spans, settings))
+
+                # Show hits so far with the "Searching..." entry at the end
+                callInMainThreadAsync(self._displayFound,
+                        len(self.foundinfo) + 1, threadstop)
+
+            # Bring all hits into final order
+            infoByWord = dict(zip(self.found, self.foundinfo))
+            if applyOrdering:
+                sarOp.beginWikiSearch(wikiDocument)
+                try:
+                    found = sarOp.applyOrdering(set(self.found),
+                            wikiDocument.getCollator())
+                finally:
+                    sarOp.endWikiSearch()
+            else:
+                found = self.found[:]
+                wikiDocument.getCollator().sort(found)
+
+            threadstop.testValidThread()
+            self.found = found
+            self.foundinfo = [infoByWord[word] for word in found]
+            if len(found) == 0:
+                self.searchOp = None
+
+            self.isShowingSearching = False
+            # At least 1 for the "Not found" entry
+            callInMainThreadAsync(self._displayFound,
+                    max(1, len(self.foundinfo)), threadstop)
+
+            return found
+
+        except NotCurrentThreadException:
+            self.found = []
+            self.foundinfo = []
+            self.isShowingSearching = False
+            # For the "Not found" entry
+            callInMainThreadAsync(self._displayFound, 1, threadstop)
+            raise
+
+
     def showFound(self, sarOp, found, wikiDocument,
             threadstop=DUMBTHREADSTOP):
         """
@@ -219,15 +354,10 @@ class SearchResultListBox(wx.HtmlListBox, MiscEventSourceMixin):
                 self.found = found
                 self.foundinfo = []
                 # Load context settings
-                before = self.pWiki.configuration.getint("main",
-                        "search_wiki_context_before")
-                after = self.pWiki.configuration.getint("main",
-                        "search_wiki_context_after")
-                        
-                countOccurrences = self.pWiki.getConfig().getboolean("main",
-                        "search_wiki_count_occurrences")
-                maxCountOccurrences = self.pWiki.getConfig().getint("main",
-                        "search_wiki_max_count_occurrences", 100)
+                settings = self._getFoundInfoSettings()
+                before, after, countOccurrences, maxCountOccurrences = settings
+                if not countOccurrences:
+                    maxCountOccurrences = 0   # Only first position needed
 
                 context = before + after
 
@@ -246,46 +376,11 @@ class SearchResultListBox(wx.HtmlListBox, MiscEventSourceMixin):
                                 text = docPage.getLiveTextNoTemplate()
                                 if text is None:
                                     continue
-    
-    #                             pos = sarOp.searchText(text)
-                                pos = sarOp.searchDocPageAndText(docPage, text)
-                                if pos[0] is None:
-                                    # This can happen e.g. for boolean searches like
-                                    # 'foo or not bar' on a page which has neither 'foo'
-                                    # nor 'bar'.
-                                    
-                                    # Similar as if no particular text position available
-                                    if context == 0:
-                                        self.foundinfo.append(
-                                                _SearchResultItemInfo(w))
-                                    else:
-                                        self.foundinfo.append(
-                                                _SearchResultItemInfo(w).buildOccurrence(
-                                                text, before, after, (-1, -1), -1,
-                                                100))
-                                    continue
-                                firstpos = pos
-                                
-                                info = _SearchResultItemInfo(w, occPos=pos,
-                                        maxOccCount=maxCountOccurrences)
-    
-                                if countOccurrences:
-                                    occ = 1
-                                    while True:
-                                        pos = sarOp.searchDocPageAndText(
-                                                docPage, text, pos[1])
-                                        if pos[0] is None or pos[0] == pos[1]:
-                                            break
-                                        occ += 1
-                                        if occ > maxCountOccurrences:
-                                            occ = -2
-                                            break
-    
-                                    info.occCount = occ
-    
-                                self.foundinfo.append(info.buildOccurrence(
-                                        text, before, after, firstpos, 1,
-                                        maxCountOccurrences))
+
+                                spans = sarOp.searchAllDocPageAndText(docPage,
+                                        text, maxCountOccurrences)
+                                self.foundinfo.append(self._buildFoundInfo(
+                                        sarOp, w, text, spans, settings))
                         finally:
                             sarOp.endWikiSearch()
                 elif sarOp.hasWhooshHighlighting():
@@ -1399,15 +1494,21 @@ class SearchWikiDialog(wx.Dialog, MiscEventSourceMixin):
         for win in disableSet:
             win.Disable()
         try:
-            self.foundPages = self.mainControl.getWikiDocument().searchWiki(
-                    sarOp, self.allowOrdering, threadstop=threadstop)
-            if not self.allowOrdering:
-                # Use default alphabetical ordering
-                self.mainControl.getCollator().sort(self.foundPages)
-
-            self.ctrls.htmllbPages.showFound(sarOp, self.foundPages,
-                    self.mainControl.getWikiDocument(),
-                    threadstop=threadstop)
+            if sarOp.indexSearch == "no":
+                # Without ordering, default alphabetical ordering is used
+                self.foundPages = self.ctrls.htmllbPages.searchAndShowFound(
+                        sarOp, self.mainControl.getWikiDocument(),
+                        self.allowOrdering, threadstop=threadstop)
+            else:
+                self.foundPages = self.mainControl.getWikiDocument().searchWiki(
+                        sarOp, self.allowOrdering, threadstop=threadstop)
+                if not self.allowOrdering:
+                    # Use default alphabetical ordering
+                    self.mainControl.getCollator().sort(self.foundPages)
+    
+                self.ctrls.htmllbPages.showFound(sarOp, self.foundPages,
+                        self.mainControl.getWikiDocument(),
+                        threadstop=threadstop)
 
             self.listNeedsRefresh = False
 
@@ -1594,64 +1695,35 @@ class SearchWikiDialog(wx.Dialog, MiscEventSourceMixin):
 
 
     def OnReplaceAll(self, evt):
-        answer = wx.MessageBox(_(u"Replace all occurrences?"), _(u"Replace All"),
-                wx.YES_NO | wx.NO_DEFAULT, self)
-
-        if answer != wx.YES:
-            return
-
         try:
             self._refreshPageList()
 
             if self.ctrls.htmllbPages.GetCount() == 0:
                 return
 
-            # self.pWiki.saveCurrentDocPage()
-
             sarOp = self._buildSearchReplaceOperation()
             sarOp.replaceOp = True
             
-            # wikiData = self.pWiki.getWikiData()
             wikiDocument = self.mainControl.getWikiDocument()
-            self.addCurrentToHistory()
-            
-            replaceCount = 0
-    
-            for i in xrange(self.ctrls.htmllbPages.GetCount()):
-                self.ctrls.htmllbPages.SetSelection(i)
-                wikiWord = guiToUni(self.ctrls.htmllbPages.GetSelectedWord())
-                wikiPage = wikiDocument.getWikiPageNoError(wikiWord)
-                text = wikiPage.getLiveTextNoTemplate()
-                if text is None:
-                    continue
-    
-                charStartPos = 0
+
+            # Dry run to show what would happen
+            replaceCount, replacements = sarOp.replaceAllInWiki(wikiDocument,
+                    self.foundPages, dryRun=True)
+
+            answer = wx.MessageBox(
+                    _(u"Replace all %i occurrences in %i pages?") %
+                    (replaceCount, len(replacements)), _(u"Replace All"),
+                    wx.YES_NO | wx.NO_DEFAULT, self)
     
-                sarOp.beginWikiSearch(self.mainControl.getWikiDocument())
-                try:
-                    while True:
-                        try:
-                            found = sarOp.searchDocPageAndText(wikiPage, text,
-                                    charStartPos)
-                            start, end = found[:2]
-                        except:
-                            # Regex error -> Stop searching
-                            return
-                            
-                        if start is None: break
-                        
-                        repl = sarOp.replace(text, found)
-                        text = text[:start] + repl + text[end:]  # TODO Faster?
-                        charStartPos = start + len(repl)
-                        replaceCount += 1
-                        if start == end:
-                            # Otherwise replacing would go infinitely
-                            break
-                finally:
-                    sarOp.endWikiSearch()
+            if answer != wx.YES:
+                return
+
+            self.addCurrentToHistory()
+
+            # Only writes the replacements of the dry run
+            replaceCount, replacements = sarOp.replaceAllInWiki(wikiDocument,
+                    self.foundPages, replacements=replacements)
 
-                wikiPage.replaceLiveText(text)
-                    
             self._refreshPageList()
             
             wx.MessageBox(_(u"%i replacements done") % replaceCount,
@@ -2593,12 +2665,17 @@ class FastSearchPopup(wx.Frame):
         for win in disableSet:
             win.Disable()
         try:
-            self.foundPages = self.mainControl.getWikiDocument().searchWiki(
-                    self.sarOp, threadstop=threadstop)
-            self.mainControl.getCollator().sort(self.foundPages)
-            self.resultBox.showFound(self.sarOp, self.foundPages,
-                    self.mainControl.getWikiDocument(),
-                    threadstop=threadstop)
+            if self.sarOp.indexSearch == "no":
+                self.foundPages = self.resultBox.searchAndShowFound(
+                        self.sarOp, self.mainControl.getWikiDocument(),
+                        False, threadstop=threadstop)
+            else:
+                self.foundPages = self.mainControl.getWikiDocument().searchWiki(
+                        self.sarOp, threadstop=threadstop)
+                self.mainControl.getCollator().sort(self.foundPages)
+                self.resultBox.showFound(self.sarOp, self.foundPages,
+                        self.mainControl.getWikiDocument(),
+                        threadstop=threadstop)
 
             self.listNeedsRefresh = False
 
@@ -1,4 +1,7 @@
+from __future__ import with_statement
+
 import traceback
+from collections import OrderedDict
 
 import wx, wx.xrc
 
@@ -6,9 +9,11 @@ from WikiExceptions import *
 
 # from wxHelper import *
 
+import Consts
+
 from . import MiscEvent
 
-from .Utilities import DUMBTHREADSTOP
+from .Utilities import DUMBTHREADSTOP, TimeoutRLock
 
 from .wxHelper import GUI_ID, XrcControls, autosizeColumn, wxKeyFunctionSink
 
@@ -32,7 +37,8 @@ except (AttributeError, ImportError, WindowsError):
 
 from DocPages import AliasWikiPage, WikiPage
 
-from StringOps import uniToGui, guiToUni
+from StringOps import uniToGui, guiToUni, findLineStart, findLineEnd, \
+        getCommonPrefixLength, getCommonSuffixLength
 
 
 
@@ -334,7 +340,61 @@ class SpellCheckerDialog(wx.Dialog):
 
 
 
+class SpellCheckVerdictCache(object):
+    """
+    Bounded LRU cache of the spell check verdicts for words (key is tuple
+    (dictionary language, word), value is True iff word is correct).
+    It is shared by a SpellCheckerSession and all its clones.
+
+    clear() starts a new generation. A verdict computed before the clear()
+    is not stored by put() so a thread can't bring back an outdated verdict.
+    """
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.cacheLock = TimeoutRLock(Consts.DEADBLOCKTIMEOUT)
+        self.verdicts = OrderedDict()   # {(language, word): verdict}, oldest first
+        self.generation = 0
+
+
+    def getGeneration(self):
+        return self.generation
+
+
+    def get(self, key):
+        """
+        Return verdict for key or None if not cached.
+        """
+        with self.cacheLock:
+            verdict = self.verdicts.pop(key, None)
+            if verdict is not None:
+                self.verdicts[key] = verdict
+
+            return verdict
+
+
+    def put(self, key, verdict, generation):
+        with self.cacheLock:
+            if generation != self.generation or self.maxSize <= 0:
+                return
+
+            self.verdicts.pop(key, None)
+            self.verdicts[key] = verdict
+
+            while len(self.verdicts) > self.maxSize:
+                self.verdicts.popitem(last=False)
+
+
+    def clear(self):
+        with self.cacheLock:
+            self.verdicts.clear()
+            self.generation += 1
+
+
+
 class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
+    # Maximum number of word verdicts to cache
+    VERDICT_CACHE_SIZE = 50000
+
     def __init__(self, wikiDocument):
         MiscEvent.MiscEventSourceMixin.__init__(self)
 
@@ -343,7 +403,11 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
 
         self.enchantDict = None
         self.dictLanguage = None
-        
+
+        # Cache of checkWord() results, cleared together with firing
+        # "modified spell checker session"
+        self.verdictCache = SpellCheckVerdictCache(self.VERDICT_CACHE_SIZE)
+
         # For current session
         self.autoReplaceWords = {}
         self.spellChkIgnore = set()  # set of words to ignore during spell checking
@@ -398,6 +462,7 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
         # For current session
         result.autoReplaceWords = self.autoReplaceWords
         result.spellChkIgnore = self.spellChkIgnore
+        result.verdictCache = self.verdictCache
 
         result.dictLanguage = self.dictLanguage
         result.enchantDict = self.enchantDict  # Thread safety???  Dict(self.dictLanguage)
@@ -451,6 +516,7 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
 
     def onRereadPersonalWordlistNeeded(self, miscevt):
         self.rereadPersonalWordLists()
+        self.verdictCache.clear()
         self.fireMiscEventKeys(("modified spell checker session",))
 
     def rereadPersonalWordLists(self):
@@ -492,11 +558,21 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
 
 
     def checkWord(self, spWord):
-        return spWord in self.spellChkIgnore or \
+        key = (self.dictLanguage, spWord)
+        verdict = self.verdictCache.get(key)
+        if verdict is not None:
+            return verdict
+
+        generation = self.verdictCache.getGeneration()
+
+        verdict = spWord in self.spellChkIgnore or \
                 spWord in self.spellChkAddedGlobal or \
                 spWord in self.spellChkAddedLocal or \
                 (self.enchantDict is not None and \
-                self.enchantDict.check(spWord))
+                bool(self.enchantDict.check(spWord)))
+
+        self.verdictCache.put(key, verdict, generation)
+        return verdict
 
     def suggest(self, spWord):
         if self.enchantDict is None:
@@ -516,6 +592,7 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
         Clear the list of words to ignore for this session.
         """
         self.spellChkIgnore.clear()
+        self.verdictCache.clear()
         self.fireMiscEventKeys(("modified spell checker session",))
 
 
@@ -526,6 +603,7 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
         # and sends another event that session was modified.
         # For the session ignore list this must be done here explicitly
 
+        self.verdictCache.clear()
         self.fireMiscEventKeys(("modified spell checker session",))
 
 
@@ -536,6 +614,7 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
         if self.spellChkAddedGlobal is None:
             return  # TODO When does this happen?
         self.spellChkAddedGlobal.add(spWord)
+        self.verdictCache.clear()
         words = list(self.spellChkAddedGlobal)
         self.wikiDocument.getCollator().sort(words)
         self.globalPwlPage.replaceLiveText(u"\n".join(words))
@@ -548,12 +627,26 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
         if self.spellChkAddedLocal is None:
             return  # TODO When does this happen?
         self.spellChkAddedLocal.add(spWord)
+        self.verdictCache.clear()
         words = list(self.spellChkAddedLocal)
         self.wikiDocument.getCollator().sort(words)
         self.localPwlPage.replaceLiveText(u"\n".join(words))
 
 
-    def buildUnknownWordList(self, text, threadstop=DUMBTHREADSTOP):
+    def buildUnknownWordList(self, text, threadstop=DUMBTHREADSTOP,
+            reuseText=None, reuseUnknownWords=None):
+        """
+        Return unknown words of text as "unknownSpellList" syntax node
+        with WikiPyparsing.TerminalNode children.
+
+        reuseText, reuseUnknownWords: Previous text of the page and its
+            unknown word list built by this function with the same
+            dictionary. If given, only the lines around the changed part of
+            text are checked again, the unknown words outside of them
+            are taken from reuseUnknownWords.
+            This relies on words found by the language helper never
+            containing a newline.
+        """
         if not self.hasEnchantDict():
             return buildSyntaxNode([], -1, "unknownSpellList")
         
@@ -562,12 +655,32 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
         if docPage is None:
             return buildSyntaxNode([], -1, "unknownSpellList")
         
-        result = []
-
         langHelper = wx.GetApp().createWikiLanguageHelper(
                 docPage.getWikiLanguageName())
 
         startPos = 0
+        stopPos = len(text)
+        result = []
+        tail = []
+
+        if reuseText is not None and reuseUnknownWords is not None:
+            if text == reuseText:
+                return reuseUnknownWords
+
+            prefixLen = getCommonPrefixLength(reuseText, text)
+            suffixLen = getCommonSuffixLength(reuseText, text,
+                    min(len(reuseText), len(text)) - prefixLen)
+
+            startPos = findLineStart(text, prefixLen)
+            stopPos = findLineEnd(text, len(text) - suffixLen)
+            delta = len(text) - len(reuseText)
+
+            for node in reuseUnknownWords.getChildren():
+                if node.pos + node.strLength <= startPos:
+                    result.append(node)
+                elif node.pos >= stopPos - delta:
+                    tail.append(buildSyntaxNode(node.getText(),
+                            node.pos + delta, "unknownSpelling"))
 
         while True:
             threadstop.testValidThread()
@@ -576,9 +689,9 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
                     startPos, docPage)
             
 
-            if start is None:
-                # End of page reached
-                return buildSyntaxNode(result, -1, "unknownSpellList")
+            if start is None or start >= stopPos:
+                # End of page or of changed part reached
+                return buildSyntaxNode(result + tail, -1, "unknownSpellList")
 
             startPos = end
 
@@ -591,7 +704,7 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
             # It is added as a WikiPyparsing.TerminalNode
             
             result.append(buildSyntaxNode(spWord, start, "unknownSpelling"))
-            
+
 
 
 def isSpellCheckSupported():
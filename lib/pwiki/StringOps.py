@@ -9,7 +9,8 @@ import os, traceback
 
 from struct import pack, unpack
 
-import difflib, codecs, os.path, random, base64, locale, hashlib, tempfile, math
+import difflib, codecs, os.path, random, base64, locale, hashlib, tempfile, math, \
+        bisect
 
 # import urllib_red as urllib
 import urllib, urlparse, cgi
@@ -453,8 +454,15 @@ def getFileSignatureBlock(filename, timeCoarsening=None):
     (e.g. NTFS uses 100ns, FAT uses 2s for mod. time) the file would be seen as
     dirty and cache data would be rebuild without need without coarsening.
     """
-    statinfo = os.stat(pathEnc(filename))
-    
+    return getFileSignatureBlockFromStat(os.stat(pathEnc(filename)),
+            timeCoarsening)
+
+
+def getFileSignatureBlockFromStat(statinfo, timeCoarsening=None):
+    """
+    Same as getFileSignatureBlock() but takes the already retrieved
+    os.stat() result of the file.
+    """
     if timeCoarsening is None or timeCoarsening <= 0:
         return pack(">BQd", 0, statinfo.st_size, statinfo.st_mtime)
     
@@ -529,8 +537,38 @@ def findLineEnd(text, pos):
         return len(text)
     else:
         return result
-    
-    
+
+
+def getCommonPrefixLength(a, b):
+    # Binary search comparing slices is much faster than a loop
+    # over the characters
+    lo = 0
+    hi = min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
+
+
+def getCommonSuffixLength(a, b, maxLength):
+    lo = 0
+    hi = maxLength
+    lenA = len(a)
+    lenB = len(b)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lenA - mid:lenA - lo] == b[lenB - mid:lenB - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
+
+
 
 LASTWORDSTART_RE = _re.compile(r"(?:.*\W)?()\w", _re.UNICODE)
 FIRSTWORDEND_RE = _re.compile(r".*?()(?:\W|(?!.))", _re.UNICODE)
@@ -1947,15 +1985,242 @@ def applyBinCompact(a, bops):
     return applyCompact(a, binCompactToCompact(bops))
 
 
-def getBinCompactForDiff(a, b):
+def getDifflibOpcodes(a, b):
+    """
+    Diff engine comparing a and b byte by byte with difflib. Gives
+    the smallest diffs but needs quadratic time in the worst case.
+    """
+    return difflib.SequenceMatcher(None, a, b).get_opcodes()
+
+
+# Strings (or changed regions) up to this size are compared byte by byte
+# by the "linehash" engine
+_LINEHASH_BYTEDIFF_LIMIT = 4096
+
+# Changed regions without unique lines up to this number of lines are
+# compared line by line with difflib
+_LINEHASH_LINEDIFF_LIMIT = 400
+
+# Lines occurring more often in a changed region without unique lines
+# are not used as anchors by the "linehash" engine
+_LINEHASH_MAX_OCCURRENCES = 64
+
+
+def _findLineHashCommonRegion(la, alo, ahi, lb, blo, bhi):
+    """
+    Find a common region of lines la[alo:ahi] and lb[blo:bhi] for a range
+    without unique lines (histogram diff): Regions are grown around the
+    lines which are rare in la, the longest one wins, on equal length the
+    one around the rarer line.
+    Returns tuple (i, j, size) or None if no usable region exists.
+    """
+    aOccurrences = {}
+    for i in xrange(alo, ahi):
+        aOccurrences.setdefault(la[i], []).append(i)
+
+    best = None
+    bestCount = 0
+    j = blo
+    while j < bhi:
+        nextJ = j + 1
+        occurrences = aOccurrences.get(lb[j])
+
+        if occurrences is not None and \
+                len(occurrences) <= _LINEHASH_MAX_OCCURRENCES:
+            count = len(occurrences)
+            for i in occurrences:
+                # Grow region in both directions
+                si = i
+                sj = j
+                while si > alo and sj > blo and la[si - 1] == lb[sj - 1]:
+                    si -= 1
+                    sj -= 1
+
+                ei = i + 1
+                ej = j + 1
+                while ei < ahi and ej < bhi and la[ei] == lb[ej]:
+                    ei += 1
+                    ej += 1
+
+                size = ei - si
+                if best is None or size > best[2] or \
+                        (size == best[2] and count < bestCount):
+                    best = (si, sj, size)
+                    bestCount = count
+
+                # Lines inside this region can't start a longer one
+                nextJ = max(nextJ, ej)
+
+        j = nextJ
+
+    return best
+
+
+def _getLineHashLineOpcodes(la, lb):
+    """
+    Return list of non-equal opcodes (as difflib) to change list of lines la
+    to lb using patience diff: Lines occurring exactly once in both
+    sequences are matched, the longest increasing run of them is taken
+    as anchors and the regions between the anchors are processed the same
+    way. Regions without such lines are split at the longest common run
+    around rare lines (see _findLineHashCommonRegion()).
+    """
+    result = []
+    # Ranges to process, last one is processed first
+    stack = [(0, len(la), 0, len(lb))]
+
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+
+        # Strip common prefix and suffix
+        while alo < ahi and blo < bhi and la[alo] == lb[blo]:
+            alo += 1
+            blo += 1
+
+        while alo < ahi and blo < bhi and la[ahi - 1] == lb[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+
+        if alo == ahi:
+            if blo < bhi:
+                result.append(("insert", alo, ahi, blo, bhi))
+            continue
+
+        if blo == bhi:
+            result.append(("delete", alo, ahi, blo, bhi))
+            continue
+
+        # Find lines unique in both ranges
+        aCount = {}
+        for i in xrange(alo, ahi):
+            line = la[i]
+            aCount[line] = -1 if line in aCount else i
+
+        bCount = {}
+        for j in xrange(blo, bhi):
+            line = lb[j]
+            if aCount.get(line, -1) != -1:
+                bCount[line] = -1 if line in bCount else j
+
+        matches = [(aCount[bLine], j) for bLine, j in bCount.iteritems()
+                if j != -1]
+
+        if not matches:
+            # No unique lines, e.g. for repeated content. Split the range
+            # at the longest region around rare lines instead
+            region = _findLineHashCommonRegion(la, alo, ahi, lb, blo, bhi)
+            if region is not None:
+                i, j, size = region
+                stack.append((i + size, ahi, j + size, bhi))
+                stack.append((alo, i, blo, j))
+                continue
+
+            if (ahi - alo) + (bhi - blo) <= _LINEHASH_LINEDIFF_LIMIT:
+                sm = difflib.SequenceMatcher(None, la[alo:ahi], lb[blo:bhi],
+                        autojunk=False)
+                for tag, i1, i2, j1, j2 in sm.get_opcodes():
+                    if tag != "equal":
+                        result.append((tag, alo + i1, alo + i2, blo + j1,
+                                blo + j2))
+            else:
+                result.append(("replace", alo, ahi, blo, bhi))
+            continue
+
+        # Longest increasing subsequence of b indices ordered by a index
+        matches.sort()
+        tails = []   # b index of smallest tail of run of length n + 1
+        tailIdx = []   # Index into matches of these tails
+        prevIdx = [None] * len(matches)
+        for k, (i, j) in enumerate(matches):
+            pos = bisect.bisect_left(tails, j)
+            if pos > 0:
+                prevIdx[k] = tailIdx[pos - 1]
+            if pos == len(tails):
+                tails.append(j)
+                tailIdx.append(k)
+            else:
+                tails[pos] = j
+                tailIdx[pos] = k
+
+        anchors = []
+        k = tailIdx[-1]
+        while k is not None:
+            anchors.append(matches[k])
+            k = prevIdx[k]
+
+        # anchors are now in descending order so the stack processes the
+        # regions between them in ascending order
+        nextA = ahi
+        nextB = bhi
+        for i, j in anchors:
+            stack.append((i + 1, nextA, j + 1, nextB))
+            nextA = i
+            nextB = j
+
+        stack.append((alo, nextA, blo, nextB))
+
+    return result
+
+
+def getLineHashOpcodes(a, b):
+    """
+    Diff engine matching lines of a and b by hash (patience diff), with
+    linear expected time. Changed regions are refined byte by byte
+    if they are small.
+    """
+    if len(a) <= _LINEHASH_BYTEDIFF_LIMIT and len(b) <= _LINEHASH_BYTEDIFF_LIMIT:
+        return getDifflibOpcodes(a, b)
+
+    la = a.splitlines(True)
+    lb = b.splitlines(True)
+
+    aOffsets = [0]
+    for line in la:
+        aOffsets.append(aOffsets[-1] + len(line))
+
+    bOffsets = [0]
+    for line in lb:
+        bOffsets.append(bOffsets[-1] + len(line))
+
+    result = []
+    for tag, i1, i2, j1, j2 in _getLineHashLineOpcodes(la, lb):
+        i1 = aOffsets[i1]
+        i2 = aOffsets[i2]
+        j1 = bOffsets[j1]
+        j2 = bOffsets[j2]
+
+        if tag == "replace" and i2 - i1 <= _LINEHASH_BYTEDIFF_LIMIT and \
+                j2 - j1 <= _LINEHASH_BYTEDIFF_LIMIT:
+            for rtag, ri1, ri2, rj1, rj2 in getDifflibOpcodes(a[i1:i2],
+                    b[j1:j2]):
+                result.append((rtag, i1 + ri1, i1 + ri2, j1 + rj1, j1 + rj2))
+        else:
+            result.append((tag, i1, i2, j1, j2))
+
+    return result
+
+
+# Diff engines by name. Each is a function taking byte strings a and b and
+# returning a sequence of opcodes as difflib.SequenceMatcher.get_opcodes()
+# (but "equal" opcodes may be missing). Any engine creates binary compact
+# codes which can be read by applyBinCompact().
+DIFF_ENGINES = {
+        "difflib": getDifflibOpcodes,
+        "linehash": getLineHashOpcodes
+    }
+
+DEFAULT_DIFF_ENGINE = "linehash"
+
+
+def getBinCompactForDiff(a, b, engine=DEFAULT_DIFF_ENGINE):
     """
     Return the binary compact codes to change binary string a to b.
     For strings a and b (NOT unicode) it is always true that
         applyBinCompact(a, getBinCompactForDiff(a, b)) == b
-    """
 
-    sm = difflib.SequenceMatcher(None, a, b)
-    ops = sm.get_opcodes()
+    engine -- name of diff engine in DIFF_ENGINES
+    """
+    ops = DIFF_ENGINES[engine](a, b)
     return compactToBinCompact(difflibToCompact(ops, b))
 
 
@@ -376,9 +376,10 @@ class SingleThreadExecutor(BasicThreadStop, MiscEvent.MiscEventSourceMixin):
     __call__ = execute
 
 
-    def end(self, hardEnd=False):
+    def end(self, hardEnd=False, timeout=120):
         """
-        Wait (up to 120 seconds) to end the running jobs.
+        Wait (up to  timeout  seconds, None waits without limit) to end the
+        running jobs.
         
         If hardEnd is False, all jobs in the queue are processed yet.
         Even new jobs can be added during this time because
@@ -400,7 +401,7 @@ class SingleThreadExecutor(BasicThreadStop, MiscEvent.MiscEventSourceMixin):
                         False))
             self.dequeCondition.notify()
 
-        self.thread.join(120)  # TODO: Replace by constant
+        self.thread.join(timeout)
 
         if self.thread.isAlive():
             raise DeadBlockPreventionTimeOutError()
@@ -483,6 +484,17 @@ def callInMainThreadAsync(fct, *args, **kwargs):
 
 
 
+def callAfter(fct, *args, **kwargs):
+    """
+    Like wx.CallAfter(), but calls fct directly if no main loop is running
+    (e.g. at shutdown or in headless batch mode where wx.CallAfter()
+    wouldn't work).
+    """
+    if not wx.GetApp().IsMainLoopRunning():
+        return fct(*args, **kwargs)
+
+    wx.CallAfter(fct, *args, **kwargs)
+
 
 
 def TimeoutRLock(*args, **kwargs):
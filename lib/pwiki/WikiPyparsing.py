@@ -329,12 +329,34 @@ def getTokenLength(tokList):
 
 
 class SyntaxNode(object):
-    __slots__ = ("pos", "strLength", "name", "__dict__", "__weakref__")
+    """
+    Base of AST nodes. Large pages produce many nodes, therefore the common
+    fields are slots. The few other attributes set by parse actions
+    (e.g. "wikiWord", "titleNode", "level") go to the instance dictionary
+    which Python only allocates when the first of them is set, so it acts
+    as a side table. Read it through getExtraAttributes() which doesn't
+    leave an empty dictionary behind.
+    """
+    __slots__ = ("pos", "name", "__dict__", "__weakref__")
     def __init__(self, pos, name):
         self.name = name
         self.pos = pos
 
 
+    def getExtraAttributes(self):
+        """
+        Return dictionary of the attributes which are not slots (may be
+        empty).
+        """
+        extraAttrs = self.__dict__
+        if not extraAttrs:
+            # Accessing __dict__ created it, release it again
+            del self.__dict__
+
+        return extraAttrs
+
+
+
     def isTerminal(self):
         raise NotImplementedError  # abstract
 
@@ -359,8 +381,25 @@ class SyntaxNode(object):
     def findNodesForCharPos(self, charPos):
         raise NotImplementedError  # abstract
 
-#     def cloneDeep(self):
-#         raise NotImplementedError  # abstract
+    def cloneDeep(self, posDelta=0):
+        """
+        Return deep copy of this node with positions of node and all subnodes
+        moved by posDelta. Attributes referencing subnodes (e.g. "titleNode")
+        reference the respective copies in the result.
+        """
+        clones = {}
+        result = self._cloneDeepRecurs(posDelta, clones)
+
+        for clone in clones.itervalues():
+            extraAttrs = clone.getExtraAttributes()
+            if extraAttrs:
+                extraAttrs.update([(key, _remapClonedNodes(value, clones))
+                        for key, value in extraAttrs.iteritems()])
+
+        return result
+
+    def _cloneDeepRecurs(self, posDelta, clones):
+        raise NotImplementedError  # abstract
 
 
     @staticmethod
@@ -388,7 +427,7 @@ class SyntaxNode(object):
 
 
 class NonTerminalNode(SyntaxNode):
-    __slots__ = ("sub",)
+    __slots__ = ("sub", "_calcedStrLength")
 
     def __init__(self, sub, pos, name):
         super(NonTerminalNode, self).__init__(pos, name)
@@ -398,8 +437,9 @@ class NonTerminalNode(SyntaxNode):
 
 
     def __repr__(self):
-        if self.__dict__:
-            return "NonTerminalNode" + repr((self.pos, self.strLength, self.name, self.sub, self.__dict__))
+        extraAttrs = self.getExtraAttributes()
+        if extraAttrs:
+            return "NonTerminalNode" + repr((self.pos, self.strLength, self.name, self.sub, extraAttrs))
         else:
             return "NonTerminalNode" + repr((self.pos, self.strLength, self.name, self.sub))
 
@@ -432,6 +472,17 @@ class NonTerminalNode(SyntaxNode):
     def getString(self):
         return "".join([sn.getString() for sn in self.sub])
 
+    def __getstate__(self):
+        # Used when pickling (e.g. AST from a parse worker)
+        return (self.pos, self.name, self.sub,
+                self.getExtraAttributes() or None)
+
+    def __setstate__(self, state):
+        self.pos, self.name, self.sub, extraAttrs = state
+        self._calcedStrLength = -1
+        if extraAttrs:
+            self.__dict__.update(extraAttrs)
+
     @property
     def strLength(self):
         if self._calcedStrLength == -1:
@@ -639,18 +690,22 @@ class NonTerminalNode(SyntaxNode):
         
 
 
-#     def cloneDeep(self):
-#         ret = NonTerminalNode(self.sub, self.pos, self.name)
-#         ret.sub = [n.cloneDeep() for n in self.sub]
-#         ret.__dict__ = self.__dict__.copy()
-# 
-#         return ret
+    def _cloneDeepRecurs(self, posDelta, clones):
+        ret = NonTerminalNode([n._cloneDeepRecurs(posDelta, clones)
+                for n in self.sub], self.pos + posDelta, self.name)
+        extraAttrs = self.getExtraAttributes()
+        if extraAttrs:
+            ret.__dict__.update(extraAttrs)
+        clones[id(self)] = ret
+
+        return ret
 
 
     def _pprintRecurs(self, ind, inc, result):
-        if self.__dict__:
+        extraAttrs = self.getExtraAttributes()
+        if extraAttrs:
             result.append(" " * ind + "NtNode(%s, %s, %s, %s, " %
-                    (self.pos, self.strLength, repr(self.name), repr(self.__dict__)))
+                    (self.pos, self.strLength, repr(self.name), repr(extraAttrs)))
         else:
             result.append(" " * ind + "NtNode(%s, %s, %s, " %
                     (self.pos, self.strLength, repr(self.name)))
@@ -713,7 +768,7 @@ class NonTerminalNode(SyntaxNode):
 
 
 class TerminalNode(SyntaxNode):
-    __slots__ = ("text",)
+    __slots__ = ("strLength", "text")
 
     def __init__(self, text, pos, name):
         super(TerminalNode, self).__init__(pos, name)
@@ -723,8 +778,9 @@ class TerminalNode(SyntaxNode):
 
 
     def __repr__(self):
-        if self.__dict__:
-            return "TerminalNode" + repr((self.pos, self.strLength, self.name, self.text, self.__dict__))
+        extraAttrs = self.getExtraAttributes()
+        if extraAttrs:
+            return "TerminalNode" + repr((self.pos, self.strLength, self.name, self.text, extraAttrs))
         else:
             return "TerminalNode" + repr((self.pos, self.strLength, self.name, self.text))
 
@@ -764,22 +820,37 @@ class TerminalNode(SyntaxNode):
 
 
     def _pprintRecurs(self, ind, inc, result):
-        if self.__dict__:
+        extraAttrs = self.getExtraAttributes()
+        if extraAttrs:
             result.append(" " * ind + "TNode(%s, %s, %s, %s, " %
-                    (self.pos, self.strLength, repr(self.name), repr(self.__dict__)))
+                    (self.pos, self.strLength, repr(self.name), repr(extraAttrs)))
         else:
             result.append(" " * ind + "TNode(%s, %s, %s, " %
                     (self.pos, self.strLength, repr(self.name)))
         result.append("%s)" % repr(self.text))
 
-#     def cloneDeep(self):
-#         ret = TerminalNode(self.text, self.pos, self.name)
-#         ret.__dict__ = self.__dict__.copy()
-# 
-#         return ret
+    def _cloneDeepRecurs(self, posDelta, clones):
+        ret = TerminalNode(self.text, self.pos + posDelta, self.name)
+        extraAttrs = self.getExtraAttributes()
+        if extraAttrs:
+            ret.__dict__.update(extraAttrs)
+        clones[id(self)] = ret
+
+        return ret
 
 
 
+    def __getstate__(self):
+        # Used when pickling (e.g. AST from a parse worker)
+        return (self.pos, self.name, self.text,
+                self.getExtraAttributes() or None)
+
+    def __setstate__(self, state):
+        self.pos, self.name, self.text, extraAttrs = state
+        self.strLength = len(self.text)
+        if extraAttrs:
+            self.__dict__.update(extraAttrs)
+
     def copy(self):
         return TerminalNode(self.text, self.pos, self.name)
 
@@ -800,12 +871,27 @@ class ParsingState(object):
         else:
             self.threadstop = threadstop
         self.fullText = fullText
-        self.revText = u"".join(reversed(fullText))
+        self.revText = fullText[::-1]
         self.debugIndent = 0
 
 
 
 
+def _remapClonedNodes(value, clones):
+    """
+    Helper for SyntaxNode.cloneDeep(). Replace nodes in attribute value
+    (may also be a list or tuple) by their copies.
+    """
+    if isinstance(value, SyntaxNode):
+        return clones.get(id(value), value)
+    elif isinstance(value, list):
+        return [_remapClonedNodes(v, clones) for v in value]
+    elif isinstance(value, tuple):
+        return tuple([_remapClonedNodes(v, clones) for v in value])
+    else:
+        return value
+
+
 def buildSyntaxNode(sub, pos=-1, name=None):
     if isinstance(sub, basestring):   # sub.__class__ is unicode:
         return TerminalNode(sub, pos, name)
@@ -64,6 +64,162 @@ class NodeStyle(object):
 _SETTABLE_ATTRS = (u"bold", u"icon", u"color", u"bgcolor")
 
 
+class NodeStyleResolver(object):
+    """
+    Resolves the presentation attributes (see _SETTABLE_ATTRS) of a wiki word
+    node from its page attributes and the global attributes
+    "global.<key>.<value>.<attr>" and "global.<key>.<attr>".
+    
+    The global attributes are compiled into a trie of attribute paths
+    (the key and value split at the dots), so a page attribute needs
+    one walk down the trie instead of probing a string for each value and
+    each prefix of the key. Results are memoized by the page attributes
+    which can match anything.
+    The trie is rebuilt when the wiki returns changed global attributes.
+    """
+    __slots__ = ("__weakref__", "state")
+
+    _MEMO_MAX_SIZE = 5000
+
+    def __init__(self):
+        # Tuple (global attributes, trie, memo), replaced as a whole
+        # so that concurrent readers see a consistent state
+        self.state = (None, {}, {})
+
+
+    @staticmethod
+    def _compile(globalAttrs):
+        """
+        Build the trie {path component: (children trie, {attr: value})}
+        from global attributes.
+        """
+        trie = {}
+        for gKey, value in globalAttrs.iteritems():
+            path = gKey.split(u".")[1:]  # Remove "global"
+            if len(path) < 2 or path[-1] not in _SETTABLE_ATTRS:
+                continue
+
+            children = trie
+            for comp in path[:-1]:
+                node = children.get(comp)
+                if node is None:
+                    node = ({}, {})
+                    children[comp] = node
+                children = node[0]
+
+            node[1][path[-1]] = value
+
+        return trie
+
+
+    def _getState(self, globalAttrs):
+        state = self.state
+        if state[0] is not globalAttrs:
+            # Wiki rebuilt its global attributes, recompile only if they
+            # really changed
+            if state[0] != globalAttrs:
+                state = (globalAttrs, self._compile(globalAttrs), {})
+            else:
+                state = (globalAttrs, state[1], state[2])
+            self.state = state
+
+        return state
+
+
+    def resolve(self, globalAttrs, attrsItems):
+        """
+        Return tuple of resolved values (or None) in the order of
+        _SETTABLE_ATTRS.
+        globalAttrs -- dictionary as returned by WikiData.getGlobalAttributes()
+        attrsItems -- sequence of tuples (key, list of values) of page
+            attributes. The order matters if global attributes of same
+            specificity match different keys.
+        """
+        dummy, trie, memo = self._getState(globalAttrs)
+
+        # Only keys which are presentation attributes themselves or start
+        # a path in the trie can influence the result
+        relevantItems = tuple((key, tuple(values)) for key, values in attrsItems
+                if key in _SETTABLE_ATTRS or key.split(u".", 1)[0] in trie)
+
+        result = memo.get(relevantItems)
+        if result is None:
+            result = tuple(self._resolveAttr(trie, relevantItems, p)
+                    for p in _SETTABLE_ATTRS)
+            if len(memo) >= self._MEMO_MAX_SIZE:
+                memo.clear()
+            memo[relevantItems] = result
+
+        return result
+
+
+    @staticmethod
+    def _resolveAttr(trie, attrsItems, p):
+        """
+        Resolve single presentation attribute p.
+        """
+        # Check per page attrs first
+        for key, values in attrsItems:
+            if key == p:
+                return values[-1]
+
+        # Check attrs on page against global presentation attrs.
+        # The dots in the key matter. The more dots the more specific
+        # is the global prop and wins over less specific attrs
+        gPropVal = None
+        dots = -1
+
+        for key, values in attrsItems:
+            comps = key.split(u".")
+            newDots = len(comps) # key dots plus one for value
+            if newDots <= dots:
+                continue
+
+            # Walk down the trie along the key, keep nodes of all prefixes
+            prefixNodes = []
+            children = trie
+            for comp in comps:
+                node = children.get(comp)
+                if node is None:
+                    break
+                prefixNodes.append(node)
+                children = node[0]
+
+            newGPropVal = None
+            if len(prefixNodes) == len(comps):
+                # global.<key>.<value>.<p>
+                for val in values:
+                    node = prefixNodes[-1]
+                    for comp in val.split(u"."):
+                        node = node[0].get(comp)
+                        if node is None:
+                            break
+                    else:
+                        newGPropVal = node[1].get(p)
+                        if newGPropVal is not None:
+                            gPropVal = newGPropVal
+                            dots = newDots
+                            break
+
+            # global.<key>.<p> for key and its prefixes, newDots is the
+            # number of dots in the probed prefix
+            newDots -= 1
+            while newDots > dots:
+                if newDots < len(prefixNodes):
+                    newGPropVal = prefixNodes[newDots][1].get(p)
+                    if newGPropVal is not None:
+                        break
+                if newDots == 0:
+                    break
+                newDots -= 1
+
+            if newGPropVal is not None:
+                gPropVal = newGPropVal
+                dots = newDots
+
+        return gPropVal
+
+
 # New style class to allow __slots__ for efficiency
 class AbstractNode(object):
     """
@@ -197,7 +353,8 @@ class WikiWordNode(AbstractNode):
     """
     Represents a wiki word
     """
-    __slots__ = ("wikiWord", "flagChildren", "flagRoot", "ancestors", "newLabel")
+    __slots__ = ("wikiWord", "flagChildren", "flagRoot", "ancestors", "newLabel",
+            "treeNodeData")
 
     def __init__(self, tree, parentNode, wikiWord):
         AbstractNode.__init__(self, tree, parentNode)
@@ -206,6 +363,9 @@ class WikiWordNode(AbstractNode):
 
         self.flagRoot = False
         self.ancestors = None
+
+        # Tuple (children, attrs) prefetched by listChildren() of parent
+        self.treeNodeData = None
         
         # Calculate label
         self.newLabel = self.wikiWord
@@ -269,25 +429,40 @@ class WikiWordNode(AbstractNode):
 #         return relations
 
 
-    def _hasValidChildren(self, wikiPage):  # TODO More efficient
+    def _getTreeNodeData(self):
         """
-        Check if represented word has valid children, filter out undefined
-        and/or cycles if options are set accordingly
+        Return tuple (children, attrs) for this node as described in
+        WikiDataManager.getTreeNodeDataForWords(). Data prefetched by the
+        parent node is used only once, later refreshes retrieve current data.
         """
-        if self.treeCtrl.pWiki.getConfig().getboolean("main", "tree_no_cycles"):
-            # Filter out cycles
-            ancestors = self.getAncestors().union((self.getWikiWord(),))
-        else:
-            ancestors = frozenset()  # Empty
+        treeNodeData = self.treeNodeData
+        if treeNodeData is not None:
+            self.treeNodeData = None
+            return treeNodeData
 
-        relations = wikiPage.getChildRelationships(
-                existingonly=self.treeCtrl.getHideUndefined(),
-                selfreference=False, withFields=())
+        return self.treeCtrl.pWiki.getWikiDocument().getTreeNodeDataForWords(
+                (self.wikiWord,), existingonly=self.treeCtrl.getHideUndefined())[
+                self.wikiWord]
+
+
+    def _hasValidChildren(self, children):
+        """
+        Check if represented word has valid children, filter out cycles
+        if option is set accordingly.
+        children -- list of child relations (already without undefined words
+            if they should be hidden)
+        """
+        if not children:
+            return False
 
-        if len(relations) > len(ancestors):
+        if not self.treeCtrl.pWiki.getConfig().getboolean("main",
+                "tree_no_cycles"):
             return True
-            
-        for r in relations:
+
+        # Filter out cycles
+        ancestors = self.getAncestors().union((self.getWikiWord(),))
+
+        for r in children:
             if r not in ancestors:
                 return True
                 
@@ -300,9 +475,7 @@ class WikiWordNode(AbstractNode):
         """
         assert isinstance(baselabel, unicode)
 
-        wikiDataManager = self.treeCtrl.pWiki.getWikiDocument()
-        wikiData = wikiDataManager.getWikiData()
-        wikiPage = wikiDataManager.getWikiPageNoError(self.wikiWord)
+        children, attrs = self._getTreeNodeData()
 
         style = NodeStyle()
         
@@ -312,10 +485,7 @@ class WikiWordNode(AbstractNode):
         if self.flagRoot:
             style.hasChildren = True # Has at least Views
         else:
-            style.hasChildren = fast or self._hasValidChildren(wikiPage)
-
-        # apply custom attributes to nodes
-        wikiPage = wikiPage.getNonAliasPage() # Ensure we don't have an alias
+            style.hasChildren = fast or self._hasValidChildren(children)
 
         # if this is the scratch pad set the icon and return
         if (self.wikiWord == "ScratchPad"):
@@ -325,8 +495,6 @@ class WikiWordNode(AbstractNode):
 
         # fetch the global attributes
         globalAttrs = self.treeCtrl.pWiki.getWikiData().getGlobalAttributes() # TODO More elegant
-        # get the wikiPage attributes
-        attrs = wikiPage.getAttributes()
 
         # priority
         priority = attrs.get("priority", (None,))[-1]
@@ -346,60 +514,12 @@ class WikiWordNode(AbstractNode):
                 except ValueError:
                     pass
 
-        attrsItems = attrs.items()
-
         # apply the global attrs based on the attrs of this node
-        for p in _SETTABLE_ATTRS:
-            # Check per page attrs first
-            if attrs.has_key(p):
-                setattr(style, p, attrs[p][-1])
-                continue
-
-            # Check attrs on page against global presentation attrs.
-            # The dots in the key matter. The more dots the more specific
-            # is the global prop and wins over less specific attrs
-
-#             newGPropVal = globalAttrs.get(u"global.%s" % p)
-#             if newGPropVal is not None:
-#                 gPropVal = newGPropVal
-#                 dots = 0
-#             else:
-
-            gPropVal = None
-            dots = -1
-
-            for (key, values) in attrsItems:
-                newGPropVal = None
-                newDots = key.count(u".") + 1 # key dots plus one for value
-                if newDots > dots:
-                    for val in values:
-                        newGPropVal = globalAttrs.get(u"global.%s.%s.%s" % (key, val, p))
-                        if newGPropVal is not None:
-                            gPropVal = newGPropVal
-                            dots = newDots
-                            break
-
-                    newDots -= 1
-                    while newDots > dots:
-                        newGPropVal = globalAttrs.get(u"global.%s.%s" % (key, p))
-                        if newGPropVal is not None:
-                            break
-    
-                        dotpos = key.rfind(u".")
-                        if dotpos == -1:
-                            break
-                        key = key[:dotpos]
-                        newDots -= 1
-    
-                    if newGPropVal is not None:
-                        gPropVal = newGPropVal
-                        dots = newDots
-
-            # If a value is found, we stop searching for this presentation
-            # attribute here
+        for p, gPropVal in zip(_SETTABLE_ATTRS,
+                self.treeCtrl.nodeStyleResolver.resolve(globalAttrs,
+                attrs.items())):
             if gPropVal is not None:
                 setattr(style, p, gPropVal)
-                continue
 
         return style
 
@@ -438,8 +558,15 @@ class WikiWordNode(AbstractNode):
                 existingonly=self.treeCtrl.getHideUndefined(),
                 excludeSet=ancestors, includeSet=includeSet)
 
-        result = [WikiWordNode(self.treeCtrl, self, c)
-                for c in children]
+        # Retrieve what the children need for getNodePresentation() at once
+        treeNodeDataDict = wikiDocument.getTreeNodeDataForWords(children,
+                existingonly=self.treeCtrl.getHideUndefined())
+
+        result = []
+        for c in children:
+            node = WikiWordNode(self.treeCtrl, self, c)
+            node.treeNodeData = treeNodeDataDict[c]
+            result.append(node)
 
         if self.flagRoot:
             result.append(MainViewNode(self.treeCtrl, self))
@@ -500,11 +627,9 @@ class WikiWordRelabelNode(WikiWordNode):
 #         """        
 #         return []
 
-    def _hasValidChildren(self, wikiPage):  # TODO More efficient
+    def _hasValidChildren(self, children):
         """
-        Check if represented word has valid children, filter out undefined
-        and/or cycles if options are set accordingly. A WikiWordSearchNode
-        has no children.
+        A WikiWordSearchNode has no children.
         """
         return False
 
@@ -1308,6 +1433,9 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
 
         self.pWiki = pWiki
 
+        # Presentation of wiki word nodes from global attributes
+        self.nodeStyleResolver = NodeStyleResolver()
+
         # Bytestring "main" for main tree or "views" for views tree
         # The setting affects the configuration entries used to set up tree
         self.treeType = treeType
@@ -1842,8 +1970,10 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
                             for sg in self._generatorRefreshNodeAndChildren(nodeid):
                                 yield sg
                         else:
+                            # c equals nodeObj but may carry data prefetched
+                            # by listChildren()
                             retObj = self.refreshExecutor.executeAsync(0,
-                                    nodeObj.getNodePresentation)
+                                    c.getNodePresentation)
                             while retObj.state == 0:
                                 yield None
                             nodeStyle = retObj.getReturn()
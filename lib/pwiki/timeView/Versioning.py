@@ -2,7 +2,7 @@
 Processes versions of wiki pages.
 """
 
-import time, zlib, re
+import time, zlib, re, collections
 from calendar import timegm
 
 from ..rtlibRepl import minidom
@@ -119,6 +119,9 @@ class VersionEntry(object):
 
 
 class VersionOverview(MiscEventSourceMixin):
+    # Maximum number of reconstructed version contents kept in memory
+    CONTENT_CACHE_SIZE = 10
+
     def __init__(self, wikiDocument, basePage=None, unifiedBasePageName=None):
         MiscEventSourceMixin.__init__(self)
 
@@ -130,6 +133,10 @@ class VersionOverview(MiscEventSourceMixin):
             self.unifiedBasePageName = unifiedBasePageName
         self.versionEntries = []
         self.maxVersionNumber = 0
+        # Raw content of recently used versions, least recently used first.
+        # Content of a version never changes so entries only have to be
+        # removed when the version is deleted.
+        self.contentCache = collections.OrderedDict()
         
         self.xmlNode = None
 
@@ -152,6 +159,8 @@ class VersionOverview(MiscEventSourceMixin):
         Read overview from bytestring content. Needed to handle multi-page text
         imports.
         """
+        self.contentCache.clear()
+
         if content is None:
             self.versionEntries = []
             self.maxVersionNumber = 0
@@ -319,6 +328,7 @@ class VersionOverview(MiscEventSourceMixin):
         self.basePage = None
         self.wikiDocument = None
         self.versionEntries = []
+        self.contentCache.clear()
 
 
     def isInvalid(self):
@@ -407,7 +417,30 @@ class VersionOverview(MiscEventSourceMixin):
         self.maxVersionNumber = maxVersionNumber
 
 
+    def _getCachedContent(self, versionNumber):
+        content = self.contentCache.pop(versionNumber, None)
+        if content is not None:
+            # Mark as most recently used
+            self.contentCache[versionNumber] = content
+
+        return content
+
+
+    def _cacheContent(self, versionNumber, content):
+        self.contentCache.pop(versionNumber, None)
+        self.contentCache[versionNumber] = content
+
+        while len(self.contentCache) > self.CONTENT_CACHE_SIZE:
+            self.contentCache.popitem(last=False)
+
+
     def getVersionContentRaw(self, versionNumber):
+        """
+        Reconstruct content of a version. Starting at the nearest complete or
+        cached version after it, the reverse differential packets are applied
+        down to the requested version. The "versioning_completeSteps" option
+        bounds the number of packets to read.
+        """
         if len(self.versionEntries) == 0:
             raise InternalError(u"Tried to retrieve non-existing "
                     u"version number %s from empty list." % versionNumber)
@@ -415,11 +448,16 @@ class VersionOverview(MiscEventSourceMixin):
         if versionNumber == -1:
             versionNumber = self.versionEntries[-1].versionNumber
 
+        content = self._getCachedContent(versionNumber)
+        if content is not None:
+            return content
+
         base = None
         workList = []
         for i in xrange(len(self.versionEntries) - 1, -1, -1):
             entry = self.versionEntries[i]
-            if entry.contentDifferencing == u"complete":
+            if entry.versionNumber in self.contentCache or \
+                    entry.contentDifferencing == u"complete":
                 workList = []
                 base = entry
             else:
@@ -435,31 +473,36 @@ class VersionOverview(MiscEventSourceMixin):
             raise InternalError(u"No base version found for getVersionContent(%s)" %
                     versionNumber)
 
-        unifName = u"versioning/packet/versionNo/%s/%s" % (base.versionNumber,
-                self.unifiedBasePageName)
-
-        content = self.wikiDocument.retrieveDataBlock(unifName, default=DAMAGED)
-        if content is DAMAGED:
-            raise VersioningException(_(u"Versioning data damaged"))
-        elif content is None:
-            raise InternalError(u"Tried to retrieve non-existing "
-                    u"packet for version number %s" % versionNumber)
-
-        content = self.decodeContent(content, entry.contentEncoding)
+        content = self._getCachedContent(base.versionNumber)
+        if content is None:
+            unifName = u"versioning/packet/versionNo/%s/%s" % (
+                    base.versionNumber, self.unifiedBasePageName)
+    
+            content = self.wikiDocument.retrieveDataBlock(unifName,
+                    default=DAMAGED)
+            if content is DAMAGED:
+                raise VersioningException(_(u"Versioning data damaged"))
+            elif content is None:
+                raise InternalError(u"Tried to retrieve non-existing "
+                        u"packet for version number %s" % versionNumber)
+    
+            content = self.decodeContent(content, base.contentEncoding)
 
         for entry in workList:
             unifName = u"versioning/packet/versionNo/%s/%s" % (entry.versionNumber,
                     self.unifiedBasePageName)
-            packet = self.wikiDocument.retrieveDataBlock(unifName, default=None)
-            if content is DAMAGED:
+            packet = self.wikiDocument.retrieveDataBlock(unifName,
+                    default=DAMAGED)
+            if packet is DAMAGED:
                 raise VersioningException(_(u"Versioning data damaged"))
-            elif content is None:
+            elif packet is None:
                 raise InternalError(u"Tried to retrieve non-existing "
                         u"packet for version number %s" % versionNumber)
 
-
             content = applyBinCompact(content, packet)
 
+        self._cacheContent(versionNumber, content)
+
         return content
 
 
@@ -504,6 +547,7 @@ class VersionOverview(MiscEventSourceMixin):
         entry.contentDifferencing = "complete"
         entry.contentEncoding = None
         self.versionEntries.append(entry)
+        self._cacheContent(newHeadVerNo, content)
 
         if len(self.versionEntries) > 1:
             if asRevDiff:
@@ -538,6 +582,7 @@ class VersionOverview(MiscEventSourceMixin):
 
             self.wikiDocument.deleteDataBlock(unifName)
             del self.versionEntries[0]
+            self.contentCache.pop(versionNumber, None)
             self.fireMiscEventKeys(("deleted version", "changed version overview"))
 
             return
@@ -561,6 +606,7 @@ class VersionOverview(MiscEventSourceMixin):
                     self.unifiedBasePageName)
             self.wikiDocument.deleteDataBlock(unifName)
             del self.versionEntries[-1]
+            self.contentCache.pop(versionNumber, None)
             self.fireMiscEventKeys(("deleted version", "changed version overview"))
 
             return
@@ -3,10 +3,12 @@ Handles the storage of external files (e.g. images, but also other
 data or programs)
 """
 
-import os, os.path, traceback, glob
+from __future__ import with_statement
+
+import os, os.path, traceback, stat, hashlib, threading
 
 import re
-from pwiki.StringOps import createRandomString, pathEnc
+from pwiki.StringOps import createRandomString, pathEnc, pathDec
 from pwiki.OsAbstract import copyFile, moveFile
 
 
@@ -19,6 +21,253 @@ _FILESPLITPAT = re.compile(ur"^(?P<name>\.*[^.]+)(?P<suffix>.*)$",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
+def hashFile(path):
+    """
+    Return SHA-256 hex digest of the content of file path.
+    """
+    h = hashlib.sha256()
+    with open(pathEnc(path), "rb") as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if len(block) == 0:
+                return h.hexdigest()
+            h.update(block)
+
+
+
+class FileStorageIndex(object):
+    """
+    Index of the files directly inside the storage directory by size and
+    content hash, so files possibly identical to a new one can be found
+    without looking at all files in the storage.
+
+    The directory is only listed again if its modification time changed.
+    Entries are checked against modification time and size of the file
+    before they are used, hashes are calculated when needed first.
+    """
+    # Increase if file format changes
+    FORMAT_VERSION = u"1"
+
+    def __init__(self, storagePath, indexPath):
+        """
+        storagePath -- directory of the file storage
+        indexPath -- path of the file to store the index in or None to
+            keep it in memory only
+        """
+        self.storagePath = storagePath
+        self.indexPath = indexPath
+        self.lock = threading.RLock()
+
+        self.entries = None   # {file name: (size, mtime, hash or None)}
+        self.bySize = None   # {size: set of file names}
+        self.dirMtime = None   # mtime of storage dir when it was listed
+        self.modified = False
+
+
+    def _clear(self):
+        self.entries = {}
+        self.bySize = {}
+        self.dirMtime = None
+
+
+    def _setEntry(self, name, size, mtime, hash):
+        self._removeEntry(name)
+        self.entries[name] = (size, mtime, hash)
+        self.bySize.setdefault(size, set()).add(name)
+        self.modified = True
+
+
+    def _removeEntry(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            return
+
+        names = self.bySize[entry[0]]
+        names.discard(name)
+        if not names:
+            del self.bySize[entry[0]]
+
+        self.modified = True
+
+
+    def _load(self):
+        self._clear()
+
+        if self.indexPath is None:
+            return
+
+        try:
+            with open(pathEnc(self.indexPath), "rb") as f:
+                lines = f.read().decode("utf-8").split(u"\n")
+        except (IOError, OSError, UnicodeError):
+            return
+
+        if len(lines) < 2 or lines[0] != self.FORMAT_VERSION:
+            return
+
+        try:
+            self.dirMtime = float(lines[1])
+        except ValueError:
+            return
+
+        for line in lines[2:]:
+            parts = line.split(u"\t", 3)
+            if len(parts) < 4:
+                continue
+
+            try:
+                size, mtime = int(parts[0]), float(parts[1])
+            except ValueError:
+                continue
+
+            self._setEntry(parts[3], size, mtime, parts[2] or None)
+
+        self.modified = False
+
+
+    def save(self):
+        """
+        Write index to file if it was modified.
+        """
+        with self.lock:
+            if not self.modified or self.indexPath is None:
+                return
+
+            lines = [self.FORMAT_VERSION, repr(self.dirMtime)]
+            for name, (size, mtime, hash) in self.entries.iteritems():
+                if u"\n" in name:
+                    continue
+
+                lines.append(u"%i\t%r\t%s\t%s" % (size, mtime, hash or u"",
+                        name))
+
+            try:
+                with open(pathEnc(self.indexPath), "wb") as f:
+                    f.write(u"\n".join(lines).encode("utf-8"))
+            except (IOError, OSError):
+                # E.g. read-only wiki, index is just rebuilt next time
+                pass
+
+            self.modified = False
+
+
+    def refresh(self):
+        """
+        Bring list of files up to date if the storage directory was
+        modified.
+        """
+        with self.lock:
+            if self.entries is None:
+                self._load()
+
+            try:
+                dirMtime = os.stat(pathEnc(self.storagePath)).st_mtime
+            except OSError:
+                # No storage
+                if self.entries:
+                    self._clear()
+                    self.modified = True
+                return
+
+            if dirMtime == self.dirMtime:
+                return
+
+            names = set(pathDec(n)
+                    for n in os.listdir(pathEnc(self.storagePath)))
+
+            for name in self.entries.keys():
+                if name not in names:
+                    self._removeEntry(name)
+
+            for name in names:
+                if name in self.entries:
+                    continue
+
+                self._updateEntry(name)
+
+            self.dirMtime = dirMtime
+            self.modified = True
+
+
+    def _updateEntry(self, name):
+        """
+        Check entry for file name against the file and update it if
+        necessary. Returns the entry or None if it isn't a regular file.
+        """
+        try:
+            st = os.stat(pathEnc(os.path.join(self.storagePath, name)))
+        except OSError:
+            self._removeEntry(name)
+            return None
+
+        if not stat.S_ISREG(st.st_mode):
+            self._removeEntry(name)
+            return None
+
+        entry = self.entries.get(name)
+        if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime:
+            self._setEntry(name, st.st_size, st.st_mtime, None)
+
+        return self.entries[name]
+
+
+    def getFileNames(self):
+        """
+        Return set of names of files directly inside the storage directory.
+        """
+        with self.lock:
+            self.refresh()
+            return set(self.entries)
+
+
+    def getNamesBySize(self, size):
+        """
+        Return list of names of files with given size.
+        """
+        with self.lock:
+            self.refresh()
+
+            result = []
+            # Copy as entries may move to other size while checking
+            for name in list(self.bySize.get(size, ())):
+                entry = self._updateEntry(name)
+                if entry is not None and entry[0] == size:
+                    result.append(name)
+
+            return result
+
+
+    def getHash(self, name):
+        """
+        Return content hash of file name or None if it doesn't exist.
+        """
+        with self.lock:
+            entry = self._updateEntry(name)
+            if entry is None:
+                return None
+
+            if entry[2] is None:
+                hash = hashFile(os.path.join(self.storagePath, name))
+                self._setEntry(name, entry[0], entry[1], hash)
+                return hash
+
+            return entry[2]
+
+
+    def addFile(self, name, hash=None):
+        """
+        Inform index about file name added to storage with content
+        hash (if known).
+        """
+        with self.lock:
+            if self.entries is None:
+                self._load()
+
+            entry = self._updateEntry(name)
+            if entry is not None and hash is not None:
+                self._setEntry(name, entry[0], entry[1], hash)
+
+
 
 class FileStorage:
     """
@@ -27,15 +276,20 @@ class FileStorage:
     component, so it must be replaced by a new instance if a new wiki is loaded.
     """
     
-    def __init__(self, wikiDataManager, storagePath):
+    def __init__(self, wikiDataManager, storagePath, indexPath=None):
         """
         mainControl -- PersonalWikiFrame instance
         wikiDataManager -- WikiDataManager instance of current wiki
         filePath -- directory path where new files should be stored
                 (doesn't have to exist already)
+        indexPath -- path of file to store the FileStorageIndex in or None
         """
         self.wikiDataManager = wikiDataManager
         self.storagePath = storagePath
+        self.index = FileStorageIndex(storagePath, indexPath)
+
+        # Tuple (path, size, mtime, hash) of last hashed source file
+        self.srcHashMemo = None
         
         # Conditions for identity test
         self.modDateMustMatch = False  # File is only identical if modification
@@ -65,6 +319,12 @@ class FileStorage:
     def getStoragePath(self):
         return self.storagePath
 
+    def getIndex(self):
+        return self.index
+
+    def saveIndex(self):
+        self.index.save()
+
 
     def _storageExists(self):
         """
@@ -130,6 +390,9 @@ class FileStorage:
         must exist already.
         srcPath -- Must be a path to an existing file
         """
+        if not os.path.isfile(pathEnc(srcPath)):
+            return []
+
         srcfname = os.path.basename(srcPath)
         srcstat = os.stat(pathEnc(srcPath))
 
@@ -148,8 +411,9 @@ class FileStorage:
             return list(ccSameName)
 
 
-        ext = os.path.splitext(srcPath)[1]
-        for p in glob.glob(os.path.join(self.storagePath, "*" + ext)):
+        # Only files of same size can be identical
+        for name in self.index.getNamesBySize(srcstat.st_size):
+            p = os.path.join(self.storagePath, name)
             if p == samenamepath:
                 # Already tested above
                 continue
@@ -178,27 +442,31 @@ class FileStorage:
         if self.modDateIsEnough and stat1.st_mtime == stat2.st_mtime:
             return True
 
-        # End of fast tests, now the whole content must be compared
-        
-        file1 = file(path1, "rb")    
-        file2 = file(path2, "rb")
-        
-        try:
-            while True:
-                block1 = file1.read(1024 * 1024)
-                block2 = file2.read(1024 * 1024)
-                if len(block1) == 0 and len(block2) == 0:
-                    # EOF
-                    return True
-                if len(block1) != len(block2):
-                    raise FSException(_(u"File compare error, file not readable or "
-                            u"changed during compare"))
-
-                if block1 != block2:
-                    return False
-        finally:
-            file2.close()
-            file1.close()
+        # End of fast tests, now the content hashes must be compared.
+        # Hash of path2 comes from the index, so each file in the storage
+        # is only read once as long as it isn't modified
+        hash2 = self.index.getHash(os.path.basename(path2))
+        if hash2 is None:
+            raise FSException(_(u"File compare error, file not readable or "
+                    u"changed during compare"))
+
+        return self._getSrcHash(path1, stat1) == hash2
+
+
+    def _getSrcHash(self, srcPath, srcstat):
+        """
+        Return content hash of source file srcPath with stats srcstat.
+        The hash of the last source is remembered as it is compared against
+        all candidates and needed again when the file is added to the index.
+        """
+        memo = self.srcHashMemo
+        if memo is not None and memo[:3] == (srcPath, srcstat.st_size,
+                srcstat.st_mtime):
+            return memo[3]
+
+        hash = hashFile(srcPath)
+        self.srcHashMemo = (srcPath, srcstat.st_size, srcstat.st_mtime, hash)
+        return hash
 
 
     def findDestPath(self, srcPath):
@@ -298,11 +566,22 @@ class FileStorage:
             raise FSException(_(u"Copy of file '%s' couldn't be created") %
                     srcPath)
 
+        srcstat = os.stat(pathEnc(srcPath))
+        memo = self.srcHashMemo
+        if memo is not None and memo[:3] == (srcPath, srcstat.st_size,
+                srcstat.st_mtime):
+            # Known already from comparison
+            hash = memo[3]
+        else:
+            hash = None
+
         if move:
             self.moveFile(srcPath, destpath)
         else:
             self.copyFile(srcPath, destpath)
 
+        self.index.addFile(os.path.basename(destpath), hash)
+
         return destpath
 
     @staticmethod
@@ -7,6 +7,7 @@ from __future__ import with_statement
 from weakref import WeakValueDictionary
 import os, os.path, time, shutil, traceback, ConfigParser
 # from collections import deque
+from collections import OrderedDict
 
 import re
 
@@ -15,7 +16,8 @@ from wx import GetApp
 import Consts
 from pwiki.WikiExceptions import *
 
-from ..Utilities import TimeoutRLock, SingleThreadExecutor, DUMBTHREADSTOP
+from ..Utilities import TimeoutRLock, SingleThreadExecutor, DUMBTHREADSTOP, \
+        callInMainThreadAsync
 
 from ..MiscEvent import MiscEventSourceMixin
 
@@ -23,7 +25,7 @@ from .. import ParseUtilities
 from .. import StringOps
 from ..StringOps import mbcsDec, re_sub_escape, pathEnc, pathDec, \
         unescapeWithRe, strToBool, pathnameFromUrl, urlFromPathname, \
-        relativeFilePath, getFileSignatureBlock
+        relativeFilePath, getFileSignatureBlock, getFileSignatureBlockFromStat
 from ..DocPages import DocPage, WikiPage, FunctionalPage, AliasWikiPage
 # from ..timeView.Versioning import VersionOverview
 
@@ -35,6 +37,8 @@ from ..SearchAndReplace import SearchReplaceOperation
 
 from .. import SpellChecker
 from .. import Trashcan
+from .. import ParseWorkerPool
+from .. import OsAbstract
 
 import DbBackendUtils, FileStorage
 
@@ -276,6 +280,125 @@ class WikiDataSynchronizedProxy:
         return result
 
 
+class WikiPageCache(object):
+    """
+    Keeps strong references to the most recently used wiki pages so that
+    their live text, AST and spell checker results survive between
+    accesses. WikiDataManager.wikiPageDict only holds weak references,
+    without this cache a page is dropped as soon as nobody uses it and
+    must be loaded and parsed again on next access.
+
+    The cache is bounded by a memory budget (in bytes, 0 disables
+    caching) based on the approximate costs reported by
+    page.getCacheCost(). When over budget, least recently used pages are
+    evicted except pages shown in an editor or with unsaved changes.
+
+    Costs change when a page builds its AST after it was added, therefore
+    the cost of a page is reevaluated when it is touched again, when
+    the next page is added and before it may be evicted.
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self.cacheLock = TimeoutRLock(Consts.DEADBLOCKTIMEOUT)
+        self.pages = OrderedDict()   # {wikiWord: page}, oldest first
+        self.costs = {}   # {wikiWord: cost of page when last evaluated}
+        self.totalCost = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def setBudget(self, budget):
+        with self.cacheLock:
+            self.budget = budget
+            self._shrink()
+
+
+    def addPage(self, wikiWord, page, hit):
+        """
+        Called when page for wikiWord was retrieved. hit is True if
+        the page object existed already (no new page had to be created).
+        """
+        with self.cacheLock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            if self.budget <= 0:
+                return
+
+            if len(self.pages) > 0:
+                # Previously added page has probably built its AST meanwhile
+                self._refreshCost(next(reversed(self.pages)))
+
+            if wikiWord in self.pages:
+                del self.pages[wikiWord]
+            else:
+                self.costs[wikiWord] = 0
+
+            self.pages[wikiWord] = page
+            self._refreshCost(wikiWord)
+            self._shrink()
+
+
+    def discardPage(self, wikiWord):
+        with self.cacheLock:
+            if self.pages.pop(wikiWord, None) is not None:
+                self.totalCost -= self.costs.pop(wikiWord)
+
+
+    def clear(self):
+        with self.cacheLock:
+            self.pages.clear()
+            self.costs.clear()
+            self.totalCost = 0
+
+
+    def getStatistics(self):
+        """
+        Return dictionary with counters for hits, misses and evictions,
+        number and estimated cost of cached pages and budget.
+        """
+        with self.cacheLock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "pages": len(self.pages),
+                    "cost": self.totalCost, "budget": self.budget}
+
+
+    def _refreshCost(self, wikiWord):
+        cost = self.pages[wikiWord].getCacheCost()
+        self.totalCost += cost - self.costs[wikiWord]
+        self.costs[wikiWord] = cost
+
+
+    @staticmethod
+    def _isPinned(page):
+        if page.isInvalid():
+            return False
+
+        return page.getTxtEditor() is not None or page.getDirty()[0]
+
+
+    def _shrink(self):
+        if self.totalCost <= self.budget:
+            return
+
+        for wikiWord in list(self.pages):
+            self._refreshCost(wikiWord)
+            if self.totalCost <= self.budget:
+                break
+
+            if self._isPinned(self.pages[wikiWord]):
+                continue
+
+            del self.pages[wikiWord]
+            self.totalCost -= self.costs.pop(wikiWord)
+            self.evictions += 1
+
+
+
 class WikiDataManager(MiscEventSourceMixin):
     """
     Wraps a WikiData object and provides services independent
@@ -295,6 +418,22 @@ class WikiDataManager(MiscEventSourceMixin):
     
     # Update executor queue for index search update
     UEQUEUE_INDEX = 2
+    # Update executor queue for writing pending search index updates,
+    # runs after the queues above are empty
+    UEQUEUE_INDEX_FLUSH = 3
+
+    # Pending search index updates are written with one writer if this
+    # number of pages is reached or the oldest update is waiting
+    # longer than SEARCHINDEX_BATCH_DELAY seconds
+    SEARCHINDEX_BATCH_SIZE = 200
+    SEARCHINDEX_BATCH_DELAY = 5.0
+
+    # Maximum number of pages whose meta-data is written in one transaction
+    METADATA_BATCH_SIZE = 100
+
+    # Number of candidate pages tested by iterSearchWikiHits() before the
+    # hits found so far are handed out
+    SEARCH_CHUNK_SIZE = 250
 
     def __init__(self, wikiConfigFilename, dbtype, wikiLangName, ignoreLock=False,
             createLock=True, recoveryMode=False):
@@ -410,9 +549,21 @@ class WikiDataManager(MiscEventSourceMixin):
         self.wikiData = WikiDataSynchronizedProxy(self.baseWikiData)
         self.wikiPageDict = WeakValueDictionary()
         self.funcPageDict = WeakValueDictionary()
+        # Strong references to recently used pages of wikiPageDict
+        self.wikiPageCache = WikiPageCache(GetApp().getGlobalConfig().getint(
+                "main", "wikiPageCache_budgetMB", 32) * 1024 * 1024)
         
         self.updateExecutor = SingleThreadExecutor(4)
         self.pageRetrievingLock = TimeoutRLock(Consts.DEADBLOCKTIMEOUT)
+
+        # Created on demand if parsing in worker processes is configured
+        self.parseWorkerPool = None
+        self.parseWorkerPoolLock = TimeoutRLock(Consts.DEADBLOCKTIMEOUT)
+        # Results of parse workers waiting for the second update step
+        # {wikiWord: (wikiPage, mainDbCacheData)}
+        self.parsedMainDbCacheData = {}
+        # Watches data directory for page files changed by other programs
+        self.wikiFileWatcher = None
         self.wikiWideHistory = WikiWideHistory(self)
         
         if self.recoveryMode:
@@ -427,6 +578,15 @@ class WikiDataManager(MiscEventSourceMixin):
         self.dbtype = wikidhName
 
         self.whooshIndex = None
+        # Search index updates waiting for flushSearchIndexUpdates()
+        # {unifName: None for deletion or tuple (wikiPage, modTimestamp,
+        # content, liveTextPlaceHold, markIndexed)}
+        self.searchIndexPending = {}
+        self.searchIndexPendingSince = None
+        # Writer used by all updates during rebuildWiki() or None
+        self.searchIndexBulkWriter = None
+        self.searchIndexBulkIndexed = None
+        self.searchIndexLock = TimeoutRLock(Consts.DEADBLOCKTIMEOUT)
 
         self.refCount = 1
 
@@ -468,7 +628,8 @@ class WikiDataManager(MiscEventSourceMixin):
         fileStorDir = os.path.join(os.path.dirname(self.getWikiConfigPath()),
                 "files")
 
-        self.fileStorage = FileStorage.FileStorage(self, fileStorDir)
+        self.fileStorage = FileStorage.FileStorage(self, fileStorDir,
+                os.path.join(self.getDataDir(), u"filestorage.index"))
 
         # Set file storage according to configuration
         fs = self.fileStorage
@@ -533,6 +694,7 @@ class WikiDataManager(MiscEventSourceMixin):
             self.pushDirtyMetaDataUpdate()
 
         self.updateExecutor.start()
+        self._startWikiFileWatcher()
 
 
 #         if not self.isReadOnlyEffect():
@@ -569,6 +731,212 @@ class WikiDataManager(MiscEventSourceMixin):
             return
 
 
+    def _writeMetaDataBatch(self, batch, getEntry, finishEntry,
+            threadstop=DUMBTHREADSTOP, fromRebuild=False):
+        """
+        Write meta-data for batch, a list of tuples (wikiPage, mainDbCacheData),
+        by one call to WikiData.updateMetaDataBatch(). The caller must
+        commit afterwards.
+
+        getEntry -- Unbound WikiPage method returning the entry for
+            updateMetaDataBatch()
+        finishEntry -- Unbound WikiPage method called after writing,
+            returns True if meta-data state of the page was raised
+        fromRebuild -- True if called by rebuildWiki(), see
+            WikiPage._isMainDbCacheDataCurrent()
+
+        Returns list of those tuples of batch for which finishEntry
+        returned True.
+        """
+        if len(batch) == 0:
+            return []
+
+        entries = [getEntry(wikiPage, data, threadstop=threadstop)
+                for wikiPage, data in batch]
+
+        skipped = set(self.getWikiData().updateMetaDataBatch(entries))
+
+        return [(wikiPage, data) for wikiPage, data in batch
+                if wikiPage.getWikiWord() not in skipped and
+                finishEntry(wikiPage, data, threadstop=threadstop,
+                    fromRebuild=fromRebuild)]
+
+
+    def _writeAttributesBatch(self, batch, threadstop=DUMBTHREADSTOP,
+            fromRebuild=False):
+        """
+        Write attributes for batch, see _writeMetaDataBatch().
+        """
+        return self._writeMetaDataBatch(batch, WikiPage.getAttributesBatchEntry,
+                WikiPage.finishAttributesBatchEntry, threadstop=threadstop,
+                fromRebuild=fromRebuild)
+
+
+    def _writeMainDbCacheBatch(self, batch, threadstop=DUMBTHREADSTOP,
+            fromRebuild=False):
+        """
+        Write todos, relations and match terms for batch,
+        see _writeMetaDataBatch().
+        """
+        return self._writeMetaDataBatch(batch, WikiPage.getMainDbCacheBatchEntry,
+                WikiPage.finishMainDbCacheBatchEntry, threadstop=threadstop,
+                fromRebuild=fromRebuild)
+
+
+    def _runAttributesUpdateBatch(self, words, threadstop=DUMBTHREADSTOP):
+        """
+        Run first update step (attributes) for all words with dirty
+        meta-data. Pages are parsed by the parse worker pool (if configured)
+        and the attributes of all of them are written in one transaction.
+        The parse results are kept for the second step so pages aren't
+        parsed again there.
+        """
+        time.sleep(0.1)
+        if self.isReadOnlyEffect():
+            return
+
+        pool = self.getParseWorkerPool()
+
+        def iterDirtyPages():
+            for word in words:
+                try:
+                    page = self.getWikiPage(word)
+                except WikiWordNotFoundException:
+                    continue
+
+                if isinstance(page, AliasWikiPage):
+                    # Let the normal update handle it
+                    self.updateExecutor.executeAsyncWithThreadStop(1,
+                            self._runDatabaseUpdate, word,
+                            Consts.WIKIWORDMETADATA_STATE_DIRTY)
+                elif page.getMetaDataState() == \
+                        Consts.WIKIWORDMETADATA_STATE_DIRTY:
+                    yield page
+
+        batch = []
+        for page, text, data in ParseWorkerPool.iterPageData(iterDirtyPages(),
+                pool=pool, threadstop=threadstop):
+            if data is not None and page.getMetaDataState() == \
+                    Consts.WIKIWORDMETADATA_STATE_DIRTY:
+                batch.append((page, data))
+            else:
+                # Let the normal update handle it
+                self.updateExecutor.executeAsyncWithThreadStop(1,
+                        self._runDatabaseUpdate, page.getWikiWord(),
+                        Consts.WIKIWORDMETADATA_STATE_DIRTY)
+
+        written = self._writeAttributesBatch(batch, threadstop=threadstop)
+        self.getWikiData().commit()
+
+        writtenWords = []
+        for page, data in written:
+            word = page.getWikiWord()
+            data.attrs = None
+            self.parsedMainDbCacheData[word] = (page, data)
+            writtenWords.append(word)
+
+        writtenWordSet = set(writtenWords)
+
+        with self.updateExecutor.getDequeCondition():
+            for page, data in batch:
+                if page.getWikiWord() not in writtenWordSet:
+                    # Let the normal update handle it
+                    self.updateExecutor.executeAsyncWithThreadStop(1,
+                            self._runDatabaseUpdate, page.getWikiWord(),
+                            Consts.WIKIWORDMETADATA_STATE_DIRTY)
+
+            if writtenWords:
+                self.updateExecutor.executeAsyncWithThreadStop(1,
+                        self._runMainDbCacheUpdateBatch, writtenWords)
+
+
+    def _runMainDbCacheUpdateBatch(self, words, threadstop=DUMBTHREADSTOP):
+        """
+        Run second update step (todos, relations, match terms) for all words
+        with processed attributes and write the results in one transaction.
+        Parse results of the first step are used if they are still valid,
+        other pages are parsed (again).
+        """
+        time.sleep(0.1)
+        if self.isReadOnlyEffect():
+            return
+
+        batch = []
+        toParse = []
+
+        for word in words:
+            # The page object is held in the dictionary so getWikiPage()
+            # returns the same one
+            parsedPage, data = self.parsedMainDbCacheData.pop(word,
+                    (None, None))
+            try:
+                page = self.getWikiPage(word)
+            except WikiWordNotFoundException:
+                continue
+
+            if isinstance(page, AliasWikiPage):
+                # Let the normal update handle it
+                self.updateExecutor.executeAsyncWithThreadStop(1,
+                        self._runDatabaseUpdate, word,
+                        Consts.WIKIWORDMETADATA_STATE_ATTRSPROCESSED)
+                continue
+
+            if page.getMetaDataState() != \
+                    Consts.WIKIWORDMETADATA_STATE_ATTRSPROCESSED:
+                continue
+
+            if data is not None and data.formatDetails is not None and \
+                    page.getFormatDetails().isEquivTo(data.formatDetails):
+                batch.append((page, data))
+            else:
+                toParse.append(page)
+
+        if toParse:
+            for page, text, data in ParseWorkerPool.iterPageData(toParse,
+                    pool=self.getParseWorkerPool(), threadstop=threadstop):
+                if data is not None:
+                    batch.append((page, data))
+                else:
+                    # Let the normal update handle it
+                    self.updateExecutor.executeAsyncWithThreadStop(1,
+                            self._runDatabaseUpdate, page.getWikiWord(),
+                            Consts.WIKIWORDMETADATA_STATE_ATTRSPROCESSED)
+
+        written = self._writeMainDbCacheBatch(batch, threadstop=threadstop)
+        self.getWikiData().commit()
+
+        if self.isSearchIndexEnabled():
+            with self.updateExecutor.getDequeCondition():
+                for page, data in written:
+                    self.updateExecutor.executeAsyncWithThreadStop(
+                            self.UEQUEUE_INDEX, self._runDatabaseUpdate,
+                            page.getWikiWord(),
+                            Consts.WIKIWORDMETADATA_STATE_SYNTAXPROCESSED)
+
+
+    def getParseWorkerPool(self):
+        """
+        Return ParseWorkerPool.ParseWorkerPool object or None if parsing in
+        worker processes is disabled by global option "parseWorkers_count".
+        """
+        with self.parseWorkerPoolLock:
+            count = ParseWorkerPool.getConfiguredWorkerCount()
+
+            if self.parseWorkerPool is not None and \
+                    self.parseWorkerPool.getWorkerCount() != count:
+                self.parseWorkerPool.close()
+                self.parseWorkerPool = None
+
+            if self.parseWorkerPool is None and count > 0:
+                try:
+                    self.parseWorkerPool = ParseWorkerPool.ParseWorkerPool(
+                            count)
+                except (OSError, ImportError):
+                    traceback.print_exc()
+
+            return self.parseWorkerPool
+
+
     def incRefCount(self):
         self.refCount += 1
         return self.refCount
@@ -599,8 +967,18 @@ class WikiDataManager(MiscEventSourceMixin):
 
         if self.refCount <= 0:
             self.refCount = 0
+
+            if self.wikiFileWatcher is not None:
+                self.wikiFileWatcher.stop()
+                self.wikiFileWatcher = None
+
             self.updateExecutor.end(hardEnd=True)  # TODO Inform user as this may take some time
 
+            try:
+                self.flushSearchIndexUpdates()
+            except:
+                traceback.print_exc()
+
             if self.trashcan is not None:
                 self.trashcan.writeOverview()
                 self.trashcan.close()
@@ -609,6 +987,13 @@ class WikiDataManager(MiscEventSourceMixin):
             self.wikiWideHistory.writeOverview()
             self.wikiWideHistory.close()
 
+            try:
+                self.fileStorage.saveIndex()
+            except:
+                traceback.print_exc()
+
+            self.wikiPageCache.clear()
+
             # Invalidate all cached pages to prevent yet running threads from
             # using them
             for page in self.wikiPageDict.values():
@@ -627,6 +1012,13 @@ class WikiDataManager(MiscEventSourceMixin):
                 self.whooshIndex.close()
                 self.whooshIndex = None
 
+            with self.parseWorkerPoolLock:
+                if self.parseWorkerPool is not None:
+                    self.parseWorkerPool.close()
+                    self.parseWorkerPool = None
+
+            self.parsedMainDbCacheData.clear()
+
             GetApp().getMiscEvent().removeListener(self)
 
             del _openDocuments[self.getWikiConfig().getConfigPath()]
@@ -904,6 +1296,12 @@ class WikiDataManager(MiscEventSourceMixin):
         self.updateExecutor.executeAsyncWithThreadStop(0, page.runDatabaseUpdate)
 
 
+    def getWikiPageCache(self):
+        """
+        Return the WikiPageCache, e.g. to retrieve its statistics.
+        """
+        return self.wikiPageCache
+
     def getUpdateExecutor(self):
         return self.updateExecutor
         
@@ -942,14 +1340,19 @@ class WikiDataManager(MiscEventSourceMixin):
             words1 = self.getWikiData().getWikiPageNamesForMetaDataState(
                     Consts.WIKIWORDMETADATA_STATE_ATTRSPROCESSED)
 
+            self.parsedMainDbCacheData.clear()
+            batchSize = self.METADATA_BATCH_SIZE
+
             with self.updateExecutor.getDequeCondition():
-                for word in words0:
-                    self.updateExecutor.executeAsyncWithThreadStop(1, self._runDatabaseUpdate,
-                            word, Consts.WIKIWORDMETADATA_STATE_DIRTY)
+                for i in xrange(0, len(words0), batchSize):
+                    self.updateExecutor.executeAsyncWithThreadStop(1,
+                            self._runAttributesUpdateBatch,
+                            words0[i:i + batchSize])
     
-                for word in words1:
-                    self.updateExecutor.executeAsyncWithThreadStop(1, self._runDatabaseUpdate,
-                            word, Consts.WIKIWORDMETADATA_STATE_ATTRSPROCESSED)
+                for i in xrange(0, len(words1), batchSize):
+                    self.updateExecutor.executeAsyncWithThreadStop(1,
+                            self._runMainDbCacheUpdateBatch,
+                            words1[i:i + batchSize])
             
             if self.isSearchIndexEnabled():
                 words2 = self.getWikiData().getWikiPageNamesForMetaDataState(
@@ -1079,9 +1482,11 @@ class WikiDataManager(MiscEventSourceMixin):
 #                     value = AliasWikiPage(self, wikiWord, realpage)
 
 
+            hit = wikiWord in self.wikiPageDict
             value = self._getWikiPageNoErrorNoCache(wikiWord)
             
             self.wikiPageDict[wikiWord] = value
+            self.wikiPageCache.addPage(wikiWord, value, hit)
 
             if not value.getMiscEvent().hasListener(self):
                 value.getMiscEvent().addListener(self)
@@ -1089,6 +1494,14 @@ class WikiDataManager(MiscEventSourceMixin):
         return value
 
 
+    def getWikiPageIfLoaded(self, wikiWord):
+        """
+        Return the WikiPage object for wikiWord if one exists currently,
+        None otherwise. No page object is created.
+        """
+        return self.wikiPageDict.get(wikiWord)
+
+
     def _getWikiPageNoErrorNoCache(self, wikiWord):
         """
         Similar to getWikiPageNoError, but does not save retrieved
@@ -1308,9 +1721,16 @@ class WikiDataManager(MiscEventSourceMixin):
                 proxyAccessLock.release()
 
 
-    def checkFileSignatureForAllWikiPageNamesAndMarkDirty(self):
+    def checkFileSignatureForAllWikiPageNamesAndMarkDirty(self, filePaths=None):
+        """
+        Check file signatures of all pages and mark those with changed
+        files as dirty. Returns list of names of these pages.
+
+        filePaths -- if not None, set of file paths (relative to data
+            directory) to restrict the check to
+        """
         if self.isReadOnlyEffect():
-            return True  # TODO Error message?
+            return []  # TODO Error message?
 
         wikiData = self.getWikiData()
         
@@ -1318,20 +1738,110 @@ class WikiDataManager(MiscEventSourceMixin):
         if proxyAccessLock is not None:
             proxyAccessLock.acquire()
         try:
-            for word in self.getAllDefinedWikiPageNames():
-                if not wikiData.validateFileSignatureForWikiPageName(word):
-                    wikiData.setMetaDataState(word,
-                            Consts.WIKIWORDMETADATA_STATE_DIRTY)
-                    wikiData.refreshFileSignatureForWikiPageName(word)
+            words = wikiData.getWikiPageNamesWithChangedFileSignature(filePaths)
 
-                    wikiPage = self.wikiPageDict.get(word)
-                    if wikiPage is not None:
-                        wikiPage.markTextChanged()
+            for word in words:
+                wikiData.setMetaDataState(word,
+                        Consts.WIKIWORDMETADATA_STATE_DIRTY)
+                wikiData.refreshFileSignatureForWikiPageName(word)
+
+                wikiPage = self.wikiPageDict.get(word)
+                if wikiPage is not None:
+                    wikiPage.markTextChanged()
+
+            return words
         finally:
             if proxyAccessLock is not None:
                 proxyAccessLock.release()
 
 
+    def _startWikiFileWatcher(self):
+        """
+        Start watching the data directory for page files changed by other
+        programs if this is configured and supported.
+        """
+        if self.recoveryMode or self.isReadOnlyEffect() or \
+                self.getWikiData().checkCapability("filePerPage") != 1 or \
+                not self.getWikiConfig().getboolean("main",
+                "wikiPageFiles_watchExternalChanges", False):
+            return
+
+        watcher = OsAbstract.createDirectoryWatcher(self.getDataDir(),
+                self._onWikiFilesChanged)
+
+        if watcher is not None and watcher.start():
+            self.wikiFileWatcher = watcher
+
+
+    def _onWikiFilesChanged(self, changedNames, presenceChangedNames):
+        """
+        Called by the wiki file watcher in its own thread.
+        """
+        self.updateExecutor.executeAsyncWithThreadStop(0,
+                self._runWikiFileChangeCheck, changedNames,
+                presenceChangedNames)
+
+
+    def _runWikiFileChangeCheck(self, changedNames, presenceChangedNames,
+            threadstop=DUMBTHREADSTOP):
+        """
+        Mark pages dirty whose files were changed by other programs and
+        queue their update. Only the reported files are checked unless
+        changedNames is None (some changes weren't reported) or page files
+        were added or removed.
+        """
+        if self.isReadOnlyEffect():
+            return
+
+        wikiData = self.getWikiData()
+        suffix = self.getWikiConfig().get("main", "db_pagefile_suffix",
+                u".wiki")
+
+        if changedNames is None:
+            filePaths = None
+            listChanged = True
+        else:
+            filePaths = frozenset(n for n in changedNames if n.endswith(suffix))
+            if not filePaths:
+                # No page files, e.g. database or search index
+                return
+
+            listChanged = any(n.endswith(suffix) for n in presenceChangedNames)
+
+        threadstop.testValidThread()
+
+        if listChanged:
+            wikiData.refreshWikiPageLinkTerms(deleteFully=True)
+
+        words = self.checkFileSignatureForAllWikiPageNamesAndMarkDirty(
+                filePaths)
+
+        for word in words:
+            wikiPage = self.wikiPageDict.get(word)
+            if wikiPage is None:
+                continue
+
+            editor = wikiPage.getTxtEditor()
+            if editor is not None:
+                callInMainThreadAsync(editor.handleInvalidFileSignature,
+                        wikiPage)
+
+            callInMainThreadAsync(wikiPage.fireMiscEventKeys,
+                    ("checked file signature invalid",))
+
+        if listChanged:
+            # Also new pages
+            words = wikiData.getWikiPageNamesForMetaDataState(
+                    Consts.WIKIWORDMETADATA_STATE_DIRTY)
+
+        batchSize = self.METADATA_BATCH_SIZE
+        with self.updateExecutor.getDequeCondition():
+            for i in xrange(0, len(words), batchSize):
+                self.updateExecutor.executeAsyncWithThreadStop(1,
+                        self._runAttributesUpdateBatch,
+                        words[i:i + batchSize])
+
+
 
     def initiateFullUpdate(self, progresshandler):
         self.updateExecutor.end(hardEnd=True)
@@ -1394,12 +1904,41 @@ class WikiDataManager(MiscEventSourceMixin):
             self.updateExecutor.start()
 
 
+    def _getWikiPageForRebuild(self, wikiWord):
+        """
+        Return the real (non-alias) WikiPage for wikiWord without
+        caching it.
+        """
+        wikiPage = self._getWikiPageNoErrorNoCache(wikiWord)
+        if isinstance(wikiPage, AliasWikiPage):
+            # This should never be an alias page, so fetch the
+            # real underlying page
+            # This can only happen if there is a real page with
+            # the same name as an alias
+            wikiPage = WikiPage(self, wikiWord)
+
+        return wikiPage
+
+
     def rebuildWiki(self, progresshandler, onlyDirty):
         """
         Rebuild  the wiki
 
+        Each page is loaded and parsed only once. Attributes must be known
+        before the rest of the syntax is processed, therefore the rebuild
+        runs in two passes over the pages: The first one parses the page
+        (possibly in a parse worker process), stores attributes (and updates
+        the search index) and keeps a compact DocPages.MainDbCacheData
+        extract of the AST. The second one writes todos, relations and match
+        terms from these extracts. Only pages whose format details were
+        changed by attributes of the first pass have to be parsed again.
+        In both passes the meta-data of METADATA_BATCH_SIZE pages is written
+        in one transaction.
+
         progresshandler -- Object, fulfilling the
             PersonalWikiFrame.GuiProgressHandler protocol
+
+        returns: list of tuples (<phase description>, <seconds>)
         """
         self.updateExecutor.end(hardEnd=True)
         self.getWikiData().refreshWikiPageLinkTerms()
@@ -1415,16 +1954,20 @@ class WikiDataManager(MiscEventSourceMixin):
             # get all of the wikiWords
             wikiWords = self.getWikiData().getAllDefinedWikiPageNames()
 
-
-        if self.isSearchIndexEnabled():
-            progresshandler.open(len(wikiWords) * 4 + 1)
-        else:
-            progresshandler.open(len(wikiWords) * 3 + 1)
+        progresshandler.open(len(wikiWords) * 3 + 1)
 #         progresshandler.update(0, _(u"Waiting for update thread to end"))
 
-
         self.fireMiscEventKeys(("begin foreground update", "begin update"))
 
+        indexEnabled = self.isSearchIndexEnabled()
+        timings = []
+
+        def finishPhase(step, phaseName, startTime):
+            duration = time.time() - startTime
+            timings.append((phaseName, duration))
+            progresshandler.update(step, _(u"%s finished in %.1f seconds") %
+                    (phaseName, duration))
+
         # re-save all of the pages
         try:
             step = 1
@@ -1437,104 +1980,158 @@ class WikiDataManager(MiscEventSourceMixin):
             # Step one: update search terms which are generated synchronously.
             #   Some of them are essential to find anything or to follow
             #   links.
+            startTime = time.time()
             for wikiWord in wikiWords:
                 progresshandler.update(step, _(u"Update basic link info"))
-                wikiPage = self._getWikiPageNoErrorNoCache(wikiWord)
-                if isinstance(wikiPage, AliasWikiPage):
-                    # This should never be an alias page, so fetch the
-                    # real underlying page
-                    # This can only happen if there is a real page with
-                    # the same name as an alias
-                    wikiPage = WikiPage(self, wikiWord)
-
+                wikiPage = self._getWikiPageForRebuild(wikiWord)
                 wikiPage.refreshSyncUpdateMatchTerms()
                 
                 step += 1
 
             self.getWikiData().setDbSettingsValue(
                     "syncWikiWordMatchtermsUpToDate", "1")
+            finishPhase(step, _(u"Update basic link info"), startTime)
+
+            # Step two: parse pages and update attributes (and search index).
+            #   There may be attributes which define how the rest has to be
+            #   interpreted, therefore they must be processed first.
+            #   The data needed for step three is kept in compact form.
+            #   If configured, pages are parsed by worker processes.
+            #   Attributes are written in batches of METADATA_BATCH_SIZE
+            #   pages with one commit per batch, the search index is written
+            #   with one writer and optimized at the end.
+            mainDbCacheData = {}
+            indexedWords = set()
+            batch = []   # List of tuples (wikiPage, text, data)
+
+            def flushAttributesBatch():
+                try:
+                    self._writeAttributesBatch([(wikiPage, data)
+                            for wikiPage, text, data in batch],
+                            fromRebuild=True)
+                    self.getWikiData().commit()
+                except:
+                    traceback.print_exc()
 
-            # Step two: update attributes. There may be attributes which
-            #   define how the rest has to be interpreted, therefore they
-            #   must be processed first.
-            for wikiWord in wikiWords:
+                for wikiPage, text, data in batch:
+                    wikiWord = wikiPage.getWikiWord()
+                    data.attrs = None
+                    mainDbCacheData[wikiWord] = data
+
+                    if indexEnabled:
+                        try:
+                            if wikiPage.putIntoSearchIndex(content=text,
+                                    liveTextPlaceHold=data.liveTextPlaceHold,
+                                    markIndexed=False):
+                                indexedWords.add(wikiWord)
+                        except:
+                            traceback.print_exc()
+
+                del batch[:]
+
+            startTime = time.time()
+            if indexEnabled:
+                self.beginSearchIndexBulkUpdate()
+
+            for wikiPage, text, data in ParseWorkerPool.iterPageData(
+                    (self._getWikiPageForRebuild(wikiWord)
+                    for wikiWord in wikiWords),
+                    pool=self.getParseWorkerPool()):
+                wikiWord = wikiPage.getWikiWord()
                 progresshandler.update(step, _(u"Update attributes of %s") %
                         wikiWord)
                 try:
-                    wikiPage = self._getWikiPageNoErrorNoCache(wikiWord)
-                    if isinstance(wikiPage, AliasWikiPage):
-                        # This should never be an alias page, so fetch the
-                        # real underlying page
-                        # This can only happen if there is a real page with
-                        # the same name as an alias
-                        wikiPage = WikiPage(self, wikiWord)
+                    if data is not None:
+                        self.getWikiData().refreshFileSignatureForWikiPageName(
+                                wikiWord)
+                        batch.append((wikiPage, text, data))
+                except:
+                    traceback.print_exc()
 
-                    wikiPage.refreshSyncUpdateMatchTerms()
-                    pageAst = wikiPage.getLivePageAst()
+                step += 1
 
-                    self.getWikiData().refreshFileSignatureForWikiPageName(
-                            wikiWord)
-                    wikiPage.refreshAttributesFromPageAst(pageAst)
+                if len(batch) >= self.METADATA_BATCH_SIZE:
+                    flushAttributesBatch()
+
+            flushAttributesBatch()
+
+            if indexEnabled:
+                try:
+                    self.endSearchIndexBulkUpdate()
                 except:
                     traceback.print_exc()
+                    indexedWords.clear()
 
-                step += 1
+            finishPhase(step, _(u"Update attributes"), startTime)
 
-            # Step three: update the rest of the syntax (todos, relations)
-            for wikiWord in wikiWords:
-                progresshandler.update(step, _(u"Update syntax of %s") % wikiWord)
+            # Step three: update the rest of the syntax (todos, relations).
+            #   Pages are only parsed again if their format details
+            #   were changed by attributes in step two.
+            reparseCount = 0
+            batch = []   # List of tuples (wikiPage, data)
+
+            def flushMainDbCacheBatch():
                 try:
-                    wikiPage = self._getWikiPageNoErrorNoCache(wikiWord)
-                    if isinstance(wikiPage, AliasWikiPage):
-                        # This should never be an alias page, so fetch the
-                        # real underlying page
-                        # This can only happen if there is a real page with
-                        # the same name as an alias
-                        wikiPage = WikiPage(self, wikiWord)
+                    for wikiPage, data in self._writeMainDbCacheBatch(batch,
+                            fromRebuild=True):
+                        wikiWord = wikiPage.getWikiWord()
+                        if wikiWord in indexedWords:
+                            self.getWikiData().setMetaDataState(wikiWord,
+                                    Consts.WIKIWORDMETADATA_STATE_INDEXED)
+
+                    self.getWikiData().commit()
+                except:
+                    traceback.print_exc()
 
-                    pageAst = wikiPage.getLivePageAst()
+                del batch[:]
 
-                    wikiPage.refreshMainDbCacheFromPageAst(pageAst)
+            startTime = time.time()
+            for wikiWord in wikiWords:
+                progresshandler.update(step, _(u"Update syntax of %s") % wikiWord)
+                try:
+                    wikiPage = self._getWikiPageForRebuild(wikiWord)
+                    data = mainDbCacheData.pop(wikiWord, None)
+
+                    if data is None or data.formatDetails is None or \
+                            not wikiPage.getFormatDetails().isEquivTo(
+                            data.formatDetails):
+                        reparseCount += 1
+                        pageAst = wikiPage.getLivePageAst()
+                        data = wikiPage.extractMainDbCacheDataFromPageAst(
+                                pageAst)
+
+                    batch.append((wikiPage, data))
                 except:
                     traceback.print_exc()
 
                 step += 1
-            
-            if self.isSearchIndexEnabled():
-                # Step four: update index
-                for wikiWord in wikiWords:
-                    progresshandler.update(step, _(u"Update index of %s") % wikiWord)
-                    try:
-                        wikiPage = self._getWikiPageNoErrorNoCache(wikiWord)
-                        if isinstance(wikiPage, AliasWikiPage):
-                            # This should never be an alias page, so fetch the
-                            # real underlying page
-                            # This can only happen if there is a real page with
-                            # the same name as an alias
-                            wikiPage = WikiPage(self, wikiWord)
-
-                        wikiPage.putIntoSearchIndex()
-
-#                         writer.add_document(unifName="wikipage/"+wikiWord,
-#                                 modTimestamp=wikiPage.getTimestamps()[0],
-#                                 content=content)
-                    except:
-                        traceback.print_exc()
- 
-                    step += 1
+
+                if len(batch) >= self.METADATA_BATCH_SIZE:
+                    flushMainDbCacheBatch()
+
+            flushMainDbCacheBatch()
+            finishPhase(step, _(u"Update syntax (%i pages parsed again)") %
+                    reparseCount, startTime)
 
             progresshandler.update(step - 1, _(u"Final cleanup"))
             # Give possibility to do further reorganisation
             # specific to database backend
+            startTime = time.time()
             self.getWikiData().cleanupAfterRebuild(progresshandler)
+            finishPhase(step, _(u"Final cleanup"), startTime)
 
             self.pushDirtyMetaDataUpdate()
 
         finally:
+            # Only needed if an exception occurred in step two
+            self.endSearchIndexBulkUpdate(cancel=True)
+
             progresshandler.close()
             self.fireMiscEventKeys(("end foreground update",))
             self.updateExecutor.start()
 
+        return timings
+
 
 
     def getWikiWordSubpages(self, wikiWord):
@@ -1670,6 +2267,7 @@ class WikiDataManager(MiscEventSourceMixin):
         oldWikiPage.queueRemoveFromSearchIndex()
         oldWikiPage.informRenamedWikiPage(toWikiWord)
         del self.wikiPageDict[wikiWord]
+        self.wikiPageCache.discardPage(wikiWord)
 
         if modifyText:
             # now we have to search the wiki files and replace the old word with the new
@@ -1840,6 +2438,88 @@ class WikiDataManager(MiscEventSourceMixin):
             return result
 
 
+    def iterSearchWikiHits(self, sarOp, withText=True, maxCount=-1,
+            threadstop=DUMBTHREADSTOP):
+        """
+        Single pass variant of searchWiki() for non-index searches which
+        yields lists of hits while the search is running, one list after
+        each SEARCH_CHUNK_SIZE tested pages (lists may be empty). A hit is a
+        tuple (word, text, spans). The ordering of sarOp is not applied.
+
+        text -- Content the page was tested against. If the test didn't need
+                it, it is loaded only if withText is True, otherwise it may
+                be None.
+        spans -- Occurrences as returned by sarOp.searchAllDocPageAndText()
+                with maxCount, empty if withText is False or the search has
+                no particular text position.
+        """
+        assert sarOp.indexSearch == "no"
+
+        sarOp.beginWikiSearch(self)
+        try:
+            threadstop.testValidThread()
+            findPositions = withText and sarOp.hasParticularTextPosition()
+
+            def buildHit(word, docPage, text):
+                if text is None and withText:
+                    if docPage is None:
+                        docPage = self.getWikiPageNoError(word)
+                    text = docPage.getLiveTextNoTemplate()
+                    if text is None:
+                        return None
+
+                if not findPositions:
+                    return (word, text, [])
+
+                if docPage is None:
+                    docPage = self.getWikiPageNoError(word)
+
+                return (word, text, sarOp.searchAllDocPageAndText(docPage,
+                        text, maxCount))
+
+            # First search currently cached pages with their live text
+            exclusionSet = set()
+            hits = []
+            for k in self.wikiPageDict.keys():
+                wikiPage = self.wikiPageDict.get(k)
+                if wikiPage is None:
+                    continue
+                if isinstance(wikiPage, AliasWikiPage):
+                    # Avoid to process same page twice (alias and real) or more often
+                    continue
+
+                text = wikiPage.getLiveTextNoTemplate()
+                if text is None:
+                    continue
+
+                exclusionSet.add(k)
+                if sarOp.testWikiPage(k, text) == True:
+                    hit = buildHit(k, wikiPage, text)
+                    if hit is not None:
+                        hits.append(hit)
+
+                threadstop.testValidThread()
+
+            yield hits
+
+            # Now search database, each candidate page is read only once
+            wikiData = self.getWikiData()
+            words = wikiData.getSearchCandidateWords(sarOp, exclusionSet)
+            for i in xrange(0, len(words), self.SEARCH_CHUNK_SIZE):
+                threadstop.testValidThread()
+                hits = []
+                for word, text in wikiData.searchWordsWithContent(sarOp,
+                        words[i:i + self.SEARCH_CHUNK_SIZE]):
+                    hit = buildHit(word, None, text)
+                    if hit is not None:
+                        hits.append(hit)
+
+                threadstop.testValidThread()
+                yield hits
+        finally:
+            sarOp.endWikiSearch()
+
+
     @staticmethod
     def getWhooshIndexContentAnalyzer():
         from whoosh.analysis import StandardAnalyzer        
@@ -1888,6 +2568,10 @@ class WikiDataManager(MiscEventSourceMixin):
         self.updateExecutor.clearDeque(self.UEQUEUE_INDEX)
         self.updateExecutor.start()
 
+        with self.searchIndexLock:
+            self.searchIndexPending.clear()
+            self.searchIndexPendingSince = None
+
         if self.whooshIndex is not None:
             self.whooshIndex.close()
             self.whooshIndex = None
@@ -1933,6 +2617,161 @@ class WikiDataManager(MiscEventSourceMixin):
         return self.whooshIndex
 
 
+    def queueSearchIndexUpdate(self, wikiPage, content, liveTextPlaceHold,
+            markIndexed=True):
+        """
+        Add or update wikiPage with text content in the search index
+        by the next call to flushSearchIndexUpdates(). The update is dropped
+        if liveTextPlaceHold isn't current anymore by then.
+        
+        markIndexed -- Set meta-data state to "indexed" when written
+        """
+        self._queueSearchIndexEntry(wikiPage.getUnifiedPageName(),
+                (wikiPage, wikiPage.getTimestamps()[0], content,
+                liveTextPlaceHold, markIndexed))
+
+
+    def queueSearchIndexRemoval(self, unifName):
+        """
+        Remove page with unified name unifName from the search index
+        by the next call to flushSearchIndexUpdates().
+        """
+        self._queueSearchIndexEntry(unifName, None)
+
+
+    def _queueSearchIndexEntry(self, unifName, entry):
+        with self.searchIndexLock:
+            if self.searchIndexBulkWriter is not None:
+                self._writeSearchIndexEntry(self.searchIndexBulkWriter,
+                        unifName, entry, self.searchIndexBulkIndexed)
+                return
+
+            if len(self.searchIndexPending) == 0:
+                self.searchIndexPendingSince = time.time()
+                self.updateExecutor.executeAsync(self.UEQUEUE_INDEX_FLUSH,
+                        self.flushSearchIndexUpdates)
+
+            # A later update of the same page replaces the earlier one
+            self.searchIndexPending[unifName] = entry
+
+            if len(self.searchIndexPending) >= self.SEARCHINDEX_BATCH_SIZE or \
+                    time.time() - self.searchIndexPendingSince >= \
+                    self.SEARCHINDEX_BATCH_DELAY:
+                self.flushSearchIndexUpdates()
+
+
+    @staticmethod
+    def _writeSearchIndexEntry(writer, unifName, entry, indexed):
+        """
+        Write a pending entry as stored in self.searchIndexPending.
+        Pages which should be marked as indexed are appended as tuples
+        (wikiPage, liveTextPlaceHold) to list indexed.
+        """
+        if entry is None:
+            writer.delete_by_term("unifName", unifName)
+            return
+
+        wikiPage, modTimestamp, content, liveTextPlaceHold, markIndexed = entry
+
+        if not liveTextPlaceHold is wikiPage.liveTextPlaceHold:
+            # Page was modified meanwhile, the newer text is queued
+            # when its meta-data is updated
+            return
+
+        writer.delete_by_term("unifName", unifName)
+        writer.add_document(unifName=unifName, modTimestamp=modTimestamp,
+                content=content)
+
+        if markIndexed:
+            indexed.append((wikiPage, liveTextPlaceHold))
+
+
+    def _markSearchIndexed(self, indexed):
+        """
+        Set meta-data state to "indexed" for list of tuples
+        (wikiPage, liveTextPlaceHold) if the text wasn't modified meanwhile.
+        """
+        if len(indexed) == 0:
+            return
+
+        for wikiPage, liveTextPlaceHold in indexed:
+            with wikiPage.getTextOperationLock():
+                if liveTextPlaceHold is wikiPage.liveTextPlaceHold:
+                    self.getWikiData().setMetaDataState(
+                            wikiPage.getWikiWord(),
+                            Consts.WIKIWORDMETADATA_STATE_INDEXED)
+
+        self.getWikiData().commit()
+
+
+    def flushSearchIndexUpdates(self):
+        """
+        Write all pending search index updates with one writer and commit.
+        """
+        with self.searchIndexLock:
+            pending = self.searchIndexPending
+            if len(pending) == 0:
+                return
+
+            self.searchIndexPending = {}
+            self.searchIndexPendingSince = None
+
+            if not self.isSearchIndexEnabled():
+                return
+
+            indexed = []
+            writer = self.getSearchIndex().writer(
+                    timeout=Consts.DEADBLOCKTIMEOUT)
+            try:
+                for unifName, entry in pending.iteritems():
+                    self._writeSearchIndexEntry(writer, unifName, entry,
+                            indexed)
+            except:
+                writer.cancel()
+                raise
+
+            writer.commit()
+            self._markSearchIndexed(indexed)
+
+
+    def beginSearchIndexBulkUpdate(self):
+        """
+        Write all following search index updates with one writer until
+        endSearchIndexBulkUpdate() is called. Used by rebuildWiki().
+        """
+        with self.searchIndexLock:
+            self.flushSearchIndexUpdates()
+
+            if not self.isSearchIndexEnabled():
+                return
+
+            self.searchIndexBulkIndexed = []
+            self.searchIndexBulkWriter = self.getSearchIndex().writer(
+                    timeout=Consts.DEADBLOCKTIMEOUT)
+
+
+    def endSearchIndexBulkUpdate(self, cancel=False):
+        """
+        Commit the writer of the bulk update and merge all segments of the
+        index into one.
+        """
+        with self.searchIndexLock:
+            writer = self.searchIndexBulkWriter
+            if writer is None:
+                return
+
+            self.searchIndexBulkWriter = None
+            indexed = self.searchIndexBulkIndexed
+            self.searchIndexBulkIndexed = None
+
+            if cancel:
+                writer.cancel()
+                return
+
+            writer.commit(optimize=True)
+            self._markSearchIndexed(indexed)
+
+
 #     def rebuildSearchIndex(self, progresshandler, onlyDirty=False):
 #         """
 #         progresshandler -- Object, fulfilling the
@@ -2208,7 +3047,53 @@ class WikiDataManager(MiscEventSourceMixin):
         """
         return self.getWikiData().getGlobalAttributes().get(
                 u"global." + attribute, default)
-        
+
+
+    def getAttributesForWords(self, words):
+        """
+        Function must work for read-only wiki.
+        Return dictionary {word: attrs} for each word of sequence words.
+        attrs is a new dictionary {key: list of values} as returned by
+        WikiPage.getAttributes() of the real page (aliases are resolved).
+        Needs a few queries for all words instead of a page load for each.
+        """
+        realWords = dict((word, self.getWikiPageNameForLinkTermOrAsIs(word))
+                for word in words)
+
+        attrLists = self.getWikiData().getAttributesForWords(
+                set(realWords.itervalues()))
+
+        result = {}
+        for word, realWord in realWords.iteritems():
+            attrs = {}
+            for key, value in attrLists[realWord]:
+                attrs.setdefault(key, []).append(value)
+            result[word] = attrs
+
+        return result
+
+
+    def getTreeNodeDataForWords(self, words, existingonly=False):
+        """
+        Function must work for read-only wiki.
+        Return dictionary {word: (children, attrs)} with the data the tree
+        needs to present a node for each word of sequence words.
+        children is the list of child relations of the real page without
+        self-reference and (if existingonly is True) without undefined words.
+        attrs is the dictionary as in getAttributesForWords().
+        """
+        realWords = dict((word, self.getWikiPageNameForLinkTermOrAsIs(word))
+                for word in words)
+
+        childLists = self.getWikiData().getChildRelationshipsForWords(
+                set(realWords.itervalues()), existingonly=existingonly,
+                selfreference=False)
+
+        attrsDict = self.getAttributesForWords(words)
+
+        return dict((word, (childLists[realWord], attrsDict[word]))
+                for word, realWord in realWords.iteritems())
+
 
     def reconnect(self):
         """
@@ -2289,7 +3174,20 @@ class WikiDataManager(MiscEventSourceMixin):
         It calls StringOps.getFileSignatureBlock with the time coarsening
         given in the wiki options.
         """
-        
+        return getFileSignatureBlock(filename,
+                self._getFileSignatureTimeCoarsening())
+
+
+    def getFileSignatureBlockFromStat(self, statinfo):
+        """
+        Same as getFileSignatureBlock() but takes the os.stat() result of
+        the file. Used when many files are checked at once.
+        """
+        return getFileSignatureBlockFromStat(statinfo,
+                self._getFileSignatureTimeCoarsening())
+
+
+    def _getFileSignatureTimeCoarsening(self):
         coarseStr = self.getWikiConfig().get("main",
                 "fileSignature_timeCoarsening", "0")
 
@@ -2301,7 +3199,7 @@ class WikiDataManager(MiscEventSourceMixin):
         except ValueError:
             coarsening = None
             
-        return getFileSignatureBlock(filename, coarsening)
+        return coarsening
 
 
 
@@ -2330,6 +3228,8 @@ class WikiDataManager(MiscEventSourceMixin):
 
             if miscevt.has_key_in(("deleted wiki page", "renamed wiki page",
                     "pseudo-deleted wiki page")):
+                self.wikiPageCache.discardPage(
+                        miscevt.getSource().getWikiWord())
                 self.autoLinkRelaxInfo = None
                 attrs = miscevt.getProps().copy()
                 attrs["wikiPage"] = miscevt.getSource()
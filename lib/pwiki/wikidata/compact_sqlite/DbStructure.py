@@ -56,6 +56,11 @@ class ConnectWrapBase:
             self.dbCursor.execute(sql)
 
 
+    def execSqlMany(self, sql, seqOfParams):
+        "utility method, executes the sql once for each params tuple"
+        self.dbCursor.executemany(sql, seqOfParams)
+
+
     def execSqlQuery(self, sql, params=None):
         "utility method, executes the sql, returns query result"
         if params:
@@ -259,6 +264,17 @@ class ConnectWrapAsyncCommit(ConnectWrapBase):
         finally:
             self.accessLock.release()
 
+    def execSqlMany(self, sql, seqOfParams):
+        "utility method, executes the sql once for each params tuple"
+        self.accessLock.acquire()
+        try:
+            # Commit first before executing something that changes database
+            self._commitIfPending()
+            self.commitNeeded = True
+            return ConnectWrapBase.execSqlMany(self, sql, seqOfParams)
+        finally:
+            self.accessLock.release()
+
     def execSqlQuery(self, sql, params=None):
         "utility method, executes the sql, returns query result"
         self.accessLock.acquire()
@@ -586,6 +602,112 @@ def recreateCacheTables(connwrap):
 
 
 
+def hasContentIndex(connwrap):
+    """
+    connwrap -- a ConnectWrap object
+    Returns true if the optional full text index of the page content exists
+    """
+    t1 = connwrap.execSqlQuerySingleItem("select name from sqlite_master "
+            "where name='wikiwordcontentindex'", default=None)
+    return not t1 is None
+
+
+def getContentIndexSignature(connwrap):
+    """
+    Return a string which changes (most probably) if pages are added,
+    deleted or modified or if their rowids change. It is computed from
+    index "wikiwords_modified" only so it is cheap to retrieve.
+    """
+    row = connwrap.execSqlQuery("select count(*), total(modified), "
+            "total(rowid) from wikiwordcontent")[0]
+
+    return "%i %r %r" % tuple(row)
+
+
+def rebuildContentIndex(connwrap):
+    """
+    Fill the full text index again from the content of all pages
+    """
+    connwrap.execSql("insert into wikiwordcontentindex(wikiwordcontentindex) "
+            "values ('rebuild')")
+    storeContentIndexSignature(connwrap)
+
+
+def storeContentIndexSignature(connwrap):
+    """
+    Remember that the full text index is up to date with the current content
+    """
+    connwrap.execSql("insert or replace into settings(key, value) "
+            "values ('contentindexsignature', ?)",
+            (getContentIndexSignature(connwrap),))
+
+
+def isContentIndexCurrent(connwrap):
+    """
+    Returns True if the optional full text index exists, can be used by the
+    sqlite library and is up to date with the page content (as far as the
+    stored signature can tell). Doesn't modify the database.
+    """
+    if not hasContentIndex(connwrap):
+        return False
+
+    try:
+        # Fails if sqlite library doesn't know FTS5 or trigram tokenizer
+        connwrap.execSqlQuery("select rowid from wikiwordcontentindex "
+                "limit 0")
+    except sqlite.Error:
+        return False
+
+    return getSettingsValue(connwrap, "contentindexsignature") == \
+            getContentIndexSignature(connwrap)
+
+
+def prepareContentIndex(connwrap):
+    """
+    Create the optional full text index "wikiwordcontentindex" of the page
+    content if it doesn't exist or rebuild it if it isn't current (the
+    content was modified while the index wasn't maintained).
+
+    The index is an FTS5 table with the trigram tokenizer and uses
+    "wikiwordcontent" as external content table so the rowids of both
+    tables correspond. It needs sqlite 3.34 or later.
+
+    Returns True if the index is usable and must be kept up to date.
+    """
+    if isContentIndexCurrent(connwrap):
+        return True
+
+    # Don't roll back pending changes on failure
+    connwrap.syncCommit()
+
+    try:
+        if not hasContentIndex(connwrap):
+            connwrap.execSql("create virtual table wikiwordcontentindex "
+                    "using fts5(content, content='wikiwordcontent', "
+                    "tokenize='trigram')")
+
+        rebuildContentIndex(connwrap)
+
+        connwrap.syncCommit()
+        return True
+    except sqlite.Error:
+        # Unsupported by sqlite library or read-only database
+        connwrap.rollback()
+        return False
+
+
+def dropContentIndex(connwrap):
+    """
+    Remove the optional full text index (if present) to free its space
+    """
+    if not hasContentIndex(connwrap):
+        return
+
+    connwrap.execSql("drop table wikiwordcontentindex")
+    connwrap.execSql("delete from settings where key = 'contentindexsignature'")
+
+
+
 ####################################################
 # module level functions
 ####################################################
@@ -794,7 +916,7 @@ def sqlite_testMatch(context, values):
     """
     nakedword = utf8Dec(values[0].value_blob(), "replace")[0]
     fileContents = utf8Dec(values[1].value_blob(), "replace")[0]
-    sarOp = sqlite.getTransObject(values[2].value_int())
+    sarOp = sqlite.getTransObject(values[2].value_int64())
     if sarOp.testWikiPage(nakedword, fileContents) == True:
         context.result_int(1)
     else:
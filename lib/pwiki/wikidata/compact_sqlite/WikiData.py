@@ -18,7 +18,7 @@ import os, os.path
 
 from time import time, localtime
 import datetime
-import string, glob, traceback
+import string, glob, traceback, re, bisect
 
 from wx import GetApp
 
@@ -45,12 +45,253 @@ from pwiki.StringOps import getBinCompactForDiff, applyBinCompact, longPathEnc,
 
 import Consts
 
+
+# Number of words per query in bulk functions, SQLite allows at most 999
+# parameters per statement
+_BULK_QUERY_CHUNK_SIZE = 500
+
+
+def _iterChunks(seq, size=_BULK_QUERY_CHUNK_SIZE):
+    for i in xrange(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def _insortUnique(seq, item):
+    pos = bisect.bisect_left(seq, item)
+    if pos == len(seq) or seq[pos] != item:
+        seq.insert(pos, item)
+
+
+def _removeSorted(seq, item):
+    pos = bisect.bisect_left(seq, item)
+    if pos < len(seq) and seq[pos] == item:
+        del seq[pos]
+
+
+def _iterSortedStartingWith(seq, thisStr):
+    for i in xrange(bisect.bisect_left(seq, thisStr), len(seq)):
+        if not seq[i].startswith(thisStr):
+            break
+        yield seq[i]
+
+
+class WikiPageLinkTermIndex(object):
+    """
+    In-memory index of all wiki page link terms, these are the page names
+    and the match terms of type ASLINK. Page names and terms are held in
+    sorted lists, so a prefix query needs O(log n) plus the number of
+    results.
+    The index is updated by WikiData when pages or match terms change.
+    """
+    def __init__(self, pageNames, matchTerms):
+        """
+        pageNames -- iterable of all page names
+        matchTerms -- iterable of tuples (matchterm, type, word) of all
+                match terms of type ASLINK
+        """
+        self.pageNames = set(pageNames)
+        self.sortedPageNames = sorted(self.pageNames)
+
+        self.termWords = {}   # {matchterm: list of words}
+        self.wordTerms = {}   # {(word, syncUpdate): list of matchterms}
+
+        for matchterm, typ, word in matchTerms:
+            self._addMatchTermEntry(matchterm, typ, word)
+
+        self.sortedTerms = sorted(self.termWords)
+        # Sorted tuples (normcased matchterm, matchterm)
+        self.sortedNormTerms = sorted((t.lower(), t) for t in self.termWords)
+
+
+    def get(self, key, default=None):
+        if key in self.pageNames:
+            return key
+
+        words = self.termWords.get(key)
+        if not words:
+            return default
+
+        return words[0]
+
+
+    def keys(self):
+        return list(self.pageNames.union(self.termWords))
+
+
+    def getLinkTermsStartingWith(self, thisStr, caseNormed=False):
+        """
+        Return list of page names and match terms starting with thisStr.
+        If caseNormed is True, only match terms are compared with normcased
+        thisStr.
+        """
+        if caseNormed:
+            thisStr = thisStr.lower()   # TODO More general normcase function
+            result = []
+            for i in xrange(bisect.bisect_left(self.sortedNormTerms,
+                    (thisStr,)), len(self.sortedNormTerms)):
+                normTerm, term = self.sortedNormTerms[i]
+                if not normTerm.startswith(thisStr):
+                    break
+                result.append(term)
+
+            return result
+
+        result = list(_iterSortedStartingWith(self.sortedTerms, thisStr))
+        result += [w for w in _iterSortedStartingWith(self.sortedPageNames,
+                thisStr) if w not in self.termWords]
+
+        return result
+
+
+    def addPageName(self, word):
+        if word in self.pageNames:
+            return
+
+        self.pageNames.add(word)
+        _insortUnique(self.sortedPageNames, word)
+
+
+    def removePageName(self, word):
+        if word not in self.pageNames:
+            return
+
+        self.pageNames.discard(word)
+        _removeSorted(self.sortedPageNames, word)
+
+
+    def renamePageName(self, oldWord, newWord):
+        if oldWord not in self.pageNames:
+            return
+
+        self.removePageName(oldWord)
+        self.addPageName(newWord)
+
+
+    def _addMatchTermEntry(self, matchterm, typ, word):
+        """
+        Add matchterm to dictionaries. Returns True if the term
+        wasn't present before.
+        """
+        syncUpdate = (typ & Consts.WIKIWORDMATCHTERMS_TYPE_SYNCUPDATE) != 0
+        self.wordTerms.setdefault((word, syncUpdate), []).append(matchterm)
+
+        words = self.termWords.get(matchterm)
+        if words is None:
+            self.termWords[matchterm] = [word]
+            return True
+
+        words.append(word)
+        return False
+
+
+    def addMatchTerm(self, matchterm, typ, word):
+        if (typ & Consts.WIKIWORDMATCHTERMS_TYPE_ASLINK) == 0:
+            return
+
+        if self._addMatchTermEntry(matchterm, typ, word):
+            _insortUnique(self.sortedTerms, matchterm)
+            _insortUnique(self.sortedNormTerms, (matchterm.lower(), matchterm))
+
+
+    def removeMatchTermsForWord(self, word, syncUpdate=False):
+        """
+        Remove match terms of word which were created by synchronous
+        update (syncUpdate is True) or not.
+        """
+        for matchterm in self.wordTerms.pop((word, syncUpdate), ()):
+            words = self.termWords[matchterm]
+            words.remove(word)
+            if not words:
+                del self.termWords[matchterm]
+                _removeSorted(self.sortedTerms, matchterm)
+                _removeSorted(self.sortedNormTerms,
+                        (matchterm.lower(), matchterm))
+
+
+    def renameMatchTermsWord(self, oldWord, newWord):
+        """
+        Match terms of oldWord now belong to newWord.
+        """
+        for syncUpdate in (False, True):
+            matchterms = self.wordTerms.pop((oldWord, syncUpdate), None)
+            if matchterms is None:
+                continue
+
+            self.wordTerms.setdefault((newWord, syncUpdate), []).extend(
+                    matchterms)
+            for matchterm in matchterms:
+                words = self.termWords[matchterm]
+                words[words.index(oldWord)] = newWord
+
+
+
+class WikiRelationGraph(object):
+    """
+    In-memory copy of the wikirelations table as adjacency lists in both
+    directions. Children of a word are sorted as the database returns them
+    for a word.
+    The graph is updated by WikiData when child relations change.
+    """
+    def __init__(self, relations):
+        """
+        relations -- iterable of tuples (word, relation)
+        """
+        self.children = {}   # {word: list of relations}
+        self.parents = {}   # {relation: list of words}
+
+        for word, relation in relations:
+            self.children.setdefault(word, []).append(relation)
+            self.parents.setdefault(relation, []).append(word)
+
+        for children in self.children.itervalues():
+            children.sort()
+
+
+    def getChildren(self, word):
+        return self.children.get(word, ())
+
+
+    def getParents(self, relation):
+        return self.parents.get(relation, ())
+
+
+    def deleteChildren(self, word):
+        for relation in self.children.pop(word, ()):
+            words = self.parents[relation]
+            words.remove(word)
+            if not words:
+                del self.parents[relation]
+
+
+    def setChildren(self, word, relations):
+        """
+        Replace children of word by sequence relations.
+        """
+        self.deleteChildren(word)
+
+        # Relation is unique as in the wikirelations table
+        children = sorted(set(relations))
+        for relation in children:
+            self.parents.setdefault(relation, []).append(word)
+
+        if children:
+            self.children[word] = children
+
+
+
 class WikiData:
     "Interface to wiki data."
     def __init__(self, wikiDocument, dataDir, tempDir):
         self.wikiDocument = wikiDocument
         self.dataDir = dataDir
-        self.cachedWikiPageLinkTermDict = None
+        self.linkTermIndex = None
+        self.relationGraph = None
+        # Content index is current and kept up to date
+        self.contentIndexUsable = False
+        # Content index state was checked once in this session
+        self.contentIndexChecked = False
+        # Creating the content index failed, don't try again in this session
+        self.contentIndexFailed = False
 
         dbPath = self.wikiDocument.getWikiConfig().get("wiki_db", "db_filename",
                 u"").strip()
@@ -175,11 +416,9 @@ class WikiData:
         self.contentUniInputToDb = contentUniInputToDb
 
         try:
-            if not recoveryMode:
-                self._createTempTables()
-
             # reset cache
-            self.cachedWikiPageLinkTermDict = None
+            self.linkTermIndex = None
+            self.relationGraph = None
             self.cachedGlobalAttrs = None
             
             if not recoveryMode:
@@ -204,19 +443,6 @@ class WikiData:
         pass        
 
 
-    def _createTempTables(self):
-        # Temporary table for findBestPathFromWordToWord
-        # TODO: Possible for read-only dbs?
-
-        # These schema changes are only on a temporary table so they are not
-        # in DbStructure.py
-        self.connWrap.execSql("create temp table temppathfindparents "
-                "(word text primary key, child text, steps integer)")
-
-        self.connWrap.execSql("create index temppathfindparents_steps "
-                "on temppathfindparents(steps)")
-
-
     # ---------- Direct handling of page data ----------
 
     def getContent(self, word):
@@ -255,6 +481,57 @@ class WikiData:
             raise DbReadAccessError(e)
 
 
+    def getWikiPageContentsAfter(self, word, limit):
+        """
+        Returns a list of at most limit tuples
+        (word, content, modified, created, visited) for the wiki pages
+        following word in name order (or starting with the first page if
+        word is None). Call it repeatedly with the last returned name to
+        read all pages with bounded memory.
+        Must be implemented if checkCapability returns a version number
+        for "content paging".
+        Function must work for read-only wiki.
+        """
+        try:
+            if word is None:
+                result = self.connWrap.execSqlQuery("select word, content, "
+                        "modified, created, visited from wikiwordcontent "
+                        "order by word limit ?", (limit,))
+            else:
+                result = self.connWrap.execSqlQuery("select word, content, "
+                        "modified, created, visited from wikiwordcontent "
+                        "where word > ? order by word limit ?", (word, limit))
+
+            return [(w, self.contentDbToOutput(c), float(m), float(cr),
+                    float(v)) for w, c, m, cr, v in result]
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
+    def getWikiPageContentsForWords(self, words):
+        """
+        Returns a list of tuples (word, content, modified, created, visited)
+        for those of the given words which have a page, in no particular
+        order.
+        Function must work for read-only wiki.
+        """
+        result = []
+        try:
+            for chunk in _iterChunks(words):
+                for w, c, m, cr, v in self.connWrap.execSqlQuery(
+                        "select word, content, modified, created, visited "
+                        "from wikiwordcontent where word in (%s)" %
+                        ", ".join(["?"] * len(chunk)), chunk):
+                    result.append((w, self.contentDbToOutput(c), float(m),
+                            float(cr), float(v)))
+
+            return result
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
     def iterAllWikiPages(self):
         """
         Returns iterator over all wiki pages. Each iteration returns a tuple
@@ -269,7 +546,7 @@ class WikiData:
     def setContent(self, word, content, moddate = None, creadate = None):
         """
         Sets the content, does not modify the cache information
-        except self.cachedWikiPageLinkTermDict
+        except self.linkTermIndex
         """
         if not content: content = u""  # ?
         
@@ -278,13 +555,11 @@ class WikiData:
         content = self.contentUniInputToDb(content)
         self.setContentRaw(word, content, moddate, creadate)
 
-        self.cachedWikiPageLinkTermDict = None
-
 
     def setContentRaw(self, word, content, moddate = None, creadate = None):
         """
         Sets the content without applying any encoding, used by versioning,
-        does not modify the cache information
+        does not modify the cache information except self.linkTermIndex
         
         moddate -- Modification date to store or None for current
         creadate -- Creation date to store or None for current 
@@ -299,6 +574,8 @@ class WikiData:
         
         assert type(content) is str
 
+        self._checkContentIndex()
+
         try:
             if self.connWrap.execSqlQuerySingleItem("select word from "+\
                     "wikiwordcontent where word=?", (word,), None) is not None:
@@ -307,6 +584,7 @@ class WikiData:
     #             self.connWrap.execSql("insert or replace into wikiwordcontent"+\
     #                 "(word, content, modified) values (?,?,?)",
     #                 (word, sqlite.Binary(content), moddate))
+                self._removeFromContentIndex(word)
                 self.connWrap.execSql("update wikiwordcontent set "
                     "content=?, modified=? where word=?",
                     (sqlite.Binary(content), moddate, word))
@@ -319,6 +597,11 @@ class WikiData:
                     "(word, content, modified, created) "
                     "values (?,?,?,?)",
                     (word, sqlite.Binary(content), moddate, creadate))
+
+                if self.linkTermIndex is not None:
+                    self.linkTermIndex.addPageName(word)
+
+            self._addToContentIndex(word)
         except (IOError, OSError, sqlite.Error), e:
             traceback.print_exc()
             raise DbWriteAccessError(e)
@@ -327,28 +610,98 @@ class WikiData:
     def _renameContent(self, oldWord, newWord):
         """
         The content which was stored under oldWord is stored
-        after the call under newWord. The self.cachedWikiPageLinkTermDict
-        dictionary is updated, other caches won't be updated.
+        after the call under newWord. The self.linkTermIndex
+        is updated, other caches won't be updated.
         """
         try:
+            # Rowid doesn't change so the content index stays valid
             self.connWrap.execSql("update wikiwordcontent set word = ? "
                     "where word = ?", (newWord, oldWord))
     
-            self.cachedWikiPageLinkTermDict = None
+            if self.linkTermIndex is not None:
+                self.linkTermIndex.renamePageName(oldWord, newWord)
         except (IOError, OSError, sqlite.Error), e:
             traceback.print_exc()
             raise DbWriteAccessError(e)
 
 
     def _deleteContent(self, word):
+        self._checkContentIndex()
+
         try:
+            self._removeFromContentIndex(word)
             self.connWrap.execSql("delete from wikiwordcontent where word = ?", (word,))
-            self.cachedWikiPageLinkTermDict = None
+            if self.linkTermIndex is not None:
+                self.linkTermIndex.removePageName(word)
         except (IOError, OSError, sqlite.Error), e:
             traceback.print_exc()
             raise DbWriteAccessError(e)
 
 
+    def _isContentIndexEnabled(self):
+        return self.wikiDocument.getWikiConfig().getboolean("main",
+                "search_contentIndex_enabled", False)
+
+
+    def _checkContentIndex(self):
+        """
+        Find out once per session if the full text index is current and
+        should be kept up to date. Must be called before the content is
+        modified for the first time because the check compares the stored
+        signature with the content.
+        """
+        if self.contentIndexChecked:
+            return
+
+        self.contentIndexChecked = True
+        try:
+            self.contentIndexUsable = self._isContentIndexEnabled() and \
+                    DbStructure.isContentIndexCurrent(self.connWrap)
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            self.contentIndexUsable = False
+
+
+    def _prepareContentIndex(self):
+        """
+        Called before searching. Create or rebuild the full text index
+        if it is enabled but not current, stop maintaining it if it was
+        disabled.
+        """
+        if not self._isContentIndexEnabled():
+            self.contentIndexUsable = False
+            return
+
+        self._checkContentIndex()
+        if not self.contentIndexUsable and not self.contentIndexFailed:
+            self.contentIndexUsable = DbStructure.prepareContentIndex(
+                    self.connWrap)
+            self.contentIndexFailed = not self.contentIndexUsable
+
+
+    def _removeFromContentIndex(self, word):
+        """
+        Remove the content of word from the full text index (if used).
+        Must be called before the content is modified or deleted because
+        the index needs the old content to find its entries.
+        """
+        if self.contentIndexUsable:
+            self.connWrap.execSql("insert into wikiwordcontentindex"
+                    "(wikiwordcontentindex, rowid, content) select 'delete', "
+                    "rowid, content from wikiwordcontent where word = ?",
+                    (word,))
+
+
+    def _addToContentIndex(self, word):
+        """
+        Add the content of word to the full text index (if used).
+        """
+        if self.contentIndexUsable:
+            self.connWrap.execSql("insert into wikiwordcontentindex"
+                    "(rowid, content) select rowid, content from "
+                    "wikiwordcontent where word = ?", (word,))
+
+
     def getTimestamps(self, word):
         """
         Returns a tuple with modification, creation and visit date of
@@ -377,6 +730,9 @@ class WikiData:
         """
         moddate, creadate, visitdate = timestamps[:3]
 
+        # Modification date is part of the content index signature
+        self._checkContentIndex()
+
         try:
             data = self.connWrap.execSqlQuery("select word from wikiwordcontent "
                     "where word = ?", (word,))
@@ -507,13 +863,21 @@ class WikiData:
 
             try:
                 self.connWrap.execSql("update wikirelations set word = ? where word = ?", (toWord, word))
+                if self.relationGraph is not None:
+                    self.relationGraph.setChildren(toWord,
+                            list(self.relationGraph.getChildren(word)))
+                    self.relationGraph.deleteChildren(word)
                 self.connWrap.execSql("update wikiwordattrs set word = ? where word = ?", (toWord, word))
                 self.connWrap.execSql("update todos set word = ? where word = ?", (toWord, word))
                 self.connWrap.execSql("update wikiwordmatchterms set word = ? where word = ?", (toWord, word))
+                if self.linkTermIndex is not None:
+                    self.linkTermIndex.renameMatchTermsWord(word, toWord)
                 self._renameContent(word, toWord)
                 self.connWrap.commit()
             except:
                 self.connWrap.rollback()
+                self.linkTermIndex = None
+                self.relationGraph = None
                 raise
         except (IOError, OSError, sqlite.Error), e:
             traceback.print_exc()
@@ -546,6 +910,8 @@ class WikiData:
                     self.connWrap.commit()
                 except:
                     self.connWrap.rollback()
+                    self.linkTermIndex = None
+                    self.relationGraph = None
                     raise
             except (IOError, OSError, sqlite.Error), e:
                 traceback.print_exc()
@@ -621,6 +987,15 @@ class WikiData:
         return True
 
 
+    def getWikiPageNamesWithChangedFileSignature(self, filePaths=None):
+        """
+        Returns list of names of all pages for which the file signature
+        stored in DB doesn't match the file containing the content.
+        For compact_sqlite it always returns an empty list.
+        """
+        return []
+
+
     def refreshFileSignatureForWikiPageName(self, word):
         """
         Sets file signature to match current file.
@@ -699,6 +1074,32 @@ class WikiData:
             raise DbReadAccessError(e)
 
 
+    def getChildRelationshipsForWords(self, words, existingonly=False,
+            selfreference=True):
+        """
+        Bulk version of getChildRelationships() (without withFields) for
+        a sequence of real page names. Returns dictionary
+        {word: list of child relations} with an entry for each word.
+        Function must work for read-only wiki.
+        """
+        graph = self._getRelationGraph()
+        if existingonly:
+            linkTermIndex = self._getLinkTermIndex()
+
+        result = {}
+        for word in words:
+            children = graph.getChildren(word)
+            if not selfreference:
+                children = [c for c in children if c != word]
+            if existingonly:
+                children = [c for c in children
+                        if linkTermIndex.get(c) is not None]
+
+            result[word] = list(children)
+
+        return result
+
+
     def getParentRelationships(self, wikiWord):
         """
         get the parent relations to this word
@@ -773,6 +1174,23 @@ class WikiData:
             raise DbReadAccessError(e)
 
 
+    def _getRelationGraph(self):
+        """
+        Return the WikiRelationGraph, build it if necessary.
+        Function works for read-only wiki.
+        """
+        try:
+            if self.relationGraph is None:
+                self.relationGraph = WikiRelationGraph(
+                        self.connWrap.execSqlQuery(
+                        "select word, relation from wikirelations"))
+
+            return self.relationGraph
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
     def _addRelationship(self, word, rel):
         """
         Add a relationship from word to rel. rel is a tuple (toWord, pos).
@@ -792,16 +1210,21 @@ class WikiData:
         for r in childRelations:
             self._addRelationship(word, r)
 
+        if self.relationGraph is not None:
+            self.relationGraph.setChildren(word,
+                    [r[0] for r in childRelations])
+
     def deleteChildRelationships(self, fromWord):
         try:
             self.connWrap.execSql("delete from wikirelations where word = ?",
                     (fromWord,))
+            if self.relationGraph is not None:
+                self.relationGraph.deleteChildren(fromWord)
         except (IOError, OSError, sqlite.Error), e:
             traceback.print_exc()
             raise DbWriteAccessError(e)
 
 
-    # TODO Maybe optimize
     def getAllSubWords(self, words, level=-1):
         """
         Return all words which are children, grandchildren, etc.
@@ -809,30 +1232,33 @@ class WikiData:
         functions. All returned words are real existing words, no aliases.
         Function must work for read-only wiki.
         """
+        graph = self._getRelationGraph()
+        linkTermIndex = self._getLinkTermIndex()
+
         checkList = [(w, 0)
-                for w in (self.getWikiPageNameForLinkTerm(w) for w in words)
+                for w in (linkTermIndex.get(w) for w in words)
                 if w is not None]
         checkList.reverse()
         
-        resultSet = {}
+        resultSet = set()
         result = []
 
         while len(checkList) > 0:
             toCheck, chLevel = checkList.pop()
-            if resultSet.has_key(toCheck):
+            if toCheck in resultSet:
                 continue
 
             result.append(toCheck)
-            resultSet[toCheck] = None
+            resultSet.add(toCheck)
             
             if level > -1 and chLevel >= level:
                 continue  # Don't go deeper
-            
-            children = self.getChildRelationships(toCheck, existingonly=True,
-                    selfreference=False)
-                    
-            children = [(self.getWikiPageNameForLinkTerm(c), chLevel + 1)
-                    for c in children]
+
+            # Only existing words or aliases, no self reference
+            children = [(c, chLevel + 1)
+                    for c in (linkTermIndex.get(c)
+                        for c in graph.getChildren(toCheck) if c != toCheck)
+                    if c is not None and c not in resultSet]
             children.reverse()
             checkList += children
 
@@ -845,61 +1271,43 @@ class WikiData:
         word and toWord are included as first/last element. If word == toWord,
         it is included only once as the single element of the list.
         If there is no path from word to toWord, [] is returned
-        Function must work for read-only wiki (should hold although function
-        writes to temporary table).
+        Function must work for read-only wiki.
         """
         # TODO Aliases supported?
         
         if word == toWord:
             return [word]
-        try:
-            # Clear temporary table
-            self.connWrap.execSql("delete from temppathfindparents")
-    
-            self.connWrap.execSql("insert into temppathfindparents "+
-                    "(word, child, steps) select word, relation, 1 from wikirelations "+
-                    "where relation = ?", (word,))
 
-            step = 1
-            while True:
-                changes = self.connWrap.rowcount
-    
-                if changes == 0:
-                    # No more (grand-)parents
-                    return []
-
-                if self.connWrap.execSqlQuerySingleItem("select word from "+
-                        "temppathfindparents where word=?", (toWord,)) is not None:
-                    # Path found
-                    result = [toWord]
-                    crumb = toWord
-    
-                    while crumb != word:
-                        crumb = self.connWrap.execSqlQuerySingleItem(
-                                "select child from temppathfindparents where "+
-                                "word=?", (crumb,))
-                        result.append(crumb)
+        graph = self._getRelationGraph()
 
-                    # print "findBestPathFromWordToWord result", word, toWord, repr(result)
-    
-                    # Clear temporary table
-                    self.connWrap.execSql("delete from temppathfindparents")
+        # Breadth-first search, crumbs maps each reached parent to the
+        # child through which it was reached first
+        crumbs = {}
+        current = [word]
 
-                    return result
-    
-                self.connWrap.execSql("""
-                    insert or ignore into temppathfindparents (word, child, steps)
-                    select wikirelations.word, temppathfindparents.word, ? from
-                        temppathfindparents inner join wikirelations on
-                        temppathfindparents.word == wikirelations.relation where
-                        temppathfindparents.steps == ?
-                    """, (step+1, step))
-    
-                step += 1
-        
-        except (IOError, OSError, sqlite.Error), e:
-            traceback.print_exc()
-            raise DbReadAccessError(e)
+        while len(current) > 0:
+            found = []
+            for child in current:
+                for parent in graph.getParents(child):
+                    if parent not in crumbs:
+                        crumbs[parent] = child
+                        found.append(parent)
+
+            if toWord in crumbs:
+                # Path found
+                result = [toWord]
+                crumb = toWord
+
+                while crumb != word:
+                    crumb = crumbs[crumb]
+                    result.append(crumb)
+
+                return result
+
+            current = found
+
+        # No more (grand-)parents
+        return []
 
 
     # ---------- Listing/Searching wiki words (see also "alias handling", "searching pages")----------
@@ -955,79 +1363,28 @@ class WikiData:
         so it must not rely on the presence of other cache
         information (e.g. relations).
 
-        The self.cachedWikiPageLinkTermDict is invalidated.
+        The self.linkTermIndex is invalidated and rebuilt on next use.
         """
-        self.cachedWikiPageLinkTermDict = None
+        self.linkTermIndex = None
 
 
 
-    def _getCachedWikiPageLinkTermDict(self):
+    def _getLinkTermIndex(self):
         """
+        Return the WikiPageLinkTermIndex, build it if necessary.
         Function works for read-only wiki.
         """
-        class CachedWikiPageLinkTermDict(object):
-            def __init__(self, outer):
-                self.outer = outer
-                self.cache = {}
-                self.cacheNonExistent = set()
-                self.cacheComplete = False
-                
-            def get(self, key, default=None):
-                if self.cacheComplete:
-                    return self.cache.get(key, default)
-                
-                if self.cache.has_key(key):
-                    return self.cache.get(key, default)
-                    
-                if key in self.cacheNonExistent:
-                    return default
-                
-                try:
-                    value = self.lookup(key)
-                    self.cache[key] = value
-                    return value
-                except KeyError:
-                    self.cacheNonExistent.add(key)
-                    return default
-            
-            def lookup(self, key):
-                if self.outer.isDefinedWikiPageName(key):
-                    return key
-                
-                try:
-                    value = self.outer.connWrap.execSqlQuerySingleItem(
-                            "select word from wikiwordmatchterms "
-                            "where matchterm = ? and (type & 2) != 0 ", (key,))
-                    # Consts.WIKIWORDMATCHTERMS_TYPE_ASLINK == 2
-                except (IOError, OSError, sqlite.Error), e:
-                    traceback.print_exc()
-                    raise DbReadAccessError(e)
-                
-                if value is None:
-                    raise KeyError(key)
-                
-                return value
-
-
-            def keys(self):
-                if not self.cacheComplete:
-                    self.cache = dict(self.outer.connWrap.execSqlQuery(
-                            "select word, word from wikiwordcontent union "
-                            "select matchterm, word from wikiwordmatchterms "
-                            "where (type & 2) != 0 and not matchterm in "
-                            "(select word from wikiwordcontent)"))
-                    # Consts.WIKIWORDMATCHTERMS_TYPE_ASLINK == 2
-                    self.cacheComplete = True
-                    self.cacheNonExistent = set()
-
-                return self.cache.keys()
-
-
         try:
-            if self.cachedWikiPageLinkTermDict is None:
-                self.cachedWikiPageLinkTermDict = CachedWikiPageLinkTermDict(self)
+            if self.linkTermIndex is None:
+                self.linkTermIndex = WikiPageLinkTermIndex(
+                        self.connWrap.execSqlQuerySingleColumn(
+                            "select word from wikiwordcontent"),
+                        self.connWrap.execSqlQuery(
+                            "select matchterm, type, word from wikiwordmatchterms "
+                            "where (type & 2) != 0"))
+                # Consts.WIKIWORDMATCHTERMS_TYPE_ASLINK == 2
 
-            return self.cachedWikiPageLinkTermDict
+            return self.linkTermIndex
         except (IOError, OSError, sqlite.Error), e:
             traceback.print_exc()
             raise DbReadAccessError(e)
@@ -1068,46 +1425,18 @@ class WikiData:
         Return all links stored by production (in contrast to resolution)
         Function must work for read-only wiki.
         """
-        return self._getCachedWikiPageLinkTermDict().keys()
+        return self._getLinkTermIndex().keys()
 
 
     def getWikiPageLinkTermsStartingWith(self, thisStr, caseNormed=False):
         """
         Get the list of wiki page link terms (page names or aliases)
         starting with thisStr. Used for autocompletion.
+        If caseNormed is True, only match terms are searched, compared
+        case-insensitively.
         """
-        if caseNormed:
-            thisStr = sqlite.escapeForGlob(thisStr.lower())   # TODO More general normcase function
-
-            try:
-                return self.connWrap.execSqlQuerySingleColumn(
-                        "select matchterm from wikiwordmatchterms "
-                        "where matchtermnormcase glob (? || '*') and "
-                        "(type & 2) != 0", 
-                        (thisStr,))
-                # Consts.WIKIWORDMATCHTERMS_TYPE_ASLINK == 2
-
-            except (IOError, OSError, sqlite.Error), e:
-                traceback.print_exc()
-                raise DbReadAccessError(e)
-
-        else:
-            try:
-                thisStr = sqlite.escapeForGlob(thisStr)
-
-                # To ensure that at least all real wikiwords are found,
-                # the wikiwords table is also read
-                return self.connWrap.execSqlQuerySingleColumn(
-                        "select matchterm from wikiwordmatchterms "
-                        "where matchterm glob (? || '*') and "
-                        "(type & 2) != 0 union "
-                        "select word from wikiwordcontent where word glob (? || '*')", 
-                        (thisStr,thisStr))
-                # Consts.WIKIWORDMATCHTERMS_TYPE_ASLINK == 2
-
-            except (IOError, OSError, sqlite.Error), e:
-                traceback.print_exc()
-                raise DbReadAccessError(e)
+        return self._getLinkTermIndex().getLinkTermsStartingWith(thisStr,
+                caseNormed)
 
 
     def getWikiPageNamesModifiedWithin(self, startTime, endTime):
@@ -1380,6 +1709,27 @@ class WikiData:
             raise DbReadAccessError(e)
 
 
+    def getAttributesForWords(self, words):
+        """
+        Bulk version of getAttributesForWord(). Returns dictionary
+        {word: list of tuples (key, value)} with an entry for each word.
+        Function must work for read-only wiki.
+        """
+        result = dict((word, []) for word in words)
+        try:
+            for chunk in _iterChunks(list(result)):
+                for word, key, value in self.connWrap.execSqlQuery(
+                        "select word, key, value from wikiwordattrs "
+                        "where word in (%s)" % ", ".join(["?"] * len(chunk)),
+                        chunk):
+                    result[word].append((key, value))
+
+            return result
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
     def _setAttribute(self, word, key, value):
         try:
             self.connWrap.execSql(
@@ -1454,7 +1804,7 @@ class WikiData:
         of unaliasing must be performed in WikiDocument.
         Function must work for read-only wiki.
         """
-        return self._getCachedWikiPageLinkTermDict().get(alias, None)
+        return self._getLinkTermIndex().get(alias, None)
 
 
     # TODO: 2.4: Remove compatibility definitions
@@ -1610,6 +1960,8 @@ class WikiData:
                     "values (?, ?, ?, ?, ?, ?)",
                     (matchterm, typ, word, firstcharpos, charlength,
                     matchterm.lower()))
+            if self.linkTermIndex is not None:
+                self.linkTermIndex.addMatchTerm(matchterm, typ, word)
         except (IOError, OSError, sqlite.Error), e:
             traceback.print_exc()
             raise DbWriteAccessError(e)
@@ -1625,12 +1977,120 @@ class WikiData:
         try:
             self.connWrap.execSql("delete from wikiwordmatchterms where "
                     "word = ?" + addSql, (word,))
-            self.cachedWikiPageLinkTermDict = None
+            if self.linkTermIndex is not None:
+                self.linkTermIndex.removeMatchTermsForWord(word, syncUpdate)
         except (IOError, OSError, sqlite.Error), e:
             traceback.print_exc()
             raise DbWriteAccessError(e)
 
 
+    # ---------- Batch update of meta-data ----------
+
+    def updateMetaDataBatch(self, entries):
+        """
+        Update meta-data of many wiki words at once. All rows of one table
+        are written by one executemany() call. Like the single update functions
+        it doesn't commit, call commit() afterwards to write the whole
+        batch in one transaction.
+
+        entries -- Sequence of tuples (word, attrs, todos, childRelations,
+            wwmTerms) with arguments as for updateAttributes(), updateTodos(),
+            updateChildRelations() and updateWikiWordMatchTerms() (without
+            synchronously updated match terms). Each of the last four can
+            be None to leave this part unchanged.
+
+        Returns list of words which were skipped because they don't exist.
+        """
+        skipped = []
+
+        attrWords = []
+        attrRows = []
+        todoWords = []
+        todoRows = []
+        relationWords = []
+        relationRows = []
+        matchTermWords = []
+        matchTermRows = []
+
+        for word, attrs, todos, childRelations, wwmTerms in entries:
+            try:
+                self.getExistingWikiWordInfo(word)
+            except WikiWordNotFoundException:
+                skipped.append(word)
+                continue
+
+            if attrs is not None:
+                attrWords.append((word,))
+                for k, values in attrs.iteritems():
+                    for v in values:
+                        attrRows.append((word, k, v))
+
+            if todos is not None:
+                todoWords.append((word,))
+                for t in todos:
+                    todoRows.append((word, t[0], t[1]))
+
+            if childRelations is not None:
+                relationWords.append((word,))
+                for r in childRelations:
+                    relationRows.append((word, r[0], r[1]))
+
+            if wwmTerms is not None:
+                matchTermWords.append((word,))
+                for matchterm, typ, tWord, firstcharpos, charlength in \
+                        wwmTerms:
+                    assert tWord == word
+                    matchTermRows.append((matchterm, typ, word, firstcharpos,
+                            charlength, matchterm.lower()))
+
+        try:
+            if attrWords:
+                self.connWrap.execSqlMany("delete from wikiwordattrs "
+                        "where word = ?", attrWords)
+                self.connWrap.execSqlMany("insert into wikiwordattrs(word, "
+                        "key, value) values (?, ?, ?)", attrRows)
+                self.cachedGlobalAttrs = None   # reset global attributes cache
+
+            if todoWords:
+                self.connWrap.execSqlMany("delete from todos where word = ?",
+                        todoWords)
+                self.connWrap.execSqlMany("insert into todos(word, key, value) "
+                        "values (?, ?, ?)", todoRows)
+
+            if relationWords:
+                self.connWrap.execSqlMany("delete from wikirelations "
+                        "where word = ?", relationWords)
+                self.connWrap.execSqlMany("insert or replace into "
+                        "wikirelations(word, relation, firstcharpos) "
+                        "values (?, ?, ?)", relationRows)
+                if self.relationGraph is not None:
+                    children = dict((word, []) for (word,) in relationWords)
+                    for word, relation, firstcharpos in relationRows:
+                        children[word].append(relation)
+                    for word, relations in children.iteritems():
+                        self.relationGraph.setChildren(word, relations)
+
+            if matchTermWords:
+                # Consts.WIKIWORDMATCHTERMS_TYPE_SYNCUPDATE == 16
+                self.connWrap.execSqlMany("delete from wikiwordmatchterms "
+                        "where word = ? and (type & 16) == 0", matchTermWords)
+                self.connWrap.execSqlMany("insert into wikiwordmatchterms("
+                        "matchterm, type, word, firstcharpos, charlength, "
+                        "matchtermnormcase) values (?, ?, ?, ?, ?, ?)",
+                        matchTermRows)
+                if self.linkTermIndex is not None:
+                    for (word,) in matchTermWords:
+                        self.linkTermIndex.removeMatchTermsForWord(word)
+                    for matchterm, typ, word, firstcharpos, charlength, \
+                            normcase in matchTermRows:
+                        self.linkTermIndex.addMatchTerm(matchterm, typ, word)
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbWriteAccessError(e)
+
+        return skipped
+
+
     # ---------- Data block handling ----------
 
     def getDataBlockUnifNamesStartingWith(self, startingWith):
@@ -1759,11 +2219,27 @@ class WikiData:
         """
 
         if sarOp.isTextNeededForTest():
+            self._prepareContentIndex()
+
+            indexQuery = None
+            if self.contentIndexUsable:
+                indexQuery = self._contentPrefilterToIndexQuery(
+                        sarOp.getContentPrefilter())
+
             try:
-                result = self.connWrap.execSqlQuerySingleColumn(
-                        "select word from wikiwordcontent where "
-                        "testMatch(word, content, ?)",
-                        (sqlite.addTransObject(sarOp),))
+                if indexQuery is None:
+                    result = self.connWrap.execSqlQuerySingleColumn(
+                            "select word from wikiwordcontent where "
+                            "testMatch(word, content, ?)",
+                            (sqlite.addTransObject(sarOp),))
+                else:
+                    # Exact test only for candidates found by the index
+                    result = self.connWrap.execSqlQuerySingleColumn(
+                            "select word from wikiwordcontent where "
+                            "rowid in (select rowid from wikiwordcontentindex "
+                            "where wikiwordcontentindex match ?) and "
+                            "testMatch(word, content, ?)",
+                            (indexQuery, sqlite.addTransObject(sarOp)))
             except (IOError, OSError, sqlite.Error), e:
                 traceback.print_exc()
                 raise DbReadAccessError(e)
@@ -1792,6 +2268,119 @@ class WikiData:
             return result
 
 
+    def getSearchCandidateWords(self, sarOp, exclusionSet):
+        """
+        Return list of words of the pages which must be tested by
+        searchWordsWithContent() to do the same as search(). It is a superset
+        of the matching pages but may be much smaller than the list of all
+        pages if the content index can be used.
+        sarOp.beginWikiSearch() must be called before calling this function,
+        sarOp.endWikiSearch() must be called after calling this function.
+        
+        exclusionSet -- set of wiki words which must not be part of the result
+        """
+        indexQuery = None
+        if sarOp.isTextNeededForTest():
+            self._prepareContentIndex()
+            if self.contentIndexUsable:
+                indexQuery = self._contentPrefilterToIndexQuery(
+                        sarOp.getContentPrefilter())
+
+        try:
+            if indexQuery is None:
+                result = self.connWrap.execSqlQuerySingleColumn(
+                        "select word from wikiwordcontent")
+            else:
+                result = self.connWrap.execSqlQuerySingleColumn(
+                        "select word from wikiwordcontent where "
+                        "rowid in (select rowid from wikiwordcontentindex "
+                        "where wikiwordcontentindex match ?)", (indexQuery,))
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+        return [word for word in result if word not in exclusionSet]
+
+
+    def searchWordsWithContent(self, sarOp, words):
+        """
+        Test the pages of the given words like search() and return list of
+        tuples (word, content) for all matching pages. The content is the one
+        the page was tested against or None if sarOp.isTextNeededForTest()
+        returns False. Meant to be called with chunks of the list returned by
+        getSearchCandidateWords() so the caller can process hits while the
+        search is running. Each page is read only once.
+        sarOp.beginWikiSearch() must be called before calling this function,
+        sarOp.endWikiSearch() must be called after calling this function.
+        """
+        result = []
+        try:
+            if sarOp.isTextNeededForTest():
+                for chunk in _iterChunks(words):
+                    for word, content in self.connWrap.execSqlQuery(
+                            "select word, content from wikiwordcontent "
+                            "where word in (%s)" %
+                            ", ".join(["?"] * len(chunk)), chunk):
+                        content = self.contentDbToOutput(content)
+                        if sarOp.testWikiPage(word, content) == True:
+                            result.append((word, content))
+            else:
+                for word in words:
+                    if sarOp.testWikiPage(word, u"") == True:
+                        result.append((word, None))
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+        return result
+
+
+    _NON_ASCII_RE = re.compile(ur"[^\x00-\x7f]+", re.UNICODE)
+
+    def _contentPrefilterToIndexQuery(self, prefilter):
+        """
+        Convert condition returned by sarOp.getContentPrefilter() to an FTS5
+        query for the full text index. Returns None if the index can't
+        restrict the set of candidate pages.
+        """
+        if prefilter is None:
+            return None
+
+        if prefilter[0] == "str":
+            subStr, caseSensitive = prefilter[1:]
+            if caseSensitive:
+                parts = [subStr]
+            else:
+                # Case folding of index and of the "re" module may differ
+                # for non-ASCII characters
+                parts = self._NON_ASCII_RE.split(subStr)
+
+            # Trigram tokenizer can't search for strings shorter than 3 chars
+            parts = [u'"%s"' % part.replace(u'"', u'""') for part in parts
+                    if len(part) >= 3]
+
+            if len(parts) == 0:
+                return None
+
+            return u" AND ".join(parts)
+
+        left = self._contentPrefilterToIndexQuery(prefilter[1])
+        right = self._contentPrefilterToIndexQuery(prefilter[2])
+
+        if prefilter[0] == "and":
+            if left is None:
+                return right
+            if right is None:
+                return left
+
+            return u"(%s) AND (%s)" % (left, right)
+        else:   # prefilter[0] == "or"
+            if left is None or right is None:
+                return None
+
+            return u"(%s) OR (%s)" % (left, right)
+
+
 # explain select distinct type from wikiwordmatchterms where type & 2
 # explain select type from (select distinct type from wikiwordmatchterms) where type & 2
 # explain select type, type & 2 from (select distinct type from wikiwordmatchterms where type > 1) 
@@ -1804,6 +2393,8 @@ class WikiData:
         "compactify": 1,     # = sqlite vacuum
         "plain text import": 1,
         "recovery mode": 1,
+        "integrity check": 1,
+        "content paging": 1,   # getWikiPageContentsAfter() reads pages in name order
 #         "asynchronous commit":1  # Commit can be done in separate thread, but
 #                 # calling any other function during running commit is not allowed
         }
@@ -1826,9 +2417,12 @@ class WikiData:
         Needed before rebuilding the whole wiki
         """
         DbStructure.recreateCacheTables(self.connWrap)
+        if self.contentIndexUsable:
+            DbStructure.rebuildContentIndex(self.connWrap)
         self.connWrap.syncCommit()
 
-        self.cachedWikiPageLinkTermDict = None
+        self.linkTermIndex = None
+        self.relationGraph = None
         self.cachedGlobalAttrs = None
 
 
@@ -1879,6 +2473,15 @@ class WikiData:
 
 
     def close(self):
+        try:
+            if not self._isContentIndexEnabled():
+                DbStructure.dropContentIndex(self.connWrap)
+            elif self.contentIndexUsable:
+                DbStructure.storeContentIndexSignature(self.connWrap)
+        except (IOError, OSError, sqlite.Error), e:
+            # Index will be rebuilt on next search
+            traceback.print_exc()
+
         self.connWrap.syncCommit()
         self.connWrap.close()
 
@@ -2031,9 +2634,15 @@ class WikiData:
         Set the content back to the version identified by id (retrieved by getStoredVersions).
         Only wikiwordcontent is modified, the cache information must be updated separately
         """
+        self._checkContentIndex()
+        contentIndexUsable = self.contentIndexUsable
 
         self.connWrap.syncCommit()
         try:
+            # The index can't follow the rewrite of the whole table, it is
+            # rebuilt afterwards
+            self.contentIndexUsable = False
+
             # Start with head version
             self.connWrap.execSql("delete from wikiwordcontent") #delete all rows
             self.connWrap.execSql("insert into wikiwordcontent select * from headversion") # copy from headversion
@@ -2052,11 +2661,16 @@ class WikiData:
                 for c in changes:
                     self.applyChange(*c)
 
+            if contentIndexUsable:
+                DbStructure.rebuildContentIndex(self.connWrap)
 
             self.connWrap.commit()
         except:
             self.connWrap.rollback()
             raise
+        finally:
+            self.contentIndexUsable = contentIndexUsable
+            self.linkTermIndex = None
 
 
     def deleteVersioningData(self):
@@ -2148,6 +2762,9 @@ class WikiData:
         """
         Do not call from this class, only from outside to handle errors.
         """
+        # Index and graph may contain changes which are rolled back now
+        self.linkTermIndex = None
+        self.relationGraph = None
         try:
             self.connWrap.rollback()
         except (IOError, OSError, sqlite.Error), e:
@@ -2165,11 +2782,34 @@ class WikiData:
         try:
             self.connWrap.syncCommit()
             self.connWrap.execSql("vacuum")
+
+            # Vacuum may have changed the rowids the index refers to
+            if self.contentIndexUsable:
+                DbStructure.rebuildContentIndex(self.connWrap)
+                self.connWrap.syncCommit()
         except (IOError, OSError, sqlite.Error), e:
             traceback.print_exc()
             raise DbWriteAccessError(e)
 
 
+    def checkIntegrity(self):
+        """
+        Check the database for corruption. Returns a list of unistrings
+        describing the problems found, empty list if everything is fine.
+
+        Must be implemented if checkCapability returns a version number
+        for "integrity check".
+        """
+        try:
+            result = self.connWrap.execSqlQuerySingleColumn(
+                    "pragma integrity_check")
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+        return [unicode(r) for r in result if r != u"ok"]
+
+
 
     # TODO: Better error checking
     # TODO: Process 2.0-named files
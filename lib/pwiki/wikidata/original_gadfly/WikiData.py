@@ -47,6 +47,11 @@ from pwiki.StringOps import longPathEnc, longPathDec, utf8Enc, utf8Dec, BOM_UTF8
         createRandomString, pathDec
 
 
+# Bulk functions scan the whole table (held in memory by Gadfly) only for at
+# least this number of words, otherwise they query word by word
+_BULK_SCAN_MIN_WORDS = 50
+
+
 class WikiData:
     "Interface to wiki data."
     def __init__(self, wikiDocument, dataDir, tempDir):
@@ -173,6 +178,29 @@ class WikiData:
             raise DbReadAccessError(e)
 
 
+    def getWikiPageContentsForWords(self, words):
+        """
+        Returns a list of tuples (word, content, modified, created, visited)
+        for those of the given words which have a page, in no particular
+        order. The content is None if the file of a page is missing.
+        Function must work for read-only wiki.
+        """
+        result = []
+        for w in words:
+            m, c, v = self.getTimestamps(w)
+            if m is None:
+                continue
+
+            try:
+                content = self.getContent(w)
+            except WikiFileNotFoundException:
+                content = None
+
+            result.append((w, content, m, c, v))
+
+        return result
+
+
         # TODO Remove method
     def _updatePageEntry(self, word, moddate = None, creadate = None):
         """
@@ -622,6 +650,53 @@ class WikiData:
             raise DbReadAccessError(e)
 
 
+    def getWikiPageNamesWithChangedFileSignature(self, filePaths=None):
+        """
+        Bulk version of validateFileSignatureForWikiPageName(). Returns list
+        of names of all pages for which the file signature stored in DB
+        doesn't match the file containing the content.
+        The data directory is listed once and all stored signatures are
+        retrieved with one query instead of looking up each page on its own.
+
+        filePaths -- if not None, set of file paths (relative to data
+            directory) to restrict the check to
+        """
+        graceful = self.wikiDocument.getWikiConfig().getboolean("main",
+                "wikiPageFiles_gracefulOutsideAddAndRemove", True)
+
+        try:
+            rows = self.connWrap.execSqlQuery("select word, filepath, "
+                    "filesignature from wikiwords", strConv=(True, True, False))
+            diskFiles = frozenset(pathDec(fn)
+                    for fn in os.listdir(longPathEnc(self.dataDir)))
+
+            result = []
+            for word, path, dbFileSig in rows:
+                if filePaths is not None and path not in filePaths:
+                    continue
+
+                fullPath = longPathEnc(join(self.dataDir, path))
+                if path not in diskFiles and not os.path.isfile(fullPath):
+                    if graceful:
+                        # File is missing and this should be handled gracefully
+                        continue
+
+                    raise WikiFileNotFoundException(
+                            _(u"Wiki page not found (bad path information) for word: %s") %
+                            word)
+
+                fileSig = self.wikiDocument.getFileSignatureBlockFromStat(
+                        os.stat(fullPath))
+
+                if dbFileSig != fileSig:
+                    result.append(word)
+
+            return result
+        except (IOError, OSError, ValueError), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
     def refreshFileSignatureForWikiPageName(self, word):
         """
         Sets file signature to match current file.
@@ -745,6 +820,44 @@ class WikiData:
         return children
 
 
+    def getChildRelationshipsForWords(self, words, existingonly=False,
+            selfreference=True):
+        """
+        Bulk version of getChildRelationships() (without withFields) for
+        a sequence of real page names. Returns dictionary
+        {word: list of child relations} with an entry for each word.
+        Function must work for read-only wiki.
+        """
+        result = dict((word, []) for word in words)
+
+        if len(result) < _BULK_SCAN_MIN_WORDS:
+            for word in result:
+                result[word] = self.getChildRelationships(word,
+                        existingonly=existingonly, selfreference=selfreference)
+            return result
+
+        # A scan of the whole table is cheaper than a query per word
+        try:
+            relations = self.connWrap.execSqlQuery(
+                    "select word, relation from wikirelations")
+        except (IOError, OSError, ValueError), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+        for word, relation in relations:
+            children = result.get(word)
+            if children is None:
+                continue
+            if not selfreference and relation == word:
+                continue
+            if existingonly and not self.getWikiPageNameForLinkTerm(relation):
+                continue
+
+            children.append(relation)
+
+        return result
+
+
 #     # TODO More efficient
 #     def _hasChildren(self, wikiWord, existingonly=False,
 #             selfreference=True):
@@ -1053,6 +1166,10 @@ class WikiData:
             for path in self.connWrap.execSqlQuerySingleColumn(
                     "select filepath from wikiwords"):
 
+                if path in diskFiles:
+                    # Found when listing the directory already
+                    continue
+
                 testPath = longPathEnc(os.path.join(self.dataDir, path))
                 if not os.path.exists(testPath) or not os.path.isfile(testPath):
                     if deleteFully:
@@ -1693,6 +1810,34 @@ class WikiData:
             raise DbReadAccessError(e)
 
 
+    def getAttributesForWords(self, words):
+        """
+        Bulk version of getAttributesForWord(). Returns dictionary
+        {word: list of tuples (key, value)} with an entry for each word.
+        """
+        result = dict((word, []) for word in words)
+
+        if len(result) < _BULK_SCAN_MIN_WORDS:
+            for word in result:
+                result[word] = self.getAttributesForWord(word)
+            return result
+
+        # A scan of the whole table is cheaper than a query per word
+        try:
+            allAttrs = self.connWrap.execSqlQuery(
+                    "select word, key, value from wikiwordattrs")
+        except (IOError, OSError, ValueError), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+        for word, key, value in allAttrs:
+            attrs = result.get(word)
+            if attrs is not None:
+                attrs.append((key, value))
+
+        return result
+
+
     def _setAttribute(self, word, key, value):
         # make sure the value doesn't already exist for this attribute
         try:
@@ -1939,6 +2084,40 @@ class WikiData:
             raise DbWriteAccessError(e)
 
 
+    # ---------- Batch update of meta-data ----------
+
+    def updateMetaDataBatch(self, entries):
+        """
+        Update meta-data of many wiki words at once. Gadfly has no
+        executemany(), so this simply calls the single update functions.
+        Call commit() afterwards to write the whole batch in one transaction.
+
+        entries -- Sequence of tuples (word, attrs, todos, childRelations,
+            wwmTerms) with arguments as for updateAttributes(), updateTodos(),
+            updateChildRelations() and updateWikiWordMatchTerms() (without
+            synchronously updated match terms). Each of the last four can
+            be None to leave this part unchanged.
+
+        Returns list of words which were skipped because they don't exist.
+        """
+        skipped = []
+
+        for word, attrs, todos, childRelations, wwmTerms in entries:
+            try:
+                if attrs is not None:
+                    self.updateAttributes(word, attrs)
+                if todos is not None:
+                    self.updateTodos(word, todos)
+                if childRelations is not None:
+                    self.updateChildRelations(word, childRelations)
+                if wwmTerms is not None:
+                    self.updateWikiWordMatchTerms(word, wwmTerms)
+            except WikiWordNotFoundException:
+                skipped.append(word)
+
+        return skipped
+
+
     # ---------- Data block handling ----------
 
 #     def getDataBlockUnifNames(self):
@@ -2228,6 +2407,50 @@ class WikiData:
         return result
 
 
+    def getSearchCandidateWords(self, sarOp, exclusionSet):
+        """
+        Return list of words of the pages which must be tested by
+        searchWordsWithContent() to do the same as search().
+        sarOp.beginWikiSearch() must be called before calling this function,
+        sarOp.endWikiSearch() must be called after calling this function.
+        
+        exclusionSet -- set of wiki words which must not be part of the result
+        """
+        return [word for word in self.getAllDefinedWikiPageNames()
+                if word not in exclusionSet]
+
+
+    def searchWordsWithContent(self, sarOp, words):
+        """
+        Test the pages of the given words like search() and return list of
+        tuples (word, content) for all matching pages. The content is the one
+        the page was tested against or None if sarOp.isTextNeededForTest()
+        returns False. Meant to be called with chunks of the list returned by
+        getSearchCandidateWords() so the caller can process hits while the
+        search is running. Each page is read only once.
+        sarOp.beginWikiSearch() must be called before calling this function,
+        sarOp.endWikiSearch() must be called after calling this function.
+        """
+        result = []
+
+        if sarOp.isTextNeededForTest():
+            for word in words:
+                try:
+                    fileContents = self.getContent(word)
+                except WikiFileNotFoundException:
+                    # some error in cache (should not happen)
+                    continue
+    
+                if sarOp.testWikiPage(word, fileContents) == True:
+                    result.append((word, fileContents))
+        else:
+            for word in words:
+                if sarOp.testWikiPage(word, None) == True:
+                    result.append((word, None))
+
+        return result
+
+
 
     # ---------- Miscellaneous ----------
 
@@ -57,6 +57,11 @@ class ConnectWrapBase:
             self.dbCursor.execute(sql)
 
 
+    def execSqlMany(self, sql, seqOfParams):
+        "utility method, executes the sql once for each params tuple"
+        self.dbCursor.executemany(sql, seqOfParams)
+
+
     def execSqlQuery(self, sql, params=None):
         "utility method, executes the sql, returns query result"
         if params:
@@ -260,6 +265,17 @@ class ConnectWrapAsyncCommit(ConnectWrapBase):
         finally:
             self.accessLock.release()
 
+    def execSqlMany(self, sql, seqOfParams):
+        "utility method, executes the sql once for each params tuple"
+        self.accessLock.acquire()
+        try:
+            # Commit first before executing something that changes database
+            self._commitIfPending()
+            self.commitNeeded = True
+            return ConnectWrapBase.execSqlMany(self, sql, seqOfParams)
+        finally:
+            self.accessLock.release()
+
     def execSqlQuery(self, sql, params=None):
         "utility method, executes the sql, returns query result"
         self.accessLock.acquire()
@@ -47,6 +47,17 @@ from pwiki.StringOps import loadEntireFile, writeEntireFile, \
 
 import Consts
 
+
+# Number of words per query in bulk functions, SQLite allows at most 999
+# parameters per statement
+_BULK_QUERY_CHUNK_SIZE = 500
+
+
+def _iterChunks(seq, size=_BULK_QUERY_CHUNK_SIZE):
+    for i in xrange(0, len(seq), size):
+        yield seq[i:i + size]
+
+
 class WikiData:
     "Interface to wiki data."
     def __init__(self, wikiDocument, dataDir, tempDir):
@@ -250,6 +261,73 @@ class WikiData:
             raise DbReadAccessError(e)
 
 
+    def getWikiPageContentsAfter(self, word, limit):
+        """
+        Returns a list of at most limit tuples
+        (word, content, modified, created, visited) for the wiki pages
+        following word in name order (or starting with the first page if
+        word is None). Call it repeatedly with the last returned name to
+        read all pages with bounded memory. The content is None if the
+        file of a page is missing.
+        Must be implemented if checkCapability returns a version number
+        for "content paging".
+        Function must work for read-only wiki.
+        """
+        try:
+            if word is None:
+                dates = self.connWrap.execSqlQuery("select word, modified, "
+                        "created, visited from wikiwords "
+                        "order by word limit ?", (limit,))
+            else:
+                dates = self.connWrap.execSqlQuery("select word, modified, "
+                        "created, visited from wikiwords "
+                        "where word > ? order by word limit ?", (word, limit))
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+        result = []
+        for w, m, c, v in dates:
+            try:
+                content = self.getContent(w)
+            except WikiFileNotFoundException:
+                content = None
+
+            result.append((w, content, float(m), float(c), float(v)))
+
+        return result
+
+
+    def getWikiPageContentsForWords(self, words):
+        """
+        Returns a list of tuples (word, content, modified, created, visited)
+        for those of the given words which have a page, in no particular
+        order. The content is None if the file of a page is missing.
+        Function must work for read-only wiki.
+        """
+        try:
+            dates = []
+            for chunk in _iterChunks(words):
+                dates += self.connWrap.execSqlQuery("select word, modified, "
+                        "created, visited from wikiwords "
+                        "where word in (%s)" % ", ".join(["?"] * len(chunk)),
+                        chunk)
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+        result = []
+        for w, m, c, v in dates:
+            try:
+                content = self.getContent(w)
+            except WikiFileNotFoundException:
+                content = None
+
+            result.append((w, content, float(m), float(c), float(v)))
+
+        return result
+
+
         # TODO Remove method
     def _updatePageEntry(self, word, moddate = None, creadate = None):
         """
@@ -673,6 +751,53 @@ class WikiData:
             raise DbReadAccessError(e)
 
 
+    def getWikiPageNamesWithChangedFileSignature(self, filePaths=None):
+        """
+        Bulk version of validateFileSignatureForWikiPageName(). Returns list
+        of names of all pages for which the file signature stored in DB
+        doesn't match the file containing the content.
+        The data directory is listed once and all stored signatures are
+        retrieved with one query instead of looking up each page on its own.
+
+        filePaths -- if not None, set of file paths (relative to data
+            directory) to restrict the check to
+        """
+        graceful = self.wikiDocument.getWikiConfig().getboolean("main",
+                "wikiPageFiles_gracefulOutsideAddAndRemove", True)
+
+        try:
+            rows = self.connWrap.execSqlQuery("select word, filepath, "
+                    "filesignature from wikiwords")
+            diskFiles = frozenset(pathDec(fn)
+                    for fn in os.listdir(longPathEnc(self.dataDir)))
+
+            result = []
+            for word, path, dbFileSig in rows:
+                if filePaths is not None and path not in filePaths:
+                    continue
+
+                fullPath = longPathEnc(join(self.dataDir, path))
+                if path not in diskFiles and not os.path.isfile(fullPath):
+                    if graceful:
+                        # File is missing and this should be handled gracefully
+                        continue
+
+                    raise WikiFileNotFoundException(
+                            _(u"Wiki page not found (bad path information) for word: %s") %
+                            word)
+
+                fileSig = self.wikiDocument.getFileSignatureBlockFromStat(
+                        os.stat(fullPath))
+
+                if dbFileSig != fileSig:
+                    result.append(word)
+
+            return result
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
     def refreshFileSignatureForWikiPageName(self, word):
         """
         Sets file signature to match current file.
@@ -680,7 +805,7 @@ class WikiData:
         try:
             filePath = self.getWikiWordFileName(word)
             fileSig = self.wikiDocument.getFileSignatureBlock(filePath)
-        except (IOError, OSErro, sqlite.Error), e:
+        except (IOError, OSError, sqlite.Error), e:
             traceback.print_exc()
             raise DbReadAccessError(e)
 
@@ -777,6 +902,41 @@ class WikiData:
             raise DbReadAccessError(e)
 
 
+    def getChildRelationshipsForWords(self, words, existingonly=False,
+            selfreference=True):
+        """
+        Bulk version of getChildRelationships() (without withFields) for
+        a sequence of real page names. Returns dictionary
+        {word: list of child relations} with an entry for each word.
+        Function must work for read-only wiki.
+        """
+        sqlTail = ""
+        if existingonly:
+            sqlTail += (" and (exists (select 1 from wikiwords "
+                    "where word = relation) or exists "
+                    "(select 1 from wikiwordmatchterms "
+                    "where wikiwordmatchterms.matchterm = relation and "
+                    "(wikiwordmatchterms.type & 2) != 0))")
+            # Consts.WIKIWORDMATCHTERMS_TYPE_ASLINK == 2
+
+        if not selfreference:
+            sqlTail += " and relation != word"
+
+        result = dict((word, []) for word in words)
+        try:
+            for chunk in _iterChunks(list(result)):
+                for word, relation in self.connWrap.execSqlQuery(
+                        "select word, relation from wikirelations "
+                        "where word in (%s)" % ", ".join(["?"] * len(chunk)) +
+                        sqlTail, chunk):
+                    result[word].append(relation)
+
+            return result
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
 #     def getChildRelationshipsAndChildNumber(self, wikiWord, existingonly=False,
 #             selfreference=False):
 #         sql = ("select parent.relation, count(child.relation) "
@@ -1146,6 +1306,10 @@ class WikiData:
             for path in self.connWrap.execSqlQuerySingleColumn(
                     "select filepath from wikiwords"):
 
+                if path in diskFiles:
+                    # Found when listing the directory already
+                    continue
+
                 testPath = longPathEnc(os.path.join(self.dataDir, path))
                 if not os.path.exists(testPath) or not os.path.isfile(testPath):
                     if deleteFully:
@@ -1774,6 +1938,27 @@ class WikiData:
             traceback.print_exc()
             raise DbReadAccessError(e)
 
+
+    def getAttributesForWords(self, words):
+        """
+        Bulk version of getAttributesForWord(). Returns dictionary
+        {word: list of tuples (key, value)} with an entry for each word.
+        Function must work for read-only wiki.
+        """
+        result = dict((word, []) for word in words)
+        try:
+            for chunk in _iterChunks(list(result)):
+                for word, key, value in self.connWrap.execSqlQuery(
+                        "select word, key, value from wikiwordattrs "
+                        "where word in (%s)" % ", ".join(["?"] * len(chunk)),
+                        chunk):
+                    result[word].append((key, value))
+
+            return result
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
             
     def _setAttribute(self, word, key, value):
         try:
@@ -2025,6 +2210,102 @@ class WikiData:
             raise DbWriteAccessError(e)
 
 
+    # ---------- Batch update of meta-data ----------
+
+    def updateMetaDataBatch(self, entries):
+        """
+        Update meta-data of many wiki words at once. All rows of one table
+        are written by one executemany() call. Like the single update functions
+        it doesn't commit, call commit() afterwards to write the whole
+        batch in one transaction.
+
+        entries -- Sequence of tuples (word, attrs, todos, childRelations,
+            wwmTerms) with arguments as for updateAttributes(), updateTodos(),
+            updateChildRelations() and updateWikiWordMatchTerms() (without
+            synchronously updated match terms). Each of the last four can
+            be None to leave this part unchanged.
+
+        Returns list of words which were skipped because they don't exist.
+        """
+        skipped = []
+
+        attrWords = []
+        attrRows = []
+        todoWords = []
+        todoRows = []
+        relationWords = []
+        relationRows = []
+        matchTermWords = []
+        matchTermRows = []
+
+        for word, attrs, todos, childRelations, wwmTerms in entries:
+            try:
+                self.getExistingWikiWordInfo(word)
+            except WikiWordNotFoundException:
+                skipped.append(word)
+                continue
+
+            if attrs is not None:
+                attrWords.append((word,))
+                for k, values in attrs.iteritems():
+                    for v in values:
+                        attrRows.append((word, k, v))
+
+            if todos is not None:
+                todoWords.append((word,))
+                for t in todos:
+                    todoRows.append((word, t[0], t[1]))
+
+            if childRelations is not None:
+                relationWords.append((word,))
+                for r in childRelations:
+                    relationRows.append((word, r[0], r[1]))
+
+            if wwmTerms is not None:
+                matchTermWords.append((word,))
+                for matchterm, typ, tWord, firstcharpos, charlength in \
+                        wwmTerms:
+                    assert tWord == word
+                    matchTermRows.append((matchterm, typ, word, firstcharpos,
+                            charlength, matchterm.lower()))
+
+        try:
+            if attrWords:
+                self.connWrap.execSqlMany("delete from wikiwordattrs "
+                        "where word = ?", attrWords)
+                self.connWrap.execSqlMany("insert into wikiwordattrs(word, "
+                        "key, value) values (?, ?, ?)", attrRows)
+                self.cachedGlobalAttrs = None   # reset global attributes cache
+
+            if todoWords:
+                self.connWrap.execSqlMany("delete from todos where word = ?",
+                        todoWords)
+                self.connWrap.execSqlMany("insert into todos(word, key, value) "
+                        "values (?, ?, ?)", todoRows)
+
+            if relationWords:
+                self.connWrap.execSqlMany("delete from wikirelations "
+                        "where word = ?", relationWords)
+                self.connWrap.execSqlMany("insert or replace into "
+                        "wikirelations(word, relation, firstcharpos) "
+                        "values (?, ?, ?)", relationRows)
+
+            if matchTermWords:
+                # Consts.WIKIWORDMATCHTERMS_TYPE_SYNCUPDATE == 16
+                self.connWrap.execSqlMany("delete from wikiwordmatchterms "
+                        "where word = ? and (type & 16) == 0", matchTermWords)
+                self.connWrap.execSqlMany("insert into wikiwordmatchterms("
+                        "matchterm, type, word, firstcharpos, charlength, "
+                        "matchtermnormcase) values (?, ?, ?, ?, ?, ?)",
+                        matchTermRows)
+                self.cachedWikiPageLinkTermDict = None
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbWriteAccessError(e)
+
+        return skipped
+
+
     # ---------- Data block handling ----------
 
     # TODO Optimize
@@ -2310,6 +2591,52 @@ class WikiData:
                     result.add(word)
 
         return result
+
+
+    def getSearchCandidateWords(self, sarOp, exclusionSet):
+        """
+        Return list of words of the pages which must be tested by
+        searchWordsWithContent() to do the same as search().
+        sarOp.beginWikiSearch() must be called before calling this function,
+        sarOp.endWikiSearch() must be called after calling this function.
+        Function must work for read-only wiki.
+        
+        exclusionSet -- set of wiki words which must not be part of the result
+        """
+        return [word for word in self.getAllDefinedWikiPageNames()
+                if word not in exclusionSet]
+
+
+    def searchWordsWithContent(self, sarOp, words):
+        """
+        Test the pages of the given words like search() and return list of
+        tuples (word, content) for all matching pages. The content is the one
+        the page was tested against or None if sarOp.isTextNeededForTest()
+        returns False. Meant to be called with chunks of the list returned by
+        getSearchCandidateWords() so the caller can process hits while the
+        search is running. Each page is read only once.
+        sarOp.beginWikiSearch() must be called before calling this function,
+        sarOp.endWikiSearch() must be called after calling this function.
+        Function must work for read-only wiki.
+        """
+        result = []
+
+        if sarOp.isTextNeededForTest():
+            for word in words:
+                try:
+                    fileContents = self.getContent(word)
+                except WikiFileNotFoundException:
+                    # some error in cache (should not happen)
+                    continue
+    
+                if sarOp.testWikiPage(word, fileContents) == True:
+                    result.append((word, fileContents))
+        else:
+            for word in words:
+                if sarOp.testWikiPage(word, None) == True:
+                    result.append((word, None))
+
+        return result
         
 
     # ---------- Miscellaneous ----------
@@ -2318,6 +2645,8 @@ class WikiData:
         "rebuild": 1,
         "compactify": 1,     # = sqlite vacuum
         "filePerPage": 1,   # Uses a single file per page
+        "integrity check": 1,
+        "content paging": 1,   # getWikiPageContentsAfter() reads pages in name order
 #         "versioning": 1,     # (old versioning)
 #         "plain text import":1   # Is already plain text      
         }
@@ -2537,6 +2866,38 @@ class WikiData:
             raise DbWriteAccessError(e)
 
 
+    def checkIntegrity(self):
+        """
+        Check the database for corruption and for wiki pages whose file
+        is missing in the data directory. Returns a list of unistrings
+        describing the problems found, empty list if everything is fine.
+
+        Must be implemented if checkCapability returns a version number
+        for "integrity check".
+        """
+        try:
+            result = self.connWrap.execSqlQuerySingleColumn(
+                    "pragma integrity_check")
+            wordPaths = self.connWrap.execSqlQuery(
+                    "select word, filepath from wikiwords")
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+        problems = [unicode(r) for r in result if r != u"ok"]
+
+        for word, filePath in wordPaths:
+            if filePath is None:
+                problems.append(_(u"No file path for wiki page: %s") % word)
+                continue
+
+            path = longPathEnc(join(self.dataDir, filePath))
+            if not os.path.isfile(path):
+                problems.append(_(u"File missing for wiki page: %s") % word)
+
+        return problems
+
+
 def listAvailableWikiDataHandlers():
     """
     Returns a list with the names of available handlers from this module.